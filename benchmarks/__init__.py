@@ -0,0 +1,10 @@
+"""
+Бенчмарки горячих путей lab_parser
+
+Запуск из корня репозитория, например:
+
+    python -m benchmarks.bench_startup --out benchmarks/results/startup.json
+
+Результаты сохраняются в JSON (benchmarks.common.save_results) вместе с коммитом
+и версиями, чтобы сравнивать их между коммитами.
+"""
@@ -0,0 +1,118 @@
+"""
+Архив пакетов по дням (services.archive): размер и запросы за диапазон дат
+
+    python -m benchmarks.bench_archive [--days 30] [--rows 2000] [--range 7] [--repeat 3] [--out results.json]
+
+Во временном instance пишется журнал на каждый день (benchmarks/generator.py),
+дальше через тестовый клиент приложения замеряется холодный (кэши процесса
+сброшены, дисковый кэш выключен) GET /api/stats за последние --range дней:
+
+* xlsx - пакеты читаются и парсятся из исходных файлов;
+* archive - после архивации и удаления исходных файлов: из архива
+  читаются только файлы разделов, попавших в диапазон;
+* archive_reparse - то же после правки правил (пакеты перепарсиваются из архива).
+
+Плюс время архивации, размер исходных файлов и архива. Ответы /api/stats
+до и после архивации должны совпадать; при расхождении - код выхода 1.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+from datetime import date, timedelta
+from typing import Dict, Any
+
+os.environ.setdefault("PARSED_BATCH_DISK_CACHE_MB", "0")
+
+from lab_parser.app import create_app
+from lab_parser.app.models.parse_rules import get_parse_rules_db
+from lab_parser.app.services.archive import archive_batches, get_batch_archive
+from lab_parser.app.services.parsed_batch import clear_parsed_batch_cache
+from lab_parser.app.services.stats import clear_stats_cache
+
+from .common import save_results, timeit
+from .generator import generate_definitions, generate_rows, make_rules_db, write_journal
+
+
+def _dir_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def _cold_stats(client, url: str) -> Dict[str, Any]:
+    clear_parsed_batch_cache()
+    clear_stats_cache()
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError(f"{url}: {response.status_code} {response.get_data(as_text=True)[:200]}")
+    return response.json
+
+
+def _comparable(stats: Dict[str, Any]) -> str:
+    return json.dumps({k: v for k, v in stats.items() if k != "rules_generation"}, sort_keys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=30, help="сколько дней (пакетов) в instance")
+    parser.add_argument("--rows", type=int, default=2000, help="строк в пакете")
+    parser.add_argument("--range", type=int, default=7, help="дней в запросе /api/stats")
+    parser.add_argument("--rules", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args(argv)
+
+    definitions = generate_definitions(args.rules, args.seed)
+    first_day = date(2025, 1, 1)
+    last_day = first_day + timedelta(days=args.days - 1)
+    range_from = (last_day - timedelta(days=args.range - 1)).isoformat()
+    url = f"/api/stats?date_from={range_from}&date_to={last_day.isoformat()}"
+
+    with tempfile.TemporaryDirectory() as instance:
+        uploads = os.path.join(instance, "uploads")
+        os.makedirs(uploads)
+        make_rules_db(os.path.join(instance, "parse_rules.db"), definitions[:-1])
+        for i in range(args.days):
+            day = first_day + timedelta(days=i)
+            write_journal(os.path.join(uploads, f"journal__{day:%Y%m%d}-080000.xlsx"),
+                          generate_rows(args.rows, definitions, args.seed + i))
+
+        client = create_app(instance).test_client()
+        res: Dict[str, Any] = {"days": args.days, "rows": args.rows, "range_days": args.range,
+                               "xlsx_bytes": _dir_bytes(uploads)}
+        expected = _cold_stats(client, url)
+        res["xlsx"] = timeit(lambda: _cold_stats(client, url), args.repeat, warmup=0)
+
+        today = last_day + timedelta(days=2)
+        res["archive_job"] = timeit(
+            lambda: archive_batches(instance, "uploads", 1, 1, today=today), 1, warmup=0)
+        archive = get_batch_archive(instance)
+        res["archive_bytes"] = _dir_bytes(archive.archive_dir)
+        res["partitions"] = len(archive.partitions())
+        res["partitions_in_range"] = len(archive.partitions(range_from, last_day.isoformat()))
+        res["originals_left"] = len(os.listdir(uploads))
+
+        got = _cold_stats(client, url)
+        res["equal"] = _comparable(got) == _comparable(expected)
+        res["archive"] = timeit(lambda: _cold_stats(client, url), args.repeat, warmup=0)
+
+        # Правка правил: пакеты из архива перепарсиваются по исходному тексту
+        rules_db = get_parse_rules_db(instance)
+        rules_db.delete_test_definition(rules_db.get_all_test_definitions()[0]["id"])
+        res["archive_reparse"] = timeit(lambda: _cold_stats(client, url), args.repeat, warmup=0)
+
+    print(f"{args.days} пакетов по {args.rows} строк: xlsx {res['xlsx_bytes'] / 1e6:.1f} МБ, "
+          f"архив {res['archive_bytes'] / 1e6:.1f} МБ (архивация {res['archive_job']['median']:.2f} с), "
+          f"исходных файлов осталось {res['originals_left']}")
+    print(f"/api/stats за {args.range} дн. (разделов {res['partitions_in_range']} из {res['partitions']}): "
+          f"xlsx {res['xlsx']['median']:.2f} с, архив {res['archive']['median']:.2f} с, "
+          f"архив с перепарсингом {res['archive_reparse']['median']:.2f} с; "
+          f"ответы {'совпадают' if res['equal'] else 'РАЗЛИЧАЮТСЯ'}")
+    print("Результаты:", save_results("archive", res, args.out))
+    if not res["equal"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Нормализация загруженного журнала в .xlsx (services.batches)
+
+    python -m benchmarks.bench_convert [--rows 10000,100000] [--formats xlsx,html] [--repeat 3] [--out results.json]
+
+Для каждого размера, формата и расположения заголовков (raw/processed) журнал
+пишется генератором (benchmarks/generator.py) и нормализуется тремя способами:
+
+* legacy - прежний convert_to_xlsx: DataFrame из pandas.read_excel/read_html
+  и DataFrame.to_excel (его копия - _legacy_convert_to_xlsx ниже);
+* stream - convert_to_xlsx: строки из читателя формата в write-only книгу openpyxl;
+* store - путь store_upload: настоящий .xlsx с распознанными заголовками
+  переносится без пересохранения (проверяются только первые две строки).
+
+Замеряются время и пик памяти (tracemalloc). Эквивалентность: read_basic_records
+по результату каждого способа (со смещением заголовков, которое вернул способ)
+совпадает с записями из прежнего пути; при расхождении - код выхода 1.
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from typing import Callable, Dict, Any, List, Optional
+
+from lab_parser.app.services.batches import convert_to_xlsx, xlsx_header_row
+from lab_parser.app.services.parse_excel import _is_html_file, _detect_header_row, read_basic_records
+
+from .common import save_results, timeit
+from .generator import generate_definitions, generate_rows, write_journal
+
+
+def _legacy_convert_to_xlsx(source_path: str, dest_path: str) -> Optional[int]:
+    """convert_to_xlsx до потоковой записи - эталон для сравнения"""
+    import pandas as pd
+
+    file_ext = os.path.splitext(source_path)[1].lower()
+    if _is_html_file(source_path):
+        df = pd.read_html(source_path, encoding='utf-8')[0]
+    else:
+        engine = 'openpyxl' if file_ext == '.xlsx' else 'xlrd' if file_ext == '.xls' else None
+        df = pd.read_excel(source_path, sheet_name=0, engine=engine)
+    df.to_excel(dest_path, index=False, engine='openpyxl')
+    # Прежде строка заголовков определялась заново в register_batch
+    return _detect_header_row(dest_path)
+
+
+def _store(source_path: str, dest_path: str) -> Optional[int]:
+    """Как store_upload: перенос настоящего .xlsx или конвертация"""
+    header_row = xlsx_header_row(source_path) if not _is_html_file(source_path) else None
+    if header_row is not None:
+        shutil.copyfile(source_path, dest_path)  # в store_upload - os.replace
+        return header_row
+    return convert_to_xlsx(source_path, dest_path)
+
+
+def _peak(fn: Callable[[], Any]) -> int:
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def bench_case(path: str, repeat: int, tmp: str) -> Dict[str, Any]:
+    methods = {"legacy": _legacy_convert_to_xlsx, "stream": convert_to_xlsx, "store": _store}
+    expected = None
+    res: Dict[str, Any] = {"size": os.path.getsize(path)}
+    for name, method in methods.items():
+        dest = os.path.join(tmp, f"{name}.xlsx")
+        header_row = method(path, dest)
+        records = read_basic_records(dest, header_row=header_row)
+        if expected is None:
+            expected = records
+        res[name] = {
+            "header_row": header_row,
+            "equal": records == expected,
+            "time": timeit(lambda: method(path, dest), repeat, warmup=0),
+            "peak_bytes": _peak(lambda: method(path, dest)),
+            "output_size": os.path.getsize(dest),
+        }
+    res["rows"] = len(expected)
+    return res
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=_ints, default=[10000, 100000])
+    parser.add_argument("--formats", default="xlsx,html")
+    parser.add_argument("--rules", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args(argv)
+
+    definitions = generate_definitions(args.rules, args.seed)
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    if "html" in formats:
+        try:
+            import lxml  # noqa: F401 - нужен pandas.read_html
+        except ImportError:
+            print("lxml не установлен - формат html пропущен")
+            formats.remove("html")
+
+    results = []
+    failed = False
+    for n_rows in args.rows:
+        rows = generate_rows(n_rows, definitions, args.seed)
+        for fmt in formats:
+            for layout in ("raw", "processed"):
+                with tempfile.TemporaryDirectory() as tmp:
+                    path = write_journal(os.path.join(tmp, "journal.xlsx"), rows, layout, fmt)
+                    res = dict(bench_case(path, args.repeat, tmp), format=fmt, layout=layout)
+                results.append(res)
+                failed |= not all(res[m]["equal"] for m in ("stream", "store"))
+                print(f"{res['rows']} строк, {fmt}/{layout}: " + "; ".join(
+                    f"{m} {res[m]['time']['median']:.2f} с, пик {res[m]['peak_bytes'] / 1e6:.1f} МБ, "
+                    f"заголовки {res[m]['header_row']}{'' if res[m]['equal'] else ', ЗАПИСИ РАЗЛИЧАЮТСЯ'}"
+                    for m in ("legacy", "stream", "store")))
+
+    print("Результаты:", save_results("convert", results, args.out))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Выгрузка отчёта в CSV и XLSX (services.export)
+
+    python -m benchmarks.bench_export [--rows 10000,100000] [--formats csv,xlsx] [--repeat 3] [--out results.json]
+
+Для каждого размера пакета и формата весь поток выгрузки вычитывается так же,
+как его отдаёт /api/export (все колонки, без фильтров). Замеряются:
+
+* время и пропускная способность (строк/с);
+* размер файла;
+* пик памяти (tracemalloc) во время выгрузки - не должен расти с числом строк
+  сильнее, чем сама порция (EXPORT_CHUNK_ROWS).
+"""
+import os
+import argparse
+import tempfile
+import tracemalloc
+from typing import Dict, Any, List
+
+import numpy as np
+
+from lab_parser.app.services.export import ReportRows, resolve_columns, export_rows
+from lab_parser.app.services.parsed_batch import ParsedBatch
+
+from .common import save_results, timeit
+from .bench_memory import _records
+from .generator import generate_definitions, make_rules_db
+
+
+def _drain(fmt: str, batch: ParsedBatch, row_ids: np.ndarray) -> int:
+    report = ReportRows(batch, resolve_columns(batch.test_columns))
+    return sum(len(chunk) for chunk in export_rows(fmt, report, row_ids))
+
+
+def bench_case(batch: ParsedBatch, fmt: str, repeat: int) -> Dict[str, Any]:
+    row_ids = np.arange(len(batch.items))
+    size = _drain(fmt, batch, row_ids)
+
+    tracemalloc.start()
+    _drain(fmt, batch, row_ids)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timing = timeit(lambda: _drain(fmt, batch, row_ids), repeat)
+    return {
+        "rows": len(row_ids),
+        "format": fmt,
+        "bytes": size,
+        "peak_memory": peak,
+        "export": timing,
+        "rows_per_second": round(len(row_ids) / timing["median"]),
+    }
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=_ints, default=[10000, 100000])
+    parser.add_argument("--rules", type=int, default=100)
+    parser.add_argument("--formats", default="csv,xlsx")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rules = make_rules_db(os.path.join(tmp, "rules.db"),
+                              generate_definitions(args.rules, args.seed)).get_all_rules()
+
+    results = []
+    for n_rows in args.rows:
+        batch = ParsedBatch("bench.xlsx", _records(n_rows, args.rules, args.seed), rules)
+        for fmt in args.formats.split(","):
+            res = bench_case(batch, fmt.strip(), args.repeat)
+            results.append(res)
+            print(f"{n_rows} строк, {res['format']}: {res['export']['median']:.2f} с "
+                  f"({res['rows_per_second']} строк/с), файл {res['bytes'] / 1024 / 1024:.1f} МБ, "
+                  f"пик памяти {res['peak_memory'] / 1024 / 1024:.1f} МБ")
+
+    print("Результаты:", save_results("export", results, args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+"""
+Нагрузочный тест: одновременные пользователи таблицы, загрузки и настройки правил
+
+    python -m benchmarks.bench_load [--scenarios browse,upload,rules,mixed] [--clients 30]
+                                    [--duration 30] [--batches 3] [--rows 5000] [--out results.json]
+
+Без внешних сервисов: для каждого сценария копия подготовленного instance
+(журналы и правила из benchmarks/generator.py) поднимается в отдельном процессе -
+create_app() под многопоточным WSGI-сервером werkzeug, - и --clients потоков-клиентов
+в течение --duration секунд повторяют то, что делает браузер:
+
+* browse - открыть пакет (/api/batches/<имя>/meta, /api/records с per_page из
+  PER_PAGE), затем несколько шагов: фильтры (отделение, пол, анализы, поиск по ФИО,
+  в том числе с опечатками), следующая страница, карточка записи (/api/record/<rid>);
+* upload - загрузить новый журнал порциями (/api/uploads) и дальше смотреть его как browse;
+* editor - раз в --edit-interval секунд сохранить определение анализа без изменений
+  (PUT /api/test-definitions/<id>): новое поколение правил и перепарсинг в фоне.
+
+Сценарии - доли клиентов каждого вида (SCENARIOS). Между шагами - пауза
+пользователя (экспоненциальная, в среднем --think секунд; 0 - без пауз).
+
+По сценарию и по каждому виду запроса: число запросов, пропускная способность,
+доля ошибок (5xx, обрыв соединения, неожиданный код ответа), задержки
+p50/p90/p95/p99/max; по серверу - RSS после запуска и пиковый RSS (VmHWM, только Linux).
+
+Клиенты - потоки этого процесса: при сотнях клиентов без пауз замер упирается
+в сам генератор нагрузки, в этом случае стоит уменьшить --clients.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from collections import defaultdict
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+from .common import PROJECT_ROOT, save_results
+from .generator import LAST_NAMES, generate_definitions, generate_rows, make_rules_db, write_journal
+
+# Доли клиентов по видам; editors - число редакторов правил сверх --clients
+SCENARIOS = {
+    "browse": {"browse": 1.0},
+    "upload": {"upload": 1.0},
+    "rules": {"browse": 1.0, "editors": 1},
+    "mixed": {"browse": 0.85, "upload": 0.15, "editors": 1},
+}
+
+PER_PAGE = [20, 50, 50, 100, 500]
+REQUEST_TIMEOUT = 300
+
+
+# ===== Сервер =====
+
+def serve(instance: str) -> None:
+    """Дочерний процесс: приложение под многопоточным werkzeug, порт - в stdout"""
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    from lab_parser.app import create_app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, create_app(instance), threaded=True, request_handler=QuietHandler)
+    print("PORT", server.server_port, flush=True)
+    server.serve_forever()
+
+
+def _proc_status_kb(pid: int, field: str) -> Optional[int]:
+    """VmRSS/VmHWM процесса (кБ) из /proc; None вне Linux"""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class Server:
+    def __init__(self, instance: str, log_path: str):
+        self.log = open(log_path, "w", encoding="utf-8")
+        self.proc = subprocess.Popen([sys.executable, "-m", "benchmarks.bench_load", "--serve", instance],
+                                     cwd=PROJECT_ROOT, stdout=subprocess.PIPE, stderr=self.log, text=True)
+        line = self.proc.stdout.readline()
+        if not line.startswith("PORT "):
+            self.stop()
+            with open(log_path, encoding="utf-8") as f:
+                raise RuntimeError("сервер не запустился:\n" + f.read()[-2000:])
+        self.port = int(line.split()[1])
+
+    def rss_kb(self, field: str = "VmRSS") -> Optional[int]:
+        return _proc_status_kb(self.proc.pid, field)
+
+    def stop(self) -> None:
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        self.log.close()
+
+
+# ===== Клиенты =====
+
+class Recorder:
+    """Задержки и ошибки по видам запросов (общий для потоков-клиентов)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def add(self, action: str, seconds: float, error: Optional[str]) -> None:
+        with self.lock:
+            self.latencies[action].append(seconds)
+            if error is not None:
+                self.errors[action][error] += 1
+
+
+class Client:
+    def __init__(self, port: int, recorder: Recorder, rng: random.Random, think: float, deadline: float):
+        self.port = port
+        self.recorder = recorder
+        self.rng = rng
+        self.think = think
+        self.deadline = deadline
+
+    @property
+    def running(self) -> bool:
+        return time.perf_counter() < self.deadline
+
+    def pause(self) -> None:
+        if self.think > 0:
+            time.sleep(min(self.rng.expovariate(1 / self.think), max(self.deadline - time.perf_counter(), 0)))
+
+    def request(self, action: str, method: str, path: str, body=None, headers=None,
+                expect: Tuple[int, ...] = (200,)) -> Tuple[Optional[int], bytes]:
+        """Запрос с замером; код ответа вне expect (или обрыв) считается ошибкой"""
+        started = time.perf_counter()
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=REQUEST_TIMEOUT)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            status, data = response.status, response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.recorder.add(action, time.perf_counter() - started, type(e).__name__)
+            return None, b""
+        finally:
+            conn.close()
+        self.recorder.add(action, time.perf_counter() - started, None if status in expect else str(status))
+        return status, data
+
+    def json(self, action: str, method: str, path: str, payload=None,
+             expect: Tuple[int, ...] = (200,)) -> Optional[Dict[str, Any]]:
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else None
+        status, data = self.request(action, method, path, body, headers, expect)
+        if status not in expect:
+            return None
+        return json.loads(data)
+
+    # ----- Таблица -----
+
+    def _filters(self, meta: Dict[str, Any], tests: List[Dict[str, Any]]) -> Dict[str, str]:
+        rng = self.rng
+        kind = rng.choice(["department", "gender", "tests", "q", "q_fuzzy", "combined"])
+        params: Dict[str, str] = {}
+        facets = meta.get("facets", {})
+        if kind in ("department", "combined") and facets.get("departments"):
+            params["department"] = rng.choice(facets["departments"])
+        if kind in ("gender", "combined") and facets.get("genders"):
+            params["gender"] = rng.choice(facets["genders"])
+        if kind in ("tests", "combined") and tests:
+            params["tests"] = json.dumps(rng.sample(tests, min(len(tests), rng.choice([1, 1, 2]))),
+                                         ensure_ascii=False)
+        if kind == "q":
+            params["q"] = rng.choice(LAST_NAMES)[:rng.randint(4, 7)]
+        if kind == "q_fuzzy":
+            # Опечатка: соседние буквы фамилии переставлены
+            name = rng.choice(LAST_NAMES)
+            i = rng.randrange(1, len(name) - 1)
+            params.update(q=name[:i] + name[i + 1] + name[i] + name[i + 2:], fuzzy="1")
+        return params
+
+    def browse(self, batch: str, tests: List[Dict[str, Any]]) -> None:
+        """Пакет открыт в таблице: метаданные, первая страница, затем фильтры/страницы/карточки"""
+        meta = self.json("meta", "GET", f"/api/batches/{quote(batch)}/meta") or {}
+        params = {"batch": batch, "per_page": str(self.rng.choice(PER_PAGE))}
+        page = self.json("records", "GET", "/api/records?" + urlencode(params))
+        for _ in range(self.rng.randint(3, 8)):
+            if not self.running:
+                return
+            self.pause()
+            step = self.rng.choice(["filter", "filter", "next_page", "record", "record"])
+            if step == "record" and page and page.get("items"):
+                rid = self.rng.choice(page["items"])["id"]
+                self.request("record", "GET", f"/api/record/{rid}?" + urlencode({"batch": batch}))
+            elif step == "next_page" and page:
+                params["page"] = str(int(params.get("page", 1)) + 1)
+                page = self.json("records", "GET", "/api/records?" + urlencode(params))
+            else:
+                params = dict(self._filters(meta, tests), batch=batch, per_page=params["per_page"])
+                page = self.json("records_filtered", "GET", "/api/records?" + urlencode(params))
+
+    # ----- Загрузка -----
+
+    def upload(self, path: str) -> Optional[str]:
+        """Порционная загрузка как в upload.js; возвращает имя пакета"""
+        size = os.path.getsize(path)
+        started = time.perf_counter()
+        session = self.json("upload_init", "POST", "/api/uploads",
+                            {"filename": os.path.basename(path), "size": size}, expect=(200, 201))
+        if session is None:
+            return None
+        offset, chunk_size = session["offset"], session["chunk_size"]
+        with open(path, "rb") as f:
+            while offset < size:
+                f.seek(offset)
+                chunk = f.read(chunk_size)
+                status, data = self.request("upload_chunk", "PUT",
+                                            f"/api/uploads/{session['upload_id']}?offset={offset}", chunk,
+                                            {"Content-Type": "application/octet-stream"})
+                if status != 200:
+                    return None
+                offset = json.loads(data)["offset"]
+        stored = self.json("upload_finalize", "POST", f"/api/uploads/{session['upload_id']}/finalize",
+                           {}, expect=(200, 201))
+        self.recorder.add("upload_total", time.perf_counter() - started, None if stored else "failed")
+        return stored["name"] if stored else None
+
+    # ----- Правила -----
+
+    def edit_rule(self, definition_id: int) -> None:
+        """Открыть определение анализа и сохранить его без изменений"""
+        definition = self.json("rule_get", "GET", f"/api/test-definitions/{definition_id}")
+        if definition is None:
+            return
+        keys = ("indicator_pattern", "variable_part", "value_type", "is_key_indicator", "is_required",
+                "display_order")
+        self.json("rule_edit", "PUT", f"/api/test-definitions/{definition_id}", {
+            "full_example_text": definition["full_example_text"],
+            "short_description": definition["short_description"],
+            "indicators": [{k: ind[k] for k in keys} for ind in definition["indicators"]],
+        })
+
+
+def _test_filters(definitions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Фильтры по анализам, как их собирает таблица: значения или диапазон ключевого показателя"""
+    filters = []
+    for definition in definitions:
+        key = next((ind for ind in definition["indicators"] if ind["is_key_indicator"]), None)
+        if key is None:
+            continue
+        if key["value_type"] == 1:
+            filters.append({"test_definition_id": definition["id"], "values": ["Обнаружено"]})
+        elif key["value_type"] == 2:
+            filters.append({"test_definition_id": definition["id"], "min": 1, "max": 20})
+    return filters
+
+
+def _kinds(scenario: Dict[str, float], clients: int) -> List[str]:
+    kinds = []
+    for kind in ("upload", "browse"):
+        kinds += [kind] * int(round(scenario.get(kind, 0) * clients))
+    kinds = (kinds + ["browse"] * clients)[:clients]
+    return kinds + ["editor"] * int(scenario.get("editors", 0))
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def _summary(latencies: List[float], errors: Dict[str, int], elapsed: float) -> Dict[str, Any]:
+    n = len(latencies)
+    return {
+        "requests": n,
+        "throughput_rps": round(n / elapsed, 2),
+        "errors": sum(errors.values()),
+        "error_rate": round(sum(errors.values()) / n, 4) if n else 0.0,
+        "errors_by_kind": dict(errors),
+        **{f"p{q}": round(_percentile(latencies, q), 4) for q in (50, 90, 95, 99)},
+        "max": round(max(latencies), 4),
+    }
+
+
+def run_scenario(name: str, template: str, work: str, uploads: List[str], args) -> Dict[str, Any]:
+    instance = os.path.join(work, name)
+    shutil.copytree(template, instance)
+    server = Server(instance, os.path.join(work, f"{name}.log"))
+    try:
+        setup = Client(server.port, Recorder(), random.Random(0), 0, math.inf)
+        definitions = setup.json("setup", "GET", "/api/test-definitions")["definitions"]
+        tests = _test_filters(definitions)
+        batches = sorted(os.listdir(os.path.join(template, "uploads")))
+        if args.warm:
+            for batch in batches:
+                setup.request("setup", "GET", "/api/records?" + urlencode({"batch": batch, "per_page": 1}))
+        rss_start = server.rss_kb()
+
+        recorder = Recorder()
+        kinds = _kinds(SCENARIOS[name], args.clients)
+        upload_files = iter(uploads)
+        upload_lock = threading.Lock()
+        started = time.perf_counter()
+        deadline = started + args.duration
+
+        def worker(i: int, kind: str):
+            rng = random.Random(args.seed * 1000 + i)
+            client = Client(server.port, recorder, rng, args.think, deadline)
+            if kind == "editor":
+                while client.running:
+                    time.sleep(min(args.edit_interval, max(deadline - time.perf_counter(), 0)))
+                    if client.running:
+                        client.edit_rule(rng.choice(definitions)["id"])
+                return
+            own_batch = None
+            if kind == "upload":
+                with upload_lock:
+                    path = next(upload_files, None)
+                own_batch = client.upload(path) if path else None
+            while client.running:
+                client.browse(own_batch or rng.choice(batches), tests)
+                client.pause()
+
+        threads = [threading.Thread(target=worker, args=(i, kind), daemon=True) for i, kind in enumerate(kinds)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        all_errors: Dict[str, int] = defaultdict(int)
+        for action, errors in recorder.errors.items():
+            if action == "upload_total":
+                continue  # ошибка уже учтена в запросе загрузки, который не удался
+            for kind, count in errors.items():
+                all_errors[kind] += count
+        # upload_total - сводная длительность загрузки, не отдельный запрос
+        all_latencies = [v for action, values in recorder.latencies.items() if action != "upload_total"
+                         for v in values]
+        rss_peak = server.rss_kb("VmHWM")
+        return {
+            "clients": {kind: kinds.count(kind) for kind in sorted(set(kinds))},
+            "elapsed": round(elapsed, 2),
+            "total": _summary(all_latencies, all_errors, elapsed) if all_latencies else None,
+            "actions": {action: _summary(values, recorder.errors.get(action, {}), elapsed)
+                        for action, values in sorted(recorder.latencies.items())},
+            "rss_start_mb": round(rss_start / 1024, 1) if rss_start else None,
+            "rss_peak_mb": round(rss_peak / 1024, 1) if rss_peak else None,
+        }
+    finally:
+        server.stop()
+
+
+def prepare(work: str, args) -> Tuple[str, List[str]]:
+    """Исходный instance (журналы и правила) и журналы для загрузки"""
+    definitions = generate_definitions(args.rules, args.seed)
+    template = os.path.join(work, "template")
+    os.makedirs(os.path.join(template, "uploads"))
+    make_rules_db(os.path.join(template, "parse_rules.db"), definitions)
+    for i in range(args.batches):
+        write_journal(os.path.join(template, "uploads", f"journal__202511{i + 1:02d}-080000.xlsx"),
+                      generate_rows(args.rows, definitions, args.seed + i))
+
+    # У каждого загружающего клиента свой журнал (одинаковые файлы - повторная загрузка)
+    max_uploads = max(int(round(SCENARIOS[s].get("upload", 0) * args.clients)) for s in args.scenarios)
+    uploads = []
+    for i in range(max_uploads):
+        path = os.path.join(work, "to_upload", f"upload_{i + 1:03d}.xlsx")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        uploads.append(write_journal(path, generate_rows(args.upload_rows, definitions, args.seed + 1000 + i)))
+    return template, uploads
+
+
+def _print_scenario(name: str, res: Dict[str, Any]) -> None:
+    total = res["total"] or {}
+    print(f"\n{name}: клиенты {res['clients']}, {res['elapsed']} с, "
+          f"{total.get('requests', 0)} запросов, {total.get('throughput_rps', 0)} запр/с, "
+          f"ошибок {total.get('error_rate', 0):.1%}, RSS {res['rss_start_mb']} -> пик {res['rss_peak_mb']} МБ")
+    print(f"  {'запрос':<18}{'кол-во':>8}{'запр/с':>9}{'ошибки':>8}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for action, s in res["actions"].items():
+        print(f"  {action:<18}{s['requests']:>8}{s['throughput_rps']:>9}{s['errors']:>8}"
+              f"{s['p50']:>9.3f}{s['p90']:>9.3f}{s['p95']:>9.3f}{s['p99']:>9.3f}{s['max']:>9.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--serve", metavar="INSTANCE", help=argparse.SUPPRESS)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"через запятую из: {', '.join(SCENARIOS)}")
+    parser.add_argument("--clients", type=int, default=30, help="одновременных пользователей")
+    parser.add_argument("--duration", type=float, default=30, help="секунд на сценарий")
+    parser.add_argument("--think", type=float, default=1.0, help="средняя пауза пользователя между шагами, с")
+    parser.add_argument("--edit-interval", type=float, default=10, help="секунд между правками правил")
+    parser.add_argument("--batches", type=int, default=3, help="журналов в instance")
+    parser.add_argument("--rows", type=int, default=5000, help="строк в журнале")
+    parser.add_argument("--upload-rows", type=int, default=2000, help="строк в загружаемом журнале")
+    parser.add_argument("--rules", type=int, default=100)
+    parser.add_argument("--warm", action="store_true", help="до замера открыть каждый пакет (кэши прогреты)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(unknown)}")
+
+    results: Dict[str, Any] = {"params": {k: v for k, v in vars(args).items() if k not in ("serve", "out")}}
+    failed = False
+    with tempfile.TemporaryDirectory() as work:
+        template, uploads = prepare(work, args)
+        for name in args.scenarios:
+            res = run_scenario(name, template, work, uploads, args)
+            results[name] = res
+            _print_scenario(name, res)
+            failed |= bool(res["total"] and res["total"]["errors"])
+
+    print("\nРезультаты:", save_results("load", results, args.out))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Память и нагрузка на GC: записи пакета списком словарей и в CompactRecords
+
+    python -m benchmarks.bench_memory [--rows 10000,100000] [--rules 100] [--repeat 3] [--out results.json]
+
+Для каждого размера строится синтетический журнал (benchmarks/generator.py),
+записи разбираются правилами и замеряются в обоих представлениях:
+
+* bytes_per_row - прирост памяти (tracemalloc) на запись;
+* gc_objects - число объектов, отслеживаемых сборщиком мусора;
+* gc_collect - время полного gc.collect(), пока пакет в памяти;
+* page_50 / full_iteration - сборка словарей страницы из 50 записей и всего пакета.
+"""
+import gc
+import os
+import json
+import argparse
+import tempfile
+import tracemalloc
+from typing import Callable, Dict, Any, List
+
+import numpy as np
+
+from lab_parser.app.services.parse_excel import _parse_patient_block
+from lab_parser.app.services.results_parser import ResultsParser
+from lab_parser.app.services.compact_records import CompactRecords
+
+from .common import save_results, timeit
+from .generator import generate_definitions, generate_rows, make_rules_db
+
+
+def _records(n_rows: int, n_rules: int, seed: int) -> List[Dict[str, Any]]:
+    """Записи в виде read_records_with_parsing, без чтения Excel"""
+    definitions = generate_definitions(n_rules, seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        rules = make_rules_db(os.path.join(tmp, "rules.db"), definitions).get_all_rules()
+    parser = ResultsParser(rules)
+    items = []
+    for row_id, patient, sample_id, department, raw in generate_rows(n_rows, definitions, seed):
+        items.append({
+            "id": row_id,
+            "row_id": row_id,
+            "patient": _parse_patient_block(patient),
+            "sample_id": sample_id,
+            "department": department,
+            "results": parser.parse_results(raw),
+        })
+    return items
+
+
+def _footprint(build: Callable[[], Any]) -> Dict[str, Any]:
+    """Память, объекты GC и время gc.collect() для результата build()"""
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    tracemalloc.start()
+    held = build()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {
+        "bytes": allocated,
+        "gc_objects": len(gc.get_objects()) - objects_before,
+        "gc_collect": timeit(gc.collect, repeat=3),
+    }
+    del held
+    return result
+
+
+def bench_case(n_rows: int, n_rules: int, repeat: int, seed: int) -> Dict[str, Any]:
+    items = _records(n_rows, n_rules, seed)
+    # Из JSON-вида: у каждой записи свои объекты, как после чтения Excel
+    blob = json.dumps(items, ensure_ascii=False)
+    del items
+
+    loads = json.loads
+    dicts = _footprint(lambda: loads(blob))
+    compact = _footprint(lambda: CompactRecords.from_items(loads(blob)))
+
+    records = CompactRecords.from_items(loads(blob))
+    page = np.arange(min(50, n_rows)) + n_rows // 2 - 25
+    result = {
+        "rows": n_rows,
+        "rules": n_rules,
+        "dicts": dicts,
+        "compact": compact,
+        "bytes_per_row": {"dicts": round(dicts["bytes"] / n_rows, 1),
+                          "compact": round(compact["bytes"] / n_rows, 1)},
+        "compact_nbytes": records.nbytes(),
+        "from_items": timeit(lambda: CompactRecords.from_items(loads(blob)), repeat),
+        "page_50": timeit(lambda: records.take(page), repeat),
+        "full_iteration": timeit(lambda: sum(1 for _ in records), repeat),
+    }
+    return result
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=_ints, default=[10000, 100000])
+    parser.add_argument("--rules", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args(argv)
+
+    results = []
+    for n_rows in args.rows:
+        res = bench_case(n_rows, args.rules, args.repeat, args.seed)
+        results.append(res)
+        print(f"{n_rows} строк: словари {res['bytes_per_row']['dicts']:.0f} Б/строку, "
+              f"{res['dicts']['gc_objects']} объектов GC, gc.collect {res['dicts']['gc_collect']['median'] * 1000:.1f} мс; "
+              f"CompactRecords {res['bytes_per_row']['compact']:.0f} Б/строку, "
+              f"{res['compact']['gc_objects']} объектов GC, gc.collect {res['compact']['gc_collect']['median'] * 1000:.1f} мс; "
+              f"страница 50 - {res['page_50']['median'] * 1000:.2f} мс, "
+              f"весь пакет - {res['full_iteration']['median']:.3f} с")
+
+    print("Результаты:", save_results("memory", results, args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Поиск шаблонов в нераспознанных результатах (services.rule_mining)
+
+    python -m benchmarks.bench_mining [--rows 100000,1000000] [--defs 200] [--repeat 3] [--out results.json]
+
+Строки журнала генерируются только по анализам, для которых правил нет, -
+все они нераспознанные. Замеряются:
+
+* mining - TemplateMiner по строкам в памяти (сведение одинаковых текстов,
+  разбор исследований, группировка по шаблонам);
+* index - то же с чтением из поискового индекса (SearchIndexDB.iter_unparsed_results),
+  как в GET /api/test-definitions/suggestions;
+* сколько шаблонов найдено и сколько из них совпали с анализами генератора.
+"""
+import os
+import argparse
+import tempfile
+from typing import Dict, Any, List, Tuple
+
+from lab_parser.app.models.search_index import SearchIndexDB
+from lab_parser.app.services.rule_mining import TemplateMiner, mine_templates
+
+from .common import save_results, timeit
+from .generator import generate_definitions, generate_rows
+
+
+def _unparsed_rows(n_rows: int, n_defs: int, seed: int) -> Tuple[List[Tuple[str, str, int]], List[Dict[str, Any]]]:
+    definitions = generate_definitions(n_defs, seed)
+    rows = [(raw, f"batch{i % 10}.xlsx", row_id)
+            for i, (row_id, _, _, _, raw) in enumerate(generate_rows(n_rows, definitions, seed)) if raw]
+    return rows, definitions
+
+
+def _fill_index(path: str, rows: List[Tuple[str, str, int]]) -> SearchIndexDB:
+    db = SearchIndexDB(path)
+    batches: Dict[str, List[Dict[str, Any]]] = {}
+    empty = dict.fromkeys(["patient_key", "last_name", "first_name", "middle_name", "gender", "birth_date",
+                           "age_years", "sample_id", "sample_key", "department", "summary"])
+    for raw, batch, row_id in rows:
+        batches.setdefault(batch, []).append(dict(empty, row_id=row_id, tests=[], raw_text=raw))
+    for batch, batch_rows in batches.items():
+        db.replace_batch(batch, 0, 1, "2025-11-01T00:00:00", batch_rows)
+    return db
+
+
+def _matched(result: Dict[str, Any], definitions: List[Dict[str, Any]]) -> int:
+    """Сколько анализов генератора нашлись как шаблоны с тем же заголовком"""
+    prefixes = {d["_prefix"] for d in definitions}
+    found = {t["example"]["text"].split(":", 1)[0] + ":" for t in result["templates"]}
+    return len(prefixes & found)
+
+
+def bench_case(n_rows: int, n_defs: int, seed: int, repeat: int) -> Dict[str, Any]:
+    rows, definitions = _unparsed_rows(n_rows, n_defs, seed)
+
+    def run():
+        miner = TemplateMiner()
+        miner.add_rows(rows)
+        return miner.results(limit=1000)
+
+    result = mine_templates(rows, limit=1000)
+    res: Dict[str, Any] = {
+        "rows": len(rows),
+        "texts": result["texts"],
+        "templates": result["total_templates"],
+        "definitions_found": _matched(result, definitions),
+        "definitions": n_defs,
+        "mining": timeit(run, repeat),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        db = _fill_index(os.path.join(tmp, "search_index.db"), rows)
+        res["index"] = timeit(lambda: mine_templates(db.iter_unparsed_results(), limit=1000), repeat)
+    return res
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=_ints, default=[100000, 1000000])
+    parser.add_argument("--defs", type=int, default=200, help="число анализов без правил в журнале")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args(argv)
+
+    results = []
+    for n_rows in args.rows:
+        res = bench_case(n_rows, args.defs, args.seed, args.repeat)
+        results.append(res)
+        print(f"{res['rows']} строк ({res['texts']} разных текстов): шаблонов {res['templates']}, "
+              f"анализов найдено {res['definitions_found']}/{res['definitions']}; "
+              f"в памяти {res['mining']['median']:.2f} с, из индекса {res['index']['median']:.2f} с")
+
+    print("Результаты:", save_results("mining", results, args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Чтение и парсинг журналов на синтетических данных (benchmarks/generator.py)
+
+    python -m benchmarks.bench_parsing [--rows 1000,10000,100000] [--rules 10,100,1000]
+                                       [--formats xlsx,html] [--layouts raw,processed]
+                                       [--repeat 3] [--seed 1] [--out results.json]
+
+Для каждой комбинации (строки, правила, формат, раскладка) во временном каталоге
+instance генерируются журнал и БД правил, затем замеряются:
+
+* read_basic_records - чтение файла в записи;
+* parser_init - ResultsParser(rules) (компиляция правил);
+* parse_results - разбор текстов результатов всех записей готовым парсером;
+* apply_parsing_rules - то же вместе с созданием парсера (как при чтении пакета);
+* api_records_cold / _disk / _warm - GET /api/records через тестовый клиент Flask:
+  без кэшей, из дискового кэша пакетов и из кэша в памяти процесса.
+"""
+import os
+import copy
+import time
+import shutil
+import argparse
+import tempfile
+from typing import Callable, Dict, Any, List, Optional
+
+from lab_parser.app import create_app
+from lab_parser.app.services.parse_excel import read_basic_records
+from lab_parser.app.services.results_parser import ResultsParser, apply_parsing_rules
+from lab_parser.app.services.parsed_batch import clear_parsed_batch_cache
+from lab_parser.app.services.batch_cache import get_batch_disk_cache
+
+from .common import save_results, summarize, timeit
+from .generator import generate_definitions, generate_rows, make_rules_db, write_journal
+
+
+def _measure(fn: Callable[[], Any], setup: Optional[Callable[[], Any]], repeat: int) -> Dict[str, float]:
+    """Как timeit, но с подготовкой перед каждым запуском (не входит в замер)"""
+    times: List[float] = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return summarize(times)
+
+
+def bench_case(workdir: str, n_rows: int, n_rules: int, fmt: str, layout: str,
+               repeat: int, seed: int) -> Dict[str, Any]:
+    instance = os.path.join(workdir, f"instance-{n_rows}-{n_rules}-{fmt}-{layout}")
+    uploads = os.path.join(instance, "uploads")
+    os.makedirs(uploads, exist_ok=True)
+
+    definitions = generate_definitions(n_rules, seed)
+    rules_db = make_rules_db(os.path.join(instance, "parse_rules.db"), definitions)
+    rules = rules_db.get_all_rules()
+    rows = generate_rows(n_rows, definitions, seed)
+    path = write_journal(os.path.join(uploads, "journal__20251101-100000.xlsx"), rows, layout, fmt)
+
+    result: Dict[str, Any] = {"rows": n_rows, "rules": len(rules), "definitions": n_rules,
+                              "format": fmt, "layout": layout, "file_bytes": os.path.getsize(path)}
+
+    result["read_basic_records"] = timeit(lambda: read_basic_records(path), repeat)
+    items = read_basic_records(path)
+    texts = [item["results"].get("raw_text") for item in items]
+
+    result["parser_init"] = timeit(lambda: ResultsParser(rules), repeat)
+    parser = ResultsParser(rules)
+    result["parse_results"] = timeit(lambda: [parser.parse_results(t) for t in texts], repeat)
+    # apply_parsing_rules меняет записи на месте - каждый запуск на свежей копии
+    fresh: List[List[Dict[str, Any]]] = []
+    result["apply_parsing_rules"] = _measure(lambda: apply_parsing_rules(fresh[-1], rules),
+                                             lambda: fresh.append(copy.deepcopy(items)), repeat)
+    fresh.clear()
+
+    parsed = sum(1 for t in texts if t and parser.parse_results(t)["tests"])
+    result["parsed_share"] = round(parsed / max(len(texts), 1), 4)
+
+    # Полный запрос: чтение + парсинг + индексы пакета + сериализация первой страницы
+    app = create_app(instance)
+    client = app.test_client()
+    disk_cache = get_batch_disk_cache(instance, app.config["PARSED_BATCH_DISK_CACHE_MB"] * 1024 * 1024)
+    url = "/api/records?page=1&per_page=50"
+
+    def request():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url}: {response.status_code} {response.get_data(as_text=True)[:500]}")
+
+    def drop_all():
+        clear_parsed_batch_cache()
+        disk_cache.clear()
+
+    result["api_records_cold"] = _measure(request, drop_all, repeat)
+    result["api_records_disk"] = _measure(request, clear_parsed_batch_cache, repeat)
+    result["api_records_warm"] = timeit(request, repeat)
+    clear_parsed_batch_cache()
+
+    shutil.rmtree(instance, ignore_errors=True)
+    return result
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _names(value: str) -> List[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=_ints, default=[1000, 10000, 100000])
+    parser.add_argument("--rules", type=_ints, default=[10, 100, 1000])
+    parser.add_argument("--formats", type=_names, default=["xlsx"], help="xlsx,html")
+    parser.add_argument("--layouts", type=_names, default=["raw"], help="raw,processed")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args(argv)
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="lab_parser_bench_")
+    try:
+        for n_rows in args.rows:
+            for n_rules in args.rules:
+                for fmt in args.formats:
+                    for layout in args.layouts:
+                        name = f"{n_rows} строк, {n_rules} анализов, {fmt}/{layout}"
+                        try:
+                            res = bench_case(workdir, n_rows, n_rules, fmt, layout, args.repeat, args.seed)
+                        except Exception as e:
+                            # Например, нет lxml для HTML - остальные комбинации всё равно замеряются
+                            print(f"{name}: ОШИБКА: {e}")
+                            results.append({"rows": n_rows, "definitions": n_rules, "format": fmt,
+                                            "layout": layout, "error": str(e)})
+                            continue
+                        results.append(res)
+                        print(f"{name}: чтение {res['read_basic_records']['median']:.3f} с, "
+                              f"парсинг {res['parse_results']['median']:.3f} с, "
+                              f"/api/records холодный {res['api_records_cold']['median']:.3f} с, "
+                              f"диск {res['api_records_disk']['median']:.3f} с, "
+                              f"тёплый {res['api_records_warm']['median'] * 1000:.1f} мс, "
+                              f"распознано {res['parsed_share']:.0%}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("Результаты:", save_results("parsing", results, args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Сериализация ответов /api/records и их сжатие
+
+    python -m benchmarks.bench_serialization [--rows 100000] [--pages 50,1000,all] [--repeat 5] [--out results.json]
+
+Ответ строится так же, как в records(): страница записей из CompactRecords
+и версия метаданных; сами метаданные пакета (/api/batches/<имя>/meta) замеряются
+отдельной строкой "meta". Для каждого размера страницы замеряются:
+
+* json_flask - стандартный провайдер Flask (json, ASCII-экранирование);
+* json_stdlib / json_orjson - провайдеры services.json_provider (orjson - если установлен);
+* размер тела и время сжатия gzip (уровни 1 и 6) и brotli (если установлен).
+"""
+import os
+import argparse
+import tempfile
+from typing import Dict, Any, List
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from lab_parser.app.services.json_provider import StdlibJSONProvider, OrjsonJSONProvider, orjson
+from lab_parser.app.services.compression import compress_bytes, brotli
+from lab_parser.app.services.parsed_batch import ParsedBatch
+
+from .common import save_results, timeit
+from .bench_memory import _records
+from .generator import generate_definitions, make_rules_db
+
+
+def _payload(batch: ParsedBatch, per_page: int) -> Dict[str, Any]:
+    return {
+        "page": 1,
+        "per_page": per_page,
+        "total": len(batch.items),
+        "items": batch.items.take(range(min(per_page, len(batch.items)))),
+        "batch": batch.name,
+        "meta_version": "0123456789abcdef",
+    }
+
+
+def _meta_payload(batch: ParsedBatch) -> Dict[str, Any]:
+    return {
+        "batch": batch.name,
+        "version": "0123456789abcdef",
+        "rules_generation": batch.rules_generation,
+        "facets": batch.facets,
+        "test_columns": batch.test_columns,
+        "test_key_indicators": batch.test_key_indicators,
+        "rules_map": batch.rules_map,
+    }
+
+
+def bench_page(app: Flask, payload: Dict[str, Any], repeat: int) -> Dict[str, Any]:
+    providers = {"json_flask": DefaultJSONProvider(app), "json_stdlib": StdlibJSONProvider(app)}
+    if orjson is not None:
+        providers["json_orjson"] = OrjsonJSONProvider(app)
+
+    result: Dict[str, Any] = {"items": len(payload.get("items", []))}
+    body = b""
+    with app.app_context():
+        for name, provider in providers.items():
+            data = provider.response(payload).get_data()
+            result[name] = timeit(lambda: provider.response(payload), repeat)
+            result[name]["bytes"] = len(data)
+            body = data
+
+    encodings = [("gzip-1", "gzip", 1), ("gzip-6", "gzip", 6)]
+    if brotli is not None:
+        encodings += [("br-4", "br", 4)]
+    for name, encoding, level in encodings:
+        compressed = compress_bytes(body, encoding, gzip_level=level, brotli_quality=level)
+        result[name] = timeit(lambda: compress_bytes(body, encoding, gzip_level=level, brotli_quality=level),
+                              repeat)
+        result[name]["bytes"] = len(compressed)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--rules", type=int, default=100)
+    parser.add_argument("--pages", default="50,1000,all", help="размеры страниц; all - весь пакет")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rules = make_rules_db(os.path.join(tmp, "rules.db"),
+                              generate_definitions(args.rules, args.seed)).get_all_rules()
+    batch = ParsedBatch("bench.xlsx", _records(args.rows, args.rules, args.seed), rules)
+    app = Flask(__name__)
+
+    results: List[Dict[str, Any]] = []
+    for page in ["meta"] + args.pages.split(","):
+        if page == "meta":
+            res = bench_page(app, _meta_payload(batch), args.repeat)
+            per_page = "meta"
+        else:
+            per_page = args.rows if page.strip() == "all" else int(page)
+            res = bench_page(app, _payload(batch, per_page), args.repeat)
+        res["per_page"] = per_page
+        results.append(res)
+        line = ", ".join(
+            f"{name} {res[name]['median'] * 1000:.1f} мс / {res[name]['bytes'] / 1024:.0f} КБ"
+            for name in res if isinstance(res[name], dict)
+        )
+        print(f"страница {per_page}: {line}")
+
+    print("Результаты:", save_results("serialization", {"rows": args.rows, "pages": results}, args.out))
+
+
+if __name__ == "__main__":
+    main()
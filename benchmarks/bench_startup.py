@@ -0,0 +1,94 @@
+"""
+Время запуска: импорт приложения и модулей чтения журналов (python -X importtime)
+
+    python -m benchmarks.bench_startup [--repeat 5] [--out results.json]
+
+Каждый сценарий выполняется в отдельном интерпретаторе. Из вывода -X importtime
+берётся суммарное время импорта (cumulative модулей верхнего уровня) и самые
+дорогие модули; дополнительно фиксируется, загрузился ли pandas.
+"""
+import sys
+import json
+import time
+import argparse
+import subprocess
+from typing import Dict, Any, List, Tuple
+
+from .common import PROJECT_ROOT, save_results, summarize
+
+SCENARIOS = {
+    # То, что платит каждый процесс с create_app() (и скрипты, импортирующие пакет)
+    "app_import": "from lab_parser.app import create_app",
+    "routes_import": "from lab_parser.app import create_app\n"
+                     "from lab_parser.app.routes import api, ui",
+    # То, что ленивые импорты откладывают до первого чтения файла (и что снимает preload)
+    "excel_stack": "import pandas, openpyxl\n"
+                   "import pandas.io.excel._openpyxl",
+    "cli_import": "import lab_parser.cli",
+}
+
+PROBE = "\nimport sys, json\nprint(json.dumps({m: m in sys.modules for m in ('pandas', 'openpyxl', 'numpy')}))"
+
+
+def parse_importtime(stderr: str) -> Tuple[int, List[Tuple[str, int]]]:
+    """
+    Разбор вывода -X importtime.
+
+    Returns:
+        (сумма cumulative модулей верхнего уровня, мкс; [(модуль, cumulative мкс), ...] верхнего уровня)
+    """
+    top: List[Tuple[str, int]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # строка заголовка
+        name = parts[2]
+        # Модуль верхнего уровня - без отступа перед именем (вложенные сдвинуты на 2 пробела)
+        if name.startswith(" ") and not name.startswith("  "):
+            top.append((name.strip(), int(parts[1])))
+    return sum(us for _, us in top), top
+
+
+def run_scenario(code: str, repeat: int) -> Dict[str, Any]:
+    totals, walls = [], []
+    last_top: List[Tuple[str, int]] = []
+    modules: Dict[str, bool] = {}
+    for _ in range(repeat):
+        started = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code + PROBE],
+                              cwd=PROJECT_ROOT, capture_output=True, text=True)
+        walls.append(time.perf_counter() - started)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr[-2000:])
+        total, last_top = parse_importtime(proc.stderr)
+        totals.append(total / 1e6)
+        modules = json.loads(proc.stdout.strip().splitlines()[-1])
+    heaviest = sorted(last_top, key=lambda x: x[1], reverse=True)[:10]
+    return {
+        "import_seconds": summarize(totals),
+        "process_seconds": summarize(walls),
+        "loaded": modules,
+        "heaviest": [{"module": m, "cumulative_ms": round(us / 1000, 1)} for m, us in heaviest],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", help="файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, code in SCENARIOS.items():
+        results[name] = res = run_scenario(code, args.repeat)
+        print(f"{name:15s} импорт {res['import_seconds']['median'] * 1000:7.1f} мс, "
+              f"процесс {res['process_seconds']['median'] * 1000:7.1f} мс, "
+              f"pandas загружен: {res['loaded'].get('pandas')}")
+
+    print("Результаты:", save_results("startup", results, args.out))
+
+
+if __name__ == "__main__":
+    main()
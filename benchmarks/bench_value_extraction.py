@@ -0,0 +1,166 @@
+"""
+Извлечение значений показателей: прежний путь по типам и автоопределение
+
+    python -m benchmarks.bench_value_extraction [--rows 20000] [--rules 100] [--repeat 5] [--out results.json]
+
+Корпус - захваченные правилами значения из синтетического журнала
+(benchmarks/generator.py) плюс набор краевых случаев. Проверяется и замеряется:
+
+* equivalence - ResultsParser._extract_value_by_type для типов 1-3 на всём корпусе
+  и parse_results на всех строках журнала совпадают с прежней реализацией
+  (её копия - _legacy_extract_value_by_type ниже, по ней же сверяет tests/test_value_extraction.py);
+  при расхождении - код выхода 1;
+* legacy / per_type - время извлечения всех значений корпуса по типу их правила;
+* auto - то же одним проходом с автоопределением типа (тип 4);
+* auto_types - какой тип автоопределение дало значениям каждого объявленного типа.
+"""
+import re
+import os
+import sys
+import argparse
+import tempfile
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+
+from lab_parser.app.services.results_parser import ResultsParser, VALUE_TYPE_AUTO
+
+from .common import save_results, timeit
+from .generator import generate_definitions, generate_rows, make_rules_db
+
+EDGE_VALUES = [
+    "Не обнаружено", "не  обнаружена", "ОБНАРУЖЕНО", "обнаружен", "отриц.", "полож.",
+    "отрицательная", "Положительное", "Не обнаружено Повторное исследование",
+    "12,345", "0.5", "42", "12,3456", "1.2.3", "<0,5", "> 100", "1-3", "1 – 3", "5.2 мМЕ/мл",
+    "менее 0.01", "Rh+ (положительный)", "слабо - положительный", "A - B - C", "титр 1:40",
+    "Не обнаружено - повтор", "-", "  ", "x", "0,44 Повтор через неделю",
+]
+
+
+def _legacy_extract_value_by_type(captured_text: str, value_type: int) -> Optional[str]:
+    """ResultsParser._extract_value_by_type до предкомпиляции выражений - эталон для сравнения"""
+    if not captured_text:
+        return None
+
+    cutoff = re.search(r'\s+[А-ЯЁ][а-яё]', captured_text)
+    if cutoff:
+        captured_text = captured_text[:cutoff.start()].strip()
+
+    if value_type == 1:
+        match = re.search(
+            r'(не\s+обнаружен[оа]?|обнаружен[оа]?|отрицательн(?:ый|ая|ое)|положительн(?:ый|ая|ое)|отриц\.|полож\.)\s*$',
+            captured_text,
+            re.IGNORECASE
+        )
+        return match.group(1) if match else None
+
+    elif value_type == 2:
+        match = re.search(r'(\d+[.,]\d{1,3})\s*$', captured_text)
+        if match:
+            return match.group(1)
+        match = re.search(r'(\d+)\s*$', captured_text)
+        return match.group(1) if match else None
+
+    else:
+        match = re.search(r'-\s+([^\s-][^-]+?)\s*$', captured_text)
+        if match:
+            return match.group(1).strip()
+        words = captured_text.strip().split()
+        return words[-1] if words else None
+
+
+class LegacyResultsParser(ResultsParser):
+    def _extract_value_by_type(self, captured_text, value_type):
+        return _legacy_extract_value_by_type(captured_text, value_type)
+
+
+def _corpus(parser: ResultsParser, texts: List[str]) -> List[Tuple[str, int]]:
+    """Захваченные значения (как в _parse_definition) с типом правила, которое их захватило"""
+    corpus = []
+    for text in texts:
+        for indicators in parser.rules_by_definition.values():
+            working_text = text
+            for compiled in indicators:
+                match = compiled["pattern"].search(working_text)
+                if match:
+                    corpus.append((match.group(1).strip(), compiled["value_type"]))
+                    working_text = working_text.replace(match.group(0), "", 1)
+    corpus.extend((value, value_type) for value in EDGE_VALUES for value_type in (1, 2, 3))
+    return corpus
+
+
+def check_equivalence(parser: ResultsParser, legacy: LegacyResultsParser,
+                      corpus: List[Tuple[str, int]], texts: List[str]) -> Dict[str, Any]:
+    mismatches = []
+    for value, _ in corpus:
+        for value_type in (1, 2, 3):
+            new = parser._extract_value_by_type(value, value_type)
+            old = _legacy_extract_value_by_type(value, value_type)
+            if new != old:
+                mismatches.append({"value": value, "value_type": value_type, "new": new, "legacy": old})
+    rows_differ = sum(parser.parse_results(text) != legacy.parse_results(text) for text in texts)
+    return {"values": len(corpus), "value_mismatches": mismatches[:20],
+            "value_mismatch_count": len(mismatches), "rows": len(texts), "rows_differ": rows_differ}
+
+
+def main(argv=None):
+    parser_args = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser_args.add_argument("--rows", type=int, default=20000)
+    parser_args.add_argument("--rules", type=int, default=100)
+    parser_args.add_argument("--repeat", type=int, default=5)
+    parser_args.add_argument("--seed", type=int, default=1)
+    parser_args.add_argument("--out", help="файл результатов (по умолчанию benchmarks/results/)")
+    args = parser_args.parse_args(argv)
+
+    definitions = generate_definitions(args.rules, args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        rules = make_rules_db(os.path.join(tmp, "rules.db"), definitions).get_all_rules()
+    texts = [row[-1] for row in generate_rows(args.rows, definitions, args.seed) if row[-1]]
+
+    parser = ResultsParser(rules)
+    legacy = LegacyResultsParser(rules)
+    corpus = _corpus(parser, texts)
+
+    equivalence = check_equivalence(parser, legacy, corpus, texts)
+    print(f"Эквивалентность типов 1-3: значений {equivalence['values']}, расхождений "
+          f"{equivalence['value_mismatch_count']}; строк {equivalence['rows']}, "
+          f"с другим результатом parse_results {equivalence['rows_differ']}")
+
+    extract = parser._extract_value_by_type
+    extract_auto = parser._extract_auto_value
+    timings = {
+        "legacy": timeit(lambda: [_legacy_extract_value_by_type(v, t) for v, t in corpus], args.repeat),
+        "per_type": timeit(lambda: [extract(v, t) for v, t in corpus], args.repeat),
+        "auto": timeit(lambda: [extract_auto(v) for v, _ in corpus], args.repeat),
+    }
+    for name, timing in timings.items():
+        print(f"{name}: {timing['median'] * 1000:.1f} мс на {len(corpus)} значений "
+              f"({timing['median'] / len(corpus) * 1e9:.0f} нс/значение)")
+
+    auto_types: Dict[int, Counter] = {}
+    for value, value_type in corpus:
+        auto_types.setdefault(value_type, Counter())[extract_auto(value)[1]] += 1
+    for value_type, counts in sorted(auto_types.items()):
+        print(f"тип {value_type} -> автоопределение: {dict(sorted(counts.items()))}")
+
+    # parse_results целиком: все правила как тип 4
+    auto_rules = [dict(rule, value_type=VALUE_TYPE_AUTO) for rule in rules]
+    auto_parser = ResultsParser(auto_rules)
+    parse = {
+        "legacy": timeit(lambda: [legacy.parse_results(t) for t in texts], max(1, args.repeat // 2)),
+        "per_type": timeit(lambda: [parser.parse_results(t) for t in texts], max(1, args.repeat // 2)),
+        "auto": timeit(lambda: [auto_parser.parse_results(t) for t in texts], max(1, args.repeat // 2)),
+    }
+    print("parse_results: " + ", ".join(f"{name} {t['median']:.2f} с" for name, t in parse.items()))
+
+    print("Результаты:", save_results("value_extraction", {
+        "rows": args.rows, "rules": len(rules), "equivalence": equivalence, "extract": timings,
+        "parse_results": parse,
+        "auto_types": {str(k): dict(v) for k, v in auto_types.items()},
+    }, args.out))
+
+    if equivalence["value_mismatch_count"] or equivalence["rows_differ"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Общие утилиты бенчмарков: замеры и сохранение результатов в JSON"""
+import os
+import json
+import time
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Optional
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+RESULTS_DIR = os.path.join(PROJECT_ROOT, "benchmarks", "results")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timeit(fn: Callable[[], Any], repeat: int = 5, warmup: int = 1) -> Dict[str, float]:
+    """Время вызова fn (с): медиана/минимум/максимум по repeat запускам"""
+    for _ in range(warmup):
+        fn()
+    times: List[float] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return summarize(times)
+
+
+def summarize(times: List[float]) -> Dict[str, float]:
+    return {
+        "median": round(statistics.median(times), 6),
+        "min": round(min(times), 6),
+        "max": round(max(times), 6),
+        "runs": len(times),
+    }
+
+
+def save_results(name: str, results: Any, out: Optional[str] = None) -> str:
+    """
+    Сохранить результаты в JSON вместе с окружением.
+    По умолчанию - benchmarks/results/<name>-<коммит>.json
+    """
+    commit = git_commit()
+    if out is None:
+        out = os.path.join(RESULTS_DIR, f"{name}-{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    payload = {
+        "benchmark": name,
+        "commit": commit,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    return out
@@ -0,0 +1,205 @@
+"""
+Генератор синтетических лабораторных журналов и правил для бенчмарков
+
+Всё детерминировано (random.Random(seed)), поэтому результаты сравнимы между коммитами.
+
+* generate_definitions(n) - определения анализов в формате POST /api/test-definitions:
+  первые - как в реальной БД правил (антитела, гормоны, резус), дальше синтетические
+  по тем же шаблонам; часть анализов с двумя показателями.
+* make_rules_db(path, definitions) - временная ParseRulesDB с этими правилами.
+* generate_rows(n, definitions) - строки журнала в раскладке EXPECTED_COLUMNS:
+  русские ФИО/пол/возраст/дата рождения, 1-4 анализа в строке с «реалистичным»
+  повторением (частоты анализов по закону Ципфа), немного нераспознаваемых и пустых строк.
+* write_journal(path, rows, layout, fmt) - запись как .xlsx или HTML под видом .xls,
+  в сыром (строка-заголовок журнала над заголовками колонок) или дообработанном виде.
+"""
+import os
+import html
+import random
+from datetime import date, timedelta
+from typing import List, Dict, Any, Optional
+
+from lab_parser.app.models.parse_rules import ParseRulesDB
+from lab_parser.app.services.parse_excel import EXPECTED_COLUMNS
+
+LAST_NAMES = ["Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Васильев", "Соколов",
+              "Михайлов", "Новиков", "Фёдоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семёнов",
+              "Егоров", "Павлов", "Козлов", "Степанов", "Николаев", "Орлов", "Андреев", "Макаров"]
+MALE_NAMES = ["Александр", "Сергей", "Дмитрий", "Андрей", "Алексей", "Иван", "Михаил", "Пётр", "Юрий"]
+FEMALE_NAMES = ["Елена", "Ольга", "Наталья", "Татьяна", "Ирина", "Анна", "Мария", "Светлана", "Юлия"]
+PATRONYMICS = ["Александров", "Сергеев", "Дмитриев", "Андреев", "Алексеев", "Иванов", "Михайлов", "Петров"]
+DEPARTMENTS = ["Терапия", "Хирургия", "Кардиология", "Гинекология", "Неврология", "Приёмное отделение",
+               "Поликлиника", "Инфекционное отделение", "Урология", "Эндокринология"]
+
+# Реальные анализы: (краткое описание, префикс исследования, [(показатель, тип значения)])
+BASE_TESTS = [
+    ("HCV-core Ab", "Определение антител к вирусу гепатита C (Hepatitis C virus) в крови:",
+     [("Антитела к Hepatitis C virus core Ag (HCV-core Ab) - {value}", 1)]),
+    ("HIV 1", "Исследование уровня антител классов M, G к ВИЧ-1 в крови:",
+     [("Антитела к Human immunodeficiency virus 1 - {value}", 1)]),
+    ("HBsAg", "Определение антигена (HbsAg) вируса гепатита B в крови:",
+     [("Антитела к поверхностному антигену Hepatitis B virus - {value}", 1)]),
+    ("ТТГ", "Исследование уровня тиреотропного гормона (ТТГ) в крови:",
+     [("Тиреотропный гормон (ТТГ) - {value}", 3)]),
+    ("СТ4", "Исследование уровня свободного тироксина (СТ4) сыворотки крови:",
+     [("Тироксин свободный (Т4 св.) - {value}", 2)]),
+    ("Сифилис", "Определение антител к бледной трепонеме (Treponema pallidum) в крови:",
+     [("Антитела к Treponema pallidum - {val1}", 2), ("Антитела к Treponema pallidum - {val2}", 1)]),
+    ("Toxoplasma gondii (IgМ/IgG)", "Определение антител к токсоплазме в крови:",
+     [("Антитела IgМ к Toxoplasma gondii - {val1}", 1), ("Антитела IgG к Toxoplasma gondii - {val2}", 1)]),
+    ("CA 125", "Исследование уровня антигена аденогенных раков CA 125 в крови:",
+     [("Раковый антиген 125 (CA 125) - {value}", 3)]),
+]
+
+TYPE1_VALUES = ["Не обнаружено", "Не обнаружено", "Не обнаружено", "Обнаружено", "отрицательный", "положительный"]
+
+
+def _synthetic_test(k: int, rng: random.Random):
+    """Синтетический анализ по шаблонам реальных: k - номер (делает строки уникальными)"""
+    kind = rng.random()
+    if kind < 0.5:
+        return (f"Ab-{k}", f"Определение антител к антигену Ag{k} в крови:",
+                [(f"Антитела к антигену Ag{k} - {{value}}", 1)])
+    if kind < 0.8:
+        return (f"Гормон-{k}", f"Исследование уровня гормона H{k} в крови:",
+                [(f"Гормон H{k} (H{k}) - {{value}}", rng.choice([2, 3]))])
+    return (f"IgM/IgG Ag{k}", f"Определение антител классов M, G к антигену Ag{k} в крови:",
+            [(f"Антитела IgM к антигену Ag{k} - {{val1}}", 1), (f"Антитела IgG к антигену Ag{k} - {{val2}}", 1)])
+
+
+def generate_definitions(n: int, seed: int = 1) -> List[Dict[str, Any]]:
+    """
+    n определений анализов в формате POST /api/test-definitions
+    (+ служебное поле _prefix - начало текста исследования для generate_rows)
+    """
+    rng = random.Random(seed)
+    definitions = []
+    for i in range(n):
+        short, prefix, indicators = BASE_TESTS[i] if i < len(BASE_TESTS) else _synthetic_test(i, rng)
+        example = prefix + " " + " ".join(p for p, _ in indicators)
+        definitions.append({
+            "full_example_text": example,
+            "short_description": short,
+            "indicators": [
+                {
+                    "indicator_pattern": pattern,
+                    "variable_part": pattern[pattern.rindex("{"):],
+                    "value_type": value_type,
+                    "is_key_indicator": j == len(indicators) - 1,
+                    "is_required": True,
+                    "display_order": j,
+                }
+                for j, (pattern, value_type) in enumerate(indicators)
+            ],
+            "_prefix": prefix,
+        })
+    return definitions
+
+
+def make_rules_db(path: str, definitions: List[Dict[str, Any]]) -> ParseRulesDB:
+    """Создать БД правил по сгенерированным определениям"""
+    if os.path.exists(path):
+        os.remove(path)
+    db = ParseRulesDB(path)
+    for definition in definitions:
+        db.create_test_definition(definition["full_example_text"], definition["short_description"],
+                                  definition["indicators"])
+    return db
+
+
+def _value(value_type: int, rng: random.Random) -> str:
+    if value_type == 1:
+        return rng.choice(TYPE1_VALUES)
+    if value_type == 2:
+        return f"{rng.uniform(0.1, 40):.{rng.choice([1, 2, 3])}f}".replace(".", rng.choice([".", ","]))
+    return rng.choice([f"{rng.uniform(0.01, 10):.3f}", "менее 0.01", "Rh+ (положительный)"])
+
+
+def _patient(rng: random.Random, today: date) -> str:
+    male = rng.random() < 0.45
+    first = rng.choice(MALE_NAMES if male else FEMALE_NAMES)
+    last = rng.choice(LAST_NAMES) + ("" if male else "а")
+    middle = rng.choice(PATRONYMICS) + ("ич" if male else "на")
+    birth = today - timedelta(days=rng.randint(365, 90 * 365))
+    age = (today - birth).days // 365
+    word = "год" if age % 10 == 1 and age % 100 != 11 else (
+        "года" if 2 <= age % 10 <= 4 and not 12 <= age % 100 <= 14 else "лет")
+    return f"{last} {first} {middle}, {'Муж.' if male else 'Жен.'}, {age} {word}, {birth:%d.%m.%Y}"
+
+
+def generate_rows(n: int, definitions: List[Dict[str, Any]], seed: int = 1,
+                  today: Optional[date] = None) -> List[List[Any]]:
+    """n строк журнала: [№ п/п, ФИО/пол/возраст/дата, образец, отделение, результаты]"""
+    rng = random.Random(seed)
+    today = today or date(2025, 11, 1)
+    # Закон Ципфа: несколько анализов составляют большую часть назначений
+    weights = [1.0 / (i + 1) for i in range(len(definitions))]
+    rows = []
+    for i in range(n):
+        roll = rng.random()
+        if roll < 0.01:
+            results = None
+        elif roll < 0.06:
+            results = f"Исследование {rng.randint(1, 50)}: неизвестный показатель - {rng.randint(1, 99)}"
+        else:
+            chosen = []
+            for definition in rng.choices(definitions, weights=weights, k=rng.choice([1, 1, 2, 2, 3, 4])):
+                if definition not in chosen:
+                    chosen.append(definition)
+            parts = []
+            for definition in chosen:
+                text = definition["_prefix"]
+                for indicator in definition["indicators"]:
+                    pattern = indicator["indicator_pattern"]
+                    text += " " + pattern.replace(indicator["variable_part"],
+                                                  _value(indicator["value_type"], rng))
+                    text += ";" if len(definition["indicators"]) > 1 else ""
+                parts.append(text.rstrip(";"))
+            results = " ".join(parts)
+        rows.append([i + 1, _patient(rng, today), f"{rng.randint(10, 99)}-{100000 + i}",
+                     rng.choice(DEPARTMENTS), results])
+    return rows
+
+
+def write_journal(path: str, rows: List[List[Any]], layout: str = "raw", fmt: str = "xlsx") -> str:
+    """
+    Записать журнал.
+
+    Args:
+        layout: "raw" - первая строка - заголовок журнала, заголовки колонок во второй;
+                "processed" - заголовки колонок в первой строке
+        fmt: "xlsx" - настоящий Excel; "html" - HTML-таблица (как выгрузка ЛИС), расширение .xls
+
+    Returns:
+        Путь к файлу (для html расширение заменяется на .xls)
+    """
+    title = "Журнал регистрации результатов исследований"
+    if fmt == "html":
+        path = os.path.splitext(path)[0] + ".xls"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("<html><head><meta charset=\"utf-8\"></head><body><table>")
+            if layout == "processed":
+                f.write("<thead><tr>" + "".join(f"<th>{html.escape(c)}</th>" for c in EXPECTED_COLUMNS)
+                        + "</tr></thead>")
+            f.write("<tbody>")
+            if layout == "raw":
+                # Без <thead>: первая строка - заголовок журнала, вторая - заголовки колонок
+                f.write(f"<tr><td>{title}</td>" + "<td></td>" * (len(EXPECTED_COLUMNS) - 1) + "</tr>")
+                f.write("<tr>" + "".join(f"<td>{html.escape(c)}</td>" for c in EXPECTED_COLUMNS) + "</tr>")
+            for row in rows:
+                f.write("<tr>" + "".join(f"<td>{'' if v is None else html.escape(str(v))}</td>" for v in row)
+                        + "</tr>")
+            f.write("</tbody></table></body></html>")
+        return path
+
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    if layout == "raw":
+        ws.append([title])
+    ws.append(EXPECTED_COLUMNS)
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+    return path
@@ -3,7 +3,11 @@ from dotenv import load_dotenv
 import os
 from .config import BaseConfig
 
-def create_app():
+def create_app(instance_path=None):
+    """
+    Фабрика приложения. instance_path - другой каталог instance
+    (по умолчанию lab_parser/instance; бенчмарки используют временный)
+    """
     load_dotenv()
 
     base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -12,17 +16,34 @@ def create_app():
     app = Flask(
         __name__,
         template_folder=os.path.join(base_dir, "templates"),
-        instance_path=os.path.join(project_root, "instance"),
+        instance_path=instance_path or os.path.join(project_root, "instance"),
         instance_relative_config=True
     )
     app.config.from_object(BaseConfig)
 
+    from .services.json_provider import get_json_provider_class
+    app.json = get_json_provider_class(app.config["JSON_BACKEND"])(app)
+
     uploads_dir = os.path.join(app.instance_path, app.config["INSTANCE_UPLOADS_SUBDIR"])
     os.makedirs(uploads_dir, exist_ok=True)
 
+    # Каталог пакетов: один раз сверяем с диском, дальше запросы работают по каталогу
+    from .services.batches import sync_catalog_with_uploads
+    sync_catalog_with_uploads(app.instance_path, app.config["INSTANCE_UPLOADS_SUBDIR"])
+
     from .routes.ui import ui_bp
     from .routes.api import api_bp
     app.register_blueprint(ui_bp)
     app.register_blueprint(api_bp)
 
+    from .services.metrics import init_app as init_metrics
+    init_metrics(app)
+
+    from .services.profiling import init_app as init_profiling
+    init_profiling(app)
+
+    # Последним: after_request выполняются в обратном порядке, сжатие попадает в Server-Timing
+    from .services.compression import init_app as init_compression
+    init_compression(app)
+
     return app
\ No newline at end of file
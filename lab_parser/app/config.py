@@ -9,6 +9,53 @@ class BaseConfig:
     INSTANCE_UPLOADS_SUBDIR = "uploads"
     MAX_CONTENT_LENGTH = 20 * 1024 * 1024  # 20 MB
     ALLOWED_EXTENSIONS = {"xlsx", "xls"}
+    # Порционная загрузка больших файлов (/api/uploads, services.chunked_upload):
+    # предельный размер файла, рекомендуемый размер порции (тело PUT не больше MAX_CONTENT_LENGTH)
+    # и сколько хранить брошенные сессии
+    UPLOAD_MAX_MB = int(os.getenv("UPLOAD_MAX_MB", "1024"))
+    UPLOAD_CHUNK_MB = int(os.getenv("UPLOAD_CHUNK_MB", "8"))
+    UPLOAD_SESSION_TTL_HOURS = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", "48"))
+    # Сколько распарсенных пакетов держать в памяти процесса
+    PARSED_BATCH_CACHE_SIZE = int(os.getenv("PARSED_BATCH_CACHE_SIZE", "4"))
+    # Лимит общего для воркеров дискового кэша пакетов (instance/cache), МБ; 0 - выключен
+    PARSED_BATCH_DISK_CACHE_MB = int(os.getenv("PARSED_BATCH_DISK_CACHE_MB", "512"))
+    # Сколько таблиц тестов пакетов держит кэш статистики /api/stats (services.stats)
+    STATS_CACHE_SIZE = int(os.getenv("STATS_CACHE_SIZE", "32"))
+
+    # Архив распарсенных пакетов по дням (python -m lab_parser archive, services.archive):
+    # пакеты старше ARCHIVE_AFTER_DAYS дней уходят в архив, исходные файлы заархивированных
+    # пакетов старше ARCHIVE_RETAIN_ORIGINALS_DAYS дней удаляются (0 - хранятся всегда)
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+    ARCHIVE_RETAIN_ORIGINALS_DAYS = int(os.getenv("ARCHIVE_RETAIN_ORIGINALS_DAYS", "0"))
+
+    # Предзагрузка в мастер-процессе pre-fork сервера (gunicorn --preload), см. services.warmup
+    PRELOAD = os.getenv("PRELOAD", "0").lower() in ("1", "true", "yes")
+    PRELOAD_LATEST_BATCH = os.getenv("PRELOAD_LATEST_BATCH", "1").lower() in ("1", "true", "yes")
+
+    # Замеры этапов запроса: заголовок Server-Timing и GET /metrics (формат Prometheus)
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+    # Доля запросов /api/records, для которых в лог пишется JSON-событие с фильтрами и временем
+    METRICS_LOG_SAMPLE_RATE = float(os.getenv("METRICS_LOG_SAMPLE_RATE", "0.01"))
+
+    # Сериализация JSON: auto (orjson, если установлен), orjson или stdlib - services.json_provider
+    JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
+    # Сжатие ответов gzip/brotli по Accept-Encoding (services.compression)
+    COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "1").lower() in ("1", "true", "yes")
+    COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+    COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "1"))
+    COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+    # Профилирование запросов по ?__profile=1 / X-Profile: 1 (services.profiling), профили в instance/profiles
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0").lower() in ("1", "true", "yes")
+    PROFILES_KEEP = int(os.getenv("PROFILES_KEEP", "50"))
+
+    # Демон приёма выгрузок ЛИС (python -m lab_parser.ingest)
+    INGEST_WATCH_DIR = os.getenv("INGEST_WATCH_DIR")
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+    INGEST_SETTLE_SECONDS = float(os.getenv("INGEST_SETTLE_SECONDS", "5"))
+    INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "2"))
+    INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+    INGEST_RETRY_DELAY_SECONDS = float(os.getenv("INGEST_RETRY_DELAY_SECONDS", "30"))
 
     @staticmethod
     def init_app(app):  # хук на будущее
@@ -1,3 +1,4 @@
 from .parse_rules import ParseRulesDB, get_parse_rules_db
+from .search_index import SearchIndexDB, get_search_index_db
 
-__all__ = ['ParseRulesDB', 'get_parse_rules_db']
+__all__ = ['ParseRulesDB', 'get_parse_rules_db', 'SearchIndexDB', 'get_search_index_db']
@@ -0,0 +1,28 @@
+import sqlite3
+from contextlib import contextmanager
+
+
+class SQLiteDB:
+    """Базовый класс для хранилищ в SQLite-файлах instance/"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._init_db()
+
+    @contextmanager
+    def _get_connection(self):
+        """Контекстный менеджер для работы с БД"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        """Создание таблиц (переопределяется в наследниках)"""
+        raise NotImplementedError
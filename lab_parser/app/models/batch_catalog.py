@@ -0,0 +1,235 @@
+import os
+import json
+from typing import List, Dict, Optional, Any
+
+from .base import SQLiteDB
+
+
+class BatchCatalogDB(SQLiteDB):
+    """
+    Каталог загруженных пакетов (файлов в instance/uploads).
+
+    Хранится в той же БД instance/, что и правила парсинга. Загрузка файла
+    регистрирует пакет здесь, и страница /batches, и выбор «последнего пакета»
+    работают по каталогу, без сканирования каталога загрузок на каждый запрос.
+    """
+
+    _COLUMNS = """
+        name, original_name, size, mtime_ns, uploaded_at, content_hash, source_hash, source_format,
+        header_row, row_count, rules_generation, artifacts_json, alias_of
+    """
+
+    def _init_db(self):
+        """Инициализация структуры БД"""
+        with self._get_connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS batches (
+                    name TEXT PRIMARY KEY,
+                    original_name TEXT,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    uploaded_at TEXT NOT NULL,
+                    content_hash TEXT,
+                    source_hash TEXT,
+                    source_format TEXT,
+                    header_row INTEGER,
+                    row_count INTEGER,
+                    rules_generation INTEGER,
+                    artifacts_json TEXT NOT NULL DEFAULT '{}',
+                    alias_of TEXT
+                )
+            """)
+
+            # Миграция каталогов, созданных до появления дедупликации
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(batches)")}
+            if 'alias_of' not in columns:
+                conn.execute("ALTER TABLE batches ADD COLUMN alias_of TEXT")
+            # ...и до хранения хеша принятого файла отдельно от хеша сконвертированного
+            if 'source_hash' not in columns:
+                conn.execute("ALTER TABLE batches ADD COLUMN source_hash TEXT")
+
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_batches_uploaded_at ON batches(uploaded_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_batches_content_hash ON batches(content_hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_batches_source_hash ON batches(source_hash)")
+
+            # Версия каталога: увеличивается при любом изменении таблицы batches,
+            # по ней проверки вида "каталог не менялся" обходятся без чтения всех записей
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS catalog_meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            """)
+            conn.execute("INSERT OR IGNORE INTO catalog_meta (key, value) VALUES ('version', 0)")
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS batches_version_{event.lower()} AFTER {event} ON batches
+                    BEGIN
+                        UPDATE catalog_meta SET value = value + 1 WHERE key = 'version';
+                    END
+                """)
+
+    @staticmethod
+    def _row_to_dict(row) -> Dict[str, Any]:
+        data = dict(row)
+        data['artifacts'] = json.loads(data.pop('artifacts_json') or '{}')
+        return data
+
+    def add_batch(self, name: str, size: int, mtime_ns: int, uploaded_at: str,
+                  original_name: Optional[str] = None, content_hash: Optional[str] = None,
+                  source_format: Optional[str] = None, header_row: Optional[int] = None,
+                  source_hash: Optional[str] = None) -> None:
+        """
+        Зарегистрировать пакет. Повторная регистрация того же имени перезаписывает
+        запись (результаты парсинга и артефакты сбрасываются), но псевдоним остаётся
+        псевдонимом, пока содержимое файла совпадает с основным пакетом, а хеш
+        принятого файла сохраняется, пока не изменилось содержимое.
+
+        Args:
+            name: Имя файла в instance/uploads
+            size: Размер файла в байтах
+            mtime_ns: mtime файла
+            uploaded_at: Время загрузки (ISO, YYYY-MM-DDTHH:MM:SS)
+            original_name: Исходное имя загруженного файла
+            content_hash: SHA-256 файла в instance/uploads (как он хранится)
+            source_format: Формат источника: xlsx, xls или html
+            header_row: Смещение строки заголовков (0 или 1), см. _detect_header_row
+            source_hash: SHA-256 принятого файла, если он сконвертирован при загрузке
+        """
+        with self._get_connection() as conn:
+            conn.execute("""
+                INSERT INTO batches
+                (name, original_name, size, mtime_ns, uploaded_at, content_hash, source_hash,
+                 source_format, header_row)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    original_name = excluded.original_name, size = excluded.size,
+                    mtime_ns = excluded.mtime_ns, uploaded_at = excluded.uploaded_at,
+                    content_hash = excluded.content_hash,
+                    source_hash = CASE
+                        WHEN excluded.source_hash IS NOT NULL THEN excluded.source_hash
+                        WHEN batches.content_hash = excluded.content_hash THEN batches.source_hash
+                    END,
+                    source_format = excluded.source_format, header_row = excluded.header_row,
+                    row_count = NULL, rules_generation = NULL, artifacts_json = '{}',
+                    alias_of = CASE
+                        WHEN (SELECT t.content_hash FROM batches t WHERE t.name = batches.alias_of)
+                             = excluded.content_hash
+                        THEN batches.alias_of
+                    END
+            """, (name, original_name, size, mtime_ns, uploaded_at, content_hash, source_hash,
+                  source_format, header_row))
+
+    def add_alias(self, name: str, target: Dict[str, Any], mtime_ns: int, uploaded_at: str,
+                  original_name: Optional[str] = None) -> None:
+        """
+        Зарегистрировать повторную загрузку того же содержимого как псевдоним пакета target.
+        Метаданные (формат, заголовки, число строк) берутся у target; парсинг и кэши
+        используются общие - по имени target.
+        """
+        with self._get_connection() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO batches
+                (name, original_name, size, mtime_ns, uploaded_at, content_hash, source_hash, source_format,
+                 header_row, row_count, rules_generation, alias_of)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (name, original_name, target['size'], mtime_ns, uploaded_at, target['content_hash'],
+                  target['source_hash'], target['source_format'], target['header_row'], target['row_count'],
+                  target['rules_generation'], target['name']))
+
+    def find_by_hash(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        Основной (не псевдоним) пакет с таким содержимым, если он есть:
+        хранимый файл или принятый до конвертации файл с этим SHA-256
+        """
+        with self._get_connection() as conn:
+            cursor = conn.execute(f"""
+                SELECT {self._COLUMNS} FROM batches
+                WHERE (content_hash = ? OR source_hash = ?) AND alias_of IS NULL
+                ORDER BY uploaded_at
+                LIMIT 1
+            """, (content_hash, content_hash))
+            row = cursor.fetchone()
+            return self._row_to_dict(row) if row else None
+
+    def resolve(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Запись пакета, чьи данные следует использовать для name:
+        для псевдонима - основной пакет (если он ещё в каталоге), иначе сам name.
+        """
+        entry = self.get_batch(name)
+        if entry and entry['alias_of']:
+            target = self.get_batch(entry['alias_of'])
+            if target:
+                return target
+        return entry
+
+    def get_batch(self, name: str) -> Optional[Dict[str, Any]]:
+        """Получить запись каталога по имени файла"""
+        with self._get_connection() as conn:
+            cursor = conn.execute(f"SELECT {self._COLUMNS} FROM batches WHERE name = ?", (name,))
+            row = cursor.fetchone()
+            return self._row_to_dict(row) if row else None
+
+    def get_latest_batch(self) -> Optional[Dict[str, Any]]:
+        """Последний загруженный пакет (по индексу uploaded_at)"""
+        with self._get_connection() as conn:
+            cursor = conn.execute(f"""
+                SELECT {self._COLUMNS} FROM batches
+                ORDER BY uploaded_at DESC, name DESC
+                LIMIT 1
+            """)
+            row = cursor.fetchone()
+            return self._row_to_dict(row) if row else None
+
+    def get_version(self) -> int:
+        """Версия каталога (меняется при любом изменении записей)"""
+        with self._get_connection() as conn:
+            row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'version'").fetchone()
+            return row['value'] if row else 0
+
+    def list_batches(self) -> List[Dict[str, Any]]:
+        """Все пакеты, новые сверху"""
+        with self._get_connection() as conn:
+            cursor = conn.execute(f"""
+                SELECT {self._COLUMNS} FROM batches
+                ORDER BY uploaded_at DESC, name DESC
+            """)
+            return [self._row_to_dict(row) for row in cursor.fetchall()]
+
+    def record_parse(self, name: str, row_count: int, rules_generation: int,
+                     header_row: Optional[int] = None) -> None:
+        """Сохранить результаты последнего парсинга пакета"""
+        with self._get_connection() as conn:
+            conn.execute("""
+                UPDATE batches
+                SET row_count = ?, rules_generation = ?, header_row = COALESCE(?, header_row)
+                WHERE name = ?
+            """, (row_count, rules_generation, header_row, name))
+
+    def set_artifact(self, name: str, key: str, value: Any) -> None:
+        """Записать сведения о производном артефакте пакета (кэш, индекс и т.п.); None удаляет ключ"""
+        with self._get_connection() as conn:
+            cursor = conn.execute("SELECT artifacts_json FROM batches WHERE name = ?", (name,))
+            row = cursor.fetchone()
+            if not row:
+                return
+            artifacts = json.loads(row['artifacts_json'] or '{}')
+            if value is None:
+                artifacts.pop(key, None)
+            else:
+                artifacts[key] = value
+            conn.execute("UPDATE batches SET artifacts_json = ? WHERE name = ?",
+                         (json.dumps(artifacts, ensure_ascii=False), name))
+
+    def delete_batch(self, name: str) -> bool:
+        """Удалить пакет из каталога (сам файл не трогается)"""
+        with self._get_connection() as conn:
+            cursor = conn.execute("DELETE FROM batches WHERE name = ?", (name,))
+            return cursor.rowcount > 0
+
+
+def get_batch_catalog(instance_path: str) -> BatchCatalogDB:
+    """Фабрика для получения каталога пакетов (таблица в БД instance/parse_rules.db)"""
+    db_path = os.path.join(instance_path, "parse_rules.db")
+    return BatchCatalogDB(db_path)
@@ -1,29 +1,12 @@
-import sqlite3
 import os
 from typing import List, Dict, Optional, Any
-from contextlib import contextmanager
 
+from .base import SQLiteDB
+from ..services.metrics import timed
 
-class ParseRulesDB:
-    """Управление правилами парсинга результатов анализов с поддержкой множественных показателей"""
 
-    def __init__(self, db_path: str):
-        self.db_path = db_path
-        self._init_db()
-
-    @contextmanager
-    def _get_connection(self):
-        """Контекстный менеджер для работы с БД"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        try:
-            yield conn
-            conn.commit()
-        except Exception:
-            conn.rollback()
-            raise
-        finally:
-            conn.close()
+class ParseRulesDB(SQLiteDB):
+    """Управление правилами парсинга результатов анализов с поддержкой множественных показателей"""
 
     def _init_db(self):
         """Инициализация структуры БД с миграцией старой таблицы"""
@@ -69,6 +52,18 @@ class ParseRulesDB:
                 ON test_indicators(test_definition_id)
             """)
 
+            # Счетчик поколений правил: увеличивается при каждом изменении,
+            # по нему инвалидируются кэши распарсенных пакетов
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rules_meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                INSERT OR IGNORE INTO rules_meta (key, value) VALUES ('generation', 0)
+            """)
+
             # Миграция данных из старой таблицы, если она существует
             if old_table_exists:
                 self._migrate_old_data(conn)
@@ -106,8 +101,21 @@ class ParseRulesDB:
                 VALUES (?, ?, ?, ?, 1, 1, 0)
             """, (test_def_id, rule['test_pattern'], rule['variable_part'], rule['value_type']))
 
+        self._bump_generation(conn)
         print(f"Мигрировано {len(old_rules)} правил из старой таблицы parse_rules")
 
+    def _bump_generation(self, conn):
+        """Увеличить поколение правил (вызывается внутри транзакции изменения)"""
+        conn.execute("UPDATE rules_meta SET value = value + 1 WHERE key = 'generation'")
+
+    @timed("rules_db.get_rules_generation")
+    def get_rules_generation(self) -> int:
+        """Текущее поколение правил (меняется при любом изменении определений/показателей)"""
+        with self._get_connection() as conn:
+            cursor = conn.execute("SELECT value FROM rules_meta WHERE key = 'generation'")
+            row = cursor.fetchone()
+            return row['value'] if row else 0
+
     # ===== Методы для работы с определениями анализов =====
 
     def add_test_definition(self, full_example_text: str, short_description: str) -> int:
@@ -126,8 +134,10 @@ class ParseRulesDB:
                 INSERT INTO test_definitions (full_example_text, short_description)
                 VALUES (?, ?)
             """, (full_example_text, short_description))
+            self._bump_generation(conn)
             return cursor.lastrowid
 
+    @timed("rules_db.get_all_test_definitions")
     def get_all_test_definitions(self) -> List[Dict[str, Any]]:
         """Получить все определения анализов"""
         with self._get_connection() as conn:
@@ -159,14 +169,74 @@ class ParseRulesDB:
                     updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
             """, (full_example_text, short_description, definition_id))
+            self._bump_generation(conn)
             return cursor.rowcount > 0
 
     def delete_test_definition(self, definition_id: int) -> bool:
         """Удалить определение анализа (каскадно удалятся и все показатели)"""
         with self._get_connection() as conn:
             cursor = conn.execute("DELETE FROM test_definitions WHERE id = ?", (definition_id,))
+            self._bump_generation(conn)
             return cursor.rowcount > 0
 
+    def _insert_indicators(self, conn, test_definition_id: int, indicators: List[Dict[str, Any]]):
+        """Вставить показатели анализа (внутри транзакции вызывающего)"""
+        conn.executemany("""
+            INSERT INTO test_indicators
+            (test_definition_id, indicator_pattern, variable_part, value_type,
+             is_key_indicator, is_required, display_order)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (test_definition_id, indicator["indicator_pattern"], indicator["variable_part"],
+             indicator["value_type"], indicator.get("is_key_indicator", False),
+             indicator.get("is_required", True), indicator.get("display_order", idx))
+            for idx, indicator in enumerate(indicators)
+        ])
+
+    def create_test_definition(self, full_example_text: str, short_description: str,
+                               indicators: List[Dict[str, Any]]) -> int:
+        """
+        Создать определение анализа вместе с показателями одной транзакцией
+        (поколение правил увеличивается ровно на 1)
+
+        Args:
+            full_example_text: Полная строка с примером результата
+            short_description: Краткое описание для отображения
+            indicators: Показатели в формате API (indicator_pattern, variable_part, value_type, ...)
+
+        Returns:
+            ID созданного определения
+        """
+        with self._get_connection() as conn:
+            cursor = conn.execute("""
+                INSERT INTO test_definitions (full_example_text, short_description)
+                VALUES (?, ?)
+            """, (full_example_text, short_description))
+            definition_id = cursor.lastrowid
+            self._insert_indicators(conn, definition_id, indicators)
+            self._bump_generation(conn)
+            return definition_id
+
+    def replace_test_definition(self, definition_id: int, full_example_text: str,
+                                short_description: str, indicators: List[Dict[str, Any]]) -> bool:
+        """
+        Обновить определение анализа и заменить все его показатели одной транзакцией
+        (поколение правил увеличивается ровно на 1)
+        """
+        with self._get_connection() as conn:
+            cursor = conn.execute("""
+                UPDATE test_definitions
+                SET full_example_text = ?, short_description = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (full_example_text, short_description, definition_id))
+            if cursor.rowcount == 0:
+                return False
+            conn.execute("DELETE FROM test_indicators WHERE test_definition_id = ?", (definition_id,))
+            self._insert_indicators(conn, definition_id, indicators)
+            self._bump_generation(conn)
+            return True
+
     # ===== Методы для работы с показателями =====
 
     def add_test_indicator(self, test_definition_id: int, indicator_pattern: str,
@@ -179,7 +249,7 @@ class ParseRulesDB:
             test_definition_id: ID определения анализа
             indicator_pattern: Часть строки с примером показателя
             variable_part: Изменяемая часть
-            value_type: Тип значения (1, 2, 3)
+            value_type: Тип значения (1, 2, 3; 4 - автоопределение)
             is_key_indicator: Ключевой показатель (для поиска/фильтрации)
             is_required: Обязательный показатель
             display_order: Порядок отображения
@@ -195,6 +265,7 @@ class ParseRulesDB:
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             """, (test_definition_id, indicator_pattern, variable_part, value_type,
                   is_key_indicator, is_required, display_order))
+            self._bump_generation(conn)
             return cursor.lastrowid
 
     def get_indicators_for_test(self, test_definition_id: int) -> List[Dict[str, Any]]:
@@ -234,16 +305,19 @@ class ParseRulesDB:
                 WHERE id = ?
             """, (indicator_pattern, variable_part, value_type, is_key_indicator,
                   is_required, display_order, indicator_id))
+            self._bump_generation(conn)
             return cursor.rowcount > 0
 
     def delete_test_indicator(self, indicator_id: int) -> bool:
         """Удалить показатель"""
         with self._get_connection() as conn:
             cursor = conn.execute("DELETE FROM test_indicators WHERE id = ?", (indicator_id,))
+            self._bump_generation(conn)
             return cursor.rowcount > 0
 
     # ===== Вспомогательные методы =====
 
+    @timed("rules_db.get_all_rules_for_parsing")
     def get_all_rules_for_parsing(self) -> List[Dict[str, Any]]:
         """
         Получить все правила в формате, совместимом с парсером
@@ -284,6 +358,7 @@ class ParseRulesDB:
 
     # ===== Методы обратной совместимости =====
 
+    @timed("rules_db.get_all_rules")
     def get_all_rules(self) -> List[Dict[str, Any]]:
         """
         УСТАРЕВШИЙ МЕТОД для обратной совместимости.
@@ -310,6 +385,7 @@ class ParseRulesDB:
             return [dict(row) for row in cursor.fetchall()]
 
 
+@timed("rules_db.open")
 def get_parse_rules_db(instance_path: str) -> ParseRulesDB:
     """Фабрика для получения экземпляра БД правил парсинга"""
     db_path = os.path.join(instance_path, "parse_rules.db")
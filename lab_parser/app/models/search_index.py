@@ -0,0 +1,282 @@
+import os
+import json
+from typing import List, Dict, Optional, Any, Iterator, Tuple
+
+from .base import SQLiteDB
+
+
+class SearchIndexDB(SQLiteDB):
+    """
+    Глобальный индекс записей по всем загруженным пакетам.
+
+    Ключи поиска: нормализованная личность пациента (ФИО + дата рождения)
+    и идентификатор образца. Индекс производный - его можно удалить,
+    он будет перестроен из файлов в instance/uploads.
+    """
+
+    def _init_db(self):
+        """Инициализация структуры БД"""
+        with self._get_connection() as conn:
+            # Какие пакеты уже проиндексированы и с какой версией файла/правил
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS indexed_batches (
+                    batch TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    rules_generation INTEGER NOT NULL,
+                    batch_time TEXT NOT NULL,
+                    row_count INTEGER NOT NULL,
+                    indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    has_raw_text INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+
+            # Миграция: пакеты, проиндексированные до хранения raw_text, помечены has_raw_text = 0
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(indexed_batches)")}
+            if 'has_raw_text' not in columns:
+                conn.execute("ALTER TABLE indexed_batches ADD COLUMN has_raw_text INTEGER NOT NULL DEFAULT 0")
+
+            # Пакеты, которые не удалось прочитать или распарсить: не пробуем снова, пока файл не изменится
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS failed_batches (
+                    batch TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    error TEXT,
+                    failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS search_rows (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    batch TEXT NOT NULL,
+                    batch_time TEXT NOT NULL,
+                    row_id INTEGER,
+                    patient_key TEXT,
+                    last_name TEXT,
+                    first_name TEXT,
+                    middle_name TEXT,
+                    gender TEXT,
+                    birth_date TEXT,
+                    age_years INTEGER,
+                    sample_id TEXT,
+                    sample_key TEXT,
+                    department TEXT,
+                    summary TEXT,
+                    tests_json TEXT NOT NULL DEFAULT '[]',
+                    raw_text TEXT
+                )
+            """)
+
+            # Миграция индексов, созданных до хранения исходного текста результатов
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(search_rows)")}
+            if 'raw_text' not in columns:
+                conn.execute("ALTER TABLE search_rows ADD COLUMN raw_text TEXT")
+
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_search_rows_patient ON search_rows(patient_key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_search_rows_sample ON search_rows(sample_key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_search_rows_batch ON search_rows(batch)")
+
+    # ===== Обновление индекса =====
+
+    def get_indexed_batches(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Проиндексированные пакеты: имя -> {mtime_ns, rules_generation, ..., has_raw_text}.
+        has_raw_text - у строк пакета сохранён исходный текст результатов
+        (None у строки тогда означает пустую ячейку, а не старый индекс).
+        """
+        with self._get_connection() as conn:
+            cursor = conn.execute("""
+                SELECT batch, mtime_ns, rules_generation, batch_time, row_count, indexed_at, has_raw_text
+                FROM indexed_batches
+            """)
+            return {row['batch']: dict(row) for row in cursor.fetchall()}
+
+    def get_failed_batches(self) -> Dict[str, Dict[str, Any]]:
+        """Пакеты с ошибкой индексации: имя -> {mtime_ns, error, failed_at}"""
+        with self._get_connection() as conn:
+            cursor = conn.execute("SELECT batch, mtime_ns, error, failed_at FROM failed_batches")
+            return {row['batch']: dict(row) for row in cursor.fetchall()}
+
+    def record_failure(self, batch: str, mtime_ns: int, error: str) -> None:
+        """Запомнить, что версию mtime_ns пакета проиндексировать не удалось"""
+        with self._get_connection() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO failed_batches (batch, mtime_ns, error, failed_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            """, (batch, mtime_ns, error))
+
+    def replace_batch(self, batch: str, mtime_ns: int, rules_generation: int, batch_time: str,
+                      rows: List[Dict[str, Any]]) -> None:
+        """
+        Заменить все строки пакета в индексе (одной транзакцией)
+
+        Args:
+            batch: Имя файла пакета
+            mtime_ns: mtime файла на момент индексации
+            rules_generation: Поколение правил, которым распарсены тесты
+            batch_time: Время пакета (ISO), используется для хронологии
+            rows: Строки индекса (см. services.search_index.build_search_rows)
+        """
+        with self._get_connection() as conn:
+            conn.execute("DELETE FROM search_rows WHERE batch = ?", (batch,))
+            conn.executemany("""
+                INSERT INTO search_rows
+                (batch, batch_time, row_id, patient_key, last_name, first_name, middle_name,
+                 gender, birth_date, age_years, sample_id, sample_key, department, summary, tests_json, raw_text)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [
+                (batch, batch_time, r['row_id'], r['patient_key'], r['last_name'], r['first_name'],
+                 r['middle_name'], r['gender'], r['birth_date'], r['age_years'], r['sample_id'],
+                 r['sample_key'], r['department'], r['summary'], json.dumps(r['tests'], ensure_ascii=False),
+                 r.get('raw_text'))
+                for r in rows
+            ])
+            conn.execute("""
+                INSERT OR REPLACE INTO indexed_batches
+                (batch, mtime_ns, rules_generation, batch_time, row_count, indexed_at, has_raw_text)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, 1)
+            """, (batch, mtime_ns, rules_generation, batch_time, len(rows)))
+            conn.execute("DELETE FROM failed_batches WHERE batch = ?", (batch,))
+
+    def get_batch_results(self, batch: str) -> List[Dict[str, Any]]:
+        """Результаты строк пакета для повторного парсинга: id, raw_text, summary, tests"""
+        with self._get_connection() as conn:
+            cursor = conn.execute("""
+                SELECT id, raw_text, summary, tests_json
+                FROM search_rows
+                WHERE batch = ?
+                ORDER BY id
+            """, (batch,))
+            rows = []
+            for row in cursor.fetchall():
+                row = dict(row)
+                row['tests'] = json.loads(row.pop('tests_json') or '[]')
+                rows.append(row)
+            return rows
+
+    def update_batch_results(self, batch: str, updates: List[Dict[str, Any]],
+                             from_generation: int, to_generation: int) -> bool:
+        """
+        Записать результаты повторного парсинга части строк пакета и перевести
+        пакет на новое поколение правил (одной транзакцией).
+
+        Обновление применяется, только если пакет всё ещё проиндексирован
+        поколением from_generation - иначе его перестроит обычная синхронизация.
+
+        Args:
+            batch: Имя файла пакета
+            updates: Изменившиеся строки: [{id, summary, tests}, ...]
+            from_generation: Поколение правил, от которого считались изменения
+            to_generation: Новое поколение правил
+
+        Returns:
+            True, если пакет переведён на to_generation
+        """
+        with self._get_connection() as conn:
+            cursor = conn.execute("""
+                UPDATE indexed_batches SET rules_generation = ?, indexed_at = CURRENT_TIMESTAMP
+                WHERE batch = ? AND rules_generation = ?
+            """, (to_generation, batch, from_generation))
+            if cursor.rowcount == 0:
+                return False
+            conn.executemany("""
+                UPDATE search_rows SET summary = ?, tests_json = ? WHERE id = ?
+            """, [
+                (u['summary'], json.dumps(u['tests'], ensure_ascii=False), u['id'])
+                for u in updates
+            ])
+            return True
+
+    def delete_batch(self, batch: str) -> None:
+        """Удалить пакет из индекса"""
+        with self._get_connection() as conn:
+            conn.execute("DELETE FROM search_rows WHERE batch = ?", (batch,))
+            conn.execute("DELETE FROM indexed_batches WHERE batch = ?", (batch,))
+            conn.execute("DELETE FROM failed_batches WHERE batch = ?", (batch,))
+
+    # ===== Поиск =====
+
+    _ROW_COLUMNS = """
+        batch, batch_time, row_id, patient_key, last_name, first_name, middle_name,
+        gender, birth_date, age_years, sample_id, department, summary
+    """
+
+    def search(self, name_prefix: Optional[str] = None, birth_date: Optional[str] = None,
+               sample_key: Optional[str] = None, limit: int = 200) -> List[Dict[str, Any]]:
+        """
+        Поиск строк по префиксу нормализованного ФИО и/или идентификатору образца
+
+        Args:
+            name_prefix: Нормализованное начало ФИО ("иванов ив")
+            birth_date: Дата рождения (YYYY-MM-DD)
+            sample_key: Нормализованный идентификатор образца (точное совпадение)
+            limit: Максимум строк в ответе
+        """
+        where = []
+        params: List[Any] = []
+        if name_prefix:
+            # Диапазон по индексу вместо LIKE: patient_key начинается с name_prefix
+            where.append("patient_key >= ? AND patient_key < ?")
+            params.extend([name_prefix, name_prefix + "\uffff"])
+        if birth_date:
+            where.append("birth_date = ?")
+            params.append(birth_date)
+        if sample_key:
+            where.append("sample_key = ?")
+            params.append(sample_key)
+        if not where:
+            return []
+
+        with self._get_connection() as conn:
+            cursor = conn.execute(f"""
+                SELECT {self._ROW_COLUMNS}
+                FROM search_rows
+                WHERE {' AND '.join(where)}
+                ORDER BY batch_time DESC, row_id
+                LIMIT ?
+            """, (*params, limit))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def iter_unparsed_results(self, batch: Optional[str] = None,
+                              chunk_size: int = 10000) -> Iterator[Tuple[str, str, int]]:
+        """
+        Строки, в которых правила не нашли ни одного теста (parse_quality "unparsed"):
+        (raw_text, batch, row_id). Читаются курсором порциями по chunk_size -
+        строк может быть миллионы, в память целиком они не загружаются.
+        """
+        where = "tests_json = '[]' AND raw_text IS NOT NULL AND raw_text != ''"
+        params: List[Any] = []
+        if batch:
+            where += " AND batch = ?"
+            params.append(batch)
+
+        with self._get_connection() as conn:
+            cursor = conn.execute(f"SELECT raw_text, batch, row_id FROM search_rows WHERE {where}", params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row[0], row[1], row[2]
+
+    def get_patient_rows(self, patient_key: str) -> List[Dict[str, Any]]:
+        """Все строки пациента во всех пакетах (с тестами), по возрастанию времени"""
+        with self._get_connection() as conn:
+            cursor = conn.execute(f"""
+                SELECT {self._ROW_COLUMNS}, tests_json
+                FROM search_rows
+                WHERE patient_key = ?
+                ORDER BY batch_time, row_id
+            """, (patient_key,))
+            rows = []
+            for row in cursor.fetchall():
+                row = dict(row)
+                row['tests'] = json.loads(row.pop('tests_json') or '[]')
+                rows.append(row)
+            return rows
+
+
+def get_search_index_db(instance_path: str) -> SearchIndexDB:
+    """Фабрика для получения экземпляра глобального поискового индекса"""
+    db_path = os.path.join(instance_path, "search_index.db")
+    return SearchIndexDB(db_path)
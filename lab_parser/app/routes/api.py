@@ -1,12 +1,40 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 import os
+import json
+import hashlib
+import logging
 from datetime import date
-from ..utils.io_utils import list_uploaded_files
+import numpy as np
 from ..models.parse_rules import get_parse_rules_db
-from ..services.parse_excel import read_basic_records, read_records_with_parsing
+from ..models.batch_catalog import get_batch_catalog
+from ..services.parse_excel import read_basic_records
+from ..services.batch_index import parse_test_filters, TestFilterError
+from ..services.results_parser import VALUE_TYPES
+from ..services.parsed_batch import get_parsed_batch
+from ..services.batch_cache import get_batch_disk_cache
+from ..services.archive import get_batch_archive, basic_results
+from ..services.reparse import schedule_definition_reparse, get_reparse_status
+from ..services.metrics import phase, log_sampled
+from ..services.profiling import annotate_profile
+from ..services.rule_mining import mine_search_index
+from ..services.stats import StatsError, select_batches, get_stats
+from ..services.batches import ConversionError
+from ..services.export import (
+    EXPORT_FORMATS, ExportError, ReportRows, resolve_columns, export_rows, content_disposition
+)
+from ..services.chunked_upload import (
+    UploadError, UploadNotFound, UploadOffsetMismatch, get_upload_sessions
+)
+from ..utils.io_utils import allowed_file
+from ..models.search_index import get_search_index_db
+from ..services.search_index import (
+    normalize_name, normalize_sample_id, needs_sync, start_background_sync, is_sync_running, build_timeline
+)
 
 api_bp = Blueprint("api", __name__, url_prefix="/api")
 
+logger = logging.getLogger("lab_parser.api")
+
 
 @api_bp.get("/record/<int:rid>")
 def record_by_id(rid: int):
@@ -18,23 +46,28 @@ def record_by_id(rid: int):
     batch = request.args.get("batch")
     uploads_dir = os.path.join(current_app.instance_path, current_app.config["INSTANCE_UPLOADS_SUBDIR"])
 
-    # Если batch не указан - берем последний файл
+    catalog = get_batch_catalog(current_app.instance_path)
+
+    # Если batch не указан - берем последний файл из каталога
     if not batch:
-        files = list_uploaded_files(
-            instance_path=current_app.instance_path,
-            uploads_subdir=current_app.config["INSTANCE_UPLOADS_SUBDIR"]
-        )
-        if files:
-            batch = files[0]["name"]
+        latest = catalog.get_latest_batch()
+        if latest:
+            batch = latest["name"]
 
     if batch:
-        # Ищем в реальном файле
-        path = os.path.join(uploads_dir, os.path.basename(batch))
-        if not os.path.isfile(path):
+        # Повторная загрузка того же содержимого читается из основного пакета
+        entry = catalog.resolve(os.path.basename(batch))
+        path = os.path.join(uploads_dir, entry["name"] if entry else os.path.basename(batch))
+        if not _batch_available(path):
             return jsonify({"error": "batch not found", "batch": batch}), 404
 
         try:
-            data = read_basic_records(path)
+            if os.path.isfile(path):
+                data = read_basic_records(path, header_row=entry["header_row"] if entry else None)
+            else:
+                # Исходный файл удалён после архивации - записи из архива в виде read_basic_records
+                data = (dict(item, results=basic_results(item["results"]["raw_text"]))
+                        for item in _load_parsed_batch(path, catalog).items)
         except Exception as e:
             return jsonify({"error": f"failed to read excel: {e}"}), 500
 
@@ -89,28 +122,18 @@ def create_test_definition():
             return jsonify({"error": f"indicator {idx + 1}: indicator_pattern is required"}), 400
         if not indicator.get("variable_part"):
             return jsonify({"error": f"indicator {idx + 1}: variable_part is required"}), 400
-        if indicator.get("value_type") not in [1, 2, 3]:
-            return jsonify({"error": f"indicator {idx + 1}: value_type must be 1, 2, or 3"}), 400
+        if indicator.get("value_type") not in VALUE_TYPES:
+            return jsonify({"error": f"indicator {idx + 1}: value_type must be 1, 2, 3, or 4"}), 400
         if indicator["variable_part"] not in indicator["indicator_pattern"]:
             return jsonify({"error": f"indicator {idx + 1}: variable_part must be part of indicator_pattern"}), 400
 
     db = get_parse_rules_db(current_app.instance_path)
 
     try:
-        # Создаем определение анализа
-        definition_id = db.add_test_definition(full_example_text, short_description)
-
-        # Добавляем показатели
-        for idx, indicator in enumerate(indicators):
-            db.add_test_indicator(
-                test_definition_id=definition_id,
-                indicator_pattern=indicator["indicator_pattern"],
-                variable_part=indicator["variable_part"],
-                value_type=indicator["value_type"],
-                is_key_indicator=indicator.get("is_key_indicator", False),
-                is_required=indicator.get("is_required", True),
-                display_order=indicator.get("display_order", idx)
-            )
+        # Создаем определение анализа вместе с показателями (одно изменение поколения правил)
+        generation = db.get_rules_generation()
+        definition_id = db.create_test_definition(full_example_text, short_description, indicators)
+        _schedule_reparse(db, definition_id, generation)
 
         return jsonify({"success": True, "id": definition_id}), 201
     except Exception as e:
@@ -155,8 +178,8 @@ def update_test_definition(definition_id: int):
             return jsonify({"error": f"indicator {idx + 1}: indicator_pattern is required"}), 400
         if not indicator.get("variable_part"):
             return jsonify({"error": f"indicator {idx + 1}: variable_part is required"}), 400
-        if indicator.get("value_type") not in [1, 2, 3]:
-            return jsonify({"error": f"indicator {idx + 1}: value_type must be 1, 2, or 3"}), 400
+        if indicator.get("value_type") not in VALUE_TYPES:
+            return jsonify({"error": f"indicator {idx + 1}: value_type must be 1, 2, 3, or 4"}), 400
         if indicator["variable_part"] not in indicator["indicator_pattern"]:
             return jsonify({"error": f"indicator {idx + 1}: variable_part must be part of indicator_pattern"}), 400
 
@@ -167,25 +190,10 @@ def update_test_definition(definition_id: int):
         return jsonify({"error": "definition not found"}), 404
 
     try:
-        # Обновляем определение
-        db.update_test_definition(definition_id, full_example_text, short_description)
-
-        # Удаляем старые показатели
-        old_indicators = db.get_indicators_for_test(definition_id)
-        for old_indicator in old_indicators:
-            db.delete_test_indicator(old_indicator['id'])
-
-        # Добавляем новые показатели
-        for idx, indicator in enumerate(indicators):
-            db.add_test_indicator(
-                test_definition_id=definition_id,
-                indicator_pattern=indicator["indicator_pattern"],
-                variable_part=indicator["variable_part"],
-                value_type=indicator["value_type"],
-                is_key_indicator=indicator.get("is_key_indicator", False),
-                is_required=indicator.get("is_required", True),
-                display_order=indicator.get("display_order", idx)
-            )
+        # Обновляем определение и заменяем показатели одной транзакцией
+        generation = db.get_rules_generation()
+        db.replace_test_definition(definition_id, full_example_text, short_description, indicators)
+        _schedule_reparse(db, definition_id, generation)
 
         return jsonify({"success": True})
     except Exception as e:
@@ -196,14 +204,115 @@ def update_test_definition(definition_id: int):
 def delete_test_definition(definition_id: int):
     """Удалить определение анализа (каскадно удалятся все показатели)"""
     db = get_parse_rules_db(current_app.instance_path)
+    generation = db.get_rules_generation()
     success = db.delete_test_definition(definition_id)
 
     if not success:
         return jsonify({"error": "definition not found"}), 404
 
+    _schedule_reparse(db, definition_id, generation)
     return jsonify({"success": True})
 
 
+@api_bp.get("/test-definitions/suggestions")
+def test_definition_suggestions():
+    """
+    Заготовки новых правил по строкам, где ни одно правило не сработало.
+
+    Нераспознанные результаты всех пакетов (или ?batch=<имя>) сводятся к шаблонам
+    (services.rule_mining); для каждого - число строк, пример и "definition" в
+    формате POST /api/test-definitions. ?limit=<N> (по умолчанию 50), ?min_count=<N>.
+
+    Источник - глобальный индекс: если он отстаёт от каталога, запускается
+    фоновая синхронизация, а в ответе выставляется "indexing": true.
+    """
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 1000)
+        min_count = max(int(request.args.get("min_count", 1)), 1)
+    except ValueError:
+        return jsonify({"error": "limit and min_count must be integers"}), 400
+    batch = request.args.get("batch") or None
+
+    instance_path = current_app.instance_path
+    if needs_sync(instance_path):
+        start_background_sync(instance_path, current_app.config["INSTANCE_UPLOADS_SUBDIR"])
+
+    if batch:
+        entry = get_batch_catalog(instance_path).resolve(os.path.basename(batch))
+        if entry is None:
+            return jsonify({"error": "batch not found", "batch": batch}), 404
+        batch = entry["name"]
+
+    result = mine_search_index(get_search_index_db(instance_path), batch, limit, min_count)
+    result["batch"] = batch
+    result["indexing"] = is_sync_running()
+    return jsonify(result)
+
+
+def _schedule_reparse(db, definition_id: int, generation_before: int):
+    """
+    Правка затронула только один анализ - вместо полного перепарсинга
+    пакеты и поисковый индекс обновляются в фоне только по нему
+    (если поколение правил не менялось параллельно другой правкой)
+    """
+    generation_after = db.get_rules_generation()
+    if generation_after == generation_before + 1:
+        schedule_definition_reparse(current_app.instance_path, definition_id,
+                                    generation_before, generation_after,
+                                    _disk_cache_max_bytes(), current_app.config["INSTANCE_UPLOADS_SUBDIR"])
+
+
+def _disk_cache_max_bytes() -> int:
+    return current_app.config["PARSED_BATCH_DISK_CACHE_MB"] * 1024 * 1024
+
+
+def _disk_cache():
+    """Общий для процессов кэш распарсенных пакетов или None, если он выключен"""
+    max_bytes = _disk_cache_max_bytes()
+    return get_batch_disk_cache(current_app.instance_path, max_bytes) if max_bytes else None
+
+
+def _batch_path(catalog, batch: str) -> str:
+    """Файл пакета в instance/uploads; повторная загрузка того же содержимого читается из основного пакета"""
+    uploads_dir = os.path.join(current_app.instance_path, current_app.config["INSTANCE_UPLOADS_SUBDIR"])
+    entry = catalog.resolve(os.path.basename(batch))
+    return os.path.join(uploads_dir, entry["name"] if entry else os.path.basename(batch))
+
+
+def _archived_batch(path: str):
+    """Описание пакета в архиве, если его исходный файл удалён по сроку хранения (services.archive)"""
+    if os.path.isfile(path):
+        return None
+    return get_batch_archive(current_app.instance_path).get(os.path.basename(path))
+
+
+def _batch_available(path: str) -> bool:
+    """Есть ли данные пакета: исходный файл или архив"""
+    return os.path.isfile(path) or _archived_batch(path) is not None
+
+
+def _load_parsed_batch(path: str, catalog):
+    """Распарсенный пакет из кэша процесса / дискового кэша или после парсинга файла (или архива)"""
+    rules_db = get_parse_rules_db(current_app.instance_path)
+    with phase("batch"):
+        return get_parsed_batch(path, rules_db, current_app.config["PARSED_BATCH_CACHE_SIZE"], catalog,
+                                _disk_cache(), get_batch_archive(current_app.instance_path))
+
+
+def _meta_version(path: str, parsed) -> str:
+    """Версия метаданных пакета: меняется с поколением правил и при замене файла"""
+    archived = _archived_batch(path)
+    mtime_ns = archived["mtime_ns"] if archived else os.stat(path).st_mtime_ns
+    key = f"{os.path.basename(path)}:{mtime_ns}:{parsed.rules_generation}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+@api_bp.get("/test-definitions/reparse-status")
+def reparse_status():
+    """Состояние фонового перепарсинга после правок определений анализов"""
+    return jsonify(get_reparse_status())
+
+
 # ===== API для работы с записями (таблица результатов) =====
 
 @api_bp.get("/records")
@@ -214,178 +323,457 @@ def records():
     Если файлов нет - возвращаем пустой результат с сообщением.
 
     Применяет правила парсинга если они есть.
+
+    Текстовый поиск: ?q=<строка> (регистр и ё/е не важны), ?fuzzy=1 - с учётом опечаток в ФИО.
+
+    Фильтры по анализам: ?tests=<json-список> и ?tests_op=and|or, например
+    tests=[{"test_definition_id": 10, "rule_id": 45, "values": ["Обнаружено"]},
+           {"rule_id": 44, "min": 1, "max": 5}]
     """
     page = max(int(request.args.get("page", 1)), 1)
     per_page = min(max(int(request.args.get("per_page", 20)), 1), 1000000)
 
-    q = request.args.get("q")
-    gender = request.args.get("gender")
-    department = request.args.get("department")
-
     batch = request.args.get("batch")
-    uploads_dir = os.path.join(current_app.instance_path, current_app.config["INSTANCE_UPLOADS_SUBDIR"])
 
-    # Если batch не указан - берем последний файл
+    catalog = get_batch_catalog(current_app.instance_path)
+
+    # Если batch не указан - берем последний файл из каталога
     if not batch:
-        files = list_uploaded_files(
-            instance_path=current_app.instance_path,
-            uploads_subdir=current_app.config["INSTANCE_UPLOADS_SUBDIR"]
-        )
-        if files:
-            batch = files[0]["name"]
+        with phase("catalog"):
+            latest = catalog.get_latest_batch()
+        if latest:
+            batch = latest["name"]
         else:
             return jsonify({
                 "page": page,
                 "per_page": per_page,
                 "total": 0,
                 "items": [],
-                "facets": {"departments": [], "genders": []},
-                "test_columns": [],
-                "test_key_indicators": {},
                 "message": "Нет загруженных файлов. Перейдите на страницу загрузки.",
-                "batch": None
+                "batch": None,
+                "meta_version": None
             })
 
-    # Читаем файл
-    path = os.path.join(uploads_dir, os.path.basename(batch))
-    if not os.path.isfile(path):
+    # Читаем файл (для повторной загрузки того же содержимого - основной пакет,
+    # чтобы использовать уже распарсенные данные)
+    with phase("catalog"):
+        path = _batch_path(catalog, batch)
+    annotate_profile(batch=batch)
+    if not _batch_available(path):
         return jsonify({"error": "batch not found", "batch": batch}), 404
 
     try:
-        # Загружаем правила парсинга (в старом формате для совместимости с парсером)
-        rules_db = get_parse_rules_db(current_app.instance_path)
-        rules = rules_db.get_all_rules()
+        filters = _record_filters()
+    except TestFilterError as e:
+        return jsonify({"error": str(e)}), 400
 
-        # Читаем данные с применением правил парсинга
-        data = read_records_with_parsing(path, rules)
+    try:
+        # Читаем данные с применением правил парсинга (из кэша, если пакет уже разобран)
+        parsed = _load_parsed_batch(path, catalog)
     except Exception as e:
         return jsonify({"error": f"failed to read excel: {e}"}), 500
 
-    # Собираем уникальные колонки тестов из всех записей
-    test_definitions_set = set()
-    test_def_names = {}
-
-    for item in data:
-        tests = item.get("results", {}).get("tests", [])
-        for test in tests:
-            test_def_id = test.get("test_definition_id", test.get("rule_id"))
-            base_name = test["name"].split('-')[0] if '-' in test["name"] else test["name"]
-            test_definitions_set.add(test_def_id)
-            test_def_names[test_def_id] = base_name
-
-    test_columns = sorted([test_def_names[def_id] for def_id in test_definitions_set])
-
-    # Создаем маппинг rule_id -> test_pattern для фильтрации на клиенте
-    rules_map = {}
-    for rule in rules:
-        rules_map[rule['id']] = {
-            'test_pattern': rule['test_pattern'],
-            'variable_part': rule['variable_part'],
-            'short_name': rule['short_name']
-        }
-
-    # НОВОЕ: Собираем информацию о ключевых показателях для каждого анализа
-    test_key_indicators = {}
-
-    # Группируем правила по test_definition_id
-    definitions_map = {}
-    for rule in rules:
-        def_id = rule.get('test_definition_id', rule['id'])
-        if def_id not in definitions_map:
-            definitions_map[def_id] = []
-        definitions_map[def_id].append(rule)
-
-    # Для каждого определения анализа находим ключевой показатель
-    for def_id, indicators in definitions_map.items():
-        # Находим ключевой показатель (is_key_indicator = True)
-        key_indicator = None
-        for indicator in indicators:
-            if indicator.get('is_key_indicator', True):  # По умолчанию True для старых данных
-                key_indicator = indicator
-                break
-
-        if not key_indicator:
-            # Если нет явно указанного ключевого, берём первый
-            key_indicator = indicators[0] if indicators else None
-
-        if key_indicator:
-            # Получаем базовое имя анализа
-            base_name = test_def_names.get(def_id)
-            if not base_name:
-                continue
-
-            # Собираем уникальные значения этого ключевого показателя из всех записей
-            # ВАЖНО: Используем raw_value (исходное значение), а не нормализованное
-            possible_values = set()
-            for item in data:
-                tests = item.get("results", {}).get("tests", [])
-                for test in tests:
-                    test_def = test.get("test_definition_id", test.get("rule_id"))
-                    if test_def == def_id and test.get("rule_id") == key_indicator['id']:
-                        # Это нужный показатель
-                        if test.get("is_key_indicator", True):
-                            # Используем raw_value для фильтра (исходное значение из таблицы)
-                            raw_value = test.get("raw_value")
-                            if raw_value:
-                                possible_values.add(str(raw_value))
-
-            # Формируем информацию о ключевом показателе
-            test_key_indicators[base_name] = {
-                "rule_id": key_indicator['id'],
-                "test_definition_id": def_id,
-                "indicator_name": key_indicator['short_name'],
-                "possible_values": sorted(list(possible_values)),
-                "value_type": key_indicator['value_type']
-            }
-
-    # простые фильтры
-    def _match(item):
-        ok = True
-        p = item.get("patient", {})
-
-        if q:
-            ql = q.lower()
-            ok = ok and (
-                    (p.get("last_name") or "").lower().find(ql) >= 0
-                    or (p.get("first_name") or "").lower().find(ql) >= 0
-                    or (p.get("middle_name") or "").lower().find(ql) >= 0
-                    or (item.get("sample_id") or "").lower().find(ql) >= 0
-                    or (item.get("department") or "").lower().find(ql) >= 0
-                    or (item.get("results", {}).get("summary") or "").lower().find(ql) >= 0
-            )
-        if gender:
-            patient_gender = p.get("gender")
-            match = patient_gender == gender
-            if not match and patient_gender:
-                print(f"Не совпало: '{patient_gender}' != '{gender}'")
-            ok = ok and match
-        if department:
-            item_dept = item.get("department")
-            match = item_dept == department
-            if not match and item_dept:
-                print(f"Не совпало отделение: '{item_dept}' != '{department}'")
-            ok = ok and match
-        return ok
-
-    filtered = [x for x in data if _match(x)]
-    total = len(filtered)
+    # Все фильтры - побитовые операции над индексами пакета (текстовый поиск - по триграммам)
+    try:
+        with phase("filter"):
+            mask = parsed.select(**filters)
+            row_ids = np.flatnonzero(mask)
+    except TestFilterError as e:
+        return jsonify({"error": str(e)}), 400
+
+    data = parsed.items
+    total = len(row_ids)
     start = (page - 1) * per_page
     end = start + per_page
-    items = filtered[start:end]
+    # Словари собираются только для запрошенной страницы
+    items = data.take(row_ids[start:end])
+
+    # Диагностика фильтров - одно JSON-событие на долю запросов, а не вывод на каждую строку
+    log_sampled(logger, current_app.config["METRICS_LOG_SAMPLE_RATE"], "records.filter",
+                batch=batch, rows=len(data), matched=total, **filters)
+
+    # Метаданные пакета (колонки, ключевые показатели, правила) - отдельно, /api/batches/<имя>/meta
+    with phase("serialize"):
+        return jsonify({
+            "page": page,
+            "per_page": per_page,
+            "total": total,
+            "items": items,
+            "batch": batch,
+            "meta_version": _meta_version(path, parsed)
+        })
+
+
+@api_bp.get("/batches/<name>/meta")
+def batch_meta(name: str):
+    """
+    Метаданные пакета для таблицы и отчёта: facets, test_columns, test_key_indicators, rules_map.
+
+    Они меняются только вместе с пакетом и поколением правил, поэтому /api/records
+    отдаёт лишь их версию (meta_version). Ответ на ?v=<текущая версия> браузер
+    кэширует надолго; без v (или со старой версией) - ETag и проверка на каждый запрос.
+    """
+    catalog = get_batch_catalog(current_app.instance_path)
+    path = _batch_path(catalog, name)
+    if not _batch_available(path):
+        return jsonify({"error": "batch not found", "batch": name}), 404
+
+    try:
+        parsed = _load_parsed_batch(path, catalog)
+    except Exception as e:
+        return jsonify({"error": f"failed to read excel: {e}"}), 500
+
+    version = _meta_version(path, parsed)
+    if request.if_none_match.contains(version):
+        response = current_app.response_class(status=304)
+    else:
+        with phase("serialize"):
+            response = jsonify({
+                "batch": name,
+                "version": version,
+                "rules_generation": parsed.rules_generation,
+                "facets": parsed.facets,
+                "test_columns": parsed.test_columns,
+                "test_key_indicators": parsed.test_key_indicators,
+                "rules_map": parsed.rules_map,
+            })
+    response.set_etag(version)
+    if request.args.get("v") == version:
+        # URL с версией неизменен: новая версия - это новый URL
+        response.cache_control.private = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+@api_bp.get("/export")
+def export():
+    """
+    Выгрузка таблицы/отчёта файлом: ?format=xlsx|csv и те же фильтры, что у /api/records
+    (batch, q, fuzzy, gender, department, tests, tests_op).
+
+    Колонки - как в отчёте: ?column_order=<json-список id> и ?column_hidden=<json-список id>,
+    id - row_number, fio, ..., test_<анализ>, full_result, notes.
+    Строки собираются порциями и отдаются потоком (services.export).
+    """
+    fmt = request.args.get("format", "xlsx").lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+    try:
+        column_order = _json_list_arg("column_order")
+        column_hidden = _json_list_arg("column_hidden")
+    except ExportError as e:
+        return jsonify({"error": str(e)}), 400
+
+    catalog = get_batch_catalog(current_app.instance_path)
+    batch = request.args.get("batch")
+    if not batch:
+        latest = catalog.get_latest_batch()
+        if not latest:
+            return jsonify({"error": "no batches uploaded"}), 404
+        batch = latest["name"]
+
+    path = _batch_path(catalog, batch)
+    annotate_profile(batch=batch)
+    if not _batch_available(path):
+        return jsonify({"error": "batch not found", "batch": batch}), 404
+
+    try:
+        filters = _record_filters()
+    except TestFilterError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        parsed = _load_parsed_batch(path, catalog)
+    except Exception as e:
+        return jsonify({"error": f"failed to read excel: {e}"}), 500
 
-    facets = {
-        "departments": sorted(list({(x.get("department") or "") for x in data if x.get("department")})),
-        "genders": sorted(list({(x["patient"].get("gender") or "") for x in data if x["patient"].get("gender")})),
+    try:
+        with phase("filter"):
+            row_ids = np.flatnonzero(parsed.select(**filters))
+    except TestFilterError as e:
+        return jsonify({"error": str(e)}), 400
+
+    report = ReportRows(parsed, resolve_columns(parsed.test_columns, column_order, column_hidden))
+    filename = f"{os.path.splitext(os.path.basename(batch))[0]}_export.{fmt}"
+    return Response(
+        stream_with_context(export_rows(fmt, report, row_ids)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": content_disposition(filename), "X-Export-Rows": str(len(row_ids))},
+    )
+
+
+def _json_list_arg(name: str):
+    raw = request.args.get(name)
+    if not raw:
+        return None
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        raise ExportError(f"{name} must be a JSON list")
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ExportError(f"{name} must be a JSON list of column ids")
+    return value
+
+
+def _record_filters():
+    """Фильтры записей из параметров запроса (общие для /api/records и /api/export)"""
+    tests = parse_test_filters(request.args.get("tests"))
+    tests_op = request.args.get("tests_op", "and").lower()
+    if tests_op not in ("and", "or"):
+        raise TestFilterError("tests_op must be 'and' or 'or'")
+    return {
+        "gender": request.args.get("gender"),
+        "department": request.args.get("department"),
+        "tests": tests,
+        "tests_op": tests_op,
+        "q": request.args.get("q"),
+        "fuzzy": request.args.get("fuzzy") in ("1", "true"),
     }
 
+
+# ===== Сводная статистика =====
+
+@api_bp.get("/stats")
+def stats():
+    """
+    Положительные/отрицательные результаты по показателям (всего, по отделениям, по дням)
+    и распределения числовых результатов - services.stats.
+
+    Пакеты: ?batch=<имя> - один пакет, ?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD - все пакеты,
+    загруженные в эти дни (включительно), без параметров - последний пакет.
+    """
+    catalog = get_batch_catalog(current_app.instance_path)
+    try:
+        with phase("catalog"):
+            batches = select_batches(catalog, request.args.get("batch"),
+                                     request.args.get("date_from"), request.args.get("date_to"))
+    except StatsError as e:
+        return jsonify({"error": str(e)}), 400
+    if not batches:
+        return jsonify({"error": "no batches found"}), 404
+
+    uploads_dir = os.path.join(current_app.instance_path, current_app.config["INSTANCE_UPLOADS_SUBDIR"])
+    missing = [b["name"] for b in batches if not _batch_available(os.path.join(uploads_dir, b["data_name"]))]
+    if missing:
+        return jsonify({"error": "batch not found", "batches": missing}), 404
+
+    rules_db = get_parse_rules_db(current_app.instance_path)
+    try:
+        result = get_stats(batches, uploads_dir, lambda path: _load_parsed_batch(path, catalog),
+                           rules_db.get_rules_generation(), current_app.config["STATS_CACHE_SIZE"])
+    except Exception as e:
+        return jsonify({"error": f"failed to read excel: {e}"}), 500
+    return jsonify(result)
+
+
+# ===== Поиск по всем загруженным пакетам =====
+
+@api_bp.get("/search")
+def search():
+    """
+    Поиск строк во всех пакетах по пациенту и/или образцу.
+
+    ?q=<начало ФИО> (например "Иванов Ив"), ?birth_date=YYYY-MM-DD,
+    ?sample_id=<идентификатор образца>, ?limit=<N>.
+
+    Если в каталоге есть пакеты, ещё не попавшие в индекс, запускается фоновая
+    синхронизация, а в ответе выставляется "indexing": true.
+    """
+    q = (request.args.get("q") or "").strip()
+    sample_id = (request.args.get("sample_id") or "").strip()
+    birth_date = (request.args.get("birth_date") or "").strip() or None
+    try:
+        limit = min(max(int(request.args.get("limit", 200)), 1), 1000)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+
+    if not q and not sample_id:
+        return jsonify({"error": "q or sample_id is required"}), 400
+
+    instance_path = current_app.instance_path
+    uploads_subdir = current_app.config["INSTANCE_UPLOADS_SUBDIR"]
+    if needs_sync(instance_path):
+        start_background_sync(instance_path, uploads_subdir)
+
+    db = get_search_index_db(instance_path)
+    rows = db.search(
+        name_prefix=normalize_name(q) or None,
+        birth_date=birth_date,
+        sample_key=normalize_sample_id(sample_id),
+        limit=limit
+    )
+
+    # Группируем найденные строки по пациентам
+    patients = {}
+    for row in rows:
+        key = row["patient_key"]
+        if not key:
+            continue
+        entry = patients.get(key)
+        if entry is None:
+            entry = patients[key] = {
+                "patient_key": key,
+                "last_name": row["last_name"],
+                "first_name": row["first_name"],
+                "middle_name": row["middle_name"],
+                "gender": row["gender"],
+                "birth_date": row["birth_date"],
+                "batches": set(),
+                "last_seen": row["batch_time"],
+            }
+        entry["batches"].add(row["batch"])
+        entry["last_seen"] = max(entry["last_seen"], row["batch_time"])
+
+    for entry in patients.values():
+        entry["batches"] = len(entry["batches"])
+
     return jsonify({
-        "page": page,
-        "per_page": per_page,
-        "total": total,
-        "items": items,
-        "facets": facets,
-        "test_columns": test_columns,
-        "test_key_indicators": test_key_indicators,  # НОВОЕ ПОЛЕ
-        "rules_map": rules_map,
-        "batch": batch
-    })
\ No newline at end of file
+        "total": len(rows),
+        "items": rows,
+        "patients": sorted(patients.values(), key=lambda p: p["last_seen"], reverse=True),
+        "indexing": is_sync_running()
+    })
+
+
+@api_bp.get("/search/timeline")
+def patient_timeline():
+    """Хронология пациента по всем пакетам: ?patient_key=<ключ из /api/search>"""
+    key = request.args.get("patient_key")
+    if not key:
+        return jsonify({"error": "patient_key is required"}), 400
+
+    db = get_search_index_db(current_app.instance_path)
+    rows = db.get_patient_rows(key)
+    if not rows:
+        return jsonify({"error": "patient not found"}), 404
+
+    last = rows[-1]
+    timeline = build_timeline(rows)
+    return jsonify({
+        "patient_key": key,
+        "patient": {
+            "last_name": last["last_name"],
+            "first_name": last["first_name"],
+            "middle_name": last["middle_name"],
+            "gender": last["gender"],
+            "birth_date": last["birth_date"],
+            "age_years": last["age_years"],
+        },
+        "events": timeline["events"],
+        "series": timeline["series"]
+    })
+
+
+# ===== Порционная загрузка файлов (services.chunked_upload) =====
+
+def _upload_sessions():
+    config = current_app.config
+    return get_upload_sessions(current_app.instance_path, config["UPLOAD_MAX_MB"] * 1024 * 1024,
+                               config["UPLOAD_SESSION_TTL_HOURS"])
+
+
+def _upload_chunk_size() -> int:
+    # Порция должна пройти через MAX_CONTENT_LENGTH
+    config = current_app.config
+    return int(min(config["UPLOAD_CHUNK_MB"] * 1024 * 1024, config["MAX_CONTENT_LENGTH"] or float("inf")))
+
+
+def _upload_error(e: UploadError):
+    if isinstance(e, UploadNotFound):
+        return jsonify({"error": str(e)}), 404
+    if isinstance(e, UploadOffsetMismatch):
+        return jsonify({"error": str(e), "offset": e.offset}), 409
+    return jsonify({"error": str(e)}), 400
+
+
+@api_bp.post("/uploads")
+def upload_init():
+    """
+    Начать порционную загрузку: {"filename": "...", "size": <байт>}.
+    Ответ: upload_id, offset (0) и рекомендуемый размер порции chunk_size.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = (data.get("filename") or "").strip()
+    if not filename:
+        return jsonify({"error": "filename is required"}), 400
+    if not allowed_file(filename, current_app.config["ALLOWED_EXTENSIONS"]):
+        return jsonify({"error": "only .xlsx and .xls files are allowed"}), 400
+
+    size = data.get("size")
+    if size is not None and (not isinstance(size, int) or isinstance(size, bool)):
+        return jsonify({"error": "size must be an integer"}), 400
+
+    try:
+        session = _upload_sessions().create(filename, size)
+    except UploadError as e:
+        return _upload_error(e)
+
+    return jsonify({**session, "chunk_size": _upload_chunk_size()}), 201
+
+
+@api_bp.get("/uploads/<upload_id>")
+def upload_status(upload_id: str):
+    """Состояние загрузки: с offset продолжать после обрыва соединения"""
+    try:
+        return jsonify({**_upload_sessions().get(upload_id), "chunk_size": _upload_chunk_size()})
+    except UploadError as e:
+        return _upload_error(e)
+
+
+@api_bp.put("/uploads/<upload_id>")
+def upload_chunk(upload_id: str):
+    """
+    Порция файла: тело запроса - байты, ?offset=<смещение порции>.
+    Смещение должно совпадать с подтверждённым, иначе 409 с текущим offset.
+    """
+    try:
+        offset = int(request.args["offset"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "offset is required"}), 400
+
+    try:
+        session = _upload_sessions().write_chunk(upload_id, offset, request.stream, request.content_length)
+    except UploadError as e:
+        return _upload_error(e)
+    return jsonify(session)
+
+
+@api_bp.post("/uploads/<upload_id>/finalize")
+def upload_finalize(upload_id: str):
+    """
+    Завершить загрузку ({"sha256": "..."} - необязательная проверка содержимого):
+    файл конвертируется и регистрируется как пакет, как при загрузке формой
+    """
+    data = request.get_json(silent=True) or {}
+    uploads_dir = os.path.join(current_app.instance_path, current_app.config["INSTANCE_UPLOADS_SUBDIR"])
+    catalog = get_batch_catalog(current_app.instance_path)
+
+    try:
+        stored = _upload_sessions().finalize(upload_id, catalog, uploads_dir, data.get("sha256"))
+    except UploadError as e:
+        return _upload_error(e)
+    except ConversionError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"failed to process file: {e}"}), 500
+
+    if not stored["duplicate_of"]:
+        # Новый пакет попадёт в глобальный поиск в фоне
+        start_background_sync(current_app.instance_path, current_app.config["INSTANCE_UPLOADS_SUBDIR"])
+    return jsonify({"success": True, **stored}), 201
+
+
+@api_bp.delete("/uploads/<upload_id>")
+def upload_abort(upload_id: str):
+    """Отменить загрузку и удалить принятые порции"""
+    try:
+        sessions = _upload_sessions()
+        sessions.get(upload_id)
+        sessions.delete(upload_id)
+    except UploadError as e:
+        return _upload_error(e)
+    return jsonify({"success": True})
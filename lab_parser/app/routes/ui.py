@@ -1,45 +1,15 @@
-from flask import Blueprint, render_template, request, current_app, redirect, url_for, flash, send_file
+from flask import Blueprint, render_template, request, current_app, redirect, url_for, flash, send_file, abort
 from werkzeug.utils import secure_filename
 import os
 import time
-import pandas as pd
-import unicodedata
 
-from ..utils.io_utils import allowed_file, list_uploaded_files, human_size
+from ..utils.io_utils import allowed_file, human_size, save_stream_with_hash, safe_filename_unicode
+from ..models.batch_catalog import get_batch_catalog
+from ..services.batches import store_upload
+from ..services.search_index import start_background_sync
+from ..services.profiling import list_profiles, profiles_dir, PROFILE_EXTENSIONS
 
 
-def safe_filename_unicode(filename: str) -> str:
-    """
-    Создает безопасное имя файла с сохранением кириллицы.
-    Удаляет только опасные символы, оставляя буквы (включая кириллицу), цифры, точки, дефисы и подчеркивания.
-    """
-    # Нормализуем unicode
-    filename = unicodedata.normalize('NFKC', filename)
-
-    # Разрешенные символы: буквы (любые), цифры, точка, дефис, подчеркивание, пробел
-    safe_chars = []
-    for char in filename:
-        if char.isalnum() or char in '._- ':
-            safe_chars.append(char)
-        else:
-            safe_chars.append('_')
-
-    result = ''.join(safe_chars)
-
-    # Убираем множественные пробелы и подчеркивания
-    result = ' '.join(result.split())
-    result = result.replace(' ', '_')
-
-    # Убираем точки в начале (скрытые файлы в Unix)
-    result = result.lstrip('.')
-
-    # Ограничиваем длину (оставляем место для метки времени)
-    if len(result) > 100:
-        name, ext = os.path.splitext(result)
-        result = name[:100] + ext
-
-    return result or 'unnamed'
-
 ui_bp = Blueprint("ui", __name__)
 
 
@@ -58,54 +28,16 @@ def report():
     return render_template("report.html")
 
 
+@ui_bp.get("/search")
+def search_page():
+    return render_template("search.html")
+
+
 @ui_bp.get("/upload")
 def upload_get():
     return render_template("upload.html")
 
 
-def _is_html_file(file_path: str) -> bool:
-    """Определяет, является ли файл HTML"""
-    try:
-        with open(file_path, 'rb') as f:
-            header = f.read(1024).lower()
-            return b'<html' in header or b'<!doctype html' in header or b'<table' in header
-    except Exception:
-        return False
-
-
-def _convert_to_xlsx(source_path: str, dest_path: str) -> None:
-    """
-    Конвертирует файл любого поддерживаемого формата в настоящий .xlsx
-
-    Поддерживает:
-    - .xlsx файлы (копирует через pandas для нормализации)
-    - .xls файлы (конвертирует в .xlsx)
-    - HTML-файлы с расширением .xls/.xlsx (парсит и сохраняет как .xlsx)
-    """
-    file_ext = os.path.splitext(source_path)[1].lower()
-    is_html = _is_html_file(source_path)
-
-    if is_html:
-        # Читаем HTML-таблицу
-        tables = pd.read_html(source_path, encoding='utf-8')
-        if not tables:
-            raise ValueError("HTML файл не содержит таблиц")
-        df = tables[0]
-    else:
-        # Определяем движок по расширению
-        engine = None
-        if file_ext == '.xlsx':
-            engine = 'openpyxl'
-        elif file_ext == '.xls':
-            engine = 'xlrd'
-
-        # Читаем Excel-файл
-        df = pd.read_excel(source_path, sheet_name=0, engine=engine)
-
-    # Сохраняем как настоящий .xlsx
-    df.to_excel(dest_path, index=False, engine='openpyxl')
-
-
 @ui_bp.post("/upload")
 def upload_post():
     if "file" not in request.files:
@@ -121,30 +53,30 @@ def upload_post():
         flash("Разрешены только файлы .xlsx и .xls", "error")
         return redirect(url_for("ui.upload_get"))
 
-    # Безопасное имя с сохранением кириллицы + метка времени
-    safe_name = safe_filename_unicode(f.filename)
-    name, _ = os.path.splitext(safe_name)  # Игнорируем исходное расширение
-    ts = time.strftime("%Y%m%d-%H%M%S")
-
     dest_dir = os.path.join(current_app.instance_path, current_app.config["INSTANCE_UPLOADS_SUBDIR"])
     os.makedirs(dest_dir, exist_ok=True)
 
     # Временный файл для загрузки
-    temp_path = os.path.join(dest_dir, f"temp_{ts}_{safe_name}")
+    ts = time.strftime("%Y%m%d-%H%M%S")
+    temp_path = os.path.join(dest_dir, f"temp_{ts}_{safe_filename_unicode(f.filename)}")
 
     try:
-        # Сохраняем загруженный файл временно
-        f.save(temp_path)
+        # Сохраняем загруженный файл временно, считая хеш содержимого по ходу записи
+        content_hash, _ = save_stream_with_hash(f.stream, temp_path)
 
-        # Итоговое имя ВСЕГДА с расширением .xlsx
-        final_name = f"{name}__{ts}.xlsx"
-        dest_path = os.path.join(dest_dir, final_name)
+        # Конвертируем в настоящий .xlsx и регистрируем в каталоге; если такой же файл
+        # уже загружался - не конвертируем и не парсим заново, а ссылаемся на готовый пакет
+        catalog = get_batch_catalog(current_app.instance_path)
+        stored = store_upload(catalog, dest_dir, temp_path, f.filename, content_hash)
+        final_name = stored["name"]
 
-        # Конвертируем в настоящий .xlsx
-        _convert_to_xlsx(temp_path, dest_path)
+        if stored["duplicate_of"]:
+            flash(f"Такой файл уже загружался ({stored['duplicate_of']}), используются готовые данные: {final_name}",
+                  "success")
+            return redirect(url_for("ui.table") + f"?batch={final_name}")
 
-        # Удаляем временный файл
-        os.remove(temp_path)
+        # Новый пакет попадёт в глобальный поиск в фоне
+        start_background_sync(current_app.instance_path, current_app.config["INSTANCE_UPLOADS_SUBDIR"])
 
         flash(f"Файл загружен и сконвертирован: {final_name}", "success")
         return redirect(url_for("ui.table") + f"?batch={final_name}")
@@ -158,14 +90,14 @@ def upload_post():
 
 @ui_bp.get("/batches")
 def batches():
-    files = list_uploaded_files(
-        instance_path=current_app.instance_path,
-        uploads_subdir=current_app.config["INSTANCE_UPLOADS_SUBDIR"]
-    )
+    files = get_batch_catalog(current_app.instance_path).list_batches()
+    uploads_dir = os.path.join(current_app.instance_path, current_app.config["INSTANCE_UPLOADS_SUBDIR"])
     # подготовим удобные поля для шаблона
     for f in files:
         f["size_h"] = human_size(f["size"])
-        f["mtime_h"] = f["mtime"].strftime("%Y-%m-%d %H:%M:%S")
+        f["mtime_h"] = f["uploaded_at"].replace("T", " ")
+        # Исходный файл заархивированного пакета мог быть удалён по сроку хранения (services.archive)
+        f["original_pruned"] = not os.path.isfile(os.path.join(uploads_dir, f["name"]))
     return render_template("batches.html", files=files)
 
 
@@ -190,4 +122,26 @@ def batches_download():
 @ui_bp.get("/parse-settings")
 def parse_settings():
     """Страница настроек парсинга результатов"""
-    return render_template("parse_settings.html")
\ No newline at end of file
+    return render_template("parse_settings.html")
+
+@ui_bp.get("/profiles")
+def profiles():
+    """Сохранённые профили запросов (services.profiling), доступно при PROFILING_ENABLED"""
+    if not current_app.config["PROFILING_ENABLED"]:
+        abort(404)
+    return render_template("profiles.html", profiles=list_profiles(current_app.instance_path))
+
+
+@ui_bp.get("/profiles/download")
+def profiles_download():
+    """Скачивание файла профиля по имени (?name=...)"""
+    if not current_app.config["PROFILING_ENABLED"]:
+        abort(404)
+    name = os.path.basename(request.args.get("name") or "")
+    if not name.endswith(PROFILE_EXTENSIONS):
+        abort(404)
+    path = os.path.join(profiles_dir(current_app.instance_path), name)
+    if not os.path.isfile(path):
+        abort(404)
+    # .html (pyinstrument) удобнее открыть в браузере, остальное - скачать
+    return send_file(path, as_attachment=not name.endswith(".html"), download_name=name)
@@ -0,0 +1,330 @@
+"""
+Архив распарсенных пакетов, разложенный по дням загрузки (instance/archive)
+
+Пакеты копятся в instance/uploads отдельными .xlsx, и запрос за диапазон дат
+(статистика за месяц) читает и парсит каждый файл заново. Задание архивации
+(python -m lab_parser archive) переносит распарсенные пакеты старше
+ARCHIVE_AFTER_DAYS в сжатые колоночные файлы:
+
+    manifest.json                      - {"format", "partitions": {"YYYY-MM-DD": {пакет: описание}}}
+    YYYY-MM/YYYY-MM-DD/<пакет>.npz     - колонки CompactRecords (те же массивы, что
+                                         в services.batch_cache), np.savez_compressed
+
+* Раздел - день загрузки пакета (uploaded_at из каталога, как services.stats.batch_day).
+  Запрос за диапазон дат находит по манифесту пересекающиеся разделы и открывает
+  только файлы их пакетов; манифест кэшируется в памяти процесса до его изменения.
+* В архиве лежит и исходный текст результатов: после правки правил пакет
+  перепарсивается из архива, исходный файл для этого не нужен.
+* Исходные файлы заархивированных пакетов старше ARCHIVE_RETAIN_ORIGINALS_DAYS
+  удаляются (0 - хранятся всегда). Запись каталога остаётся, а пакет дальше
+  читается из архива: get_parsed_batch, /api/stats, поисковый индекс.
+* Файлы пакетов и манифест публикуются атомарно (временный файл + os.replace),
+  изменения манифеста идут под flock - два задания не затрут записи друг друга.
+"""
+import os
+import json
+import uuid
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from ..models.batch_catalog import get_batch_catalog
+from ..models.parse_rules import get_parse_rules_db
+from .batch_cache import encode_items, decode_items
+from .compact_records import CompactRecords
+from .parse_excel import read_records_with_parsing
+from .results_parser import ResultsParser
+from .metrics import phase
+
+try:
+    import fcntl
+except ImportError:  # Windows: без межпроцессной блокировки манифеста
+    fcntl = None
+
+ARCHIVE_FORMAT = 1
+
+# путь манифеста -> ((mtime_ns, размер), манифест) в этом процессе
+_manifests: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+_manifests_lock = threading.Lock()
+
+
+def _empty_manifest() -> Dict[str, Any]:
+    return {"format": ARCHIVE_FORMAT, "partitions": {}}
+
+
+class BatchArchive:
+    """Сжатые колоночные файлы пакетов по дням + манифест с описанием разделов"""
+
+    def __init__(self, archive_dir: str):
+        self.archive_dir = archive_dir
+        self.manifest_path = os.path.join(archive_dir, "manifest.json")
+        os.makedirs(archive_dir, exist_ok=True)
+
+    # ===== Манифест =====
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return _empty_manifest()
+        if manifest.get("format") != ARCHIVE_FORMAT:
+            raise ValueError(f"unsupported archive format: {manifest.get('format')}")
+        return manifest
+
+    def manifest(self) -> Dict[str, Any]:
+        """Манифест (из памяти процесса, пока файл не изменился)"""
+        try:
+            st = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return _empty_manifest()
+        version = (st.st_mtime_ns, st.st_size)
+        with _manifests_lock:
+            cached = _manifests.get(self.manifest_path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        manifest = self._read_manifest()
+        with _manifests_lock:
+            _manifests[self.manifest_path] = (version, manifest)
+        return manifest
+
+    def _write_manifest(self, manifest: Dict[str, Any]) -> None:
+        tmp_path = f"{self.manifest_path}.tmp-{uuid.uuid4().hex}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    @contextmanager
+    def _locked(self):
+        """Эксклюзивная блокировка изменения манифеста (между процессами)"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.archive_dir, "manifest.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # ===== Разделы =====
+
+    def partitions(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[str]:
+        """Дни (YYYY-MM-DD), чьи разделы пересекаются с диапазоном (включительно)"""
+        return sorted(day for day in self.manifest()["partitions"]
+                      if (date_from is None or day >= date_from) and (date_to is None or day <= date_to))
+
+    def entries(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Заархивированные пакеты из разделов диапазона: описание + name и day"""
+        partitions = self.manifest()["partitions"]
+        return [dict(meta, name=name, day=day)
+                for day in self.partitions(date_from, date_to)
+                for name, meta in sorted(partitions[day].items())]
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """Описание заархивированного пакета или None"""
+        for day, batches in self.manifest()["partitions"].items():
+            meta = batches.get(name)
+            if meta is not None:
+                return dict(meta, name=name, day=day)
+        return None
+
+    def _file_path(self, relpath: str) -> str:
+        return os.path.join(self.archive_dir, relpath)
+
+    # ===== Запись и чтение =====
+
+    def add(self, entry: Dict[str, Any], items, rules_generation: int) -> Dict[str, Any]:
+        """
+        Заархивировать записи пакета (entry - запись каталога) в раздел дня его загрузки.
+        Повторная архивация того же пакета заменяет файл.
+        """
+        name = os.path.basename(entry["name"])
+        day = entry["uploaded_at"][:10]
+        relpath = os.path.join(day[:7], day, name + ".npz")
+        path = self._file_path(relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        arrays, counts = encode_items(items)
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez_compressed(f, **arrays)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        meta = {
+            "file": relpath,
+            **counts,
+            "size": os.path.getsize(path),
+            "rules_generation": rules_generation,
+            "mtime_ns": entry["mtime_ns"],
+            "content_hash": entry.get("content_hash"),
+            "original_name": entry.get("original_name"),
+            "uploaded_at": entry["uploaded_at"],
+            "archived_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        with self._locked():
+            manifest = self._read_manifest()
+            for other_day, batches in list(manifest["partitions"].items()):
+                # Дата загрузки могла измениться - пакет не должен остаться в двух разделах
+                if other_day != day and batches.pop(name, None) is not None and not batches:
+                    del manifest["partitions"][other_day]
+            manifest["partitions"].setdefault(day, {})[name] = meta
+            self._write_manifest(manifest)
+        return dict(meta, name=name, day=day)
+
+    def load(self, name: str) -> Tuple[CompactRecords, Dict[str, Any]]:
+        """Записи пакета из архива и его описание (FileNotFoundError, если пакета нет)"""
+        meta = self.get(name)
+        if meta is None:
+            raise FileNotFoundError(f"batch is not archived: {name}")
+        with phase("archive.load"):
+            with np.load(self._file_path(meta["file"]), allow_pickle=False) as npz:
+                records = decode_items(lambda array: npz[array])
+        return records, meta
+
+    def remove(self, name: str) -> bool:
+        """Убрать пакет из архива"""
+        with self._locked():
+            manifest = self._read_manifest()
+            for day, batches in manifest["partitions"].items():
+                meta = batches.pop(name, None)
+                if meta is None:
+                    continue
+                if not batches:
+                    del manifest["partitions"][day]
+                self._write_manifest(manifest)
+                path = self._file_path(meta["file"])
+                if os.path.exists(path):
+                    os.remove(path)
+                return True
+        return False
+
+
+def get_batch_archive(instance_path: str) -> BatchArchive:
+    """Фабрика для получения архива пакетов (instance/archive)"""
+    return BatchArchive(os.path.join(instance_path, "archive"))
+
+
+# ===== Чтение пакетов из архива =====
+
+def basic_results(raw_text: Optional[str]) -> Dict[str, Any]:
+    """Результаты записи без правил парсинга - как их отдаёт read_basic_records"""
+    summary = raw_text.strip() if raw_text else None
+    if summary and len(summary) > 140:
+        summary = summary[:137] + "..."
+    return {"summary": summary, "tests": [], "raw_text": raw_text, "parse_quality": "basic"}
+
+
+def reparse_records(records: CompactRecords, rules: List[Dict[str, Any]]) -> CompactRecords:
+    """Перепарсить записи архива правилами rules по исходному тексту результатов"""
+    parser = ResultsParser(rules) if rules else None
+    items = []
+    for item in records:
+        raw_text = item["results"].get("raw_text")
+        item["results"] = parser.parse_results(raw_text) if parser is not None else basic_results(raw_text)
+        items.append(item)
+    return CompactRecords.from_items(items)
+
+
+def load_archived_items(archive: BatchArchive, name: str, rules: List[Dict[str, Any]],
+                        rules_generation: int) -> CompactRecords:
+    """Записи пакета из архива; если с архивации правила менялись - перепарсенные"""
+    records, meta = archive.load(name)
+    if meta["rules_generation"] != rules_generation:
+        with phase("archive.reparse"):
+            records = reparse_records(records, rules)
+    return records
+
+
+# ===== Задание архивации =====
+
+def archive_batches(instance_path: str, uploads_subdir: str, older_than_days: int,
+                    retain_originals_days: int = 0, disk_cache=None, today: Optional[date] = None,
+                    dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Заархивировать пакеты, загруженные раньше older_than_days дней назад,
+    и удалить исходные файлы заархивированных пакетов старше retain_originals_days
+    (0 - исходные файлы не удаляются).
+
+    Пакет парсится текущими правилами (или берётся из дискового кэша, если передан);
+    уже заархивированный пакет повторно не архивируется, пока его файл не заменят.
+    Псевдонимы (повторные загрузки) не архивируются - их данные в основном пакете,
+    а их файлы удаляются вместе с файлом основного.
+
+    Returns:
+        {"archived": [...], "pruned": [...], "failed": [{"batch", "error"}], "bytes": размер архива}
+    """
+    today = today or date.today()
+    catalog = get_batch_catalog(instance_path)
+    rules_db = get_parse_rules_db(instance_path)
+    archive = get_batch_archive(instance_path)
+    uploads_dir = os.path.join(instance_path, uploads_subdir)
+    stats: Dict[str, Any] = {"archived": [], "pruned": [], "failed": [], "bytes": 0}
+
+    batches = catalog.list_batches()
+    cutoff = (today - timedelta(days=older_than_days)).isoformat()
+    rules = None
+    for entry in batches:
+        name = entry["name"]
+        path = os.path.join(uploads_dir, name)
+        if entry["alias_of"] or entry["uploaded_at"][:10] >= cutoff or not os.path.isfile(path):
+            continue
+        archived = archive.get(name)
+        if archived and archived["mtime_ns"] == entry["mtime_ns"]:
+            continue
+        if dry_run:
+            stats["archived"].append(name)
+            continue
+
+        if rules is None:
+            rules = rules_db.get_all_rules()
+        generation = rules_db.get_rules_generation()
+
+        def _parse():
+            return CompactRecords.from_items(read_records_with_parsing(path, rules, header_row=entry["header_row"]))
+
+        try:
+            if disk_cache is not None:
+                items, _ = disk_cache.get_or_build(disk_cache.entry_key(path, entry["mtime_ns"], generation),
+                                                   name, generation, _parse)
+            else:
+                items = _parse()
+            meta = archive.add(entry, items, generation)
+        except Exception as e:
+            stats["failed"].append({"batch": name, "error": str(e)})
+            continue
+        catalog.set_artifact(name, "archive", {
+            "day": meta["day"], "file": meta["file"], "size": meta["size"], "rules_generation": generation
+        })
+        stats["archived"].append(name)
+
+    if retain_originals_days > 0:
+        keep_from = (today - timedelta(days=retain_originals_days)).isoformat()
+        mtimes = {entry["name"]: entry["mtime_ns"] for entry in batches}
+        for entry in batches:
+            path = os.path.join(uploads_dir, entry["name"])
+            if entry["uploaded_at"][:10] >= keep_from or not os.path.isfile(path):
+                continue
+            # Удаляется только файл, чьё содержимое уже в архиве (для псевдонима - основной пакет)
+            target = entry["alias_of"] or entry["name"]
+            archived = archive.get(target)
+            if not archived or archived["mtime_ns"] != mtimes.get(target):
+                continue
+            if not dry_run:
+                os.remove(path)
+            stats["pruned"].append(entry["name"])
+
+    stats["bytes"] = sum(meta["size"] for meta in archive.entries())
+    return stats
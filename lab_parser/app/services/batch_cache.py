@@ -0,0 +1,389 @@
+"""
+Общий для всех процессов на хосте кэш распарсенных пакетов (instance/cache)
+
+Под gunicorn у каждого воркера свой кэш в памяти (services.parsed_batch),
+поэтому один и тот же пакет парсился бы в каждом воркере заново. Этот кэш -
+второй уровень: записи пакета хранятся на диске в колоночном виде
+(массивы NumPy .npy, читаются через mmap), и любой воркер поднимает их без
+чтения Excel и без регулярных выражений.
+
+Формат записи - каталог <ключ>/ с файлами:
+    meta.json            - версия формата, пакет, поколение правил, число строк/тестов, размер
+    <колонка>.npy        - целые числа (int64), <колонка>.null.npy - маска пропусков
+    <колонка>.txt.npy    - UTF-8 всех строк колонки подряд, <колонка>.off.npy - смещения (в символах)
+    <колонка>.codes.npy  - словарное кодирование (int32, -1 = None) + словарь <колонка>.vocab.*
+Тесты всех записей лежат одной плоской таблицей, test_offsets - границы по записям.
+
+Протокол:
+* публикация атомарная: запись во временный каталог и os.rename в итоговое имя;
+* строит запись только один процесс: эксклюзивный flock на locks/<ключ>.lock,
+  остальные ждут на той же блокировке и затем читают готовую запись;
+* если построение упало, ошибка пишется в locks/<ключ>.error - процессы, ждавшие
+  на блокировке, получают её (BatchBuildError), а не повторяют ту же работу;
+  запросы, пришедшие после сбоя, пробуют построить запись заново;
+* вытеснение по суммарному размеру на диске: самые давно использованные записи
+  (mtime каталога обновляется при каждом чтении) удаляются, пока не уложимся в лимит;
+  вместе с ними (и при clear) удаляются свободные файлы блокировок и сбоев ключей
+  без записи - удаляются под той же блокировкой, а взявший блокировку проверяет,
+  что файл по пути всё ещё тот же (иначе берёт её заново).
+
+Прочитанные записи не копируются из mmap: массивы колонок - представления только
+для чтения, их страницы общие у всех воркеров.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import uuid
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+import numpy as np
+
+from .metrics import timed
+from .compact_records import (
+    CompactRecords, IntColumn, TextColumn, DictColumn, ROW_COLUMNS, TEST_COLUMNS
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: без межпроцессной блокировки, в худшем случае пакет распарсят дважды
+    fcntl = None
+
+FORMAT_VERSION = 1
+
+
+class BatchBuildError(RuntimeError):
+    """Пакет не удалось построить в другом процессе, пока этот ждал его на блокировке"""
+
+
+# ===== Кодирование колонок =====
+
+def _save(dirpath: str, name: str, array: np.ndarray):
+    np.save(os.path.join(dirpath, name + ".npy"), array, allow_pickle=False)
+
+
+def _load(dirpath: str, name: str) -> np.ndarray:
+    return np.load(os.path.join(dirpath, name + ".npy"), mmap_mode="r", allow_pickle=False)
+
+
+def _encode_text(arrays: Dict[str, np.ndarray], col: str, values: List[Optional[str]]):
+    nulls = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+    strings = ["" if v is None else v for v in values]
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in strings], out=offsets[1:])
+    arrays[col + ".txt"] = np.frombuffer("".join(strings).encode("utf-8"), dtype=np.uint8)
+    arrays[col + ".off"] = offsets
+    arrays[col + ".null"] = nulls
+
+
+def _decode_text(load: Callable[[str], np.ndarray], col: str) -> List[Optional[str]]:
+    text = load(col + ".txt").tobytes().decode("utf-8")
+    offsets = load(col + ".off").tolist()
+    nulls = load(col + ".null").tolist()
+    return [None if nulls[i] else text[offsets[i]:offsets[i + 1]] for i in range(len(nulls))]
+
+
+def _encode_column(arrays: Dict[str, np.ndarray], col: str, column):
+    if isinstance(column, IntColumn):
+        arrays[col] = column.values
+        arrays[col + ".null"] = column.nulls
+    elif isinstance(column, DictColumn):
+        arrays[col + ".codes"] = column.codes
+        _encode_text(arrays, col + ".vocab", column.vocab)
+    else:
+        _encode_text(arrays, col, column.values)
+
+
+def _view(array: np.ndarray) -> np.ndarray:
+    # Без копии: страницы файла из mmap общие у всех процессов, прочитавших запись.
+    # Массивы колонок нигде не изменяются (запись - ошибка "read-only"), а вытеснение
+    # записи им не мешает: на Linux удалённый файл живёт, пока отображён в память
+    return array.view(np.ndarray)
+
+
+def _decode_column(load: Callable[[str], np.ndarray], col: str, kind: str):
+    if kind == "int":
+        return IntColumn(_view(load(col)), _view(load(col + ".null")))
+    if kind == "dict":
+        return DictColumn(_view(load(col + ".codes")), _decode_text(load, col + ".vocab"))
+    return TextColumn(_decode_text(load, col))
+
+
+def encode_items(items) -> Tuple[Dict[str, np.ndarray], Dict[str, int]]:
+    """
+    Записи пакета (CompactRecords или список словарей) - именованными массивами.
+    Тот же набор массивов пишет архив пакетов (services.archive). Возвращает (массивы, {rows, tests}).
+    """
+    records = CompactRecords.from_items(items)
+    arrays: Dict[str, np.ndarray] = {}
+    for col, _ in ROW_COLUMNS:
+        _encode_column(arrays, col, records.rows[col])
+    for col, _ in TEST_COLUMNS:
+        _encode_column(arrays, "test_" + col, records.tests[col])
+    arrays["test_offsets"] = records.test_offsets
+    return arrays, {"rows": len(records), "tests": int(records.test_offsets[-1])}
+
+
+def decode_items(load: Callable[[str], np.ndarray]) -> CompactRecords:
+    """Записи пакета из массивов encode_items; load(имя) возвращает массив"""
+    return CompactRecords(
+        {col: _decode_column(load, col, kind) for col, kind in ROW_COLUMNS},
+        {col: _decode_column(load, "test_" + col, kind) for col, kind in TEST_COLUMNS},
+        _view(load("test_offsets")),
+    )
+
+
+def write_items(dirpath: str, items) -> Dict[str, int]:
+    """Записать записи пакета (CompactRecords или список словарей) в каталог. Возвращает {rows, tests}."""
+    arrays, counts = encode_items(items)
+    for name, array in arrays.items():
+        _save(dirpath, name, array)
+    return counts
+
+
+def read_items(dirpath: str) -> CompactRecords:
+    """Записи пакета в колоночном виде - без сборки словарей на каждую строку"""
+    return decode_items(lambda name: _load(dirpath, name))
+
+
+def _dir_size(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+# ===== Кэш =====
+
+class BatchDiskCache:
+    """Колоночный кэш распарсенных пакетов в instance/cache, общий для процессов"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.locks_dir = os.path.join(cache_dir, "locks")
+        os.makedirs(self.locks_dir, exist_ok=True)
+
+    @staticmethod
+    def entry_key(path: str, mtime_ns: int, rules_generation: int) -> str:
+        """Имя записи: хеш пути файла + версия файла + поколение правил"""
+        digest = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+        return f"{digest}-{mtime_ns}-g{rules_generation}"
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(self.locks_dir, key + ".lock")
+
+    def _acquire(self, key: str, blocking: bool = True):
+        """
+        Открытый файл блокировки key под flock или None (blocking=False и блокировка занята).
+        Файл блокировки могут удалить (_remove_lock), пока мы ждём, - тогда
+        блокировка взята на уже удалённом файле, и берём её заново по пути.
+        """
+        path = self._lock_path(key)
+        while True:
+            f = open(path, "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                f.close()
+                return None
+            try:
+                if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    @contextmanager
+    def _lock(self, key: str):
+        """Эксклюзивная блокировка построения записи key (между процессами)"""
+        if fcntl is None:
+            yield
+            return
+        f = self._acquire(key)
+        try:
+            yield
+        finally:
+            f.close()
+
+    def _remove_lock(self, key: str):
+        """Удалить файлы блокировки и сбоя key, если их сейчас никто не держит"""
+        if fcntl is None or not os.path.exists(self._lock_path(key)):
+            self._clear_failure(key)
+            return
+        f = self._acquire(key, blocking=False)
+        if f is None:
+            return
+        with f:
+            self._clear_failure(key)
+            os.remove(self._lock_path(key))
+
+    def _sweep_locks(self):
+        """Файлы блокировок и сбоев ключей без опубликованной записи (ключи с mtime и поколением правил копятся)"""
+        keys = set()
+        for entry in os.scandir(self.locks_dir):
+            key, ext = os.path.splitext(entry.name)
+            if ext in (".lock", ".error"):
+                keys.add(key)
+        for key in keys:
+            if not os.path.isdir(self._entry_dir(key)):
+                self._remove_lock(key)
+
+    def _failure_path(self, key: str) -> str:
+        return os.path.join(self.locks_dir, key + ".error")
+
+    def _read_failure(self, key: str, since: float) -> Optional[Dict[str, Any]]:
+        """Сбой построения key не раньше момента since (time.time()) или None"""
+        try:
+            with open(self._failure_path(key), encoding="utf-8") as f:
+                failure = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return failure if failure.get("failed_at", 0) >= since else None
+
+    def _write_failure(self, key: str, error: BaseException):
+        tmp_path = self._failure_path(key) + f".{uuid.uuid4().hex}"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"error": str(error), "type": type(error).__name__, "failed_at": time.time()},
+                          f, ensure_ascii=False)
+            os.replace(tmp_path, self._failure_path(key))
+        except OSError:
+            pass
+
+    def _clear_failure(self, key: str):
+        try:
+            os.remove(self._failure_path(key))
+        except OSError:
+            pass
+
+    @timed("disk_cache.load")
+    def load(self, key: str) -> Optional[CompactRecords]:
+        """Записи пакета из кэша или None (нет записи, другая версия формата, запись вытеснена)"""
+        dirpath = self._entry_dir(key)
+        try:
+            with open(os.path.join(dirpath, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("format") != FORMAT_VERSION:
+                return None
+            items = read_items(dirpath)
+            os.utime(dirpath)  # отметка использования для вытеснения
+            return items
+        except (OSError, ValueError):
+            return None
+
+    @timed("disk_cache.store")
+    def store(self, key: str, name: str, rules_generation: int, items) -> Dict[str, Any]:
+        """
+        Записать пакет во временный каталог и атомарно опубликовать под именем key.
+        Если запись уже опубликована, ничего не делает.
+        """
+        final_dir = self._entry_dir(key)
+        if os.path.isdir(final_dir):
+            return {}
+
+        tmp_dir = os.path.join(self.cache_dir, f".tmp-{key}-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        try:
+            counts = write_items(tmp_dir, items)
+            meta = {
+                "format": FORMAT_VERSION,
+                "batch": name,
+                "rules_generation": rules_generation,
+                **counts,
+                "size": _dir_size(tmp_dir),
+            }
+            with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.rename(tmp_dir, final_dir)
+        except OSError:
+            # Запись опубликовал кто-то другой или не хватило места - кэш необязателен
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return {}
+
+        self.evict()
+        return meta
+
+    def get_or_build(self, key: str, name: str, rules_generation: int,
+                     build: Callable[[], Any]) -> Tuple[CompactRecords, Optional[Dict[str, Any]]]:
+        """
+        Записи пакета из кэша; при промахе строит их ровно один процесс,
+        остальные дожидаются публикации и читают готовую запись.
+
+        Returns:
+            (записи, meta опубликованной записи - если её построил этот вызов, иначе None)
+
+        Raises:
+            BatchBuildError: построение упало в другом процессе, пока этот его ждал
+        """
+        waiting_since = time.time()
+        items = self.load(key)
+        if items is not None:
+            return items, None
+
+        with self._lock(key):
+            items = self.load(key)
+            if items is not None:
+                return items, None
+            failure = self._read_failure(key, waiting_since)
+            if failure is not None:
+                raise BatchBuildError(failure["error"])
+            try:
+                items = CompactRecords.from_items(build())
+            except Exception as e:
+                self._write_failure(key, e)
+                raise
+            self._clear_failure(key)
+            return items, self.store(key, name, rules_generation, items)
+
+    def list_entries(self) -> List[Dict[str, Any]]:
+        """Опубликованные записи: {key, batch, rules_generation, size, last_used}"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir() or entry.name.startswith(".") or entry.name == "locks":
+                continue
+            try:
+                with open(os.path.join(entry.path, "meta.json"), encoding="utf-8") as f:
+                    meta = json.load(f)
+                last_used = entry.stat().st_mtime
+            except (OSError, ValueError):
+                continue
+            entries.append({"key": entry.name, "batch": meta.get("batch"),
+                            "rules_generation": meta.get("rules_generation"),
+                            "size": meta.get("size", 0), "last_used": last_used})
+        return entries
+
+    def evict(self) -> List[str]:
+        """Удалить давно использованные записи, пока суммарный размер больше лимита"""
+        entries = sorted(self.list_entries(), key=lambda e: e["last_used"])
+        total = sum(e["size"] for e in entries)
+        evicted = []
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            # Сначала убираем запись из-под имени (атомарно), потом удаляем файлы.
+            # Процессы, уже отобразившие файлы в память, дочитают их - на Linux удаление им не мешает
+            trash = os.path.join(self.cache_dir, f".del-{entry['key']}-{uuid.uuid4().hex}")
+            try:
+                os.rename(self._entry_dir(entry["key"]), trash)
+            except OSError:
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+            total -= entry["size"]
+            evicted.append(entry["key"])
+        self._sweep_locks()
+        return evicted
+
+    def clear(self):
+        """Удалить все записи (и свободные файлы блокировок)"""
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_dir() and entry.name != "locks":
+                shutil.rmtree(entry.path, ignore_errors=True)
+        self._sweep_locks()
+
+
+def get_batch_disk_cache(instance_path: str, max_bytes: int) -> BatchDiskCache:
+    """Фабрика для получения дискового кэша пакетов (instance/cache)"""
+    return BatchDiskCache(os.path.join(instance_path, "cache"), max_bytes)
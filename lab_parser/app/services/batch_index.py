@@ -0,0 +1,262 @@
+"""
+Битовые индексы пакета для серверной фильтрации записей
+
+Для каждого пакета один раз строятся булевы массивы NumPy (по одному элементу
+на запись): по отделениям, полу и значениям показателей. Фильтры по анализам
+превращаются в побитовые операции над этими массивами.
+"""
+import json
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from .compact_records import CompactRecords
+
+
+class TestFilterError(ValueError):
+    """Некорректное описание фильтра по анализам"""
+
+
+def _to_number(value: Any) -> Optional[float]:
+    """Преобразует сырое значение показателя в число (запятая допускается как разделитель)"""
+    if value is None:
+        return None
+    try:
+        return float(str(value).strip().replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def _to_id(value: Any, field: str, idx: int) -> Optional[int]:
+    """ID анализа/показателя из фильтра (None - не указан)"""
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        raise TestFilterError(f"tests[{idx}]: {field} must be an integer")
+
+
+def parse_test_filters(raw: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Разбирает параметр ?tests=<json> в список фильтров.
+
+    Формат: список объектов вида
+        {"test_definition_id": 10, "rule_id": 45, "values": ["Обнаружено"]}
+        {"rule_id": 44, "min": 1.5, "max": 4}
+
+    Если rule_id не указан, используется ключевой показатель анализа.
+
+    Raises:
+        TestFilterError: если параметр не удаётся разобрать
+    """
+    if not raw:
+        return []
+
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        raise TestFilterError("tests: invalid JSON")
+
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        raise TestFilterError("tests: expected a list of filters")
+
+    filters = []
+    for idx, item in enumerate(data):
+        if not isinstance(item, dict):
+            raise TestFilterError(f"tests[{idx}]: expected an object")
+
+        def_id = _to_id(item.get("test_definition_id"), "test_definition_id", idx)
+        rule_id = _to_id(item.get("rule_id"), "rule_id", idx)
+        if def_id is None and rule_id is None:
+            raise TestFilterError(f"tests[{idx}]: test_definition_id or rule_id is required")
+
+        values = item.get("values")
+        if values is None and "raw_value" in item:
+            values = [item["raw_value"]]
+        if values is not None and not isinstance(values, list):
+            raise TestFilterError(f"tests[{idx}]: values must be a list")
+        if values is not None and not all(isinstance(v, (str, int, float)) for v in values):
+            raise TestFilterError(f"tests[{idx}]: values must be strings or numbers")
+
+        min_value = _to_number(item.get("min")) if item.get("min") is not None else None
+        max_value = _to_number(item.get("max")) if item.get("max") is not None else None
+        if (item.get("min") is not None and min_value is None) or \
+                (item.get("max") is not None and max_value is None):
+            raise TestFilterError(f"tests[{idx}]: min/max must be numbers")
+
+        if values is None and min_value is None and max_value is None:
+            raise TestFilterError(f"tests[{idx}]: values or min/max is required")
+
+        filters.append({
+            "test_definition_id": def_id,
+            "rule_id": rule_id,
+            "values": [str(v) for v in values] if values is not None else None,
+            "min": min_value,
+            "max": max_value,
+        })
+
+    return filters
+
+
+class BatchIndex:
+    """Булевы индексы по записям одного пакета"""
+
+    def __init__(self, items: List[Dict[str, Any]], key_rule_ids: Optional[set] = None):
+        """
+        Args:
+            items: Записи пакета (после применения правил парсинга), лучше CompactRecords
+            key_rule_ids: ID ключевых показателей, для значений которых
+                битовые маски строятся сразу (для остальных - по запросу)
+        """
+        # Индексы строятся по колонкам - без сборки словарей записей
+        records = CompactRecords.from_items(items)
+        self.size = len(records)
+
+        departments: Dict[str, List[int]] = {}
+        genders: Dict[str, List[int]] = {}
+        # rule_id -> {raw_value -> [row, ...]}
+        values: Dict[int, Dict[str, List[int]]] = {}
+        # rule_id -> [(row, number), ...]
+        numbers: Dict[int, List[tuple]] = {}
+        self.rule_definitions: Dict[int, Any] = {}
+
+        for row, dept in enumerate(records.column("department")):
+            if dept:
+                departments.setdefault(dept, []).append(row)
+        for row, gender in enumerate(records.column("gender")):
+            if gender:
+                genders.setdefault(gender, []).append(row)
+
+        for row, rule_id, definition_id, raw_value in zip(
+                records.test_rows().tolist(), records.test_column("rule_id"),
+                records.test_column("test_definition_id"), records.test_column("raw_value")):
+            self.rule_definitions[rule_id] = definition_id
+            if raw_value is None:
+                continue
+            values.setdefault(rule_id, {}).setdefault(str(raw_value), []).append(row)
+            number = _to_number(raw_value)
+            if number is not None:
+                numbers.setdefault(rule_id, []).append((row, number))
+
+        self.departments = {k: self._mask(rows) for k, rows in departments.items()}
+        self.genders = {k: self._mask(rows) for k, rows in genders.items()}
+
+        # Значения показателей храним компактно: номер значения на каждую запись
+        # (-1 - показатель не найден); маски по значениям строятся лениво и кэшируются
+        self._vocab: Dict[int, List[str]] = {}
+        self._codes: Dict[int, np.ndarray] = {}
+        self._value_masks: Dict[int, Dict[str, np.ndarray]] = {}
+        for rule_id, by_value in values.items():
+            vocab = sorted(by_value)
+            codes = np.full(self.size, -1, dtype=np.int32)
+            for code, value in enumerate(vocab):
+                codes[by_value[value]] = code
+            self._vocab[rule_id] = vocab
+            self._codes[rule_id] = codes
+            self._value_masks[rule_id] = {}
+
+        self._numbers: Dict[int, np.ndarray] = {}
+        for rule_id, pairs in numbers.items():
+            arr = np.full(self.size, np.nan, dtype=np.float64)
+            rows, nums = zip(*pairs)
+            arr[list(rows)] = nums
+            self._numbers[rule_id] = arr
+
+        for rule_id in key_rule_ids or ():
+            for value in self._vocab.get(rule_id, []):
+                self.value_mask(rule_id, value)
+
+    def _mask(self, rows: List[int]) -> np.ndarray:
+        mask = np.zeros(self.size, dtype=bool)
+        mask[rows] = True
+        return mask
+
+    def all(self) -> np.ndarray:
+        return np.ones(self.size, dtype=bool)
+
+    def none(self) -> np.ndarray:
+        return np.zeros(self.size, dtype=bool)
+
+    def values_for(self, rule_id: int) -> List[str]:
+        """Все различные сырые значения показателя в пакете (отсортированы)"""
+        return list(self._vocab.get(rule_id, []))
+
+    def value_mask(self, rule_id: int, value: str) -> np.ndarray:
+        """Маска записей, где показатель rule_id имеет сырое значение value"""
+        cache = self._value_masks.get(rule_id)
+        if cache is None:
+            return self.none()
+        mask = cache.get(value)
+        if mask is None:
+            vocab = self._vocab[rule_id]
+            try:
+                code = vocab.index(value)
+            except ValueError:
+                return self.none()
+            mask = self._codes[rule_id] == code
+            cache[value] = mask
+        return mask
+
+    def value_counts(self, rule_id: int) -> Dict[str, int]:
+        """Количество записей для каждого значения показателя"""
+        codes = self._codes.get(rule_id)
+        if codes is None:
+            return {}
+        counts = np.bincount(codes[codes >= 0], minlength=len(self._vocab[rule_id]))
+        return {value: int(counts[code]) for code, value in enumerate(self._vocab[rule_id])}
+
+    def range_mask(self, rule_id: int, min_value: Optional[float], max_value: Optional[float]) -> np.ndarray:
+        """Маска записей, где числовое значение показателя попадает в [min, max]"""
+        arr = self._numbers.get(rule_id)
+        if arr is None:
+            return self.none()
+        mask = ~np.isnan(arr)
+        if min_value is not None:
+            mask &= arr >= min_value
+        if max_value is not None:
+            mask &= arr <= max_value
+        return mask
+
+    def test_filter_mask(self, flt: Dict[str, Any]) -> np.ndarray:
+        """Маска для одного фильтра по анализу (rule_id уже должен быть определён)"""
+        rule_id = flt["rule_id"]
+        def_id = flt.get("test_definition_id")
+        if def_id is not None and self.rule_definitions.get(rule_id, def_id) != def_id:
+            return self.none()
+
+        mask = None
+        if flt.get("values") is not None:
+            mask = self.none()
+            for value in flt["values"]:
+                mask = mask | self.value_mask(rule_id, value)
+        if flt.get("min") is not None or flt.get("max") is not None:
+            range_mask = self.range_mask(rule_id, flt.get("min"), flt.get("max"))
+            mask = range_mask if mask is None else (mask & range_mask)
+        return mask if mask is not None else self.none()
+
+    def select(self, gender: Optional[str] = None, department: Optional[str] = None,
+               tests: Optional[List[Dict[str, Any]]] = None, tests_op: str = "and") -> np.ndarray:
+        """
+        Комбинирует фильтры в итоговую маску записей.
+
+        Пол и отделение всегда объединяются по И; фильтры по анализам
+        между собой - по И или ИЛИ (tests_op), затем по И с остальными.
+        """
+        mask = self.all()
+        if gender:
+            mask &= self.genders.get(gender, self.none())
+        if department:
+            mask &= self.departments.get(department, self.none())
+
+        if tests:
+            masks = [self.test_filter_mask(flt) for flt in tests]
+            if tests_op == "or":
+                combined = np.logical_or.reduce(masks)
+            else:
+                combined = np.logical_and.reduce(masks)
+            mask &= combined
+
+        return mask
@@ -0,0 +1,347 @@
+"""
+Приём файлов в каталог загрузок, регистрация пакетов в каталоге
+и сверка каталога с каталогом загрузок
+"""
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Any, Iterator, Optional
+
+from ..models.batch_catalog import BatchCatalogDB, get_batch_catalog
+from ..utils.io_utils import (
+    list_uploaded_files, batch_timestamp, file_sha256, link_or_copy, safe_filename_unicode
+)
+from .parse_excel import detect_source_format, _detect_header_row, _is_header_row
+from .archive import get_batch_archive
+
+try:
+    import fcntl
+except ImportError:  # Windows: без межпроцессной блокировки регистрации
+    fcntl = None
+
+
+def _xlsx_rows(path: str) -> Iterator[tuple]:
+    """Строки первого листа .xlsx (openpyxl read-only: лист читается потоком)"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from wb.worksheets[0].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def _xls_cell_value(cell, datemode: int) -> Any:
+    """Значение ячейки xlrd так же, как его отдаёт pandas.read_excel"""
+    import xlrd
+
+    if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+        return None
+    if cell.ctype == xlrd.XL_CELL_BOOLEAN:
+        return bool(cell.value)
+    if cell.ctype == xlrd.XL_CELL_DATE:
+        value = xlrd.xldate.xldate_as_datetime(cell.value, datemode)
+        return value.time() if cell.value < 1 else value
+    if cell.ctype == xlrd.XL_CELL_NUMBER and cell.value == int(cell.value):
+        return int(cell.value)
+    return cell.value
+
+
+def _xls_rows(path: str) -> Iterator[list]:
+    """Строки первого листа .xls (xlrd, листы загружаются по требованию)"""
+    import xlrd
+
+    book = xlrd.open_workbook(path, on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        for i in range(sheet.nrows):
+            yield [_xls_cell_value(cell, book.datemode) for cell in sheet.row(i)]
+    finally:
+        book.release_resources()
+
+
+def _html_rows(path: str) -> Iterator[list]:
+    """Строки HTML-таблицы (первая строка - заголовки из <thead>, как у pandas.read_html)"""
+    import pandas as pd
+
+    tables = pd.read_html(path, encoding='utf-8')
+    if not tables:
+        raise ValueError("HTML файл не содержит таблиц")
+    df = tables[0].astype(object).where(tables[0].notna(), None)
+    yield [str(c) for c in df.columns]
+    yield from df.itertuples(index=False, name=None)
+
+
+def _source_rows(path: str, source_format: str) -> Iterator:
+    if source_format == 'html':
+        return _html_rows(path)
+    if source_format == 'xls':
+        return _xls_rows(path)
+    return _xlsx_rows(path)
+
+
+def xlsx_header_row(path: str) -> Optional[int]:
+    """
+    Смещение строки заголовков настоящего .xlsx по первым двум строкам
+    (None - файл не читается как .xlsx или заголовки не найдены)
+    """
+    rows = _xlsx_rows(path)
+    try:
+        for i, row in enumerate(islice(rows, 2)):
+            if _is_header_row(row):
+                return i
+    except Exception:
+        return None
+    finally:
+        rows.close()
+    return None
+
+
+class ConversionError(ValueError):
+    """Принятый файл не читается как журнал .xlsx/.xls/HTML (ошибка во входных данных, не сервера)"""
+
+
+def convert_to_xlsx(source_path: str, dest_path: str) -> Optional[int]:
+    """
+    Конвертирует файл любого поддерживаемого формата в настоящий .xlsx
+
+    Поддерживает:
+    - .xlsx файлы (пересохраняет первый лист)
+    - .xls файлы (конвертирует в .xlsx)
+    - HTML-файлы с расширением .xls/.xlsx (парсит и сохраняет как .xlsx)
+
+    Строки копируются из читателя исходного формата прямо в write-only книгу
+    openpyxl, без DataFrame: память не растёт с числом строк (кроме HTML -
+    таблицу целиком разбирает pandas.read_html). Расположение строк сохраняется,
+    поэтому строка заголовков остаётся на том же месте.
+
+    Returns:
+        Смещение строки заголовков (0 или 1, см. _detect_header_row) или None, если не найдена
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    header_row = None
+
+    rows = _source_rows(source_path, detect_source_format(source_path))
+    try:
+        for i, row in enumerate(rows):
+            if i < 2 and header_row is None and _is_header_row(row):
+                header_row = i
+            # Управляющие символы из .xls/HTML openpyxl записать не даст
+            ws.append([ILLEGAL_CHARACTERS_RE.sub("", v) if isinstance(v, str) else v for v in row])
+    finally:
+        rows.close()
+
+    wb.save(dest_path)
+    return header_row
+
+
+def batch_file_name(uploads_dir: str, original_name: str) -> str:
+    """
+    Имя файла пакета: безопасное исходное имя + метка времени, всегда .xlsx.
+    Если такое имя уже занято (два файла в одну секунду), к имени добавляется номер.
+    """
+    name, _ = os.path.splitext(safe_filename_unicode(original_name))  # Игнорируем исходное расширение
+    ts = time.strftime("%Y%m%d-%H%M%S")
+    final_name = f"{name}__{ts}.xlsx"
+    n = 1
+    while os.path.exists(os.path.join(uploads_dir, final_name)):
+        final_name = f"{name}-{n}__{ts}.xlsx"
+        n += 1
+    return final_name
+
+
+@contextmanager
+def _store_lock(uploads_dir: str):
+    """
+    Эксклюзивная блокировка регистрации в каталоге загрузок (между потоками и процессами):
+    проверка дубликата, выбор имени и запись в каталог идут одним шагом
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(uploads_dir, ".store.lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _store_duplicate(catalog: BatchCatalogDB, uploads_dir: str, content_hash: str,
+                     original_name: str) -> Optional[Dict[str, Any]]:
+    """Зарегистрировать псевдоним, если такое содержимое уже есть (вызывается под _store_lock)"""
+    existing = catalog.find_by_hash(content_hash)
+    if not existing or not os.path.isfile(os.path.join(uploads_dir, existing["name"])):
+        return None
+    final_name = batch_file_name(uploads_dir, original_name)
+    dest_path = os.path.join(uploads_dir, final_name)
+    link_or_copy(os.path.join(uploads_dir, existing["name"]), dest_path)
+    catalog.add_alias(
+        final_name,
+        existing,
+        mtime_ns=os.stat(dest_path).st_mtime_ns,
+        uploaded_at=datetime.now().isoformat(timespec="seconds"),
+        original_name=original_name
+    )
+    return {"name": final_name, "duplicate_of": existing["name"]}
+
+
+def store_upload(catalog: BatchCatalogDB, uploads_dir: str, temp_path: str, original_name: str,
+                 content_hash: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Принять сохранённый во временный файл журнал в каталог загрузок.
+
+    Повторная загрузка того же содержимого регистрируется псевдонимом готового
+    пакета (без конвертации и парсинга), иначе файл конвертируется в .xlsx
+    (настоящий .xlsx с распознанными заголовками переносится как есть)
+    и регистрируется вместе со смещением заголовков. Временный файл удаляется
+    во всех случаях.
+
+    Одновременные загрузки (потоки сервера, процессы демона приёма) не регистрируют
+    одно содержимое дважды и не получают одно имя: проверка дубликата, выбор имени
+    и регистрация идут под _store_lock; долгая конвертация - вне блокировки.
+
+    content_hash - SHA-256 принятого файла, если он уже посчитан при приёме.
+    В каталог хеш пишется по хранимому файлу (как его посчитает и сверка при
+    старте); у сконвертированного файла хеш принятого хранится отдельно
+    (source_hash) - по нему повторная загрузка находится без конвертации.
+
+    Returns:
+        {"name": имя пакета, "duplicate_of": имя основного пакета или None}
+
+    Raises:
+        ConversionError: файл не удалось прочитать ни в одном поддерживаемом формате
+    """
+    if content_hash is None:
+        content_hash = file_sha256(temp_path)
+
+    with _store_lock(uploads_dir):
+        duplicate = _store_duplicate(catalog, uploads_dir, content_hash, original_name)
+    if duplicate:
+        os.remove(temp_path)
+        return duplicate
+
+    source_format = detect_source_format(temp_path)
+    header_row = xlsx_header_row(temp_path) if source_format == 'xlsx' else None
+
+    if header_row is not None:
+        # Настоящий .xlsx с распознанными заголовками - переносим как есть, без пересохранения
+        staged_path = temp_path
+        stored_hash, source_hash = content_hash, None
+    else:
+        # Конвертируем в настоящий .xlsx (имя temp_* - в каталог при сверке не попадёт)
+        staged_path = temp_path + ".converted.xlsx"
+        try:
+            header_row = convert_to_xlsx(temp_path, staged_path)
+        except Exception as e:
+            if os.path.exists(staged_path):
+                os.remove(staged_path)
+            # Нехватка места, нет lxml и т.п. - ошибка сервера; остальное - повреждённый или чужой файл
+            if isinstance(e, (OSError, ImportError, MemoryError)):
+                raise
+            raise ConversionError(f"file is not a readable .xlsx/.xls journal: {e}") from e
+        finally:
+            # Удаляем временный файл
+            os.remove(temp_path)
+        stored_hash, source_hash = file_sha256(staged_path), content_hash
+
+    with _store_lock(uploads_dir):
+        # Пока шла конвертация, то же содержимое могли принять параллельно
+        duplicate = _store_duplicate(catalog, uploads_dir, content_hash, original_name)
+        if duplicate:
+            os.remove(staged_path)
+            return duplicate
+
+        final_name = batch_file_name(uploads_dir, original_name)
+        dest_path = os.path.join(uploads_dir, final_name)
+        os.replace(staged_path, dest_path)
+        register_batch(
+            catalog,
+            dest_path,
+            original_name=original_name,
+            content_hash=stored_hash,
+            source_format=source_format,
+            header_row=header_row,
+            source_hash=source_hash
+        )
+    return {"name": final_name, "duplicate_of": None}
+
+
+def register_batch(catalog: BatchCatalogDB, path: str, original_name: Optional[str] = None,
+                   content_hash: Optional[str] = None, source_format: Optional[str] = None,
+                   header_row: Optional[int] = None, source_hash: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Зарегистрировать файл из instance/uploads в каталоге.
+
+    content_hash - SHA-256 самого файла path (если не передан, считается здесь);
+    source_hash - SHA-256 принятого файла, из которого path сконвертирован.
+
+    Заодно один раз определяется строка заголовков (если её не передали -
+    store_upload знает её после конвертации), чтобы при чтении пакета её
+    не приходилось определять повторно.
+    """
+    name = os.path.basename(path)
+    st = os.stat(path)
+
+    if header_row is None:
+        try:
+            header_row = _detect_header_row(path)
+        except ValueError:
+            # Формат не распознан - ошибка будет показана при открытии таблицы
+            header_row = None
+
+    catalog.add_batch(
+        name=name,
+        size=st.st_size,
+        mtime_ns=st.st_mtime_ns,
+        uploaded_at=batch_timestamp(name, st.st_mtime).isoformat(timespec="seconds"),
+        original_name=original_name,
+        content_hash=content_hash if content_hash else file_sha256(path),
+        source_format=source_format if source_format else detect_source_format(path),
+        header_row=header_row,
+        source_hash=source_hash,
+    )
+    return catalog.get_batch(name)
+
+
+def sync_catalog_with_uploads(instance_path: str, uploads_subdir: str) -> Dict[str, int]:
+    """
+    Сверка каталога с файлами на диске (при старте приложения):
+    файлы, загруженные до появления каталога, регистрируются,
+    записи об удалённых файлах убираются - кроме пакетов, чьи данные
+    в архиве (исходный файл удалён по сроку хранения, services.archive).
+
+    Изменившиеся файлы регистрируются заново с хешем хранимого файла - как
+    при загрузке. Псевдонимы остаются псевдонимами, если их содержимое
+    по-прежнему совпадает с основным пакетом, поэтому они сверяются после
+    основных пакетов (жёсткая ссылка меняется вместе с основным файлом).
+    """
+    catalog = get_batch_catalog(instance_path)
+    archived = {entry["name"] for entry in get_batch_archive(instance_path).entries()}
+    known = {b["name"]: b for b in catalog.list_batches()}
+    stats = {"added": 0, "removed": 0}
+
+    files = list_uploaded_files(instance_path, uploads_subdir)
+    files.sort(key=lambda f: bool(known.get(f["name"], {}).get("alias_of")))
+
+    on_disk = set()
+    for f in files:
+        on_disk.add(f["name"])
+        entry = known.get(f["name"])
+        if entry and entry["mtime_ns"] == os.stat(f["path"]).st_mtime_ns:
+            continue
+        register_batch(catalog, f["path"], original_name=entry["original_name"] if entry else None)
+        stats["added"] += 1
+
+    for name, entry in known.items():
+        if name not in on_disk and (entry["alias_of"] or name) not in archived:
+            catalog.delete_batch(name)
+            stats["removed"] += 1
+
+    return stats
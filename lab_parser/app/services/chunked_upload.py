@@ -0,0 +1,285 @@
+"""
+Загрузка больших журналов порциями с продолжением после обрыва (instance/upload_sessions)
+
+Форма /upload упирается в MAX_CONTENT_LENGTH (тело multipart целиком), а на
+медленной больничной сети оборванная загрузка начинается заново. Здесь файл
+передаётся порциями:
+
+    POST /api/uploads                     {filename, size}      -> {upload_id, offset: 0, chunk_size}
+    PUT  /api/uploads/<id>?offset=<N>     тело - байты порции   -> {offset}
+    GET  /api/uploads/<id>                                      -> {offset, size, chunk_size, ...}
+    POST /api/uploads/<id>/finalize       {sha256?}             -> {name, duplicate_of, sha256}
+
+* Порция пишется прямо в файл сессии блоками (память не растёт с размером файла).
+  Подтверждённое смещение хранится в <id>.json и меняется только после того,
+  как порция дописана и сброшена на диск; перед записью файл обрезается до
+  него - хвост оборванной порции не остаётся.
+* Порция с чужим смещением (повтор уже принятой, пропуск) отклоняется с текущим
+  смещением - клиент продолжает с него (GET /api/uploads/<id> после переподключения).
+* SHA-256 считается по ходу записи. Состояние хеша нельзя сохранить на диск,
+  поэтому оно живёт в памяти процесса; если порция пришла в другой воркер
+  или после перезапуска, хеш досчитывается по уже записанной части файла.
+* Одновременная запись в одну сессию исключена flock на файле данных.
+* finalize передаёт файл в services.batches.store_upload - дальше всё как у формы:
+  дедупликация по хешу, конвертация в .xlsx, регистрация в каталоге.
+* Брошенные сессии старше UPLOAD_SESSION_TTL_HOURS удаляются при создании новых.
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple
+
+from ..models.batch_catalog import BatchCatalogDB
+from ..utils.io_utils import safe_filename_unicode
+from .batches import store_upload
+from .metrics import phase
+
+try:
+    import fcntl
+except ImportError:  # Windows: без межпроцессной блокировки сессии
+    fcntl = None
+
+# Размер блока чтения тела запроса и досчёта хеша
+_BLOCK_SIZE = 1024 * 1024
+
+
+class UploadError(ValueError):
+    """Неверный запрос к сессии загрузки"""
+
+
+class UploadNotFound(UploadError):
+    """Сессии нет (не создавалась, завершена или удалена как брошенная)"""
+
+
+class UploadOffsetMismatch(UploadError):
+    """Порция не с подтверждённого смещения - клиент должен продолжить с offset"""
+
+    def __init__(self, message: str, offset: int):
+        super().__init__(message)
+        self.offset = offset
+
+
+# upload_id -> (смещение, sha256 до этого смещения) в этом процессе
+_hashers: Dict[str, Tuple[int, Any]] = {}
+_hashers_lock = threading.Lock()
+
+
+class UploadSessions:
+    """Сессии порционной загрузки: <id>.part - данные, <id>.json - состояние"""
+
+    def __init__(self, sessions_dir: str, max_bytes: int, ttl_seconds: float):
+        self.sessions_dir = sessions_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(sessions_dir, exist_ok=True)
+
+    def _paths(self, upload_id: str) -> Tuple[str, str]:
+        # id - только hex из uuid4: путь не выходит за пределы каталога сессий
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            raise UploadNotFound("upload not found")
+        base = os.path.join(self.sessions_dir, upload_id)
+        return base + ".part", base + ".json"
+
+    def _read_state(self, upload_id: str) -> Dict[str, Any]:
+        _, meta_path = self._paths(upload_id)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadNotFound("upload not found") from None
+
+    def _write_state(self, state: Dict[str, Any]) -> None:
+        # Атомарно: подтверждённое смещение не может оказаться записанным наполовину
+        _, meta_path = self._paths(state["upload_id"])
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, meta_path)
+
+    @contextmanager
+    def _locked(self, upload_id: str):
+        """Открытый файл данных сессии под эксклюзивной блокировкой"""
+        part_path, _ = self._paths(upload_id)
+        try:
+            f = open(part_path, "r+b")
+        except FileNotFoundError:
+            raise UploadNotFound("upload not found") from None
+        with f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield f
+
+    @staticmethod
+    def _public(state: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: state[key] for key in ("upload_id", "filename", "size", "offset", "created_at", "updated_at")}
+
+    # ===== Сессии =====
+
+    def create(self, filename: str, size: Optional[int] = None) -> Dict[str, Any]:
+        """Новая сессия загрузки файла filename (size - ожидаемый размер, если известен)"""
+        if size is not None:
+            if size < 0:
+                raise UploadError("size must be non-negative")
+            if size > self.max_bytes:
+                raise UploadError(f"file is too large (max {self.max_bytes} bytes)")
+
+        self.cleanup()
+        upload_id = uuid.uuid4().hex
+        part_path, _ = self._paths(upload_id)
+        open(part_path, "wb").close()
+        now = time.time()
+        state = {
+            "upload_id": upload_id,
+            "filename": filename,
+            "size": size,
+            "offset": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self._write_state(state)
+        return self._public(state)
+
+    def get(self, upload_id: str) -> Dict[str, Any]:
+        """Состояние сессии: подтверждённое смещение - с него продолжать загрузку"""
+        return self._public(self._read_state(upload_id))
+
+    def delete(self, upload_id: str) -> None:
+        for path in self._paths(upload_id):
+            if os.path.exists(path):
+                os.remove(path)
+        with _hashers_lock:
+            _hashers.pop(upload_id, None)
+
+    def cleanup(self) -> int:
+        """Удалить сессии, не обновлявшиеся дольше ttl_seconds"""
+        removed = 0
+        deadline = time.time() - self.ttl_seconds
+        for name in os.listdir(self.sessions_dir):
+            upload_id, ext = os.path.splitext(name)
+            if ext != ".part":
+                continue
+            path = os.path.join(self.sessions_dir, name)
+            try:
+                if os.stat(path).st_mtime < deadline:
+                    self.delete(upload_id)
+                    removed += 1
+            except (OSError, UploadError):
+                continue
+        return removed
+
+    # ===== Порции =====
+
+    def _hasher_at(self, upload_id: str, f, offset: int):
+        """sha256 первых offset байт файла: из памяти процесса или досчитанный по файлу"""
+        with _hashers_lock:
+            cached = _hashers.get(upload_id)
+        if cached is not None and cached[0] == offset:
+            return cached[1].copy()
+
+        h = hashlib.sha256()
+        f.seek(0)
+        remaining = offset
+        while remaining > 0:
+            block = f.read(min(_BLOCK_SIZE, remaining))
+            if not block:
+                raise UploadError("upload data is shorter than the confirmed offset")
+            h.update(block)
+            remaining -= len(block)
+        return h
+
+    def write_chunk(self, upload_id: str, offset: int, stream, length: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Дописать порцию из потока stream с позиции offset
+
+        Args:
+            upload_id: Сессия
+            offset: Смещение порции - должно совпадать с подтверждённым
+            stream: Поток тела запроса (читается блоками)
+            length: Длина порции (Content-Length), если известна
+
+        Returns:
+            Состояние сессии с новым подтверждённым смещением
+        """
+        with self._locked(upload_id) as f:
+            state = self._read_state(upload_id)
+            if offset != state["offset"]:
+                raise UploadOffsetMismatch("offset does not match the confirmed offset", state["offset"])
+
+            # Хвост оборванной порции (если был) отбрасывается
+            f.truncate(offset)
+            h = self._hasher_at(upload_id, f, offset)
+            f.seek(offset)
+
+            written = 0
+            with phase("upload.chunk"):
+                while True:
+                    block = stream.read(_BLOCK_SIZE)
+                    if not block:
+                        break
+                    written += len(block)
+                    if offset + written > self.max_bytes or (
+                            state["size"] is not None and offset + written > state["size"]):
+                        f.truncate(offset)
+                        raise UploadError("chunk exceeds the declared file size")
+                    h.update(block)
+                    f.write(block)
+                f.flush()
+                os.fsync(f.fileno())
+
+            if length is not None and written != length:
+                # Соединение оборвалось посреди порции - смещение не подтверждаем
+                f.truncate(offset)
+                raise UploadError(f"incomplete chunk: got {written} of {length} bytes")
+
+            state["offset"] = offset + written
+            state["updated_at"] = time.time()
+            self._write_state(state)
+            with _hashers_lock:
+                _hashers[upload_id] = (state["offset"], h)
+            return self._public(state)
+
+    def finalize(self, upload_id: str, catalog: BatchCatalogDB, uploads_dir: str,
+                 sha256: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Завершить загрузку: проверить размер и хеш и передать файл в store_upload
+
+        Returns:
+            {"name", "duplicate_of", "sha256", "size"}
+        """
+        with self._locked(upload_id) as f:
+            state = self._read_state(upload_id)
+            offset = state["offset"]
+            if state["size"] is not None and offset != state["size"]:
+                raise UploadOffsetMismatch(f"upload is incomplete: {offset} of {state['size']} bytes", offset)
+            if offset == 0:
+                raise UploadError("upload is empty")
+
+            f.truncate(offset)
+            content_hash = self._hasher_at(upload_id, f, offset).hexdigest()
+            if sha256 and sha256.lower() != content_hash:
+                raise UploadError("sha256 does not match the uploaded data")
+
+            # Временный файл в каталоге загрузок - как у формы (temp_* не попадают в каталог)
+            part_path, _ = self._paths(upload_id)
+            temp_path = os.path.join(uploads_dir, f"temp_{upload_id}_{safe_filename_unicode(state['filename'])}")
+            os.replace(part_path, temp_path)
+
+        try:
+            with phase("upload.store"):
+                stored = store_upload(catalog, uploads_dir, temp_path, state["filename"], content_hash)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            self.delete(upload_id)
+        return {**stored, "sha256": content_hash, "size": offset}
+
+
+def get_upload_sessions(instance_path: str, max_bytes: int, ttl_hours: float) -> UploadSessions:
+    """Фабрика для получения сессий порционной загрузки (instance/upload_sessions)"""
+    return UploadSessions(os.path.join(instance_path, "upload_sessions"), max_bytes, ttl_hours * 3600)
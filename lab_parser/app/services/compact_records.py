@@ -0,0 +1,278 @@
+"""
+Компактное колоночное представление записей пакета
+
+Запись из read_basic_records - это вложенные словари: сама запись, patient,
+results и словарь на каждый тест с повторяющимися ключами. На больших пакетах
+это десятки объектов на строку: память кэша и нагрузка на сборщик мусора.
+
+CompactRecords хранит те же данные колонками:
+* целые - массивы NumPy int64 + маска пропусков;
+* повторяющиеся строки (отделение, пол, имя, значения тестов...) - коды int32
+  в словарь уникальных строк (каждая строка хранится один раз);
+* уникальные строки (фамилия, образец, текст результатов) - список строк;
+* тесты всех записей - одна плоская таблица, test_offsets - границы по записям.
+
+Словари в прежнем виде (как их отдаёт /api/records) собираются только при
+сериализации: take(индексы) для страницы, итерация - порциями.
+Те же колонки и виды хранения использует дисковый кэш (services.batch_cache).
+"""
+import sys
+from typing import List, Dict, Any, Optional, Iterator, Sequence
+
+import numpy as np
+
+# (колонка, вид хранения) - поля записи из read_basic_records / ResultsParser
+ROW_COLUMNS = [
+    ("row_id", "int"),
+    ("last_name", "text"),
+    ("first_name", "dict"),
+    ("middle_name", "dict"),
+    ("gender", "dict"),
+    ("birth_date", "dict"),
+    ("age_years", "int"),
+    ("sample_id", "text"),
+    ("department", "dict"),
+    ("summary", "text"),
+    ("raw_text", "text"),
+    ("parse_quality", "dict"),
+]
+
+TEST_COLUMNS = [
+    ("name", "dict"),
+    ("value", "dict"),
+    ("raw_value", "dict"),
+    ("value_type", "int"),
+    ("rule_id", "int"),
+    ("test_definition_id", "int"),
+    ("is_key_indicator", "int"),
+    ("is_required", "int"),
+]
+
+PATIENT_FIELDS = ("last_name", "first_name", "middle_name", "gender", "birth_date", "age_years")
+
+# Сколько записей собирать в словари за раз при итерации
+ITER_CHUNK = 2048
+
+
+class IntColumn:
+    """Целые с пропусками"""
+
+    def __init__(self, values: np.ndarray, nulls: np.ndarray):
+        self.values = values
+        self.nulls = nulls
+
+    @classmethod
+    def encode(cls, values: List[Optional[int]]) -> "IntColumn":
+        n = len(values)
+        return cls(np.fromiter((0 if v is None else int(v) for v in values), dtype=np.int64, count=n),
+                   np.fromiter((v is None for v in values), dtype=bool, count=n))
+
+    def take(self, idx: np.ndarray) -> List[Optional[int]]:
+        values = self.values[idx].tolist()
+        if not self.nulls.any():
+            return values
+        return [None if n else v for v, n in zip(values, self.nulls[idx].tolist())]
+
+    def tolist(self) -> List[Optional[int]]:
+        return self.take(slice(None))
+
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.nulls.nbytes
+
+
+class TextColumn:
+    """Почти уникальные строки - обычный список"""
+
+    def __init__(self, values: List[Optional[str]]):
+        self.values = values
+
+    @classmethod
+    def encode(cls, values: List[Optional[str]]) -> "TextColumn":
+        return cls(list(values))
+
+    def take(self, idx: np.ndarray) -> List[Optional[str]]:
+        values = self.values
+        return [values[i] for i in idx.tolist()]
+
+    def tolist(self) -> List[Optional[str]]:
+        return list(self.values)
+
+    def nbytes(self) -> int:
+        return _list_nbytes(self.values)
+
+
+class DictColumn:
+    """Повторяющиеся строки - коды в словарь (-1 = None)"""
+
+    def __init__(self, codes: np.ndarray, vocab: List[str]):
+        self.codes = codes
+        self.vocab = vocab
+
+    @classmethod
+    def encode(cls, values: List[Optional[str]]) -> "DictColumn":
+        lookup: Dict[str, int] = {}
+        codes = np.fromiter((-1 if v is None else lookup.setdefault(v, len(lookup)) for v in values),
+                            dtype=np.int32, count=len(values))
+        return cls(codes, list(lookup))
+
+    def take(self, idx: np.ndarray) -> List[Optional[str]]:
+        vocab = self.vocab
+        return [None if c < 0 else vocab[c] for c in self.codes[idx].tolist()]
+
+    def tolist(self) -> List[Optional[str]]:
+        return self.take(slice(None))
+
+    def nbytes(self) -> int:
+        return self.codes.nbytes + _list_nbytes(self.vocab)
+
+
+COLUMN_TYPES = {"int": IntColumn, "text": TextColumn, "dict": DictColumn}
+
+
+def _list_nbytes(values: List[Optional[str]]) -> int:
+    return sys.getsizeof(values) + sum(sys.getsizeof(v) for v in values if v is not None)
+
+
+class CompactRecords(Sequence):
+    """Записи пакета в колонках; элементы - словари прежнего вида, собираемые по требованию"""
+
+    def __init__(self, rows: Dict[str, Any], tests: Dict[str, Any], test_offsets: np.ndarray):
+        self.rows = rows
+        self.tests = tests
+        self.test_offsets = test_offsets
+
+    @classmethod
+    def from_items(cls, items: List[Dict[str, Any]]) -> "CompactRecords":
+        """Упаковать записи (результат read_basic_records / read_records_with_parsing)"""
+        if isinstance(items, CompactRecords):
+            return items
+        rows: Dict[str, List[Any]] = {col: [] for col, _ in ROW_COLUMNS}
+        tests: Dict[str, List[Any]] = {col: [] for col, _ in TEST_COLUMNS}
+        test_offsets = [0]
+
+        for item in items:
+            patient = item.get("patient") or {}
+            results = item.get("results") or {}
+            rows["row_id"].append(item.get("row_id"))
+            for col in PATIENT_FIELDS:
+                rows[col].append(patient.get(col))
+            rows["sample_id"].append(item.get("sample_id"))
+            rows["department"].append(item.get("department"))
+            for col in ("summary", "raw_text", "parse_quality"):
+                rows[col].append(results.get(col))
+
+            for test in results.get("tests", []):
+                for col, _ in TEST_COLUMNS:
+                    tests[col].append(test.get(col))
+            test_offsets.append(len(tests["name"]))
+
+        return cls(
+            {col: COLUMN_TYPES[kind].encode(rows[col]) for col, kind in ROW_COLUMNS},
+            {col: COLUMN_TYPES[kind].encode(tests[col]) for col, kind in TEST_COLUMNS},
+            np.asarray(test_offsets, dtype=np.int64),
+        )
+
+    # ===== Доступ как к списку словарей =====
+
+    def __len__(self) -> int:
+        return len(self.test_offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(np.arange(len(self))[index])
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("record index out of range")
+        return self.take(np.array([index]))[0]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for start in range(0, len(self), ITER_CHUNK):
+            yield from self.take(np.arange(start, min(start + ITER_CHUNK, len(self))))
+
+    def take(self, row_ids) -> List[Dict[str, Any]]:
+        """Собрать словари записей с данными индексами (порядок сохраняется)"""
+        rows, tests, bounds = self.take_columns(row_ids)
+
+        test_dicts = [
+            {
+                "name": name,
+                "value": value,
+                "raw_value": raw_value,
+                "value_type": value_type,
+                "rule_id": rule_id,
+                "test_definition_id": definition_id,
+                "is_key_indicator": is_key,
+                "is_required": is_required,
+            }
+            for name, value, raw_value, value_type, rule_id, definition_id, is_key, is_required in zip(
+                tests["name"], tests["value"], tests["raw_value"], tests["value_type"], tests["rule_id"],
+                tests["test_definition_id"], tests["is_key_indicator"], tests["is_required"])
+        ]
+
+        items = []
+        for i, row_id in enumerate(rows["row_id"]):
+            row_tests = test_dicts[bounds[i]:bounds[i + 1]]
+            quality = rows["parse_quality"][i]
+            # Порядок ключей - как у ResultsParser / read_basic_records
+            if quality in ("parsed", "unparsed"):
+                results = {
+                    "tests": row_tests,
+                    "summary": rows["summary"][i],
+                    "raw_text": rows["raw_text"][i],
+                    "parse_quality": quality,
+                    "matched_rules": [t["rule_id"] for t in row_tests],
+                }
+            elif quality == "none":
+                results = {"tests": row_tests, "summary": rows["summary"][i],
+                           "raw_text": rows["raw_text"][i], "parse_quality": quality}
+            else:
+                results = {"summary": rows["summary"][i], "tests": row_tests,
+                           "raw_text": rows["raw_text"][i], "parse_quality": quality}
+
+            items.append({
+                "id": row_id,
+                "row_id": row_id,
+                "patient": {col: rows[col][i] for col in PATIENT_FIELDS},
+                "sample_id": rows["sample_id"][i],
+                "department": rows["department"][i],
+                "results": results,
+            })
+        return items
+
+    # ===== Колоночный доступ (индексы, метаданные пакета, выгрузка) =====
+
+    def take_columns(self, row_ids, row_columns=None, test_columns=None):
+        """
+        Поля записей с данными индексами и их тестов - колонками, без сборки словарей.
+        bounds[i]:bounds[i + 1] - тесты i-й выбранной записи в колонках тестов.
+        """
+        idx = np.asarray(row_ids, dtype=np.int64)
+        starts = self.test_offsets[idx]
+        counts = self.test_offsets[idx + 1] - starts
+        # Индексы тестов выбранных записей подряд: start_k, start_k + 1, ... для каждой записи
+        ends = np.cumsum(counts)
+        test_idx = np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - (ends - counts), counts)
+        bounds = [0] + ends.tolist()
+
+        rows = {col: self.rows[col].take(idx) for col in (row_columns or self.rows)}
+        tests = {col: self.tests[col].take(test_idx) for col in (test_columns or self.tests)}
+        return rows, tests, bounds
+
+    def column(self, name: str) -> List[Any]:
+        """Значения поля записи (row_id, department, gender, ...) по всем записям"""
+        return self.rows[name].tolist()
+
+    def test_column(self, name: str) -> List[Any]:
+        """Значения поля теста по всем тестам всех записей (в порядке записей)"""
+        return self.tests[name].tolist()
+
+    def test_rows(self) -> np.ndarray:
+        """Номер записи для каждого теста"""
+        return np.repeat(np.arange(len(self)), np.diff(self.test_offsets))
+
+    def nbytes(self) -> int:
+        """Оценка занимаемой памяти (массивы + строки), байт"""
+        columns = list(self.rows.values()) + list(self.tests.values())
+        return sum(c.nbytes() for c in columns) + self.test_offsets.nbytes
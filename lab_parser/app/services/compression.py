@@ -0,0 +1,127 @@
+"""
+Сжатие ответов по Accept-Encoding (gzip, brotli)
+
+JSON пакетов и страницы хорошо сжимаются (повторяющиеся ключи и значения),
+а передаются без сжатия, если перед приложением нет прокси, который это делает.
+
+* Кодировка выбирается по Accept-Encoding с учётом q; brotli - если установлен
+  пакет brotli (или brotlicffi), иначе gzip.
+* Обычные ответы сжимаются целиком, если они не меньше COMPRESS_MIN_BYTES.
+* Потоковые ответы (генераторы) сжимаются по мере отдачи, порциями -
+  размер заранее неизвестен, поэтому порог к ним не применяется.
+* Файлы (send_file) и уже сжатые типы (xlsx, zip, картинки) не трогаем.
+"""
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from .metrics import phase
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/javascript",
+    "text/html",
+    "text/plain",
+    "text/csv",
+    "text/css",
+    "text/javascript",
+}
+
+
+def available_encodings():
+    """Поддерживаемые кодировки в порядке предпочтения сервера"""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def _gzip_compressor(level: int):
+    # wbits=31: формат gzip (заголовок и CRC), а не «голый» deflate
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+class _Compressor:
+    """Единый интерфейс потокового сжатия: compress(chunk) / finish()"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            self._obj = brotli.Compressor(quality=brotli_quality)
+            self.compress = self._obj.process
+            self.finish = self._obj.finish
+        else:
+            self._obj = _gzip_compressor(gzip_level)
+            self.compress = self._obj.compress
+            self.finish = self._obj.flush
+
+
+def compress_bytes(data: bytes, encoding: str, gzip_level: int = 1, brotli_quality: int = 4) -> bytes:
+    compressor = _Compressor(encoding, gzip_level, brotli_quality)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks: Iterable, encoding: str, gzip_level: int = 1,
+                    brotli_quality: int = 4) -> Iterator[bytes]:
+    """Сжимать поток порциями; пустые выходы компрессора не отдаются"""
+    compressor = _Compressor(encoding, gzip_level, brotli_quality)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            out = compressor.compress(chunk)
+            if out:
+                yield out
+        yield compressor.finish()
+    finally:
+        # Исходный итератор мог держать ресурсы (файлы, курсоры) - закрываем его сами
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def choose_encoding(request) -> Optional[str]:
+    """Лучшая кодировка из Accept-Encoding клиента (None - без сжатия)"""
+    return request.accept_encodings.best_match(available_encodings())
+
+
+def init_app(app):
+    """Подключить сжатие ответов (COMPRESS_ENABLED)"""
+    from flask import request
+
+    if not app.config["COMPRESS_ENABLED"]:
+        return
+
+    min_bytes = app.config["COMPRESS_MIN_BYTES"]
+    gzip_level = app.config["COMPRESS_GZIP_LEVEL"]
+    brotli_quality = app.config["COMPRESS_BROTLI_QUALITY"]
+
+    @app.after_request
+    def _compress_response(response):
+        # Только 200: ошибки короткие (и Werkzeug отдаёт их потоком), 206/304 сжимать нельзя
+        if (response.direct_passthrough or response.status_code != 200
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or "Content-Encoding" in response.headers
+                or request.method == "HEAD"):
+            return response
+
+        # Ответ зависит от Accept-Encoding - даже если именно этот не сжат
+        response.vary.add("Accept-Encoding")
+        encoding = choose_encoding(request)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding, gzip_level, brotli_quality)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < min_bytes:
+                return response
+            with phase("compress"):
+                response.set_data(compress_bytes(data, encoding, gzip_level, brotli_quality))
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,266 @@
+"""
+Выгрузка таблицы/отчёта в XLSX и CSV на сервере
+
+Раньше отчёт скачивал весь пакет в браузер (/api/records?per_page=999999) и
+собирал таблицу там - на больших журналах вкладка подвисала. Здесь строки
+отчёта собираются прямо из колонок пакета (CompactRecords.take_columns, без
+словарей записей) порциями по chunk_rows и сразу пишутся в ответ:
+
+* CSV - построчно, каждая порция уходит клиенту сразу (UTF-8 с BOM и ";",
+  чтобы Excel открывал файл без мастера импорта);
+* XLSX - write-only книга openpyxl: строки сразу уходят во временный файл
+  листа, память не растёт с размером выгрузки. Zip-контейнер пишется целиком
+  в конце, поэтому готовый файл отдаётся порциями после сборки.
+
+Колонки, их порядок и названия - как в report.js / table.js: базовые поля,
+test_<анализ> (значения показателей через запятую) и full_result - текст
+результатов без распарсенных частей.
+"""
+import io
+import re
+import csv
+import tempfile
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+from urllib.parse import quote
+
+import numpy as np
+
+# (id колонки, заголовок) - id те же, что у колонок таблицы в браузере
+BASE_COLUMNS = [
+    ("row_number", "#"),
+    ("fio", "ФИО"),
+    ("gender", "Пол"),
+    ("age", "Возраст"),
+    ("birth_date", "ДР"),
+    ("sample_id", "Идентификатор"),
+    ("department", "Отделение"),
+]
+TAIL_COLUMNS = [
+    ("full_result", "Результат (полный)"),
+    ("notes", "Примечания"),
+]
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# Сколько записей собирать за раз
+EXPORT_CHUNK_ROWS = 2048
+
+_SECTION = r"(?:Определение|Исследование|Выявление|Анализ)"
+_CLEANUP = [
+    (re.compile(r":\s*[;,\s]*(?=(?:" + _SECTION + r"|\Z))", re.I), ": "),
+    (re.compile(_SECTION + r"[^:]+:\s*(?=(?:" + _SECTION + r"|\Z))", re.I), ""),
+    (re.compile(r"\s+"), " "),
+    (re.compile(r",\s*,"), ","),
+    (re.compile(r"^[,;\s]+"), ""),
+    (re.compile(r"[,;\s]+\Z"), ""),
+]
+
+
+def _definition_order(def_id) -> Tuple[bool, int]:
+    # report.js обходит тесты по определениям в порядке возрастания id (ключи объекта JS)
+    return def_id is None, def_id or 0
+
+
+class ExportError(ValueError):
+    """Неверные параметры выгрузки (формат, колонки)"""
+
+
+def resolve_columns(test_columns: List[str], order: Optional[List[str]] = None,
+                    hidden: Optional[List[str]] = None) -> List[Tuple[str, str]]:
+    """
+    Видимые колонки отчёта в нужном порядке: (id, заголовок).
+    Как в report.js: неизвестные id из order отбрасываются, «Примечания» - всегда последней.
+    """
+    names = dict(BASE_COLUMNS)
+    names.update((f"test_{name}", name) for name in test_columns)
+    names.update(TAIL_COLUMNS)
+
+    if order:
+        ordered = [col for col in order if col in names and col != "notes"]
+    else:
+        ordered = [col for col in names if col != "notes"]
+    ordered.append("notes")
+
+    hidden = set(hidden or [])
+    return [(col, names[col]) for col in ordered if col not in hidden]
+
+
+class ReportRows:
+    """Значения ячеек отчёта для выбранных записей пакета, порциями"""
+
+    def __init__(self, batch, columns: List[Tuple[str, str]]):
+        self.batch = batch
+        self.column_ids = [col for col, _ in columns]
+        self.headers = [title for _, title in columns]
+        self.test_names = [col[len("test_"):] for col in self.column_ids if col.startswith("test_")]
+        self.with_text = "full_result" in self.column_ids
+        # rule_id -> (шаблон, изменяемая часть) для вырезания распарсенных частей из текста
+        self._patterns: Dict[int, Tuple[str, Optional[str]]] = {
+            rule_id: (rule["test_pattern"], rule["variable_part"])
+            for rule_id, rule in batch.rules_map.items() if rule["test_pattern"]
+        }
+
+    def _row_columns(self) -> List[str]:
+        needed = {"row_id"}
+        for col in self.column_ids:
+            if col == "fio":
+                needed.update(("last_name", "first_name", "middle_name"))
+            elif col == "age":
+                needed.add("age_years")
+            elif col in ("gender", "birth_date", "sample_id", "department"):
+                needed.add(col)
+        if self.with_text:
+            needed.add("raw_text")
+        return sorted(needed)
+
+    def _test_columns(self) -> List[str]:
+        if not self.test_names and not self.with_text:
+            return []
+        return ["name", "value", "raw_value", "rule_id", "test_definition_id"]
+
+    def _exact_pattern(self, rule_id: int, raw_value: Any) -> Optional[str]:
+        """Шаблон правила с подставленным значением - точный фрагмент исходного текста"""
+        rule = self._patterns.get(rule_id)
+        if rule is None:
+            return None
+        pattern, variable_part = rule
+        if variable_part is None or raw_value is None:
+            return pattern
+        return pattern.replace(variable_part, str(raw_value), 1)
+
+    def _filtered_text(self, raw_text: Optional[str], parsed: List[Tuple[int, Any]]) -> str:
+        """Текст результатов без распарсенных частей (как фильтр в report.js)"""
+        text = raw_text or ""
+        for rule_id, raw_value in parsed:
+            pattern = self._exact_pattern(rule_id, raw_value)
+            if pattern is not None:
+                text = text.replace(pattern + ";", "", 1)
+                text = text.replace(pattern, "", 1)
+        for regex, replacement in _CLEANUP:
+            text = regex.sub(replacement, text)
+        return text.strip()
+
+    def _test_cells(self, n: int, tests: Dict[str, List[Any]], bounds: List[int],
+                    raw_text: Optional[List[Optional[str]]]):
+        """Значения колонок тестов и текст результатов для порции из n записей"""
+        test_values = {name: [None] * n for name in self.test_names}
+        texts = [None] * n
+        names, values, raw_values = tests["name"], tests["value"], tests["raw_value"]
+        rule_ids, definition_ids = tests["rule_id"], tests["test_definition_id"]
+
+        for i in range(n):
+            # Тесты записи по определениям анализов (как testsByDefinition в report.js)
+            groups: Dict[Any, List[int]] = {}
+            for t in range(bounds[i], bounds[i + 1]):
+                groups.setdefault(definition_ids[t] or rule_ids[t], []).append(t)
+
+            ordered = sorted(groups, key=_definition_order) if len(groups) > 1 else list(groups)
+            for def_id in ordered:
+                indices = groups[def_id]
+                column = test_values.get(names[indices[0]].split("-")[0])
+                if column is not None:
+                    column[i] = ", ".join(values[t] for t in indices if values[t]) or None
+            if self.with_text:
+                texts[i] = self._filtered_text(
+                    raw_text[i], [(rule_ids[t], raw_values[t]) for d in ordered for t in groups[d]]
+                ) or None
+        return test_values, texts
+
+    def iter_chunks(self, row_ids: np.ndarray, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[List[tuple]]:
+        """Порции строк отчёта; пустые значения - None. Порция собирается по колонкам"""
+        records = self.batch.items
+        row_columns = self._row_columns()
+        test_columns = self._test_columns()
+
+        for start in range(0, len(row_ids), chunk_rows):
+            rows, tests, bounds = records.take_columns(row_ids[start:start + chunk_rows],
+                                                       row_columns, test_columns or ["name"])
+            n = len(rows["row_id"])
+            if test_columns:
+                test_values, texts = self._test_cells(n, tests, bounds, rows.get("raw_text"))
+
+            columns = []
+            for col in self.column_ids:
+                if col == "row_number":
+                    columns.append(rows["row_id"])
+                elif col == "fio":
+                    columns.append([" ".join(filter(None, parts)) or None for parts in
+                                    zip(rows["last_name"], rows["first_name"], rows["middle_name"])])
+                elif col == "age":
+                    columns.append(rows["age_years"])
+                elif col == "full_result":
+                    columns.append(texts)
+                elif col.startswith("test_"):
+                    columns.append(test_values[col[len("test_"):]])
+                elif col == "notes":
+                    columns.append([None] * n)
+                else:
+                    columns.append([v if v != "" else None for v in rows[col]])
+            yield list(zip(*columns)) if columns else [()] * n
+
+
+def iter_csv(report: ReportRows, row_ids: np.ndarray, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """CSV по порциям: UTF-8 с BOM, разделитель ";" (так его ждёт Excel с русской локалью)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=";", lineterminator="\r\n")
+    writer.writerow(report.headers)
+    yield "\ufeff".encode("utf-8") + buffer.getvalue().encode("utf-8")
+
+    for chunk in report.iter_chunks(row_ids, chunk_rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iter_xlsx(report: ReportRows, row_ids: np.ndarray, chunk_rows: int = EXPORT_CHUNK_ROWS,
+              read_size: int = 256 * 1024) -> Iterator[bytes]:
+    """XLSX через write-only книгу openpyxl; готовый файл отдаётся порциями по read_size"""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    from openpyxl.styles import Font
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Отчёт")
+    ws.freeze_panes = "A2"
+    header = []
+    for title in report.headers:
+        cell = WriteOnlyCell(ws, value=title)
+        cell.font = Font(bold=True)
+        header.append(cell)
+    ws.append(header)
+
+    illegal = ILLEGAL_CHARACTERS_RE.search
+    clean = ILLEGAL_CHARACTERS_RE.sub
+    for chunk in report.iter_chunks(row_ids, chunk_rows):
+        for cells in chunk:
+            # Управляющие символы из исходного Excel openpyxl не пишет - вырезаем их
+            ws.append([clean("", v) if isinstance(v, str) and illegal(v) else v for v in cells])
+
+    with tempfile.TemporaryFile() as fh:
+        wb.save(fh)
+        fh.seek(0)
+        while True:
+            data = fh.read(read_size)
+            if not data:
+                break
+            yield data
+
+
+def export_rows(fmt: str, report: ReportRows, row_ids: np.ndarray,
+                chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    if fmt == "csv":
+        return iter_csv(report, row_ids, chunk_rows)
+    if fmt == "xlsx":
+        return iter_xlsx(report, row_ids, chunk_rows)
+    raise ExportError(f"unsupported format: {fmt}")
+
+
+def content_disposition(filename: str) -> str:
+    """attachment с именем файла: ASCII-запасной вариант + RFC 5987 для кириллицы"""
+    fallback = filename.encode("ascii", "ignore").decode("ascii").replace('"', "") or "export"
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
@@ -0,0 +1,95 @@
+"""
+Быстрая сериализация JSON для ответов API
+
+Ответы /api/records - большие однотипные документы; стандартный json тратит на
+них заметную часть времени запроса. Провайдер выбирается настройкой JSON_BACKEND:
+
+* "orjson" - orjson (необязательная зависимость), в разы быстрее json;
+* "stdlib" - стандартный json;
+* "auto" (по умолчанию) - orjson, если установлен, иначе json.
+
+Оба варианта сортируют ключи (как Flask по умолчанию), пишут UTF-8 без
+\\uXXXX-экранирования и понимают типы NumPy/pandas (числа, массивы, даты, NaN/NaT -> null).
+"""
+import sys
+import math
+from typing import Any
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_default(obj: Any) -> Any:
+    """Типы, которые json/orjson не умеют сами: NumPy, pandas, затем правила Flask"""
+    np = sys.modules.get("numpy")
+    if np is not None:
+        if isinstance(obj, np.floating):
+            value = obj.item()
+            return None if math.isnan(value) else value
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+    # pandas импортирован, только если его типы вообще могли появиться
+    pd = sys.modules.get("pandas")
+    if pd is not None:
+        if obj is pd.NaT or obj is pd.NA:
+            return None
+        if isinstance(obj, pd.Timestamp):
+            return obj.isoformat()
+        if isinstance(obj, (pd.Series, pd.Index)):
+            return obj.tolist()
+    return DefaultJSONProvider.default(obj)
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    """Стандартный json с поддержкой NumPy/pandas и без ASCII-экранирования"""
+
+    ensure_ascii = False
+    default = staticmethod(json_default)
+
+
+class OrjsonJSONProvider(StdlibJSONProvider):
+    """orjson для ответов и разбора запросов; json - только для вызовов с особыми параметрами"""
+
+    # Даты отдаются в json_default - тот же формат, что у Flask (RFC 822)
+    OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+               | orjson.OPT_PASSTHROUGH_DATETIME) if orjson is not None else 0
+
+    def _options(self) -> int:
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return self.OPTIONS | orjson.OPT_INDENT_2
+        return self.OPTIONS
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=json_default, option=self.OPTIONS).decode("utf-8")
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        data = orjson.dumps(obj, default=json_default, option=self._options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+
+JSON_BACKENDS = {"stdlib": StdlibJSONProvider, "orjson": OrjsonJSONProvider}
+
+
+def get_json_provider_class(backend: str = "auto"):
+    """Класс провайдера по имени; "auto" и недоступный orjson дают stdlib"""
+    if backend == "auto":
+        backend = "orjson" if orjson is not None else "stdlib"
+    if backend == "orjson" and orjson is None:
+        backend = "stdlib"
+    if backend not in JSON_BACKENDS:
+        raise ValueError(f"Неизвестный JSON_BACKEND: {backend}")
+    return JSON_BACKENDS[backend]
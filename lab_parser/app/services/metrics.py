@@ -0,0 +1,174 @@
+"""
+Лёгкие метрики горячего пути без внешних сервисов
+
+* phase("excel.read") - контекстный менеджер: время этапа попадает в гистограмму
+  lab_parser_phase_seconds{phase=...}, а если этап выполняется внутри HTTP-запроса -
+  ещё и в заголовок ответа Server-Timing (видно во вкладке Network браузера).
+* timed("rules_db.get_all_rules") - то же в виде декоратора.
+* init_app(app) - хуки запроса (Server-Timing, lab_parser_request_seconds)
+  и GET /metrics в текстовом формате Prometheus.
+* log_sampled(...) - структурированная (JSON) запись в лог для доли запросов,
+  чтобы диагностика не стоила ввода-вывода на каждый запрос.
+
+Метрики живут в памяти процесса: под gunicorn каждый воркер отдаёт свои.
+"""
+import json
+import time
+import random
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Any, List, Optional, Tuple
+
+# Границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Гистограмма Prometheus: накопленные корзины, сумма и число наблюдений по наборам меток"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        # Серия: [счётчики корзин..., +Inf, сумма]
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.label_names, labels))
+            prefix = base + "," if base else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+PHASE_SECONDS = Histogram("lab_parser_phase_seconds", "Время этапов обработки", ("phase",))
+REQUEST_SECONDS = Histogram("lab_parser_request_seconds", "Время обработки HTTP-запросов",
+                            ("endpoint", "method", "status"))
+HISTOGRAMS = [REQUEST_SECONDS, PHASE_SECONDS]
+
+# Этапы текущего запроса: имя -> суммарная длительность (None вне запроса)
+_request_phases: ContextVar[Optional[Dict[str, float]]] = ContextVar("_request_phases", default=None)
+
+
+@contextmanager
+def phase(name: str):
+    """Замерить этап: гистограмма процесса + Server-Timing текущего запроса"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        PHASE_SECONDS.observe(elapsed, name)
+        phases = _request_phases.get()
+        if phases is not None:
+            phases[name] = phases.get(name, 0.0) + elapsed
+
+
+def timed(name: str):
+    """Декоратор: весь вызов функции - этап name"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(phases: Dict[str, float], total: float) -> str:
+    """Значение заголовка Server-Timing (длительности в мс)"""
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in phases.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def render_metrics() -> str:
+    """Все гистограммы в текстовом формате Prometheus"""
+    lines: List[str] = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return "\n".join(lines) + "\n"
+
+
+def log_sampled(logger: logging.Logger, rate: float, event: str, **fields: Any):
+    """Записать событие в лог одной JSON-строкой с вероятностью rate"""
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return
+    logger.info(json.dumps({"event": event, **fields}, ensure_ascii=False, default=str))
+
+
+def init_app(app):
+    """Подключить замеры запросов и GET /metrics"""
+    from flask import Response, g, request
+
+    if not app.config["METRICS_ENABLED"]:
+        return
+
+    # Выборочные события пишутся в логгер lab_parser на уровне INFO;
+    # если приложение не настроило логирование само - выводим в stderr
+    logger = logging.getLogger("lab_parser")
+    if app.config["METRICS_LOG_SAMPLE_RATE"] > 0 and not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+    @app.before_request
+    def _start_request_timing():
+        g._metrics_started = time.perf_counter()
+        g._metrics_token = _request_phases.set({})
+
+    @app.after_request
+    def _finish_request_timing(response):
+        started = g.pop("_metrics_started", None)
+        if started is None:
+            return response
+        total = time.perf_counter() - started
+        phases = _request_phases.get() or {}
+        response.headers["Server-Timing"] = server_timing(phases, total)
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.observe(total, endpoint, request.method, str(response.status_code))
+        return response
+
+    @app.teardown_request
+    def _reset_request_timing(exc):
+        token = g.pop("_metrics_token", None)
+        if token is not None:
+            _request_phases.reset(token)
+
+    @app.get("/metrics")
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4; charset=utf-8")
@@ -1,10 +1,14 @@
 import os
 import re
-import pandas as pd
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 
 from .results_parser import apply_parsing_rules
+from .metrics import phase
+
+# pandas (а с ним openpyxl/xlrd/lxml) импортируется внутри функций, при первом
+# чтении файла: импорт модуля не должен стоить ~0.3 с каждому процессу и скрипту.
+# Заранее загрузить всё в мастер-процессе можно через services.warmup.preload
 
 # Простые регексы под возраст/дату
 AGE_RE = re.compile(r"(\d+)\s*(?:год|года|лет)")
@@ -20,6 +24,12 @@ EXPECTED_COLUMNS = [
 ]
 
 
+def _is_header_row(values) -> bool:
+    """Содержит ли строка (значения ячеек) все ожидаемые заголовки колонок"""
+    row_values = [str(val).strip() for val in values]
+    return all(col in row_values for col in EXPECTED_COLUMNS)
+
+
 def _is_html_file(file_path: str) -> bool:
     """
     Определяет, является ли файл HTML, читая первые байты.
@@ -32,6 +42,16 @@ def _is_html_file(file_path: str) -> bool:
         return False
 
 
+def detect_source_format(file_path: str) -> str:
+    """
+    Формат исходного файла: 'html' (HTML-таблица под видом Excel), 'xls' или 'xlsx'.
+    """
+    if _is_html_file(file_path):
+        return 'html'
+    file_ext = os.path.splitext(file_path)[1].lower()
+    return 'xls' if file_ext == '.xls' else 'xlsx'
+
+
 def _detect_header_row(xlsx_path: str, sheet_name: Optional[str] = None) -> int:
     """
     Определяет, в какой строке находятся заголовки колонок.
@@ -41,6 +61,8 @@ def _detect_header_row(xlsx_path: str, sheet_name: Optional[str] = None) -> int:
 
     Выбрасывает ValueError, если заголовки не найдены ни в первой, ни во второй строке.
     """
+    import pandas as pd
+
     # Если sheet_name не указан, используем первый лист (индекс 0)
     if sheet_name is None:
         sheet_name = 0
@@ -58,14 +80,12 @@ def _detect_header_row(xlsx_path: str, sheet_name: Optional[str] = None) -> int:
 
             # Для HTML pandas автоматически определяет заголовки из <thead>
             # Проверяем, что колонки содержат ожидаемые заголовки
-            columns = [str(c).strip() for c in df_check.columns]
-            if all(col in columns for col in EXPECTED_COLUMNS):
+            if _is_header_row(df_check.columns):
                 return 0  # Заголовки уже на месте, не нужно пропускать строки
 
             # Если заголовки не найдены в <thead>, проверяем первые две строки
             if len(df_check) >= 2:
-                first_row = [str(val).strip() for val in df_check.iloc[0]]
-                if all(col in first_row for col in EXPECTED_COLUMNS):
+                if _is_header_row(df_check.iloc[0]):
                     return 1  # Заголовки во второй строке (первая - заголовок журнала)
 
             raise ValueError("Не удалось найти ожидаемые заголовки колонок в HTML-таблице")
@@ -89,9 +109,7 @@ def _detect_header_row(xlsx_path: str, sheet_name: Optional[str] = None) -> int:
         """Проверяет, содержит ли строка все ожидаемые заголовки"""
         if row_index >= len(df_check):
             return False
-        row_values = [str(val).strip() for val in df_check.iloc[row_index]]
-        # Проверяем наличие всех ожидаемых заголовков
-        return all(col in row_values for col in EXPECTED_COLUMNS)
+        return _is_header_row(df_check.iloc[row_index])
 
     # Для не-HTML файлов проверяем первую и вторую строки
     # Проверяем первую строку (индекс 0)
@@ -166,7 +184,8 @@ def _parse_patient_block(text: str) -> dict:
     }
 
 
-def read_basic_records(xlsx_path: str, sheet_name: Optional[str] = None) -> List[Dict[str, Any]]:
+def read_basic_records(xlsx_path: str, sheet_name: Optional[str] = None,
+                       header_row: Optional[int] = None) -> List[Dict[str, Any]]:
     """Читает Excel и возвращает упрощённые записи для таблицы.
 
     Автоматически определяет формат файла:
@@ -175,45 +194,53 @@ def read_basic_records(xlsx_path: str, sheet_name: Optional[str] = None) -> List
     - HTML с расширением .xls/.xlsx: парсит как HTML-таблицу
 
     Если sheet_name не указан, использует первый лист файла.
+    Если header_row известен заранее (из каталога пакетов), повторное определение пропускается.
 
     Столбцы ожидаются: № п/п, ФИО пациента..., Идентификатор образца, Отделение, Результаты исследования
     """
+    import pandas as pd
+
     # Если sheet_name не указан, используем первый лист (индекс 0)
     if sheet_name is None:
         sheet_name = 0
 
     # Определяем, сколько строк нужно пропустить
-    skip_rows = _detect_header_row(xlsx_path, sheet_name)
+    if header_row is not None:
+        skip_rows = header_row
+    else:
+        with phase("excel.detect_header"):
+            skip_rows = _detect_header_row(xlsx_path, sheet_name)
 
     # Проверяем, является ли файл HTML
     is_html = _is_html_file(xlsx_path)
 
-    if is_html:
-        # Читаем HTML-таблицу
-        tables = pd.read_html(xlsx_path, encoding='utf-8')
-        if not tables:
-            raise ValueError("HTML файл не содержит таблиц")
+    with phase("excel.read"):
+        if is_html:
+            # Читаем HTML-таблицу
+            tables = pd.read_html(xlsx_path, encoding='utf-8')
+            if not tables:
+                raise ValueError("HTML файл не содержит таблиц")
 
-        df = tables[0]  # Берем первую таблицу
+            df = tables[0]  # Берем первую таблицу
 
-        # Для HTML pandas уже правильно определил заголовки из <thead>
-        # Просто проверяем, что skip_rows = 0 (заголовки уже на месте)
-        if skip_rows != 0:
-            # Это не должно произойти для HTML с <thead>, но на всякий случай
-            df.columns = df.iloc[skip_rows]
-            df = df.iloc[skip_rows + 1:].reset_index(drop=True)
-    else:
-        # Определяем движок по расширению файла
-        file_ext = os.path.splitext(xlsx_path)[1].lower()
-        engine = None
+            # Для HTML pandas уже правильно определил заголовки из <thead>
+            # Просто проверяем, что skip_rows = 0 (заголовки уже на месте)
+            if skip_rows != 0:
+                # Это не должно произойти для HTML с <thead>, но на всякий случай
+                df.columns = df.iloc[skip_rows]
+                df = df.iloc[skip_rows + 1:].reset_index(drop=True)
+        else:
+            # Определяем движок по расширению файла
+            file_ext = os.path.splitext(xlsx_path)[1].lower()
+            engine = None
 
-        if file_ext == '.xlsx':
-            engine = 'openpyxl'
-        elif file_ext == '.xls':
-            engine = 'xlrd'
+            if file_ext == '.xlsx':
+                engine = 'openpyxl'
+            elif file_ext == '.xls':
+                engine = 'xlrd'
 
-        # Читаем файл с правильным смещением
-        df = pd.read_excel(xlsx_path, sheet_name=sheet_name, skiprows=skip_rows, engine=engine)
+            # Читаем файл с правильным смещением
+            df = pd.read_excel(xlsx_path, sheet_name=sheet_name, skiprows=skip_rows, engine=engine)
 
     # нормализуем имена колонок (уберём лишние пробелы)
     df.columns = [str(c).strip() for c in df.columns]
@@ -225,42 +252,44 @@ def read_basic_records(xlsx_path: str, sheet_name: Optional[str] = None) -> List
     col_dept = "Отделение"
     col_res = "Результаты исследования"
 
-    items: List[Dict[str, Any]] = []
-    for _, row in df.iterrows():
-        row_id = row.get(col_idx, None)
-        patient_block = row.get(col_patient, None)
-        sample_id = row.get(col_sample, None)
-        department = row.get(col_dept, None)
-        raw_res = row.get(col_res, None)
-
-        patient = _parse_patient_block(patient_block)
-
-        # summary результатов (пока коротко — первые 140 символов)
-        summary = None
-        if isinstance(raw_res, str):
-            summary = raw_res.strip()
-            if len(summary) > 140:
-                summary = summary[:137] + "..."
-
-        items.append({
-            "id": int(row_id) if pd.notna(row_id) else None,  # для ссылки
-            "row_id": int(row_id) if pd.notna(row_id) else None,
-            "patient": patient,
-            "sample_id": str(sample_id) if pd.notna(sample_id) else None,
-            "department": str(department) if pd.notna(department) else None,
-            "results": {
-                "summary": summary,
-                "tests": [],  # заполним позже продвинутым парсером
-                "raw_text": str(raw_res) if pd.notna(raw_res) else None,
-                "parse_quality": "basic"
-            }
-        })
+    with phase("excel.rows"):
+        items: List[Dict[str, Any]] = []
+        for _, row in df.iterrows():
+            row_id = row.get(col_idx, None)
+            patient_block = row.get(col_patient, None)
+            sample_id = row.get(col_sample, None)
+            department = row.get(col_dept, None)
+            raw_res = row.get(col_res, None)
+
+            patient = _parse_patient_block(patient_block)
+
+            # summary результатов (пока коротко — первые 140 символов)
+            summary = None
+            if isinstance(raw_res, str):
+                summary = raw_res.strip()
+                if len(summary) > 140:
+                    summary = summary[:137] + "..."
+
+            items.append({
+                "id": int(row_id) if pd.notna(row_id) else None,  # для ссылки
+                "row_id": int(row_id) if pd.notna(row_id) else None,
+                "patient": patient,
+                "sample_id": str(sample_id) if pd.notna(sample_id) else None,
+                "department": str(department) if pd.notna(department) else None,
+                "results": {
+                    "summary": summary,
+                    "tests": [],  # заполним позже продвинутым парсером
+                    "raw_text": str(raw_res) if pd.notna(raw_res) else None,
+                    "parse_quality": "basic"
+                }
+            })
 
     return items
 
 
 def read_records_with_parsing(xlsx_path: str, rules: List[Dict[str, Any]],
-                               sheet_name: Optional[str] = None) -> List[Dict[str, Any]]:
+                               sheet_name: Optional[str] = None,
+                               header_row: Optional[int] = None) -> List[Dict[str, Any]]:
     """
     Читает Excel и применяет правила парсинга к результатам
 
@@ -268,12 +297,13 @@ def read_records_with_parsing(xlsx_path: str, rules: List[Dict[str, Any]],
         xlsx_path: Путь к файлу Excel
         rules: Список правил парсинга из БД
         sheet_name: Название листа (если None, используется первый)
+        header_row: Смещение строки заголовков, если уже известно
 
     Returns:
         Список записей с распарсенными результатами
     """
     # Сначала читаем базовые данные
-    items = read_basic_records(xlsx_path, sheet_name)
+    items = read_basic_records(xlsx_path, sheet_name, header_row)
 
     # Затем применяем правила парсинга
     if rules:
@@ -0,0 +1,342 @@
+"""
+Распарсенный пакет (загруженный файл) с предвычисленными метаданными и индексами
+
+Пакет читается и парсится один раз на пару (файл, поколение правил)
+и хранится в небольшом кэше внутри процесса.
+
+Одновременные запросы одного и того же пакета (только что загружен, его
+открывают сразу несколько человек) не парсят его каждый заново: строит
+первый, остальные ждут его результат - или получают его ошибку. Между
+процессами то же обеспечивает дисковый кэш (блокировка на ключ записи).
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional, Tuple
+
+from .parse_excel import read_records_with_parsing
+from .results_parser import ResultsParser
+from .batch_index import BatchIndex, TestFilterError
+from .text_index import TextIndex
+from .metrics import phase
+from .compact_records import CompactRecords
+from .archive import load_archived_items
+
+
+class ParsedBatch:
+    """Записи пакета после парсинга + всё, что нужно для ответа /api/records"""
+
+    def __init__(self, name: str, items: List[Dict[str, Any]], rules: List[Dict[str, Any]],
+                 rules_generation: int = 0):
+        self.name = name
+        # Записи хранятся колонками; словари собираются только для отдаваемых строк
+        self.items = CompactRecords.from_items(items)
+        self.rules = rules
+        self.rules_generation = rules_generation
+
+        self._build_test_columns()
+        self._build_rules_map()
+        self._find_key_indicators()
+
+        self.index = BatchIndex(self.items, key_rule_ids={k['id'] for k in self._key_indicators.values()})
+        self._build_test_key_indicators()
+
+        self.facets = {
+            "departments": sorted(self.index.departments),
+            "genders": sorted(self.index.genders),
+        }
+
+        self._text_index = None
+
+    @property
+    def text_index(self) -> TextIndex:
+        """Триграммный индекс строится при первом текстовом поиске по пакету"""
+        if self._text_index is None:
+            self._text_index = TextIndex(self.items)
+        return self._text_index
+
+    def _build_test_columns(self):
+        """Собираем уникальные колонки тестов из всех записей"""
+        test_def_names = {}
+        for test_def_id, name in zip(self.items.test_column("test_definition_id"), self.items.test_column("name")):
+            base_name = name.split('-')[0] if '-' in name else name
+            test_def_names[test_def_id] = base_name
+
+        self.test_def_names = test_def_names
+        self.test_columns = sorted(test_def_names.values())
+
+    def _build_rules_map(self):
+        """Маппинг rule_id -> test_pattern для вырезания распарсенных частей на клиенте"""
+        self.rules_map = {}
+        for rule in self.rules:
+            self.rules_map[rule['id']] = {
+                'test_pattern': rule['test_pattern'],
+                'variable_part': rule['variable_part'],
+                'short_name': rule['short_name']
+            }
+
+    def _find_key_indicators(self):
+        """Для каждого определения анализа находим ключевой показатель"""
+        definitions_map = {}
+        for rule in self.rules:
+            def_id = rule.get('test_definition_id', rule['id'])
+            definitions_map.setdefault(def_id, []).append(rule)
+
+        self._key_indicators = {}
+        for def_id, indicators in definitions_map.items():
+            key_indicator = None
+            for indicator in indicators:
+                if indicator.get('is_key_indicator', True):  # По умолчанию True для старых данных
+                    key_indicator = indicator
+                    break
+
+            if not key_indicator:
+                # Если нет явно указанного ключевого, берём первый
+                key_indicator = indicators[0] if indicators else None
+
+            if key_indicator:
+                self._key_indicators[def_id] = key_indicator
+
+    def _build_test_key_indicators(self):
+        """Информация о ключевых показателях: возможные значения берутся из индекса"""
+        self.test_key_indicators = {}
+        for def_id, key_indicator in self._key_indicators.items():
+            base_name = self.test_def_names.get(def_id)
+            if not base_name:
+                continue
+
+            # ВАЖНО: значения - это raw_value (исходное значение из таблицы)
+            possible_values = []
+            value_counts = {}
+            if key_indicator.get('is_key_indicator', True):
+                value_counts = {v: c for v, c in self.index.value_counts(key_indicator['id']).items() if v}
+                possible_values = sorted(value_counts)
+
+            self.test_key_indicators[base_name] = {
+                "rule_id": key_indicator['id'],
+                "test_definition_id": def_id,
+                "indicator_name": key_indicator['short_name'],
+                "possible_values": possible_values,
+                "value_counts": value_counts,
+                "value_type": key_indicator['value_type']
+            }
+
+    def resolve_test_filters(self, filters: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Подставляет ключевой показатель в фильтры, где указан только test_definition_id"""
+        resolved = []
+        for flt in filters:
+            if flt.get("rule_id") is None:
+                key_indicator = self._key_indicators.get(flt["test_definition_id"])
+                if not key_indicator:
+                    raise TestFilterError(f"unknown test_definition_id: {flt['test_definition_id']}")
+                flt = dict(flt, rule_id=key_indicator['id'])
+            resolved.append(flt)
+        return resolved
+
+    def select(self, gender: Optional[str] = None, department: Optional[str] = None,
+               tests: Optional[List[Dict[str, Any]]] = None, tests_op: str = "and",
+               q: Optional[str] = None, fuzzy: bool = False):
+        """Маска записей, удовлетворяющих фильтрам (см. BatchIndex.select и TextIndex.mask)"""
+        mask = self.index.select(gender=gender, department=department,
+                                 tests=self.resolve_test_filters(tests or []), tests_op=tests_op)
+        if q and q.strip():
+            mask &= self.text_index.mask(q, fuzzy=fuzzy)
+        return mask
+
+
+# ===== Кэш распарсенных пакетов внутри процесса =====
+
+_cache: "OrderedDict[Tuple[str, int, int], ParsedBatch]" = OrderedDict()
+_cache_lock = threading.Lock()
+# Пакеты, которые сейчас строятся в этом процессе: ключ кэша -> результат построения
+_inflight: Dict[Tuple[str, int, int], Future] = {}
+
+
+class _RulesChanged(Exception):
+    """Правила изменились между чтением поколения и чтением самих правил - ключ кэша устарел"""
+
+
+def get_parsed_batch(path: str, rules_db, max_entries: int = 4, catalog=None,
+                     disk_cache=None, archive=None) -> ParsedBatch:
+    """
+    Возвращает распарсенный пакет из кэша или читает и парсит файл.
+
+    Ключ кэша - (путь, mtime файла, поколение правил), поэтому правка
+    правил или перезапись файла автоматически дают новую запись.
+
+    Если передан каталог пакетов, из него берётся известная строка заголовков,
+    а после парсинга в него записываются число строк и поколение правил.
+
+    Если передан дисковый кэш (services.batch_cache), при промахе в памяти
+    записи сначала ищутся в нём - его разделяют все процессы на хосте.
+
+    Если передан архив (services.archive) и исходного файла уже нет (удалён
+    по сроку хранения), записи берутся из архива; ключи кэшей те же, что и
+    при живом файле (в архиве сохранён его mtime).
+
+    Пока пакет с этим ключом строится в другом потоке, вызов ждёт его
+    результат; если построение упало, та же ошибка достаётся всем ждавшим.
+    Если правила правили, пока пакет строился, всё повторяется с новым поколением.
+    """
+    while True:
+        try:
+            return _get_parsed_batch(path, rules_db, max_entries, catalog, disk_cache, archive)
+        except _RulesChanged:
+            continue
+
+
+def _get_parsed_batch(path: str, rules_db, max_entries: int, catalog,
+                      disk_cache, archive) -> ParsedBatch:
+    """Один проход get_parsed_batch с поколением правил, прочитанным сейчас"""
+    generation = rules_db.get_rules_generation()
+    name = os.path.basename(path)
+    archived = None
+    if archive is not None and not os.path.isfile(path):
+        archived = archive.get(name)
+        if archived is None:
+            raise FileNotFoundError(path)
+        mtime_ns = archived["mtime_ns"]
+    else:
+        mtime_ns = os.stat(path).st_mtime_ns
+    key = (os.path.abspath(path), mtime_ns, generation)
+
+    with _cache_lock:
+        batch = _cache.get(key)
+        if batch is not None:
+            _cache.move_to_end(key)
+            return batch
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = Future()
+
+    if not leader:
+        # Пакет уже строит другой поток - ждём его, а не парсим второй раз
+        with phase("batch.wait"):
+            return flight.result()
+
+    try:
+        batch = _build_parsed_batch(path, key, rules_db, max_entries, catalog, disk_cache, archived, archive)
+    except BaseException as e:
+        flight.set_exception(e)
+        raise
+    else:
+        flight.set_result(batch)
+        return batch
+    finally:
+        with _cache_lock:
+            _inflight.pop(key, None)
+
+
+def _build_parsed_batch(path: str, key: Tuple[str, int, int], rules_db, max_entries: int, catalog,
+                        disk_cache, archived: Optional[Dict[str, Any]], archive) -> ParsedBatch:
+    """Прочитать и распарсить пакет (или поднять из дискового кэша/архива) и положить в кэш процесса"""
+    name = os.path.basename(path)
+    _, mtime_ns, generation = key
+    entry = catalog.get_batch(name) if catalog is not None else None
+    header_row = entry["header_row"] if entry else None
+
+    rules = rules_db.get_all_rules()
+    # Поколение в ключе прочитано раньше правил: если между чтениями была правка,
+    # пакет с новыми правилами попал бы в кэши (и дисковый) под старым поколением
+    if rules_db.get_rules_generation() != generation:
+        raise _RulesChanged()
+
+    def _parse():
+        if archived is not None:
+            return load_archived_items(archive, name, rules, generation)
+        return CompactRecords.from_items(read_records_with_parsing(path, rules, header_row=header_row))
+
+    if disk_cache is not None:
+        disk_key = disk_cache.entry_key(path, mtime_ns, generation)
+        items, stored = disk_cache.get_or_build(disk_key, name, generation, _parse)
+        if stored and entry:
+            catalog.set_artifact(name, "disk_cache", {
+                "key": disk_key, "rules_generation": generation, "size": stored["size"]
+            })
+    else:
+        items = _parse()
+    with phase("batch.index"):
+        batch = ParsedBatch(name, items, rules, generation)
+
+    if entry:
+        catalog.record_parse(name, len(items), generation)
+
+    with _cache_lock:
+        # Устаревшие записи того же файла больше не понадобятся
+        for stale in [k for k in _cache if k[0] == key[0] and k != key]:
+            del _cache[stale]
+        _cache[key] = batch
+        while len(_cache) > max_entries:
+            _cache.popitem(last=False)
+
+    return batch
+
+
+def reparse_definition(batch: ParsedBatch, parser: ResultsParser, definition_id: int,
+                       rules_generation: int) -> Tuple[ParsedBatch, int]:
+    """
+    Новый пакет, в котором перепарсены только показатели одного анализа.
+
+    Записи без изменений переиспользуются как есть, изменившиеся копируются
+    с новыми results - исходный пакет не меняется (его могут читать другие запросы).
+
+    Returns:
+        (новый пакет, число изменившихся записей)
+    """
+    items, changed = reparse_items(batch.items, parser, definition_id)
+    return ParsedBatch(batch.name, items, parser.rules, rules_generation), changed
+
+
+def reparse_items(items, parser: ResultsParser, definition_id: int) -> Tuple[List[Dict[str, Any]], int]:
+    """Записи (CompactRecords или список словарей) с перепарсенными показателями одного анализа: (записи, изменилось)"""
+    new_items = []
+    changed = 0
+    for item in items:
+        new_results = parser.reparse_definition(item.get("results", {}), definition_id)
+        if new_results is None:
+            new_items.append(item)
+        else:
+            new_items.append(dict(item, results=new_results))
+            changed += 1
+    return new_items, changed
+
+
+def upgrade_cached_batches(definition_id: int, from_generation: int, to_generation: int,
+                           rules: List[Dict[str, Any]]) -> Dict[Tuple[str, int, int], Tuple[ParsedBatch, int]]:
+    """
+    Перевести закэшированные пакеты с поколения from_generation на to_generation,
+    когда между ними изменился только один анализ (definition_id).
+
+    Пакеты, распарсенные без правил, и переход к пустому набору правил
+    не обновляются: там меняется не только один анализ, а вид всех записей
+    (parse_quality "basic") - такие пакеты будут перечитаны при следующем запросе.
+
+    Returns:
+        Ключ кэша -> (новый пакет, число перепарсенных записей)
+    """
+    with _cache_lock:
+        candidates = [(k, b) for k, b in _cache.items() if k[2] == from_generation and b.rules]
+    if not rules or not candidates:
+        return {}
+
+    parser = ResultsParser(rules)
+    stats = {}
+    for key, batch in candidates:
+        new_batch, changed = reparse_definition(batch, parser, definition_id, to_generation)
+        new_key = (key[0], key[1], to_generation)
+        with _cache_lock:
+            if key not in _cache and new_key not in _cache:
+                # Запись вытеснена, пока шёл перепарсинг
+                continue
+            _cache.pop(key, None)
+            _cache.setdefault(new_key, new_batch)
+        stats[new_key] = (new_batch, changed)
+    return stats
+
+
+def clear_parsed_batch_cache():
+    """Сбросить кэш распарсенных пакетов"""
+    with _cache_lock:
+        _cache.clear()
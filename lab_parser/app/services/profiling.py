@@ -0,0 +1,205 @@
+"""
+Профилирование отдельных запросов по требованию
+
+Включается настройкой PROFILING_ENABLED; после этого любой запрос с ?__profile=1
+(или заголовком X-Profile: 1) выполняется под cProfile. Профиль сохраняется в
+instance/profiles/ тремя файлами с общим именем:
+
+* <имя>.prof - pstats (snakeviz, python -m pstats);
+* <имя>.txt - топ функций по cumulative и tottime, чтобы приложить к задаче;
+* <имя>.json - маршрут, пакет, поколение правил, статус и длительность.
+
+С ?__profile=sampling используется семплирующий pyinstrument (если установлен) -
+меньше искажает время горячих циклов; результат сохраняется как <имя>.html.
+
+Список профилей и скачивание - страница /profiles (routes.ui).
+"""
+import io
+import os
+import re
+import json
+import time
+import pstats
+import cProfile
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+    SamplingProfiler = None
+
+PROFILE_PARAM = "__profile"
+PROFILE_HEADER = "X-Profile"
+PROFILES_SUBDIR = "profiles"
+# Расширения файлов профиля, которые можно скачать со страницы /profiles
+PROFILE_EXTENSIONS = (".prof", ".txt", ".html", ".json")
+
+_SLUG_RE = re.compile(r"[^0-9A-Za-zА-Яа-яЁё._-]+")
+
+
+def profiles_dir(instance_path: str) -> str:
+    return os.path.join(instance_path, PROFILES_SUBDIR)
+
+
+def _slug(value: Optional[str], limit: int = 40) -> str:
+    return _SLUG_RE.sub("_", value or "").strip("_")[:limit] or "none"
+
+
+def annotate_profile(**fields: Any):
+    """Добавить поля в метаданные профиля текущего запроса (если он профилируется)"""
+    from flask import g
+
+    meta = g.get("_profile_meta")
+    if meta is not None:
+        meta.update(fields)
+
+
+def list_profiles(instance_path: str) -> List[Dict[str, Any]]:
+    """Сохранённые профили (по метаданным .json), новые первыми"""
+    directory = profiles_dir(instance_path)
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        base = name[:-len(".json")]
+        meta["name"] = base
+        meta["files"] = [base + ext for ext in PROFILE_EXTENSIONS
+                         if os.path.isfile(os.path.join(directory, base + ext))]
+        profiles.append(meta)
+    # Имя начинается с отметки времени (до микросекунд)
+    profiles.sort(key=lambda p: p["name"], reverse=True)
+    return profiles
+
+
+def _prune(instance_path: str, keep: int):
+    """Оставить keep последних профилей"""
+    for meta in list_profiles(instance_path)[keep:]:
+        for name in meta["files"]:
+            try:
+                os.remove(os.path.join(profiles_dir(instance_path), name))
+            except OSError:
+                pass
+
+
+def _stats_text(profiler: cProfile.Profile, limit: int = 60) -> str:
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats("cumulative").print_stats(limit)
+    stats.sort_stats("tottime").print_stats(limit)
+    return out.getvalue()
+
+
+def save_profile(instance_path: str, profiler, meta: Dict[str, Any], keep: int) -> str:
+    """Сохранить профиль и метаданные; возвращает общее имя файлов"""
+    directory = profiles_dir(instance_path)
+    os.makedirs(directory, exist_ok=True)
+    base = "-".join([
+        datetime.now().strftime("%Y%m%d-%H%M%S-%f"),
+        _slug(meta.get("endpoint")),
+        _slug(meta.get("batch")),
+        f"g{meta.get('rules_generation', 0)}",
+    ])
+    path = os.path.join(directory, base)
+
+    if isinstance(profiler, cProfile.Profile):
+        profiler.dump_stats(path + ".prof")
+        with open(path + ".txt", "w", encoding="utf-8") as f:
+            f.write(_stats_text(profiler))
+    else:
+        with open(path + ".html", "w", encoding="utf-8") as f:
+            f.write(profiler.output_html())
+        with open(path + ".txt", "w", encoding="utf-8") as f:
+            f.write(profiler.output_text(unicode=True))
+
+    with open(path + ".json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    _prune(instance_path, keep)
+    return base
+
+
+def _start(profiler):
+    if isinstance(profiler, cProfile.Profile):
+        profiler.enable()
+    else:
+        profiler.start()
+
+
+def _stop(profiler):
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+    else:
+        profiler.stop()
+
+
+def _requested_mode(request) -> Optional[str]:
+    """'cprofile', 'sampling' или None, если запрос не просит профилирования"""
+    value = request.args.get(PROFILE_PARAM) or request.headers.get(PROFILE_HEADER)
+    if not value or value.lower() in ("0", "false", "no"):
+        return None
+    if value.lower() == "sampling" and SamplingProfiler is not None:
+        return "sampling"
+    return "cprofile"
+
+
+def init_app(app):
+    """Подключить профилирование запросов (только при PROFILING_ENABLED)"""
+    from flask import g, request
+
+    if not app.config["PROFILING_ENABLED"]:
+        return
+
+    @app.before_request
+    def _start_profile():
+        # Статику и саму страницу профилей не профилируем
+        if request.endpoint in ("static", "ui.profiles", "ui.profiles_download"):
+            return
+        mode = _requested_mode(request)
+        if mode is None:
+            return
+        profiler = SamplingProfiler() if mode == "sampling" else cProfile.Profile()
+        g._profile_meta = {
+            "endpoint": request.url_rule.rule if request.url_rule is not None else request.path,
+            "method": request.method,
+            "url": request.full_path,
+            "batch": request.args.get("batch"),
+            "mode": mode,
+        }
+        g._profile_started = time.perf_counter()
+        g._profiler = profiler
+        _start(profiler)
+
+    @app.after_request
+    def _finish_profile(response):
+        profiler = g.pop("_profiler", None)
+        if profiler is None:
+            return response
+        _stop(profiler)
+
+        from ..models.parse_rules import get_parse_rules_db
+
+        meta = g.pop("_profile_meta")
+        meta.update(
+            status=response.status_code,
+            duration_ms=round((time.perf_counter() - g.pop("_profile_started")) * 1000, 1),
+            rules_generation=get_parse_rules_db(app.instance_path).get_rules_generation(),
+            created_at=datetime.now().isoformat(timespec="seconds"),
+        )
+        name = save_profile(app.instance_path, profiler, meta, app.config["PROFILES_KEEP"])
+        response.headers["X-Profile-Name"] = name
+        return response
+
+    @app.teardown_request
+    def _stop_profile(exc):
+        # Исключение в обработчике: after_request не вызывался - просто выключаем профайлер
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:
+            _stop(profiler)
@@ -0,0 +1,228 @@
+"""
+Частичный перепарсинг после правки одного определения анализа
+
+Правка (создание, изменение, удаление) одного анализа меняет только его тесты,
+поэтому вместо полного перепарсинга всех пакетов к уже распарсенным записям
+повторно применяются показатели только этого анализа:
+
+* пакеты в кэше процесса (services.parsed_batch) переводятся на новое поколение правил
+  и публикуются в общий дисковый кэш (services.batch_cache);
+* записи дискового кэша старого поколения, которых нет в памяти этого процесса
+  (их распарсили другие воркеры), тоже переводятся - по всем пакетам каталога;
+* строки глобального поискового индекса перепарсиваются по сохранённому raw_text.
+
+Задачи выполняются в фоновом потоке строго по очереди (каждая переводит
+поколение N -> N+1), чтобы не задерживать ответ редактору правил.
+"""
+import os
+import queue
+import logging
+import threading
+from typing import Dict, Any, Optional, Set
+
+from ..models.parse_rules import get_parse_rules_db
+from ..models.search_index import get_search_index_db
+from ..models.batch_catalog import get_batch_catalog
+from .parsed_batch import upgrade_cached_batches, reparse_items
+from .batch_cache import get_batch_disk_cache
+from .archive import get_batch_archive
+from .results_parser import ResultsParser
+from .search_index import search_tests
+
+logger = logging.getLogger("lab_parser.reparse")
+
+
+def reparse_search_index(instance_path: str, parser: ResultsParser, definition_id: int,
+                         from_generation: int, to_generation: int) -> Dict[str, Any]:
+    """
+    Перепарсить в поисковом индексе тесты одного анализа у пакетов,
+    проиндексированных поколением from_generation.
+
+    Пакеты, проиндексированные до хранения raw_text (has_raw_text = 0),
+    пропускаются - их перестроит обычная синхронизация индекса. Строки с
+    raw_text None в остальных пакетах - пустые ячейки результатов, их
+    перепарсинг ничего не меняет.
+    """
+    search_db = get_search_index_db(instance_path)
+    stats = {"batches": 0, "rows": 0, "skipped": []}
+
+    for name, entry in search_db.get_indexed_batches().items():
+        if entry["rules_generation"] != from_generation:
+            continue
+
+        if not entry["has_raw_text"]:
+            stats["skipped"].append(name)
+            continue
+
+        rows = search_db.get_batch_results(name)
+
+        updates = []
+        for row in rows:
+            results = {
+                "raw_text": row["raw_text"],
+                "tests": row["tests"],
+                "parse_quality": "parsed" if row["tests"] else "unparsed",
+            }
+            new_results = parser.reparse_definition(results, definition_id)
+            if new_results is None:
+                continue
+            tests = search_tests(new_results["tests"])
+            if tests != row["tests"] or new_results["summary"] != row["summary"]:
+                updates.append({"id": row["id"], "summary": new_results["summary"], "tests": tests})
+
+        if search_db.update_batch_results(name, updates, from_generation, to_generation):
+            stats["batches"] += 1
+            stats["rows"] += len(updates)
+
+    return stats
+
+
+def upgrade_disk_cache(instance_path: str, uploads_subdir: str, disk_cache, parser: ResultsParser,
+                       definition_id: int, from_generation: int, to_generation: int,
+                       done: Set[str]) -> Dict[str, int]:
+    """
+    Перевести на to_generation записи дискового кэша поколения from_generation
+    у пакетов каталога (кроме путей из done - их уже перевёл кэш процесса).
+
+    Записи, распарсенные без правил (parse_quality "basic"), не переводятся -
+    их перепарсят целиком при следующем обращении.
+
+    Returns:
+        Имя пакета -> число перепарсенных записей
+    """
+    catalog = get_batch_catalog(instance_path)
+    archive = get_batch_archive(instance_path)
+    uploads_dir = os.path.join(instance_path, uploads_subdir)
+    upgraded = {}
+    for entry in catalog.list_batches():
+        if entry["alias_of"]:
+            continue
+        path = os.path.abspath(os.path.join(uploads_dir, entry["name"]))
+        if path in done:
+            continue
+        # mtime - как в ключе get_parsed_batch: у файла или, если он удалён, из архива
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            archived = archive.get(entry["name"])
+            if archived is None:
+                continue
+            mtime_ns = archived["mtime_ns"]
+
+        new_key = disk_cache.entry_key(path, mtime_ns, to_generation)
+        items = disk_cache.load(disk_cache.entry_key(path, mtime_ns, from_generation))
+        if items is None or disk_cache.load(new_key) is not None:
+            continue
+        if len(items) and items[0]["results"].get("parse_quality") == "basic":
+            continue
+
+        new_items, changed = reparse_items(items, parser, definition_id)
+        disk_cache.store(new_key, entry["name"], to_generation, new_items)
+        if entry["rules_generation"] == from_generation:
+            catalog.record_parse(entry["name"], len(new_items), to_generation)
+        upgraded[entry["name"]] = changed
+    return upgraded
+
+
+def run_definition_reparse(instance_path: str, definition_id: int,
+                           from_generation: int, to_generation: int,
+                           disk_cache_max_bytes: int = 0, uploads_subdir: str = "uploads") -> Dict[str, Any]:
+    """
+    Применить правку одного анализа к кэшу пакетов и поисковому индексу.
+    Обновлённые пакеты публикуются и в дисковый кэш (если он включён),
+    чтобы другие процессы не парсили их заново; там же переводятся записи,
+    которые распарсили другие процессы.
+
+    Кэши в памяти других процессов не трогаются: их записи старого поколения
+    просто перестают находиться, и пакет поднимается из дискового кэша.
+    Если дисковый кэш выключен, такие процессы перепарсят пакеты целиком.
+
+    Если между поколениями была ещё какая-то правка (to_generation != from_generation + 1)
+    или правила уже ушли дальше, частичный перепарсинг некорректен -
+    такие данные перепарсятся целиком при следующем обращении.
+    """
+    rules_db = get_parse_rules_db(instance_path)
+    if to_generation != from_generation + 1 or rules_db.get_rules_generation() != to_generation:
+        return {"skipped": True}
+
+    rules = rules_db.get_all_rules()
+    # Правка между проверкой поколения и чтением правил: правила уже не to_generation
+    if not rules or rules_db.get_rules_generation() != to_generation:
+        return {"skipped": True}
+
+    upgraded = upgrade_cached_batches(definition_id, from_generation, to_generation, rules)
+    disk_cache = get_batch_disk_cache(instance_path, disk_cache_max_bytes) if disk_cache_max_bytes else None
+
+    # Каталог: пакеты из кэша теперь соответствуют новому поколению правил
+    catalog = get_batch_catalog(instance_path)
+    cached = {}
+    done = set()
+    for (path, mtime_ns, generation), (batch, changed) in upgraded.items():
+        cached[batch.name] = changed
+        done.add(path)
+        if disk_cache is not None:
+            disk_cache.store(disk_cache.entry_key(path, mtime_ns, generation), batch.name, generation, batch.items)
+        entry = catalog.get_batch(batch.name)
+        if entry and entry["rules_generation"] == from_generation:
+            catalog.record_parse(batch.name, entry["row_count"], to_generation)
+
+    parser = ResultsParser(rules)
+    result = {"cached": cached}
+    if disk_cache is not None:
+        result["disk_cache"] = upgrade_disk_cache(instance_path, uploads_subdir, disk_cache, parser,
+                                                  definition_id, from_generation, to_generation, done)
+    result["search_index"] = reparse_search_index(instance_path, parser, definition_id,
+                                                  from_generation, to_generation)
+    return result
+
+
+# ===== Фоновая очередь =====
+
+_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+_worker_lock = threading.Lock()
+_worker: Optional[threading.Thread] = None
+_last_result: Dict[str, Any] = {}
+
+
+def _work():
+    while True:
+        job = _queue.get()
+        try:
+            result = run_definition_reparse(**job)
+        except Exception as e:
+            logger.exception("Ошибка частичного перепарсинга анализа %s", job["definition_id"])
+            result = {"error": str(e)}
+        _last_result.clear()
+        _last_result.update(job=job, result=result)
+        _queue.task_done()
+
+
+def schedule_definition_reparse(instance_path: str, definition_id: int,
+                                from_generation: int, to_generation: int,
+                                disk_cache_max_bytes: int = 0, uploads_subdir: str = "uploads") -> None:
+    """Поставить частичный перепарсинг в очередь фонового потока"""
+    global _worker
+
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, name="definition-reparse", daemon=True)
+            _worker.start()
+
+    _queue.put({
+        "instance_path": instance_path,
+        "definition_id": definition_id,
+        "from_generation": from_generation,
+        "to_generation": to_generation,
+        "disk_cache_max_bytes": disk_cache_max_bytes,
+        "uploads_subdir": uploads_subdir,
+    })
+
+
+def get_reparse_status() -> Dict[str, Any]:
+    """Состояние очереди: сколько задач ждёт и результат последней"""
+    return {"pending": _queue.unfinished_tasks, "last": dict(_last_result)}
+
+
+def wait_for_reparse():
+    """Дождаться выполнения всех поставленных задач (для скриптов и бенчмарков)"""
+    _queue.join()
@@ -5,6 +5,36 @@
 import re
 from typing import List, Dict, Any, Optional, Tuple
 
+from .metrics import phase
+
+# Типы значений показателей: 1 - обнаружено/не обнаружено, 2 - число, 3 - иное,
+# 4 - определить автоматически по самому значению (тест получает найденный тип 1-3)
+VALUE_TYPE_DETECTED = 1
+VALUE_TYPE_NUMBER = 2
+VALUE_TYPE_TEXT = 3
+VALUE_TYPE_AUTO = 4
+VALUE_TYPES = (VALUE_TYPE_DETECTED, VALUE_TYPE_NUMBER, VALUE_TYPE_TEXT, VALUE_TYPE_AUTO)
+
+# Регулярные выражения извлечения значений компилируются один раз, а не на каждый тест.
+# Начало следующего предложения: пробел + заглавная русская буква
+_SENTENCE_CUTOFF = re.compile(r'\s+[А-ЯЁ][а-яё]')
+_DETECTED_WORDS = r'не\s+обнаружен[оа]?|обнаружен[оа]?|отрицательн(?:ый|ая|ое)|положительн(?:ый|ая|ое)|отриц\.|полож\.'
+_DETECTED_VALUE = re.compile(r'(' + _DETECTED_WORDS + r')\s*$', re.IGNORECASE)
+_DECIMAL_VALUE = re.compile(r'(\d+[.,]\d{1,3})\s*$')
+_INTEGER_VALUE = re.compile(r'(\d+)\s*$')
+_DASH_VALUE = re.compile(r'-\s+([^\s-][^-]+?)\s*$')
+
+# Автоопределение - один проход по значению: слово-результат, число (десятичная
+# точка или запятая, "<"/">", диапазон "1-3") или любой текст - по словам до начала
+# следующего предложения (пробел + заглавная русская буква) или конца.
+# Номер совпавшей группы и есть тип значения (1-3).
+_AUTO_VALUE = re.compile(
+    r'(?:(?P<detected>(?i:' + _DETECTED_WORDS + r'))'
+    r'|(?P<number>(?:[<>≤≥]=?\s*)?\d+(?:[.,]\d+)?(?:\s*[-–]\s*\d+(?:[.,]\d+)?)?)'
+    r'|(?P<text>\S+(?:\s+(?![А-ЯЁ][а-яё])\S+)*))'
+    r'(?=\s+[А-ЯЁ][а-яё]|\s*$)'
+)
+
 
 class ResultsParser:
     """Парсер результатов на основе правил из БД с поддержкой множественных показателей"""
@@ -52,88 +82,81 @@ class ResultsParser:
                 # Если не удалось скомпилировать регекс, пропускаем правило
                 continue
 
-    def parse_results(self, raw_text: Optional[str]) -> Dict[str, Any]:
+        # Группируем правила по test_definition_id (для анализов с несколькими показателями).
+        # Группировка не зависит от текста, поэтому делается один раз, а не для каждой записи
+        self.rules_by_definition = {}
+        for compiled_rule in self.compiled_rules:
+            rule = compiled_rule['rule']
+            def_id = rule.get('test_definition_id', rule['id'])  # Fallback на id для старых данных
+            self.rules_by_definition.setdefault(def_id, []).append(compiled_rule)
+
+    def _parse_definition(self, def_id: Any, indicators: List[Dict[str, Any]], raw_text: str) -> List[Dict[str, Any]]:
         """
-        Парсит строку с результатами анализов
+        Ищет в тексте показатели одного анализа
 
         Args:
-            raw_text: Сырой текст из колонки "Результаты исследования"
+            def_id: ID определения анализа
+            indicators: Скомпилированные правила показателей этого анализа
+            raw_text: Текст результатов (уже без пробелов по краям)
 
         Returns:
-            Словарь с распарсенными тестами
+            Список найденных тестов этого анализа
         """
-        if not raw_text or not isinstance(raw_text, str):
-            return {
-                "tests": [],
-                "summary": None,
-                "raw_text": raw_text,
-                "parse_quality": "none"
-            }
-
-        raw_text = raw_text.strip()
         tests = []
-        matched_rules = []
 
-        # Группируем правила по test_definition_id (для анализов с несколькими показателями)
-        rules_by_definition = {}
-        for compiled_rule in self.compiled_rules:
+        # Создаем рабочую копию текста для этого анализа
+        working_text = raw_text
+
+        # Для каждого показателя в этом анализе
+        for indicator_index, compiled_rule in enumerate(indicators, start=1):
             rule = compiled_rule['rule']
-            def_id = rule.get('test_definition_id', rule['id'])  # Fallback на id для старых данных
+            pattern = compiled_rule['pattern']
+            value_type = compiled_rule['value_type']
 
-            if def_id not in rules_by_definition:
-                rules_by_definition[def_id] = []
-            rules_by_definition[def_id].append(compiled_rule)
+            match = pattern.search(working_text)
+            if match:
+                # Получили захваченное значение (сырое)
+                captured_value = match.group(1).strip()
 
-        # Обрабатываем каждый анализ (группу показателей)
-        for def_id, indicators in rules_by_definition.items():
-            # Создаем рабочую копию текста для этого анализа
-            working_text = raw_text
-
-            # Для каждого показателя в этом анализе
-            for compiled_rule in indicators:
-                rule = compiled_rule['rule']
-                pattern = compiled_rule['pattern']
-                value_type = compiled_rule['value_type']
-
-                match = pattern.search(working_text)
-                if match:
-                    # Получили захваченное значение (сырое)
-                    captured_value = match.group(1).strip()
-
-                    # Извлекаем конечное значение в зависимости от типа
+                # Извлекаем конечное значение в зависимости от типа
+                if value_type == VALUE_TYPE_AUTO:
+                    extracted_value, test_value_type = self._extract_auto_value(captured_value)
+                else:
                     extracted_value = self._extract_value_by_type(captured_value, value_type)
-
-                    if extracted_value:
-                        # Нормализация значения в зависимости от типа
-                        normalized_value = self._normalize_value(extracted_value, value_type)
-
-                        # Формируем название показателя
-                        # Если у анализа несколько показателей, добавляем номер
-                        indicator_name = rule['short_name']
-                        if len(indicators) > 1:
-                            # TODO: В будущем можно добавить более осмысленные суффиксы
-                            # например, на основе display_order или is_key_indicator
-                            indicator_index = indicators.index(compiled_rule) + 1
-                            indicator_name = f"{rule['short_name']}-{indicator_index}"
-
-                        tests.append({
-                            "name": indicator_name,
-                            "value": normalized_value,
-                            "raw_value": extracted_value,
-                            "value_type": value_type,
-                            "rule_id": rule['id'],
-                            "test_definition_id": def_id,
-                            "is_key_indicator": rule.get('is_key_indicator', True),
-                            "is_required": rule.get('is_required', True)
-                        })
-
-                        matched_rules.append(rule['id'])
-
-                        # ВАЖНО: Удаляем найденную часть из рабочего текста
-                        # чтобы следующий показатель этого же анализа искался в оставшейся части
-                        matched_text = match.group(0)
-                        working_text = working_text.replace(matched_text, '', 1)  # Удаляем только первое вхождение
-
+                    test_value_type = value_type
+
+                if extracted_value:
+                    # Нормализация значения в зависимости от типа
+                    normalized_value = self._normalize_value(extracted_value, test_value_type)
+
+                    # Формируем название показателя
+                    # Если у анализа несколько показателей, добавляем номер
+                    indicator_name = rule['short_name']
+                    if len(indicators) > 1:
+                        # TODO: В будущем можно добавить более осмысленные суффиксы
+                        # например, на основе display_order или is_key_indicator
+                        indicator_name = f"{rule['short_name']}-{indicator_index}"
+
+                    tests.append({
+                        "name": indicator_name,
+                        "value": normalized_value,
+                        "raw_value": extracted_value,
+                        "value_type": test_value_type,
+                        "rule_id": rule['id'],
+                        "test_definition_id": def_id,
+                        "is_key_indicator": rule.get('is_key_indicator', True),
+                        "is_required": rule.get('is_required', True)
+                    })
+
+                    # ВАЖНО: Удаляем найденную часть из рабочего текста
+                    # чтобы следующий показатель этого же анализа искался в оставшейся части
+                    matched_text = match.group(0)
+                    working_text = working_text.replace(matched_text, '', 1)  # Удаляем только первое вхождение
+
+        return tests
+
+    def _make_results(self, tests: List[Dict[str, Any]], raw_text: str) -> Dict[str, Any]:
+        """Собирает итоговый словарь результатов по найденным тестам"""
         # Формируем краткую сводку
         summary = self._build_summary(tests, raw_text)
 
@@ -148,9 +171,80 @@ class ResultsParser:
             "summary": summary,
             "raw_text": raw_text,
             "parse_quality": parse_quality,
-            "matched_rules": matched_rules
+            "matched_rules": [test["rule_id"] for test in tests]
         }
 
+    def parse_results(self, raw_text: Optional[str]) -> Dict[str, Any]:
+        """
+        Парсит строку с результатами анализов
+
+        Args:
+            raw_text: Сырой текст из колонки "Результаты исследования"
+
+        Returns:
+            Словарь с распарсенными тестами
+        """
+        if not raw_text or not isinstance(raw_text, str):
+            return {
+                "tests": [],
+                "summary": None,
+                "raw_text": raw_text,
+                "parse_quality": "none"
+            }
+
+        raw_text = raw_text.strip()
+        tests = []
+
+        # Обрабатываем каждый анализ (группу показателей)
+        for def_id, indicators in self.rules_by_definition.items():
+            tests.extend(self._parse_definition(def_id, indicators, raw_text))
+
+        return self._make_results(tests, raw_text)
+
+    def reparse_definition(self, results: Dict[str, Any], definition_id: Any) -> Optional[Dict[str, Any]]:
+        """
+        Повторно применяет к уже распарсенной записи только показатели одного анализа.
+
+        Тесты остальных анализов берутся из results как есть, тесты анализа
+        definition_id заменяются (или удаляются, если анализа больше нет среди правил).
+        Результат совпадает с полным parse_results по тем же правилам.
+
+        Args:
+            results: Результаты записи, распарсенные предыдущей версией правил
+            definition_id: ID изменённого определения анализа
+
+        Returns:
+            Новый словарь результатов или None, если для этой записи ничего не изменилось
+        """
+        raw_text = results.get("raw_text")
+        if not raw_text or not isinstance(raw_text, str):
+            return None
+
+        raw_text = raw_text.strip()
+        indicators = self.rules_by_definition.get(definition_id)
+        new_tests = self._parse_definition(definition_id, indicators, raw_text) if indicators else []
+
+        old_tests = results.get("tests", [])
+        old_def_tests = [t for t in old_tests if t.get("test_definition_id", t.get("rule_id")) == definition_id]
+        if old_def_tests == new_tests and results.get("parse_quality") in ("parsed", "unparsed"):
+            return None
+
+        # Собираем тесты в порядке анализов текущих правил
+        groups: Dict[Any, List[Dict[str, Any]]] = {}
+        for test in old_tests:
+            def_id = test.get("test_definition_id", test.get("rule_id"))
+            if def_id != definition_id:
+                groups.setdefault(def_id, []).append(test)
+        groups[definition_id] = new_tests
+
+        tests = []
+        for def_id in self.rules_by_definition:
+            tests.extend(groups.pop(def_id, []))
+        for remaining in groups.values():
+            tests.extend(remaining)
+
+        return self._make_results(tests, raw_text)
+
     def _extract_value_by_type(self, captured_text: str, value_type: int) -> Optional[str]:
         """
         Извлекает значение из захваченного текста в зависимости от типа
@@ -167,46 +261,54 @@ class ResultsParser:
 
         # Обрезаем текст перед заглавной буквой (начало следующего предложения)
         # Ищем паттерн: пробел + заглавная русская буква
-        cutoff = re.search(r'\s+[А-ЯЁ][а-яё]', captured_text)
+        cutoff = _SENTENCE_CUTOFF.search(captured_text)
         if cutoff:
             captured_text = captured_text[:cutoff.start()].strip()
 
-        # TODO: БУДУЩЕЕ УЛУЧШЕНИЕ
-        # Здесь можно добавить автоматическое определение типа значения
-        # на основе содержимого captured_text:
-        # - Если найдено число с точкой/запятой -> тип 2
-        # - Если найдено "обнаружено/не обнаружено" -> тип 1
-        # - Иначе -> тип 3
-        # Это позволит парсеру самостоятельно различать показатели в одном анализе
-
         if value_type == 1:
             # Тип 1: Обнаружено/Не обнаружено - ищем в конце строки
-            match = re.search(
-                r'(не\s+обнаружен[оа]?|обнаружен[оа]?|отрицательн(?:ый|ая|ое)|положительн(?:ый|ая|ое)|отриц\.|полож\.)\s*$',
-                captured_text,
-                re.IGNORECASE
-            )
+            match = _DETECTED_VALUE.search(captured_text)
             return match.group(1) if match else None
 
         elif value_type == 2:
             # Тип 2: Числовое значение - извлекаем число с 1-3 знаками после запятой из конца
-            match = re.search(r'(\d+[.,]\d{1,3})\s*$', captured_text)
+            match = _DECIMAL_VALUE.search(captured_text)
             if match:
                 return match.group(1)
             # Если не нашли с запятой, попробуем целое число
-            match = re.search(r'(\d+)\s*$', captured_text)
+            match = _INTEGER_VALUE.search(captured_text)
             return match.group(1) if match else None
 
         else:
             # Тип 3: Произвольное значение - берем от последнего " - " до конца
             # Сначала пробуем найти " - значение"
-            match = re.search(r'-\s+([^\s-][^-]+?)\s*$', captured_text)
+            match = _DASH_VALUE.search(captured_text)
             if match:
                 return match.group(1).strip()
             # Если не нашли " - ", берем последнее слово
             words = captured_text.strip().split()
             return words[-1] if words else None
 
+    def _extract_auto_value(self, captured_text: str) -> Tuple[Optional[str], int]:
+        """
+        Извлекает значение и сам определяет его тип (правила с типом 4)
+
+        В отличие от типов 1-3, значение берётся целиком (до начала следующего
+        предложения), а не его хвост: "менее 0.01" и "Rh+ (положительный)"
+        остаются текстом, "<0,5" и "1-3" - числами.
+
+        Args:
+            captured_text: Захваченный текст (уже без пробелов по краям)
+
+        Returns:
+            (значение или None, тип значения 1-3)
+        """
+        match = _AUTO_VALUE.match(captured_text)
+        if not match:
+            return None, VALUE_TYPE_TEXT
+        value_type = match.lastindex
+        return match.group(value_type), value_type
+
     def _normalize_value(self, value: str, value_type: int) -> str:
         """
         Нормализует значение в зависимости от типа
@@ -282,13 +384,15 @@ def apply_parsing_rules(items: List[Dict[str, Any]], rules: List[Dict[str, Any]]
         # Если правил нет, возвращаем данные без изменений
         return items
 
-    parser = ResultsParser(rules)
+    with phase("rules.compile"):
+        parser = ResultsParser(rules)
 
-    for item in items:
-        raw_text = item.get('results', {}).get('raw_text')
-        parsed = parser.parse_results(raw_text)
+    with phase("rules.parse"):
+        for item in items:
+            raw_text = item.get('results', {}).get('raw_text')
+            parsed = parser.parse_results(raw_text)
 
-        # Обновляем результаты
-        item['results'] = parsed
+            # Обновляем результаты
+            item['results'] = parsed
 
     return items
\ No newline at end of file
@@ -0,0 +1,337 @@
+"""
+Поиск шаблонов в нераспознанных результатах - заготовки новых правил парсинга
+
+Строки, в которых правила не нашли ни одного теста (parse_quality "unparsed"),
+в таблице видны по одной, и правила для них пишутся наугад. Здесь такие строки
+всех пакетов (из глобального индекса, models.search_index) сводятся к шаблонам:
+
+* одинаковые тексты считаются один раз (словарь текст -> число строк);
+* текст режется на исследования ("Определение ...", "Исследование ..." и т.п.),
+  исследование - на заголовок (до ":") и показатели (через ";" или перед "Антитела");
+* в значениях показателей (после " - ") и в показателях без " - " маскируются
+  значения: слова «обнаружено/не обнаружено/отрицательный...» -> <VAL>, числа -> <NUM>,
+  даты -> <DATE>; в названиях маскируются только даты - числа в них
+  (HIV 1, CA 125) различают анализы;
+* исследования группируются по получившейся форме - ключу словаря (хэш-таблица),
+  разбор каждой уникальной формулировки кэшируется, поэтому миллион строк
+  обрабатывается за секунды.
+
+Для каждого шаблона собирается заготовка определения анализа в формате
+POST /api/test-definitions (full_example_text, short_description, indicators)
+по первому встреченному примеру.
+"""
+import re
+import threading
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+from .metrics import phase
+from .results_parser import VALUE_TYPE_AUTO
+
+VALUE_TOKEN = "<VAL>"
+NUMBER_TOKEN = "<NUM>"
+DATE_TOKEN = "<DATE>"
+# Значение показателя после " - " в шаблоне (тип значения собирается отдельно)
+ANY_TOKEN = "<*>"
+
+# Сколько примеров пакетов хранить у шаблона
+MAX_EXAMPLE_BATCHES = 5
+
+# Пробелы в тексте уже схлопнуты (split_segments) - разделитель ровно один пробел.
+# Начало исследования - те же слова, на которых парсер заканчивает значение показателя
+_SEGMENT_SPLIT = re.compile(r" (?=Определение|Исследование|Выявление|Анализ)")
+_PART_SPLIT = re.compile(r" ?; ?| (?=Антитела\b)")
+
+# [0-9] вместо \d и без ведущего lookbehind: первый символ - простой класс,
+# по нему re быстро пропускает текст без цифр
+_DATE = re.compile(r"[0-9]{1,2}[./][0-9]{1,2}[./][0-9]{2,4}(?![0-9])|[0-9]{4}-[0-9]{2}-[0-9]{2}(?![0-9])")
+# Те же значения, что распознаёт тип 1 в ResultsParser._extract_value_by_type
+_VALUE_WORD_RE = r"(?:не\s+обнаружен\w*|обнаружен\w*|отрицательн\w*|положительн\w*|отриц\.|полож\.)"
+_VALUE_WORD = re.compile(r"(?<!\w)" + _VALUE_WORD_RE, re.IGNORECASE)
+# Отдельно стоящие числа: "Ag12" и "H1" - часть названия, а не значение
+_NUMBER = re.compile(r"(?<![\w.,])\d+(?:[.,]\d+)?(?![\w.,]?\w)")
+_ANY_VALUE = re.compile(r"<(?:VAL|NUM|DATE)>")
+
+_IS_VALUE_WORD = re.compile(_VALUE_WORD_RE + r"\s*", re.IGNORECASE)
+_IS_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+
+_TOKEN_TYPES = {VALUE_TOKEN: 1, NUMBER_TOKEN: 2, DATE_TOKEN: 3}
+
+
+def _mask_values(text: str) -> str:
+    text = _DATE.sub(DATE_TOKEN, text)
+    text = _VALUE_WORD.sub(VALUE_TOKEN, text)
+    return _NUMBER.sub(NUMBER_TOKEN, text)
+
+
+def value_type_of(value: str) -> int:
+    """Тип значения показателя так, как его понимает парсер: 1 - обнаружено/не обнаружено, 2 - число, 3 - иное"""
+    if _IS_VALUE_WORD.fullmatch(value):
+        return 1
+    if _IS_NUMBER.fullmatch(value):
+        return 2
+    return 3
+
+
+def split_segments(raw_text: str) -> List[str]:
+    """Текст результатов -> отдельные исследования"""
+    # Обычно пробелы в тексте одиночные - тогда проверка подстрок дешевле, чем пересборка строки
+    if "  " in raw_text or "\n" in raw_text or "\t" in raw_text or "\r" in raw_text or "\xa0" in raw_text:
+        raw_text = " ".join(raw_text.split())
+    return [s for s in _SEGMENT_SPLIT.split(raw_text.strip()) if s]
+
+
+def _split_parts(segment: str) -> Tuple[str, List[str]]:
+    """Исследование -> (заголовок с ":" или "", показатели)"""
+    header, sep, body = segment.partition(":")
+    if not sep:
+        header, body = "", segment
+    else:
+        header += ":"
+    return header, [p for p in _PART_SPLIT.split(body.strip()) if p]
+
+
+def segment_shape(segment: str) -> Tuple[str, Tuple[Optional[int], ...]]:
+    """
+    Форма исследования и типы значений его показателей
+
+    Returns:
+        (шаблон, (тип значения показателя или None, если значения в нём нет, ...))
+    """
+    header, parts = _split_parts(segment)
+    shapes = []
+    types: List[Optional[int]] = []
+    for part in parts:
+        name, dash, value = part.rpartition(" - ")
+        if dash and value:
+            shapes.append(name + " - " + ANY_TOKEN)
+            types.append(value_type_of(value))
+        else:
+            masked = _mask_values(part)
+            tokens = _ANY_VALUE.findall(masked)
+            shapes.append(masked)
+            types.append(_TOKEN_TYPES[tokens[-1]] if tokens else None)
+    body = "; ".join(shapes)
+    # Даты в заголовке и названиях - одной заменой по всему шаблону
+    return _DATE.sub(DATE_TOKEN, f"{header} {body}" if header else body), tuple(types)
+
+
+def _unique_variable_part(pattern: str, value: str, start: int) -> str:
+    """
+    Изменяемая часть, которая встречается в шаблоне ровно один раз:
+    парсер заменяет все её вхождения, поэтому значение "1" в "HIV 1 - 1"
+    расширяется влево до " - 1"
+    """
+    variable = value
+    while pattern.count(variable) > 1 and start > 0:
+        start -= 1
+        variable = pattern[start:start + len(variable) + 1]
+    return variable
+
+
+def _part_indicator(part: str) -> Optional[Tuple[str, str, int]]:
+    """Показатель -> (indicator_pattern, variable_part, тип значения по примеру) или None"""
+    name, dash, value = part.rpartition(" - ")
+    if dash and value:
+        start = len(name) + len(dash)
+        return part, _unique_variable_part(part, value, start), value_type_of(value)
+
+    # Без " - ": значением считается последнее число/слово-значение/дата
+    last = None
+    for regex, value_type in ((_DATE, 3), (_VALUE_WORD, 1), (_NUMBER, 2)):
+        for match in regex.finditer(part):
+            if last is None or match.start() > last[0].start():
+                last = (match, value_type)
+    if last is None:
+        return None
+    match, value_type = last
+    return part, _unique_variable_part(part, match.group(0), match.start()), value_type
+
+
+def _short_description(header: str, segment: str) -> str:
+    text = header.rstrip(":").strip() or segment
+    groups = re.findall(r"\(([^()]{1,60})\)", text)
+    if groups:
+        return groups[-1].strip()
+    return text if len(text) <= 100 else text[:97].rstrip() + "..."
+
+
+def suggest_definition(segment: str, types: Tuple[Optional[int], ...]) -> Optional[Dict[str, Any]]:
+    """
+    Заготовка определения анализа по примеру исследования
+    (формат POST /api/test-definitions) или None, если значений в нём не нашлось
+
+    Args:
+        segment: Пример исследования (как в исходном тексте)
+        types: Типы значений показателей по всем строкам шаблона (см. TemplateMiner)
+    """
+    header, parts = _split_parts(segment)
+    indicators = []
+    for part, value_type in zip(parts, types):
+        found = _part_indicator(part)
+        if found is None or value_type is None:
+            continue
+        pattern, variable_part, _ = found
+        indicators.append({
+            "indicator_pattern": pattern,
+            "variable_part": variable_part,
+            "value_type": value_type,
+            "is_key_indicator": False,
+            "is_required": True,
+            "display_order": len(indicators),
+        })
+    if not indicators:
+        return None
+    # В сводку (ключевой показатель) - последний показатель анализа
+    indicators[-1]["is_key_indicator"] = True
+    return {
+        "full_example_text": segment,
+        "short_description": _short_description(header, segment),
+        "indicators": indicators,
+    }
+
+
+class TemplateMiner:
+    """Накопление шаблонов исследований по строкам без распознанных тестов"""
+
+    def __init__(self):
+        # исследование -> шаблон (разбор одной формулировки - один раз)
+        self._segments: Dict[str, str] = {}
+        # шаблон -> {count, rows, example, batches, types, variants}
+        self._templates: Dict[str, Dict[str, Any]] = {}
+        self.rows = 0
+        self.texts = 0
+
+    def _template_of(self, segment: str) -> str:
+        shape = self._segments.get(segment)
+        if shape is not None:
+            return shape
+        shape, types = segment_shape(segment)
+        template = self._templates.get(shape)
+        if template is None:
+            self._templates[shape] = {"count": 0, "rows": 0, "example": segment,
+                                      "types": [set() if t is not None else None for t in types],
+                                      "batches": set(), "variants": 0, "example_batch": None,
+                                      "example_row_id": None}
+            template = self._templates[shape]
+        template["variants"] += 1
+        for known, value_type in zip(template["types"], types):
+            if known is not None:
+                known.add(value_type)
+        self._segments[segment] = shape
+        return shape
+
+    def add_text(self, raw_text: str, rows: int, batches: Iterable[str], example: Tuple[str, int]):
+        """Учесть текст, встретившийся в rows строках пакетов batches"""
+        self.texts += 1
+        self.rows += rows
+        seen = set()
+        for segment in split_segments(raw_text):
+            shape = self._template_of(segment)
+            template = self._templates[shape]
+            template["count"] += rows
+            if shape in seen:
+                continue
+            seen.add(shape)
+            template["rows"] += rows
+            if template["example_batch"] is None:
+                template["example_batch"], template["example_row_id"] = example
+            if len(template["batches"]) < MAX_EXAMPLE_BATCHES:
+                template["batches"].update(batches)
+
+    def add_rows(self, rows: Iterable[Tuple[str, str, int]]):
+        """Строки (raw_text, batch, row_id): одинаковые тексты сначала сводятся вместе"""
+        texts: Dict[str, list] = {}
+        for raw_text, batch, row_id in rows:
+            entry = texts.get(raw_text)
+            if entry is None:
+                texts[raw_text] = [1, {batch}, (batch, row_id)]
+            else:
+                entry[0] += 1
+                if len(entry[1]) < MAX_EXAMPLE_BATCHES:
+                    entry[1].add(batch)
+        for raw_text, (count, batches, example) in texts.items():
+            self.add_text(raw_text, count, batches, example)
+
+    def results(self, limit: int = 100, min_count: int = 1) -> List[Dict[str, Any]]:
+        """Шаблоны по убыванию числа строк, с заготовками определений"""
+        ranked = sorted(
+            (item for item in self._templates.items() if item[1]["rows"] >= min_count),
+            key=lambda item: (-item[1]["rows"], item[0])
+        )
+        results = []
+        for shape, template in ranked[:limit]:
+            # Тип значения по всем строкам шаблона; если значения разных типов - автоопределение
+            types = tuple(None if seen is None else (next(iter(seen)) if len(seen) == 1 else VALUE_TYPE_AUTO)
+                          for seen in template["types"])
+            results.append({
+                "template": shape,
+                "count": template["count"],
+                "rows": template["rows"],
+                "variants": template["variants"],
+                "batches": sorted(template["batches"]),
+                "example": {
+                    "text": template["example"],
+                    "batch": template["example_batch"],
+                    "row_id": template["example_row_id"],
+                },
+                "definition": suggest_definition(template["example"], types),
+            })
+        return results
+
+    @property
+    def template_count(self) -> int:
+        return len(self._templates)
+
+
+# Последний разбор индекса: (состояние индекса, пакет) -> TemplateMiner
+_mined: Dict[tuple, TemplateMiner] = {}
+_mined_lock = threading.Lock()
+
+
+def mine_templates(rows: Iterable[Tuple[str, str, int]], limit: int = 100,
+                   min_count: int = 1, miner: Optional[TemplateMiner] = None) -> Dict[str, Any]:
+    """
+    Шаблоны нераспознанных результатов
+
+    Args:
+        rows: (raw_text, batch, row_id) - например SearchIndexDB.iter_unparsed_results()
+        limit: Сколько самых частых шаблонов вернуть
+        min_count: Минимальное число строк с шаблоном
+        miner: Уже заполненный TemplateMiner (тогда rows не читаются)
+    """
+    with phase("mining"):
+        if miner is None:
+            miner = TemplateMiner()
+            miner.add_rows(rows)
+        templates = miner.results(limit, min_count)
+    return {
+        "rows": miner.rows,
+        "texts": miner.texts,
+        "total_templates": miner.template_count,
+        "templates": templates,
+    }
+
+
+def mine_search_index(search_db, batch: Optional[str] = None, limit: int = 100,
+                      min_count: int = 1) -> Dict[str, Any]:
+    """
+    Шаблоны нераспознанных строк глобального индекса (всех пакетов или одного).
+
+    Разбор переиспользуется, пока индекс не изменился: ключ - версии
+    проиндексированных пакетов (mtime файла и поколение правил), поэтому после
+    нового правила (повторный парсинг переводит пакеты на новое поколение)
+    или загрузки пакета шаблоны пересчитываются.
+    """
+    state = tuple(sorted((name, info["mtime_ns"], info["rules_generation"])
+                         for name, info in search_db.get_indexed_batches().items()))
+    key = (state, batch)
+    with _mined_lock:
+        miner = _mined.get(key)
+    if miner is None:
+        miner = TemplateMiner()
+        with phase("mining"):
+            miner.add_rows(search_db.iter_unparsed_results(batch))
+        with _mined_lock:
+            _mined.clear()
+            _mined[key] = miner
+    return mine_templates((), limit, min_count, miner=miner)
@@ -0,0 +1,256 @@
+"""
+Глобальный поиск пациентов и образцов по всем загруженным пакетам
+
+Индекс (models.search_index.SearchIndexDB) обновляется инкрементально по
+каталогу пакетов: переиндексируются только новые/изменённые файлы и файлы,
+распарсенные устаревшим поколением правил; удалённые пакеты убираются из индекса.
+Пакет, который не удалось прочитать или распарсить, запоминается вместе с
+версией файла и не перечитывается при каждой проверке - только когда файл изменится.
+"""
+import os
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+from ..models.parse_rules import get_parse_rules_db
+from ..models.search_index import get_search_index_db, SearchIndexDB
+from ..models.batch_catalog import get_batch_catalog
+from ..utils.io_utils import batch_timestamp
+from .parse_excel import read_records_with_parsing
+from .archive import get_batch_archive, load_archived_items
+from .text_index import normalize_text
+
+logger = logging.getLogger("lab_parser.search_index")
+
+
+def normalize_name(text: Optional[str]) -> str:
+    """Нормализованное ФИО для ключа: нижний регистр, ё -> е, одинарные пробелы"""
+    if not text:
+        return ""
+    return " ".join(normalize_text(text).split())
+
+
+def patient_key(patient: Dict[str, Any]) -> Optional[str]:
+    """
+    Ключ личности пациента: "фамилия имя отчество|YYYY-MM-DD".
+    Без фамилии ключ не строится.
+    """
+    if not patient or not patient.get("last_name"):
+        return None
+    fio = normalize_name(" ".join(
+        p for p in (patient.get("last_name"), patient.get("first_name"), patient.get("middle_name")) if p
+    ))
+    return f"{fio}|{patient.get('birth_date') or ''}"
+
+
+def normalize_sample_id(sample_id: Optional[str]) -> Optional[str]:
+    if not sample_id:
+        return None
+    return normalize_text(str(sample_id).strip())
+
+
+def search_tests(tests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Тесты в виде, в котором они хранятся в индексе (только распарсенные значения)"""
+    return [
+        {
+            "name": t.get("name"),
+            "value": t.get("value"),
+            "raw_value": t.get("raw_value"),
+            "value_type": t.get("value_type"),
+            "rule_id": t.get("rule_id"),
+            "test_definition_id": t.get("test_definition_id"),
+            "is_key_indicator": t.get("is_key_indicator"),
+        }
+        for t in tests
+    ]
+
+
+def build_search_rows(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Строки поискового индекса из распарсенных записей пакета"""
+    rows = []
+    for item in items:
+        patient = item.get("patient") or {}
+        results = item.get("results") or {}
+        rows.append({
+            "row_id": item.get("row_id"),
+            "patient_key": patient_key(patient),
+            "last_name": patient.get("last_name"),
+            "first_name": patient.get("first_name"),
+            "middle_name": patient.get("middle_name"),
+            "gender": patient.get("gender"),
+            "birth_date": patient.get("birth_date"),
+            "age_years": patient.get("age_years"),
+            "sample_id": item.get("sample_id"),
+            "sample_key": normalize_sample_id(item.get("sample_id")),
+            "department": item.get("department"),
+            "summary": results.get("summary"),
+            # Для хронологии храним только распарсенные значения
+            "tests": search_tests(results.get("tests", [])),
+            # Исходный текст нужен для частичного перепарсинга при правке одного анализа
+            "raw_text": results.get("raw_text"),
+        })
+    return rows
+
+
+def index_batch(search_db: SearchIndexDB, path: str, rules: List[Dict[str, Any]],
+                rules_generation: int, header_row: Optional[int] = None) -> int:
+    """Проиндексировать один файл пакета. Возвращает количество строк."""
+    items = read_records_with_parsing(path, rules, header_row=header_row)
+    return index_parsed_items(search_db, path, items, rules_generation)
+
+
+def index_parsed_items(search_db: SearchIndexDB, path: str, items: List[Dict[str, Any]],
+                       rules_generation: int, mtime_ns: Optional[int] = None) -> int:
+    """
+    Проиндексировать уже распарсенные записи файла пакета. Возвращает количество строк.
+    mtime_ns - версия файла, если самого файла уже нет (пакет из архива).
+    """
+    name = os.path.basename(path)
+    if mtime_ns is None:
+        mtime_ns = os.stat(path).st_mtime_ns
+    rows = build_search_rows(items)
+    search_db.replace_batch(
+        batch=name,
+        mtime_ns=mtime_ns,
+        rules_generation=rules_generation,
+        batch_time=batch_timestamp(name, mtime_ns / 1e9).isoformat(),
+        rows=rows,
+    )
+    return len(rows)
+
+
+def _pending_batches(instance_path: str):
+    """
+    Сравнивает поисковый индекс с каталогом пакетов.
+
+    Returns:
+        (пакеты каталога, которые нужно (пере)индексировать; имена, которых в каталоге больше нет;
+         текущее поколение правил)
+    """
+    search_db = get_search_index_db(instance_path)
+    generation = get_parse_rules_db(instance_path).get_rules_generation()
+    indexed = search_db.get_indexed_batches()
+    failed = search_db.get_failed_batches()
+    # Псевдонимы (повторные загрузки того же содержимого) не индексируем - строки совпадают
+    batches = [b for b in get_batch_catalog(instance_path).list_batches() if not b["alias_of"]]
+
+    pending = []
+    for batch in batches:
+        if batch["name"] in failed and failed[batch["name"]]["mtime_ns"] == batch["mtime_ns"]:
+            continue  # эта версия файла уже не прочиталась
+        entry = indexed.get(batch["name"])
+        if not entry or entry["mtime_ns"] != batch["mtime_ns"] or entry["rules_generation"] != generation:
+            pending.append(batch)
+    removed = (set(indexed) | set(failed)) - {b["name"] for b in batches}
+    return pending, removed, generation
+
+
+def sync_search_index(instance_path: str, uploads_subdir: str) -> Dict[str, Any]:
+    """
+    Привести индекс в соответствие с каталогом пакетов.
+
+    Returns:
+        Статистика: сколько пакетов проиндексировано, удалено, с ошибками
+    """
+    search_db = get_search_index_db(instance_path)
+    pending, removed, generation = _pending_batches(instance_path)
+    uploads_dir = os.path.join(instance_path, uploads_subdir)
+    stats = {"indexed": 0, "removed": 0, "failed": [], "rows": 0}
+
+    rules = get_parse_rules_db(instance_path).get_all_rules() if pending else []
+    archive = get_batch_archive(instance_path)
+    for batch in pending:
+        path = os.path.join(uploads_dir, batch["name"])
+        try:
+            if os.path.isfile(path) or archive.get(batch["name"]) is None:
+                stats["rows"] += index_batch(search_db, path, rules, generation, batch["header_row"])
+            else:
+                # Исходный файл удалён после архивации - записи из архива
+                items = load_archived_items(archive, batch["name"], rules, generation)
+                stats["rows"] += index_parsed_items(search_db, path, items, generation, batch["mtime_ns"])
+            stats["indexed"] += 1
+        except Exception as e:
+            logger.warning("Пакет %s не проиндексирован: %s", batch["name"], e)
+            search_db.record_failure(batch["name"], batch["mtime_ns"], str(e))
+            stats["failed"].append({"batch": batch["name"], "error": str(e)})
+
+    for name in removed:
+        search_db.delete_batch(name)
+        stats["removed"] += 1
+
+    return stats
+
+
+# ===== Фоновая синхронизация =====
+
+_sync_lock = threading.Lock()
+_sync_thread: Optional[threading.Thread] = None
+
+
+def is_sync_running() -> bool:
+    return _sync_thread is not None and _sync_thread.is_alive()
+
+
+def start_background_sync(instance_path: str, uploads_subdir: str) -> bool:
+    """
+    Запустить синхронизацию индекса в фоновом потоке (если она ещё не идёт).
+    Возвращает True, если поток запущен этим вызовом.
+    """
+    global _sync_thread
+
+    with _sync_lock:
+        if is_sync_running():
+            return False
+
+        def _run():
+            try:
+                sync_search_index(instance_path, uploads_subdir)
+            except Exception:
+                logger.exception("Ошибка синхронизации поискового индекса")
+
+        _sync_thread = threading.Thread(target=_run, name="search-index-sync", daemon=True)
+        _sync_thread.start()
+        return True
+
+
+# instance_path -> (поколение правил, версия каталога), при которых индекс был в порядке
+_in_sync: Dict[str, Tuple[int, int]] = {}
+
+
+def needs_sync(instance_path: str) -> bool:
+    """
+    Есть ли пакеты, не отражённые в индексе (без парсинга).
+
+    Полное сравнение каталога с индексом - только если с последней проверки,
+    где всё сошлось, изменились правила или каталог; иначе это два однострочных
+    запроса к parse_rules.db. Индекс другие процессы могут только дополнить,
+    поэтому запомненное "в порядке" не устаревает, пока не изменились каталог и правила.
+    """
+    state = (get_parse_rules_db(instance_path).get_rules_generation(),
+             get_batch_catalog(instance_path).get_version())
+    if _in_sync.get(instance_path) == state:
+        return False
+    pending, removed, _ = _pending_batches(instance_path)
+    if pending or removed:
+        return True
+    _in_sync[instance_path] = state
+    return False
+
+
+def build_timeline(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Хронология пациента: события (строки пакетов по времени) и ряды значений
+    по каждому анализу (имя показателя -> [{batch_time, value, raw_value}, ...]).
+    """
+    series: Dict[str, List[Dict[str, Any]]] = {}
+    for row in rows:
+        for test in row["tests"]:
+            series.setdefault(test["name"], []).append({
+                "batch": row["batch"],
+                "batch_time": row["batch_time"],
+                "sample_id": row["sample_id"],
+                "value": test["value"],
+                "raw_value": test["raw_value"],
+                "value_type": test["value_type"],
+            })
+    return {"events": rows, "series": series}
@@ -0,0 +1,362 @@
+"""
+Сводная статистика по пакетам для заведующих и графиков
+
+* положительные / отрицательные результаты (тип 1, значения "+"/"-")
+  по каждому показателю - всего, по отделениям и по дням;
+* распределения числовых результатов (тип 2): count/mean/std, квантили,
+  гистограмма, а также count/mean/median по отделениям и по дням.
+
+День записи - день загрузки её пакета (uploaded_at в каталоге): журналы
+выгружаются из ЛИС за день, своей даты у строки нет.
+
+Считается без циклов по записям: из колонок пакета (CompactRecords) строится
+таблица тестов с типизированными колонками - коды значений и отделений
+переводятся в знак/число/категорию через таблицы поиска по словарю значений,
+дальше группировки pandas. Кэш двухуровневый: таблица тестов пакета -
+на (файл, mtime, поколение правил, день), готовый ответ - на (набор пакетов,
+поколение правил), так что смена диапазона дат не перечитывает пакеты.
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import List, Dict, Any, Optional, Tuple, Callable, TYPE_CHECKING
+
+import numpy as np
+
+from .metrics import phase
+
+if TYPE_CHECKING:
+    # pandas импортируется при первом расчёте, а не при create_app()
+    import pandas as pd
+
+HISTOGRAM_BINS = 20
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Сколько готовых ответов держать в памяти процесса
+RESULTS_CACHE_SIZE = 16
+
+
+class StatsError(ValueError):
+    """Неверный выбор пакетов (даты, имя пакета)"""
+
+
+def batch_day(entry: Dict[str, Any]) -> str:
+    """День пакета (YYYY-MM-DD) по времени загрузки из каталога"""
+    return entry["uploaded_at"][:10]
+
+
+def select_batches(catalog, batch: Optional[str] = None, date_from: Optional[str] = None,
+                   date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Пакеты для статистики: один пакет по имени, пакеты за диапазон дней (включительно)
+    или последний загруженный. Повторные загрузки того же содержимого (псевдонимы)
+    учитываются один раз - в день первой загрузки.
+
+    Returns:
+        [{"name": пакет, "data_name": чьи данные читать, "day": YYYY-MM-DD, "mtime_ns": версия файла
+          данных из каталога}, ...] по времени загрузки
+    """
+    if batch:
+        entry = catalog.get_batch(os.path.basename(batch))
+        if not entry:
+            return []
+        entries = [entry]
+    elif date_from or date_to:
+        try:
+            start = date.fromisoformat(date_from) if date_from else date.min
+            end = date.fromisoformat(date_to) if date_to else date.max
+        except ValueError:
+            raise StatsError("date_from/date_to must be YYYY-MM-DD")
+        if start > end:
+            raise StatsError("date_from must not be after date_to")
+        entries = [b for b in reversed(catalog.list_batches())
+                   if start <= date.fromisoformat(batch_day(b)) <= end]
+    else:
+        latest = catalog.get_latest_batch()
+        entries = [latest] if latest else []
+
+    selected, seen = [], set()
+    for entry in entries:
+        target = catalog.resolve(entry["name"]) or entry
+        if target["name"] in seen:
+            continue
+        seen.add(target["name"])
+        selected.append({"name": entry["name"], "data_name": target["name"], "day": batch_day(entry),
+                         "mtime_ns": target["mtime_ns"]})
+    return selected
+
+
+# ===== Таблица тестов пакета =====
+
+def batch_tests_frame(batch, day: str) -> Tuple["pd.DataFrame", Dict[int, Tuple[str, Optional[str]]]]:
+    """
+    Тесты пакета типов 1 и 2 одной таблицей:
+    rule_id, value_type, sign (1 "+", -1 "-", 0 иное), number (float, NaN - не число),
+    department (категория), day. Плюс (имя показателя, название анализа) для каждого rule_id.
+    """
+    import pandas as pd
+
+    records = batch.items
+    value_type = records.tests["value_type"]
+    rule_id = records.tests["rule_id"]
+    keep = np.isin(value_type.values, (1, 2)) & ~value_type.nulls & ~rule_id.nulls
+
+    # Значения - коды в словарь: знак и число считаются один раз на уникальное значение
+    value = records.tests["value"]
+    vocab = pd.Series(value.vocab, dtype=object)
+    sign_lut = np.zeros(len(vocab) + 1, dtype=np.int8)  # последний элемент - для кода -1 (нет значения)
+    sign_lut[:len(vocab)] = np.where(vocab == "+", 1, np.where(vocab == "-", -1, 0))
+    number_lut = np.full(len(vocab) + 1, np.nan)
+    number_lut[:len(vocab)] = pd.to_numeric(vocab.str.replace(",", ".", regex=False).str.strip(),
+                                            errors="coerce").to_numpy(dtype=float)
+    codes = value.codes[keep]
+
+    departments = records.rows["department"]
+    test_rows = records.test_rows()[keep]
+    types = value_type.values[keep].astype(np.int8)
+
+    frame = pd.DataFrame({
+        "rule_id": rule_id.values[keep],
+        "value_type": types,
+        "sign": np.where(types == 1, sign_lut[codes], 0).astype(np.int8),
+        "number": np.where(types == 2, number_lut[codes], np.nan),
+        "department": pd.Categorical.from_codes(departments.codes[test_rows], categories=departments.vocab),
+    })
+    frame["day"] = day
+
+    # Имя показателя - по первому тесту каждого правила
+    names = records.tests["name"]
+    rule_ids, first = np.unique(frame["rule_id"].to_numpy(), return_index=True)
+    first_names = names.take(np.flatnonzero(keep)[first])
+    return frame, {
+        rule_id: (name, (batch.rules_map.get(rule_id) or {}).get("short_name"))
+        for rule_id, name in zip(rule_ids.tolist(), first_names)
+    }
+
+
+class _BatchPart:
+    __slots__ = ("frame", "names", "records")
+
+    def __init__(self, frame: "pd.DataFrame", names: Dict[int, Tuple[str, Optional[str]]], records: int):
+        self.frame = frame
+        self.names = names
+        self.records = records
+
+
+_parts: "OrderedDict[tuple, _BatchPart]" = OrderedDict()
+_results: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _lru_get(cache: OrderedDict, key):
+    with _cache_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+
+def _lru_put(cache: OrderedDict, key, value, max_entries: int):
+    with _cache_lock:
+        cache[key] = value
+        while len(cache) > max_entries:
+            cache.popitem(last=False)
+
+
+def clear_stats_cache():
+    with _cache_lock:
+        _parts.clear()
+        _results.clear()
+
+
+# ===== Агрегаты =====
+
+def _group_key(value) -> Optional[str]:
+    return None if value is None or (isinstance(value, float) and np.isnan(value)) else value
+
+
+def _positivity(frame: "pd.DataFrame") -> Dict[int, Dict[str, Any]]:
+    """Положительные/отрицательные по показателям: всего, по отделениям, по дням"""
+    import pandas as pd
+
+    flags = pd.DataFrame({
+        "rule_id": frame["rule_id"],
+        "department": frame["department"].astype(object),
+        "day": frame["day"],
+        "positive": frame["sign"] == 1,
+        "negative": frame["sign"] == -1,
+    })
+
+    def counts(keys):
+        grouped = flags.groupby(keys, sort=True, dropna=False).agg(
+            total=("positive", "size"), positive=("positive", "sum"), negative=("negative", "sum"))
+        grouped["other"] = grouped["total"] - grouped["positive"] - grouped["negative"]
+        determinate = grouped["positive"] + grouped["negative"]
+        # Доля положительных - среди результатов "+"/"-", прочие значения не учитываются
+        grouped["positive_rate"] = (grouped["positive"] / determinate.where(determinate > 0)).round(4)
+        # Групп - показатели x отделения/дни, а не записи: дальше обычные словари
+        return grouped.reset_index().to_dict("records")
+
+    result: Dict[int, Dict[str, Any]] = {}
+    for row in counts("rule_id"):
+        result[row["rule_id"]] = dict(_counts_dict(row), by_department=[], by_day=[])
+    for row in counts(["rule_id", "department"]):
+        result[row["rule_id"]]["by_department"].append(
+            dict(department=_group_key(row["department"]), **_counts_dict(row)))
+    for row in counts(["rule_id", "day"]):
+        result[row["rule_id"]]["by_day"].append(dict(day=row["day"], **_counts_dict(row)))
+    return result
+
+
+def _counts_dict(row) -> Dict[str, Any]:
+    rate = row["positive_rate"]
+    return {
+        "total": int(row["total"]),
+        "positive": int(row["positive"]),
+        "negative": int(row["negative"]),
+        "other": int(row["other"]),
+        "positive_rate": None if _isnan(rate) else float(rate),
+    }
+
+
+def _histograms(frame: "pd.DataFrame", low: "pd.Series", high: "pd.Series") -> Dict[int, Dict[str, List]]:
+    """Гистограммы всех показателей сразу: номер корзины по (x - min) / ширина, затем bincount"""
+    rule_ids = low.index.to_numpy()
+    position = np.searchsorted(rule_ids, frame["rule_id"].to_numpy())
+    lo, hi = low.to_numpy()[position], high.to_numpy()[position]
+    width = np.where(hi > lo, (hi - lo) / HISTOGRAM_BINS, 1.0)
+    bins = np.clip(((frame["number"].to_numpy() - lo) / width).astype(np.int64), 0, HISTOGRAM_BINS - 1)
+    counts = np.bincount(position * HISTOGRAM_BINS + bins,
+                         minlength=len(rule_ids) * HISTOGRAM_BINS).reshape(len(rule_ids), HISTOGRAM_BINS)
+
+    result = {}
+    for i, rule_id in enumerate(rule_ids.tolist()):
+        lo_r, hi_r = float(low.iloc[i]), float(high.iloc[i])
+        if hi_r > lo_r:
+            edges = np.linspace(lo_r, hi_r, HISTOGRAM_BINS + 1).round(6).tolist()
+            result[rule_id] = {"edges": edges, "counts": counts[i].tolist()}
+        else:
+            # Все значения одинаковые - одна корзина
+            result[rule_id] = {"edges": [lo_r, hi_r], "counts": [int(counts[i].sum())]}
+    return result
+
+
+def _numeric(frame: "pd.DataFrame") -> Dict[int, Dict[str, Any]]:
+    """Распределения числовых результатов по показателям"""
+    numbers = frame.loc[frame["number"].notna(), ["rule_id", "number", "department", "day"]]
+    if numbers.empty:
+        return {}
+    numbers = numbers.assign(department=numbers["department"].astype(object))
+
+    grouped = numbers.groupby("rule_id", sort=True)["number"]
+    summary = grouped.agg(["count", "mean", "std", "min", "max"])
+    quantiles = grouped.quantile(list(QUANTILES)).unstack()
+    histograms = _histograms(numbers, summary["min"], summary["max"])
+
+    result: Dict[int, Dict[str, Any]] = {}
+    for row in summary.reset_index().to_dict("records"):
+        rule_id = row["rule_id"]
+        result[rule_id] = {
+            "count": int(row["count"]),
+            "mean": _round(row["mean"]),
+            "std": _round(row["std"]),
+            "min": _round(row["min"]),
+            "max": _round(row["max"]),
+            "quantiles": {f"p{int(q * 100)}": _round(quantiles.loc[rule_id, q]) for q in QUANTILES},
+            "histogram": histograms[rule_id],
+            "by_department": [],
+            "by_day": [],
+        }
+
+    for key, field in (("department", "by_department"), ("day", "by_day")):
+        parts = numbers.groupby(["rule_id", key], sort=True, dropna=False)["number"].agg(["count", "mean", "median"])
+        for row in parts.reset_index().to_dict("records"):
+            result[row["rule_id"]][field].append({
+                key: _group_key(row[key]),
+                "count": int(row["count"]),
+                "mean": _round(row["mean"]),
+                "median": _round(row["median"]),
+            })
+    return result
+
+
+def _isnan(value) -> bool:
+    return value is None or np.isnan(value)
+
+
+def _round(value) -> Optional[float]:
+    return None if _isnan(value) else round(float(value), 6)
+
+
+def compute_stats(frame: "pd.DataFrame", names: Dict[int, Tuple[str, Optional[str]]]) -> Dict[str, Any]:
+    """Агрегаты по таблице тестов (см. batch_tests_frame)"""
+    positivity = _positivity(frame[frame["value_type"] == 1])
+    numeric = _numeric(frame[frame["value_type"] == 2])
+
+    def describe(rule_id: int) -> Dict[str, Any]:
+        name, short_name = names.get(rule_id, (None, None))
+        return {"rule_id": rule_id, "name": name, "short_name": short_name}
+
+    def ordered(stats: Dict[int, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        items = [dict(describe(rule_id), **values) for rule_id, values in stats.items()]
+        return sorted(items, key=lambda s: (s["name"] or "", s["rule_id"]))
+
+    return {"positivity": ordered(positivity), "numeric": ordered(numeric)}
+
+
+def get_stats(batches: List[Dict[str, Any]], uploads_dir: str, load: Callable[[str], Any],
+              rules_generation: int, max_parts: int = 32) -> Dict[str, Any]:
+    """
+    Статистика по выбранным пакетам (см. select_batches).
+
+    load(path) возвращает распарсенный пакет (get_parsed_batch); он вызывается
+    только для пакетов, чьей таблицы тестов нет в кэше. Пакет, чей исходный файл
+    удалён после архивации, load читает из архива (services.archive) - версия
+    файла тогда берётся из каталога.
+    """
+    sources = []
+    for entry in batches:
+        path = os.path.join(uploads_dir, entry["data_name"])
+        mtime_ns = os.stat(path).st_mtime_ns if os.path.isfile(path) else entry["mtime_ns"]
+        sources.append((entry, path, mtime_ns))
+
+    key = (tuple((os.path.abspath(path), mtime_ns, entry["day"]) for entry, path, mtime_ns in sources),
+           rules_generation)
+    cached = _lru_get(_results, key)
+    if cached is not None:
+        return cached
+
+    parts = []
+    for entry, path, mtime_ns in sources:
+        part_key = (os.path.abspath(path), mtime_ns, rules_generation, entry["day"])
+        part = _lru_get(_parts, part_key)
+        if part is None:
+            batch = load(path)
+            with phase("stats.frame"):
+                frame, names = batch_tests_frame(batch, entry["day"])
+            part = _BatchPart(frame, names, len(batch.items))
+            _lru_put(_parts, part_key, part, max_parts)
+        parts.append(part)
+
+    with phase("stats.aggregate"):
+        names: Dict[int, Tuple[str, Optional[str]]] = {}
+        for part in parts:
+            names.update(part.names)
+        frames = [part.frame for part in parts]
+        if len(frames) > 1:
+            import pandas as pd
+            frame = pd.concat(frames, ignore_index=True)
+        else:
+            frame = frames[0]
+        result = compute_stats(frame, names)
+
+    result.update({
+        "batches": [entry["name"] for entry in batches],
+        "days": sorted({entry["day"] for entry in batches}),
+        "records": sum(part.records for part in parts),
+        "tests": len(frame),
+        "rules_generation": rules_generation,
+    })
+    _lru_put(_results, key, result, RESULTS_CACHE_SIZE)
+    return result
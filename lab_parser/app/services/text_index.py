@@ -0,0 +1,197 @@
+"""
+Триграммный индекс для текстового поиска по записям пакета
+
+Строится один раз на пакет по полям ФИО, идентификатору образца, отделению
+и сводке результатов. Текст приводится к нижнему регистру (casefold) и
+буква «ё» заменяется на «е», так что «Ёлкин» находится по запросу «елкин».
+
+Поиск по подстроке: пересечение списков записей для триграмм запроса даёт
+кандидатов, которые затем проверяются точным вхождением подстроки.
+Нечёткий поиск (опечатки в фамилиях): кандидаты отбираются по числу общих
+триграмм, затем проверяются расстоянием Левенштейна до слов ФИО.
+"""
+import re
+from typing import List, Dict, Any, Iterable
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Поля записи, по которым идёт поиск
+SEARCH_FIELDS = (
+    ("patient", "last_name"),
+    ("patient", "first_name"),
+    ("patient", "middle_name"),
+    (None, "sample_id"),
+    (None, "department"),
+    ("results", "summary"),
+)
+
+NAME_FIELDS = ("last_name", "first_name", "middle_name")
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация для поиска: casefold + ё -> е"""
+    return text.casefold().replace("ё", "е")
+
+
+def _trigrams(token: str) -> Iterable[str]:
+    return (token[i:i + 3] for i in range(len(token) - 2))
+
+
+def _padded_trigrams(token: str) -> List[str]:
+    """Триграммы слова с маркерами границ (нужны для нечёткого поиска коротких слов)"""
+    return list(_trigrams(f"^{token}$"))
+
+
+def max_typos(token: str) -> int:
+    """Допустимое число опечаток для слова запроса"""
+    if len(token) <= 4:
+        return 1 if len(token) >= 3 else 0
+    return 2 if len(token) >= 8 else 1
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Расстояние Левенштейна (с перестановкой соседних букв); при превышении limit возвращает limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        row_min = cur[0]
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+            row_min = min(row_min, cur[j])
+        if row_min > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1] if prev[-1] <= limit else limit + 1
+
+
+class TextIndex:
+    """Инвертированный триграммный индекс по записям пакета"""
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        self.size = len(items)
+        # Нормализованный текст записи (поля через \n) - для проверки кандидатов
+        self._texts: List[str] = []
+
+        postings: Dict[str, set] = {}
+        # Слово ФИО -> записи; по словарю слов идёт нечёткий поиск
+        name_rows: Dict[str, List[int]] = {}
+        for row, item in enumerate(items):
+            values = []
+            for section, field in SEARCH_FIELDS:
+                source = (item.get(section) or {}) if section else item
+                value = source.get(field)
+                if value:
+                    values.append(normalize_text(str(value)))
+            text = "\n".join(values)
+            self._texts.append(text)
+
+            patient = item.get("patient") or {}
+            for field in NAME_FIELDS:
+                if patient.get(field):
+                    for name in TOKEN_RE.findall(normalize_text(patient[field])):
+                        name_rows.setdefault(name, []).append(row)
+
+            for token in set(TOKEN_RE.findall(text)):
+                for gram in _padded_trigrams(token):
+                    postings.setdefault(gram, set()).add(row)
+
+        self._postings = self._freeze(postings)
+        self._empty = np.empty(0, dtype=np.int32)
+
+        self._names: List[str] = list(name_rows)
+        self._name_rows: List[np.ndarray] = [np.unique(np.asarray(name_rows[n], dtype=np.int32))
+                                             for n in self._names]
+        name_postings: Dict[str, set] = {}
+        for word_id, name in enumerate(self._names):
+            for gram in _padded_trigrams(name):
+                name_postings.setdefault(gram, set()).add(word_id)
+        self._name_postings = self._freeze(name_postings)
+
+    @staticmethod
+    def _freeze(postings: Dict[str, set]) -> Dict[str, np.ndarray]:
+        return {
+            gram: np.fromiter(sorted(ids), dtype=np.int32, count=len(ids))
+            for gram, ids in postings.items()
+        }
+
+    def _posting(self, gram: str) -> np.ndarray:
+        return self._postings.get(gram, self._empty)
+
+    def candidates(self, query: str):
+        """
+        Кандидаты на вхождение подстроки query (уже нормализованной).
+        Возвращает None, если в запросе нет ни одной триграммы (нужен полный просмотр).
+        """
+        grams = {g for token in TOKEN_RE.findall(query) for g in _trigrams(token)}
+        if not grams:
+            return None
+
+        lists = sorted((self._posting(g) for g in grams), key=len)
+        result = lists[0]
+        for posting in lists[1:]:
+            if len(result) == 0:
+                break
+            result = np.intersect1d(result, posting, assume_unique=True)
+        return result
+
+    def _fuzzy_rows(self, query: str) -> np.ndarray:
+        """Записи, где каждое слово запроса совпадает с каким-либо словом ФИО с учётом опечаток"""
+        tokens = TOKEN_RE.findall(query)
+        if not tokens:
+            return self._empty
+
+        result = None
+        for token in tokens:
+            limit = max_typos(token)
+            grams = _padded_trigrams(token)
+            # Каждая опечатка портит не более трёх триграмм
+            need = max(1, len(grams) - 3 * limit)
+            postings = [p for p in (self._name_postings.get(g, self._empty) for g in grams) if len(p)]
+
+            rows = [self._empty]
+            if postings:
+                counts = np.bincount(np.concatenate(postings), minlength=len(self._names))
+                for word_id in np.flatnonzero(counts >= need):
+                    if edit_distance(token, self._names[word_id], limit) <= limit:
+                        rows.append(self._name_rows[word_id])
+
+            matched = np.unique(np.concatenate(rows))
+            result = matched if result is None else np.intersect1d(result, matched, assume_unique=True)
+
+        return result
+
+    def mask(self, query: str, fuzzy: bool = False) -> np.ndarray:
+        """
+        Маска записей, подходящих под текстовый запрос.
+
+        Args:
+            query: Строка поиска (как ввёл пользователь)
+            fuzzy: Дополнительно искать слова ФИО с опечатками
+        """
+        result = np.zeros(self.size, dtype=bool)
+        q = normalize_text(query.strip())
+        if not q:
+            result[:] = True
+            return result
+
+        rows = self.candidates(q)
+        if rows is None:
+            rows = range(self.size)
+        texts = self._texts
+        for row in rows:
+            if q in texts[row]:
+                result[row] = True
+
+        if fuzzy:
+            result[self._fuzzy_rows(q)] = True
+
+        return result
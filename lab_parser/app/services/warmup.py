@@ -0,0 +1,76 @@
+"""
+Предзагрузка для pre-fork серверов (gunicorn --preload)
+
+Тяжёлые модули (pandas, openpyxl, xlrd, lxml) импортируются лениво, при первом
+чтении файла. Под pre-fork сервером это значит, что каждый воркер платит за
+импорт и прогрев сам. preload() выполняется один раз в мастер-процессе до fork:
+воркеры получают уже загруженные модули, скомпилированные регулярные выражения
+правил и распарсенный последний пакет (общие страницы памяти после fork).
+"""
+import os
+import importlib
+import time
+from typing import Dict, Any
+
+# Модули, которые нужны для чтения журналов; xlrd и lxml необязательны
+PRELOAD_MODULES = [
+    "pandas",
+    "openpyxl",
+    "pandas.io.excel._openpyxl",
+    "xlrd",
+    "lxml.html",
+    "pandas.io.html",
+]
+
+
+def preload(app) -> Dict[str, Any]:
+    """
+    Импортировать модули чтения Excel/HTML, прогреть парсер правил и
+    загрузить последний пакет в кэш. Ничего не запускает в фоновых потоках -
+    потоки не переживают fork.
+
+    Returns:
+        Время этапов (с) и список не найденных необязательных модулей
+    """
+    from ..models.parse_rules import get_parse_rules_db
+    from ..models.batch_catalog import get_batch_catalog
+    from .batch_cache import get_batch_disk_cache
+    from .parsed_batch import get_parsed_batch
+    from .results_parser import ResultsParser
+
+    stats: Dict[str, Any] = {"missing": []}
+
+    started = time.perf_counter()
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            stats["missing"].append(name)
+    stats["imports"] = round(time.perf_counter() - started, 3)
+
+    # Компиляция правил и внутренних регулярных выражений парсера (кэш re наследуется воркерами)
+    started = time.perf_counter()
+    rules_db = get_parse_rules_db(app.instance_path)
+    parser = ResultsParser(rules_db.get_all_rules())
+    for definition in rules_db.get_all_test_definitions():
+        parser.parse_results(definition["full_example_text"])
+    stats["rules"] = round(time.perf_counter() - started, 3)
+
+    # Последний пакет - почти все запросы к /api/records идут к нему
+    started = time.perf_counter()
+    catalog = get_batch_catalog(app.instance_path)
+    latest = catalog.get_latest_batch()
+    if latest and app.config["PRELOAD_LATEST_BATCH"]:
+        entry = catalog.resolve(latest["name"])
+        path = os.path.join(app.instance_path, app.config["INSTANCE_UPLOADS_SUBDIR"], entry["name"])
+        max_bytes = app.config["PARSED_BATCH_DISK_CACHE_MB"] * 1024 * 1024
+        try:
+            get_parsed_batch(path, rules_db, app.config["PARSED_BATCH_CACHE_SIZE"], catalog,
+                             get_batch_disk_cache(app.instance_path, max_bytes) if max_bytes else None)
+            stats["batch"] = entry["name"]
+        except Exception as e:
+            # Предзагрузка необязательна - ошибка пакета покажется при обычном запросе
+            stats["batch_error"] = str(e)
+    stats["latest_batch"] = round(time.perf_counter() - started, 3)
+
+    return stats
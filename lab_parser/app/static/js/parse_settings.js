@@ -8,7 +8,8 @@ const indicatorsContainer = document.getElementById("indicators-container");
 const VALUE_TYPE_LABELS = {
   1: "Обнаружено/Не обнаружено",
   2: "Числовое значение",
-  3: "Иное значение"
+  3: "Иное значение",
+  4: "Автоопределение"
 };
 
 let indicatorCounter = 0;
@@ -95,6 +96,7 @@ function createIndicatorBlock(indicator = null) {
           <option value="1">Обнаружено / Не обнаружено</option>
           <option value="2">Числовое значение</option>
           <option value="3">Иное значение</option>
+          <option value="4">Автоопределение (тип по самому значению)</option>
         </select>
       </div>
     </div>
@@ -182,6 +184,60 @@ async function editDefinition(id) {
   }
 }
 
+function openSuggestion(definition) {
+  document.getElementById("modal-title").textContent = "Добавить анализ";
+  modal.style.display = "flex";
+
+  document.getElementById("definition-id").value = "";
+  document.getElementById("full-example-text").value = definition.full_example_text;
+  document.getElementById("short-description").value = definition.short_description;
+
+  indicatorsContainer.innerHTML = "";
+  definition.indicators.forEach(indicator => {
+    indicatorsContainer.appendChild(createIndicatorBlock(indicator));
+  });
+}
+
+async function loadSuggestions() {
+  const status = document.getElementById("suggestions-status");
+  const table = document.getElementById("suggestions-table");
+  const tbody = table.querySelector("tbody");
+  status.textContent = "Поиск...";
+
+  const res = await fetch("/api/test-definitions/suggestions?limit=100");
+  const data = await res.json();
+
+  if (data.error) {
+    status.textContent = "Ошибка: " + data.error;
+    return;
+  }
+
+  status.textContent = `Нераспознанных строк: ${data.rows}, шаблонов: ${data.total_templates}`
+    + (data.indexing ? " (индекс обновляется, результат может быть неполным)" : "");
+  tbody.innerHTML = "";
+  table.style.display = data.templates.length ? "" : "none";
+
+  data.templates.forEach(template => {
+    const tr = document.createElement("tr");
+    tr.innerHTML = `
+      <td style="text-align: center;">${template.rows}</td>
+      <td><small><code></code></small><br><small class="example"></small></td>
+      <td></td>
+    `;
+    // Тексты из журналов вставляются как текст, не как HTML
+    tr.querySelector("code").textContent = template.template;
+    tr.querySelector(".example").textContent = "Пример: " + template.example.text;
+
+    if (template.definition) {
+      const btn = document.createElement("button");
+      btn.textContent = "Создать правило";
+      btn.addEventListener("click", () => openSuggestion(template.definition));
+      tr.lastElementChild.appendChild(btn);
+    }
+    tbody.appendChild(tr);
+  });
+}
+
 async function deleteDefinition(id) {
   if (!confirm("Удалить этот анализ со всеми показателями?")) return;
 
@@ -199,6 +255,8 @@ addBtn.addEventListener("click", () => {
   openModal("Добавить анализ");
 });
 
+document.getElementById("load-suggestions-btn").addEventListener("click", loadSuggestions);
+
 addIndicatorBtn.addEventListener("click", () => {
   indicatorsContainer.appendChild(createIndicatorBlock());
 });
@@ -2,10 +2,11 @@ const urlParams = new URLSearchParams(window.location.search);
 
 const reportState = {
   q: urlParams.get("q") || "",
+  fuzzy: urlParams.get("fuzzy") === "1",
   gender: urlParams.get("gender") || "",
   department: urlParams.get("department") || "",
   batch: urlParams.get("batch") || "",
-  testFilters: {},
+  testFilters: [],
   columnOrder: [],
   columnHidden: []
 };
@@ -14,7 +15,8 @@ const reportState = {
 try {
   const testFiltersParam = urlParams.get("testFilters");
   if (testFiltersParam) {
-    reportState.testFilters = JSON.parse(testFiltersParam);
+    const parsed = JSON.parse(testFiltersParam);
+    reportState.testFilters = Array.isArray(parsed) ? parsed : [];
   }
 } catch (e) {
   console.error("Error parsing testFilters:", e);
@@ -48,40 +50,31 @@ function getApiParams() {
   p.set("page", 1);
   p.set("per_page", 999999); // Получаем все записи
   if (reportState.q) p.set("q", reportState.q);
+  if (reportState.q && reportState.fuzzy) p.set("fuzzy", "1");
   if (reportState.gender) p.set("gender", reportState.gender);
   if (reportState.department) p.set("department", reportState.department);
   if (reportState.batch) p.set("batch", reportState.batch);
+  // Фильтры по анализам применяются на сервере (testFilters хранит уже ID показателей)
+  if (reportState.testFilters.length > 0) {
+    p.set("tests", JSON.stringify(reportState.testFilters));
+    p.set("tests_op", "or");
+  }
   return p;
 }
 
-function filterRecordsByTests(records) {
-  if (Object.keys(reportState.testFilters).length === 0) {
-    return records;
-  }
-
-  return records.filter(item => {
-    for (const testName in reportState.testFilters) {
-      const filterValues = reportState.testFilters[testName];
-      if (!filterValues || filterValues.length === 0) continue;
-
-      const tests = item.results?.tests || [];
-      const indicator = testKeyIndicators[testName];
-      if (!indicator) continue;
-
-      for (const test of tests) {
-        if (test.test_definition_id === indicator.test_definition_id &&
-            test.rule_id === indicator.rule_id &&
-            test.is_key_indicator) {
-          const rawValue = test.raw_value;
-          if (filterValues.includes(rawValue)) {
-            return true;
-          }
-        }
-      }
-    }
+// Выгрузка файлом формируется на сервере потоком - те же фильтры и колонки, что в отчёте
+function getExportUrl(format) {
+  const p = getApiParams();
+  p.delete("page");
+  p.delete("per_page");
+  p.set("format", format);
+  if (reportState.columnOrder.length > 0) p.set("column_order", JSON.stringify(reportState.columnOrder));
+  if (reportState.columnHidden.length > 0) p.set("column_hidden", JSON.stringify(reportState.columnHidden));
+  return `/api/export?${p.toString()}`;
+}
 
-    return false;
-  });
+function downloadExport(format) {
+  window.location.href = getExportUrl(format);
 }
 
 async function loadReportData() {
@@ -101,13 +94,18 @@ async function loadReportData() {
       return;
     }
 
-    testKeyIndicators = data.test_key_indicators || {};
-    allRecords = data.items;
+    // Колонки и правила - из метаданных пакета (кэшируются браузером по версии)
+    const metaRes = await fetch(`/api/batches/${encodeURIComponent(data.batch)}/meta?v=${encodeURIComponent(data.meta_version)}`);
+    const meta = await metaRes.json();
+    if (meta.error) {
+      document.getElementById("report-content").innerHTML = `<p style="color: red;">Ошибка: ${meta.error}</p>`;
+      return;
+    }
 
-    // Применяем фильтры по тестам
-    const filtered = filterRecordsByTests(allRecords);
+    testKeyIndicators = meta.test_key_indicators || {};
+    allRecords = data.items;
 
-    renderReport(filtered, data.test_columns || [], data.rules_map || {});
+    renderReport(allRecords, meta.test_columns || [], meta.rules_map || {});
   } catch (error) {
     document.getElementById("report-content").innerHTML = `<p style="color: red;">Ошибка загрузки данных: ${error.message}</p>`;
   }
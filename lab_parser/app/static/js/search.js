@@ -0,0 +1,137 @@
+function escapeHtml(value) {
+  return String(value ?? "")
+    .replace(/&/g, "&amp;")
+    .replace(/</g, "&lt;")
+    .replace(/>/g, "&gt;")
+    .replace(/"/g, "&quot;");
+}
+
+function formatFio(p) {
+  return [p.last_name, p.first_name, p.middle_name].filter(Boolean).join(" ");
+}
+
+function formatTime(iso) {
+  return iso ? iso.replace("T", " ") : "";
+}
+
+async function runSearch() {
+  const q = document.getElementById("search-q").value.trim();
+  const birthDate = document.getElementById("search-birth-date").value;
+  const sampleId = document.getElementById("search-sample").value.trim();
+  const meta = document.getElementById("search-meta");
+  const results = document.getElementById("search-results");
+
+  if (!q && !sampleId) {
+    meta.textContent = "Введите ФИО или идентификатор образца";
+    return;
+  }
+
+  const params = new URLSearchParams();
+  if (q) params.set("q", q);
+  if (birthDate) params.set("birth_date", birthDate);
+  if (sampleId) params.set("sample_id", sampleId);
+
+  const res = await fetch(`/api/search?${params.toString()}`);
+  const data = await res.json();
+
+  if (data.error) {
+    meta.textContent = `Ошибка: ${data.error}`;
+    results.innerHTML = "";
+    return;
+  }
+
+  meta.textContent = `Найдено строк: ${data.total}, пациентов: ${data.patients.length}` +
+    (data.indexing ? " (идёт индексация новых загрузок, повторите поиск позже)" : "");
+
+  let html = "<table><thead><tr>" +
+    "<th>Загрузка</th><th>Время</th><th>#</th><th>ФИО</th><th>ДР</th>" +
+    "<th>Образец</th><th>Отделение</th><th>Результат</th>" +
+    "</tr></thead><tbody>";
+
+  data.items.forEach(row => {
+    const tableUrl = `/table?batch=${encodeURIComponent(row.batch)}`;
+    const fioLink = row.patient_key
+      ? `<a href="#" class="timeline-link" data-key="${escapeHtml(row.patient_key)}">${escapeHtml(formatFio(row))}</a>`
+      : escapeHtml(formatFio(row));
+    html += "<tr>" +
+      `<td><a href="${tableUrl}">${escapeHtml(row.batch)}</a></td>` +
+      `<td>${escapeHtml(formatTime(row.batch_time))}</td>` +
+      `<td>${escapeHtml(row.row_id)}</td>` +
+      `<td>${fioLink}</td>` +
+      `<td>${escapeHtml(row.birth_date)}</td>` +
+      `<td>${escapeHtml(row.sample_id)}</td>` +
+      `<td>${escapeHtml(row.department)}</td>` +
+      `<td>${escapeHtml(row.summary)}</td>` +
+      "</tr>";
+  });
+  html += "</tbody></table>";
+
+  results.innerHTML = data.items.length ? html : "<p>Ничего не найдено.</p>";
+
+  results.querySelectorAll(".timeline-link").forEach(link => {
+    link.addEventListener("click", (e) => {
+      e.preventDefault();
+      loadTimeline(link.getAttribute("data-key"));
+    });
+  });
+}
+
+async function loadTimeline(patientKey) {
+  const res = await fetch(`/api/search/timeline?patient_key=${encodeURIComponent(patientKey)}`);
+  const data = await res.json();
+  const card = document.getElementById("timeline-card");
+  const content = document.getElementById("timeline-content");
+
+  card.style.display = "";
+
+  if (data.error) {
+    content.innerHTML = `<p style="color: red;">Ошибка: ${escapeHtml(data.error)}</p>`;
+    return;
+  }
+
+  const p = data.patient;
+  document.getElementById("timeline-title").textContent =
+    `Хронология: ${formatFio(p)}${p.birth_date ? ", " + p.birth_date : ""}`;
+
+  // Строки - показатели, колонки - моменты времени (загрузки)
+  const times = [];
+  data.events.forEach(ev => {
+    const key = `${ev.batch_time}|${ev.batch}`;
+    if (!times.includes(key)) times.push(key);
+  });
+
+  let html = "<table><thead><tr><th>Показатель</th>";
+  times.forEach(key => {
+    const [time, batch] = key.split("|");
+    html += `<th title="${escapeHtml(batch)}">${escapeHtml(formatTime(time))}</th>`;
+  });
+  html += "</tr></thead><tbody>";
+
+  Object.keys(data.series).sort().forEach(name => {
+    const byTime = {};
+    data.series[name].forEach(point => {
+      const key = `${point.batch_time}|${point.batch}`;
+      (byTime[key] = byTime[key] || []).push(point.value);
+    });
+    html += `<tr><td>${escapeHtml(name)}</td>`;
+    times.forEach(key => {
+      html += `<td>${escapeHtml((byTime[key] || []).join(", "))}</td>`;
+    });
+    html += "</tr>";
+  });
+  html += "</tbody></table>";
+
+  content.innerHTML = Object.keys(data.series).length
+    ? html
+    : "<p>Распарсенных результатов нет. Проверьте настройки парсинга.</p>";
+  card.scrollIntoView({ behavior: "smooth" });
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+  document.getElementById("search-btn").addEventListener("click", runSearch);
+  ["search-q", "search-sample"].forEach(id => {
+    document.getElementById(id).addEventListener("keydown", (e) => {
+      if (e.key === "Enter") runSearch();
+    });
+  });
+});
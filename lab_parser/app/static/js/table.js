@@ -5,13 +5,18 @@ const state = {
   page: 1,
   per_page: 10,
   q: "",
+  fuzzy: false,
   gender: "",
   department: "",
   batch: initialBatch,
   showAll: false,
-  testFilters: {}
+  testFilters: {},
+  total: 0
 };
 
+// Режим "Все" - одна страница максимального размера, который принимает /api/records
+const SHOW_ALL_PER_PAGE = 1000000;
+
 function loadTestFilters() {
   try {
     const saved = localStorage.getItem('testFilters');
@@ -29,6 +34,9 @@ function saveTestFilters() {
 
 let allRecords = [];
 let testKeyIndicators = {};
+// Метаданные пакета (колонки, ключевые показатели, правила) - запрашиваются только при смене версии
+let batchMeta = null;
+let resizeHandlerAdded = false;
 
 let columnSettings = {
   order: [],
@@ -158,25 +166,8 @@ function openTestFilter(testName, event) {
   const indicator = testKeyIndicators[testName];
   if (!indicator) return;
 
-  const valueCounts = {};
-  indicator.possible_values.forEach(value => {
-    valueCounts[value] = 0;
-  });
-
-  allRecords.forEach(item => {
-    const tests = item.results?.tests || [];
-    for (const test of tests) {
-      if (test.test_definition_id === indicator.test_definition_id &&
-          test.rule_id === indicator.rule_id &&
-          test.is_key_indicator) {
-        const rawValue = test.raw_value;
-        if (valueCounts.hasOwnProperty(rawValue)) {
-          valueCounts[rawValue]++;
-        }
-        break;
-      }
-    }
-  });
+  // Количество записей по значениям считает сервер (по всему пакету)
+  const valueCounts = indicator.value_counts || {};
 
   const menu = document.createElement('div');
   menu.className = 'test-filter-menu';
@@ -294,8 +285,7 @@ function openTestFilter(testName, event) {
 function applyFilters() {
   state.page = 1;
   saveTestFilters();
-  renderTable();
-  updateActiveFiltersPanel();
+  loadData();
 }
 
 function updateActiveFiltersPanel() {
@@ -353,34 +343,23 @@ function updateActiveFiltersPanel() {
   panel.appendChild(clearAllBtn);
 }
 
-function filterRecordsByTests(records) {
-  if (Object.keys(state.testFilters).length === 0) {
-    return records;
-  }
+// Фильтры по анализам применяются на сервере: {testName: [values]} -> ?tests=[...]
+function getTestFiltersParam() {
+  const filters = [];
+  for (const testName in state.testFilters) {
+    const filterValues = state.testFilters[testName];
+    if (!filterValues || filterValues.length === 0) continue;
 
-  return records.filter(item => {
-    for (const testName in state.testFilters) {
-      const filterValues = state.testFilters[testName];
-      if (!filterValues || filterValues.length === 0) continue;
-
-      const tests = item.results?.tests || [];
-      const indicator = testKeyIndicators[testName];
-      if (!indicator) continue;
-
-      for (const test of tests) {
-        if (test.test_definition_id === indicator.test_definition_id &&
-            test.rule_id === indicator.rule_id &&
-            test.is_key_indicator) {
-          const rawValue = test.raw_value;
-          if (filterValues.includes(rawValue)) {
-            return true;
-          }
-        }
-      }
-    }
+    const indicator = testKeyIndicators[testName];
+    if (!indicator) continue;
 
-    return false;
-  });
+    filters.push({
+      test_definition_id: indicator.test_definition_id,
+      rule_id: indicator.rule_id,
+      values: filterValues
+    });
+  }
+  return filters;
 }
 
 function openColumnSettings() {
@@ -594,17 +573,39 @@ function syncColumnWidths() {
 
 function getParams() {
   const p = new URLSearchParams();
-  p.set("page", 1);
-  p.set("per_page", 999999);
+  // Сервер фильтрует и отдаёт только текущую страницу; всё целиком - только в режиме "Все"
+  p.set("page", state.showAll ? 1 : state.page);
+  p.set("per_page", state.showAll ? SHOW_ALL_PER_PAGE : state.per_page);
   if (state.q) p.set("q", state.q);
+  if (state.q && state.fuzzy) p.set("fuzzy", "1");
   if (state.gender) p.set("gender", state.gender);
   if (state.department) p.set("department", state.department);
   if (state.batch) p.set("batch", state.batch);
+  const testFilters = getTestFiltersParam();
+  if (testFilters.length > 0) {
+    p.set("tests", JSON.stringify(testFilters));
+    p.set("tests_op", "or");
+  }
   return p;
 }
 
+async function loadBatchMeta(batch, version) {
+  if (batchMeta && batchMeta.batch === batch && batchMeta.version === version) {
+    return batchMeta;
+  }
+  // URL содержит версию - ответ кэшируется браузером, пока пакет и правила не изменятся
+  const res = await fetch(`/api/batches/${encodeURIComponent(batch)}/meta?v=${encodeURIComponent(version)}`);
+  const data = await res.json();
+  if (data.error) {
+    throw new Error(data.error);
+  }
+  batchMeta = data;
+  return batchMeta;
+}
+
 async function loadData() {
   const params = getParams();
+  const sentTestFilters = params.has("tests");
   const res = await fetch(`/api/records?${params.toString()}`);
   const data = await res.json();
 
@@ -627,14 +628,27 @@ async function loadData() {
     state.batch = data.batch;
   }
 
-  testKeyIndicators = data.test_key_indicators || {};
+  let batchMetaData;
+  try {
+    batchMetaData = await loadBatchMeta(data.batch, data.meta_version);
+  } catch (e) {
+    meta.textContent = `Ошибка: ${e.message}`;
+    return;
+  }
+
+  testKeyIndicators = batchMetaData.test_key_indicators || {};
+
+  // Сохранённые фильтры по анализам можно отправить только после получения ключевых показателей
+  if (!sentTestFilters && getTestFiltersParam().length > 0) {
+    return loadData();
+  }
 
-  window.rulesMapGlobal = data.rules_map || {};
+  window.rulesMapGlobal = batchMetaData.rules_map || {};
 
   const gSel = document.getElementById("gender");
   const dSel = document.getElementById("department");
   if (gSel.options.length === 1) {
-    (data.facets.genders || []).forEach(g => {
+    (batchMetaData.facets.genders || []).forEach(g => {
       const o = document.createElement("option");
       o.value = g;
       o.textContent = g;
@@ -642,7 +656,7 @@ async function loadData() {
     });
   }
   if (dSel.options.length === 1) {
-    (data.facets.departments || []).forEach(d => {
+    (batchMetaData.facets.departments || []).forEach(d => {
       const o = document.createElement("option");
       o.value = d;
       o.textContent = d;
@@ -650,8 +664,8 @@ async function loadData() {
     });
   }
 
-  const testColumns = data.test_columns || [];
-  const rulesMap = data.rules_map || {};
+  const testColumns = batchMetaData.test_columns || [];
+  const rulesMap = batchMetaData.rules_map || {};
 
   const headerRow = document.getElementById("table-header");
 
@@ -691,6 +705,7 @@ async function loadData() {
   });
 
   allRecords = data.items;
+  state.total = data.total;
 
   window.rulesMapGlobal = rulesMap;
 
@@ -752,26 +767,29 @@ async function loadData() {
 
   syncColumnWidths();
 
-  let resizeTimer;
-  window.addEventListener('resize', () => {
-    clearTimeout(resizeTimer);
-    resizeTimer = setTimeout(() => {
-      syncColumnWidths();
-    }, 100);
-  });
+  // loadData вызывается на каждую страницу - обработчик ресайза вешаем один раз
+  if (!resizeHandlerAdded) {
+    let resizeTimer;
+    window.addEventListener('resize', () => {
+      clearTimeout(resizeTimer);
+      resizeTimer = setTimeout(() => {
+        syncColumnWidths();
+      }, 100);
+    });
+    resizeHandlerAdded = true;
+  }
 
   const batchInfo = state.batch ? ` (файл: ${state.batch})` : '';
-  meta.textContent = `Найдено: ${allRecords.length}. ${batchInfo}`;
+  meta.textContent = `Найдено: ${state.total}. ${batchInfo}`;
   updateActiveFiltersPanel();
 }
 
 function renderTable() {
-  let filtered = filterRecordsByTests(allRecords);
-
-  const total = filtered.length;
-  const start = (state.page - 1) * (state.showAll ? total : state.per_page);
-  const end = state.showAll ? total : start + state.per_page;
-  const items = filtered.slice(start, end);
+  // В allRecords - только текущая страница, total - число всех найденных записей
+  const items = allRecords;
+  const total = state.total;
+  const start = state.showAll ? 0 : (state.page - 1) * state.per_page;
+  const end = start + items.length;
 
   const testColumns = Object.keys(testKeyIndicators);
   const tbody = document.querySelector("#records tbody");
@@ -989,7 +1007,7 @@ function addPageButton(container, pageNum, currentPage) {
   btn.disabled = pageNum === currentPage;
   btn.addEventListener("click", () => {
     state.page = pageNum;
-    renderTable();
+    loadData();
   });
   container.appendChild(btn);
 }
@@ -1035,11 +1053,12 @@ function initTable() {
       state.page = 1;
     }
 
-    renderTable();
+    loadData();
   });
 
   document.getElementById("apply").addEventListener("click", () => {
     state.q = document.getElementById("q").value.trim();
+    state.fuzzy = document.getElementById("fuzzy").checked;
     state.gender = document.getElementById("gender").value;
     state.department = document.getElementById("department").value;
     state.page = 1;
@@ -1048,9 +1067,11 @@ function initTable() {
 
   document.getElementById("reset").addEventListener("click", () => {
     document.getElementById("q").value = "";
+    document.getElementById("fuzzy").checked = false;
     document.getElementById("gender").value = "";
     document.getElementById("department").value = "";
     state.q = state.gender = state.department = "";
+    state.fuzzy = false;
     state.testFilters = {};
     state.page = 1;
     saveTestFilters();
@@ -1060,13 +1081,13 @@ function initTable() {
   document.getElementById("prev-top").addEventListener("click", () => {
     if (state.page > 1) {
       state.page--;
-      renderTable();
+      loadData();
     }
   });
 
   document.getElementById("next-top").addEventListener("click", () => {
     state.page++;
-    renderTable();
+    loadData();
   });
 
   document.getElementById("column-settings-btn").addEventListener("click", openColumnSettings);
@@ -1086,13 +1107,15 @@ function initTable() {
 
     // Базовые фильтры
     if (state.q) params.set("q", state.q);
+    if (state.q && state.fuzzy) params.set("fuzzy", "1");
     if (state.gender) params.set("gender", state.gender);
     if (state.department) params.set("department", state.department);
     if (state.batch) params.set("batch", state.batch);
 
-    // Фильтры по тестам (JSON)
-    if (Object.keys(state.testFilters).length > 0) {
-      params.set("testFilters", JSON.stringify(state.testFilters));
+    // Фильтры по тестам (JSON, в серверном формате)
+    const testFilters = getTestFiltersParam();
+    if (testFilters.length > 0) {
+      params.set("testFilters", JSON.stringify(testFilters));
     }
 
     // Настройки колонок (порядок и скрытые)
@@ -1106,6 +1129,19 @@ function initTable() {
     // Открываем отчет в новой вкладке
     window.open(`/report?${params.toString()}`, '_blank');
   });
+
+  // Выгрузка текущего вида таблицы файлом (собирается на сервере)
+  ["xlsx", "csv"].forEach(format => {
+    document.getElementById(`export-${format}-btn`).addEventListener("click", () => {
+      const params = getParams();
+      params.delete("page");
+      params.delete("per_page");
+      params.set("format", format);
+      if (columnSettings.order.length > 0) params.set("column_order", JSON.stringify(columnSettings.order));
+      if (columnSettings.hidden.length > 0) params.set("column_hidden", JSON.stringify(columnSettings.hidden));
+      window.location.href = `/api/export?${params.toString()}`;
+    });
+  });
 }
 
 document.addEventListener('DOMContentLoaded', initTable);
\ No newline at end of file
@@ -0,0 +1,107 @@
+// Порционная загрузка (/api/uploads): файл уходит частями, после обрыва связи
+// или перезагрузки страницы загрузка того же файла продолжается с подтверждённого смещения
+const uploadForm = document.getElementById("upload-form");
+const uploadStatus = document.getElementById("upload-status");
+const uploadProgress = document.getElementById("upload-progress");
+
+const RETRY_DELAYS_MS = [1000, 2000, 5000, 10000, 30000];
+
+function uploadKey(file) {
+  return `upload:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+function formatMb(bytes) {
+  return (bytes / 1024 / 1024).toFixed(1);
+}
+
+function showProgress(offset, size) {
+  uploadProgress.style.display = "";
+  uploadProgress.max = size;
+  uploadProgress.value = offset;
+  uploadStatus.textContent = `Загружено ${formatMb(offset)} из ${formatMb(size)} МБ`;
+}
+
+async function jsonRequest(url, options = {}) {
+  const res = await fetch(url, options);
+  const data = await res.json().catch(() => ({}));
+  return { res, data };
+}
+
+async function startOrResume(file) {
+  // Незавершённая загрузка этого же файла - продолжаем её
+  const savedId = localStorage.getItem(uploadKey(file));
+  if (savedId) {
+    const { res, data } = await jsonRequest(`/api/uploads/${savedId}`);
+    if (res.ok && data.size === file.size) {
+      return { uploadId: savedId, offset: data.offset, chunkSize: data.chunk_size };
+    }
+    localStorage.removeItem(uploadKey(file));
+  }
+
+  const { res, data } = await jsonRequest("/api/uploads", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ filename: file.name, size: file.size })
+  });
+  if (!res.ok) throw new Error(data.error || `HTTP ${res.status}`);
+  localStorage.setItem(uploadKey(file), data.upload_id);
+  return { uploadId: data.upload_id, offset: data.offset, chunkSize: data.chunk_size };
+}
+
+async function sendChunk(uploadId, file, offset, chunkSize) {
+  const chunk = file.slice(offset, Math.min(offset + chunkSize, file.size));
+  const { res, data } = await jsonRequest(`/api/uploads/${uploadId}?offset=${offset}`, {
+    method: "PUT",
+    headers: { "Content-Type": "application/octet-stream" },
+    body: chunk
+  });
+  // 409 - сервер уже принял больше (или меньше): продолжаем с его смещения
+  if (res.ok || res.status === 409) return data.offset;
+  const error = new Error(data.error || `HTTP ${res.status}`);
+  error.fatal = res.status === 400 || res.status === 404;
+  throw error;
+}
+
+async function uploadFile(file) {
+  let { uploadId, offset, chunkSize } = await startOrResume(file);
+  let attempt = 0;
+
+  while (offset < file.size) {
+    showProgress(offset, file.size);
+    try {
+      offset = await sendChunk(uploadId, file, offset, chunkSize);
+      attempt = 0;
+    } catch (e) {
+      if (e.fatal || attempt >= RETRY_DELAYS_MS.length) throw e;
+      // Обрыв связи: ждём и спрашиваем у сервера, что он успел принять
+      uploadStatus.textContent = `Связь прервана, повтор через ${RETRY_DELAYS_MS[attempt] / 1000} с...`;
+      await new Promise(resolve => setTimeout(resolve, RETRY_DELAYS_MS[attempt]));
+      attempt++;
+      const { res, data } = await jsonRequest(`/api/uploads/${uploadId}`).catch(() => ({ res: {} }));
+      if (res.ok) offset = data.offset;
+    }
+  }
+
+  showProgress(file.size, file.size);
+  uploadStatus.textContent = "Обработка файла...";
+  const { res, data } = await jsonRequest(`/api/uploads/${uploadId}/finalize`, { method: "POST" });
+  localStorage.removeItem(uploadKey(file));
+  if (!res.ok) throw new Error(data.error || `HTTP ${res.status}`);
+  return data;
+}
+
+uploadForm.addEventListener("submit", async (e) => {
+  e.preventDefault();
+  const file = uploadForm.querySelector("input[type=file]").files[0];
+  if (!file) return;
+
+  const button = uploadForm.querySelector("button[type=submit]");
+  button.disabled = true;
+  try {
+    const stored = await uploadFile(file);
+    window.location.href = `/table?batch=${encodeURIComponent(stored.name)}`;
+  } catch (err) {
+    uploadStatus.textContent = "Ошибка загрузки: " + err.message;
+    button.disabled = false;
+  }
+});
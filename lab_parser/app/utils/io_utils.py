@@ -1,13 +1,88 @@
 import os
+import re
+import shutil
+import hashlib
+import unicodedata
 from datetime import datetime
 
+# Метка времени, которую upload_post добавляет к имени файла: name__YYYYMMDD-HHMMSS.xlsx
+BATCH_TS_RE = re.compile(r"__(\d{8}-\d{6})\.[^.]+$")
+
+def safe_filename_unicode(filename: str) -> str:
+    """
+    Создает безопасное имя файла с сохранением кириллицы.
+    Удаляет только опасные символы, оставляя буквы (включая кириллицу), цифры, точки, дефисы и подчеркивания.
+    """
+    # Нормализуем unicode
+    filename = unicodedata.normalize('NFKC', filename)
+
+    # Разрешенные символы: буквы (любые), цифры, точка, дефис, подчеркивание, пробел
+    safe_chars = []
+    for char in filename:
+        if char.isalnum() or char in '._- ':
+            safe_chars.append(char)
+        else:
+            safe_chars.append('_')
+
+    result = ''.join(safe_chars)
+
+    # Убираем множественные пробелы и подчеркивания
+    result = ' '.join(result.split())
+    result = result.replace(' ', '_')
+
+    # Убираем точки в начале (скрытые файлы в Unix)
+    result = result.lstrip('.')
+
+    # Ограничиваем длину (оставляем место для метки времени)
+    if len(result) > 100:
+        name, ext = os.path.splitext(result)
+        result = name[:100] + ext
+
+    return result or 'unnamed'
+
 def allowed_file(filename: str, allowed_extensions: set[str]) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in allowed_extensions
 
+def is_temp_upload(name: str) -> bool:
+    """Временный файл незавершённой загрузки"""
+    return name.startswith("temp_")
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 содержимого файла (читается блоками)"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def save_stream_with_hash(stream, path: str, chunk_size: int = 1024 * 1024) -> tuple[str, int]:
+    """
+    Записывает поток на диск блоками, попутно считая SHA-256.
+    Возвращает (hex-хеш, размер в байтах).
+    """
+    h = hashlib.sha256()
+    size = 0
+    with open(path, "wb") as out:
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            h.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    return h.hexdigest(), size
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Жёсткая ссылка на файл (без копирования данных); если ФС не умеет - копия"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
 def list_uploaded_files(instance_path: str, uploads_subdir: str):
     """
     Возвращает список словарей: имя, абсолютный путь, размер (байты), mtime (datetime).
-    Отсортировано по времени (новые сверху).
+    Отсортировано по времени (новые сверху). Временные файлы незавершённых загрузок (temp_*)
+    и служебные файлы (.*, например блокировка .store.lock) пропускаются.
+
+    Сканирует каталог - для запросов используйте каталог пакетов (models.batch_catalog).
     """
     uploads_dir = os.path.join(instance_path, uploads_subdir)
     if not os.path.isdir(uploads_dir):
@@ -15,6 +90,8 @@ def list_uploaded_files(instance_path: str, uploads_subdir: str):
 
     rows = []
     for name in os.listdir(uploads_dir):
+        if is_temp_upload(name) or name.startswith("."):
+            continue
         path = os.path.join(uploads_dir, name)
         if not os.path.isfile(path):
             continue
@@ -29,6 +106,18 @@ def list_uploaded_files(instance_path: str, uploads_subdir: str):
     rows.sort(key=lambda r: r["mtime"], reverse=True)
     return rows
 
+def batch_timestamp(name: str, mtime: float) -> datetime:
+    """
+    Время пакета: из метки в имени файла, а если её нет - mtime файла.
+    """
+    m = BATCH_TS_RE.search(name)
+    if m:
+        try:
+            return datetime.strptime(m.group(1), "%Y%m%d-%H%M%S")
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(mtime)
+
 def human_size(nbytes: int) -> str:
     # простая читаемая форма
     for unit in ["Б", "КБ", "МБ", "ГБ", "ТБ"]:
@@ -0,0 +1,299 @@
+"""
+Командная строка для пакетного парсинга журналов без веб-приложения
+
+    python -m lab_parser parse <файлы/маски> --rules instance/parse_rules.db --out results.parquet --jobs N
+    python -m lab_parser archive [--older-than ДНЕЙ] [--retain-originals ДНЕЙ] [--dry-run]
+
+Каждый файл читается read_basic_records и разбирается ResultsParser в отдельном
+процессе; результаты потоково пишутся в колоночный файл по мере готовности
+(в памяти одновременно не больше 2 * jobs файлов). Формат - «длинная» таблица:
+строка на каждый распознанный тест записи; записи без тестов дают одну строку
+с пустыми полями теста.
+
+Parquet пишется через pyarrow (необязательная зависимость). Если pyarrow
+не установлен, результат пишется в CSV рядом (то же имя с расширением .csv).
+
+archive - задание архивации пакетов приложения (services.archive): пакеты
+старше ARCHIVE_AFTER_DAYS переносятся в сжатый колоночный архив по дням,
+исходные файлы старше ARCHIVE_RETAIN_ORIGINALS_DAYS удаляются. Запускается
+по расписанию (cron), в любое время - повторный запуск ничего не делает дважды.
+"""
+import os
+import sys
+import csv
+import glob
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Any, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from lab_parser.app.models.parse_rules import ParseRulesDB
+from lab_parser.app.services.parse_excel import read_basic_records
+from lab_parser.app.services.results_parser import ResultsParser
+
+# Колонки выходной таблицы и их типы (для схемы Parquet)
+OUTPUT_COLUMNS = [
+    ("source_file", "string"),
+    ("row_id", "int64"),
+    ("last_name", "string"),
+    ("first_name", "string"),
+    ("middle_name", "string"),
+    ("gender", "string"),
+    ("birth_date", "string"),
+    ("age_years", "int64"),
+    ("sample_id", "string"),
+    ("department", "string"),
+    ("parse_quality", "string"),
+    ("test_name", "string"),
+    ("test_value", "string"),
+    ("test_raw_value", "string"),
+    ("value_type", "int64"),
+    ("rule_id", "int64"),
+    ("test_definition_id", "int64"),
+    ("is_key_indicator", "bool"),
+]
+
+
+def flatten_items(items: List[Dict[str, Any]], source_file: str) -> Dict[str, List[Any]]:
+    """Записи в колонки длинной таблицы (строка на тест)"""
+    columns: Dict[str, List[Any]] = {name: [] for name, _ in OUTPUT_COLUMNS}
+    for item in items:
+        patient = item.get("patient") or {}
+        results = item.get("results") or {}
+        base = {
+            "source_file": source_file,
+            "row_id": item.get("row_id"),
+            "last_name": patient.get("last_name"),
+            "first_name": patient.get("first_name"),
+            "middle_name": patient.get("middle_name"),
+            "gender": patient.get("gender"),
+            "birth_date": patient.get("birth_date"),
+            "age_years": patient.get("age_years"),
+            "sample_id": item.get("sample_id"),
+            "department": item.get("department"),
+            "parse_quality": results.get("parse_quality"),
+        }
+        for test in results.get("tests") or [None]:
+            row = dict(base)
+            if test is not None:
+                row.update(
+                    test_name=test.get("name"),
+                    test_value=test.get("value"),
+                    test_raw_value=test.get("raw_value"),
+                    value_type=test.get("value_type"),
+                    rule_id=test.get("rule_id"),
+                    test_definition_id=test.get("test_definition_id"),
+                    is_key_indicator=bool(test.get("is_key_indicator")),
+                )
+            for name, _ in OUTPUT_COLUMNS:
+                columns[name].append(row.get(name))
+    return columns
+
+
+# ===== Обработка файла в процессе пула =====
+
+_parser: Optional[ResultsParser] = None
+
+
+def _init_worker(rules: List[Dict[str, Any]]):
+    global _parser
+    _parser = ResultsParser(rules) if rules else None
+
+
+def parse_file(path: str) -> Dict[str, Any]:
+    """Прочитать и распарсить один файл. Возвращает колонки и статистику."""
+    started = time.perf_counter()
+    items = read_basic_records(path)
+    if _parser is not None:
+        for item in items:
+            item["results"] = _parser.parse_results(item["results"].get("raw_text"))
+    return {
+        "path": path,
+        "records": len(items),
+        "bytes": os.path.getsize(path),
+        "seconds": time.perf_counter() - started,
+        "columns": flatten_items(items, os.path.basename(path)),
+    }
+
+
+# ===== Запись результата =====
+
+class ParquetSink:
+    """Потоковая запись в Parquet: каждый файл - отдельная группа строк"""
+
+    def __init__(self, path: str):
+        self.path = path
+        types = {"string": pa.string(), "int64": pa.int64(), "bool": pa.bool_()}
+        self.schema = pa.schema([(name, types[kind]) for name, kind in OUTPUT_COLUMNS])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, columns: Dict[str, List[Any]]):
+        self.writer.write_table(pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class CsvSink:
+    """Запасной вариант без pyarrow: CSV (UTF-8 с BOM, чтобы открывался в Excel)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8-sig", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in OUTPUT_COLUMNS])
+
+    def write(self, columns: Dict[str, List[Any]]):
+        self.writer.writerows(zip(*(columns[name] for name, _ in OUTPUT_COLUMNS)))
+
+    def close(self):
+        self.file.close()
+
+
+def open_sink(out: str):
+    if out.lower().endswith(".parquet"):
+        if pq is not None:
+            return ParquetSink(out)
+        out = os.path.splitext(out)[0] + ".csv"
+        print(f"pyarrow не установлен - результат будет записан в CSV: {out}", file=sys.stderr)
+    return CsvSink(out)
+
+
+# ===== Команды =====
+
+def expand_inputs(patterns: List[str]) -> List[str]:
+    """Файлы по маскам (с поддержкой **), без повторов, в порядке аргументов"""
+    files = []
+    seen = set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if os.path.isfile(path) and path not in seen:
+                seen.add(path)
+                files.append(path)
+    return files
+
+
+def _rate(value: float, seconds: float) -> float:
+    return value / seconds if seconds > 0 else 0.0
+
+
+def cmd_parse(args) -> int:
+    files = expand_inputs(args.inputs)
+    if not files:
+        print("Нет файлов для обработки", file=sys.stderr)
+        return 2
+    if not os.path.isfile(args.rules):
+        print(f"Файл правил не найден: {args.rules}", file=sys.stderr)
+        return 2
+
+    rules = ParseRulesDB(args.rules).get_all_rules()
+    jobs = max(args.jobs, 1)
+    sink = open_sink(args.out)
+
+    started = time.perf_counter()
+    total_records = total_rows = total_bytes = 0
+    failed = 0
+    pending = list(reversed(files))
+    running: Dict[Any, str] = {}
+
+    try:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(rules,)) as pool:
+            while pending or running:
+                # Не больше 2 * jobs файлов в работе - память ограничена независимо от числа файлов
+                while pending and len(running) < 2 * jobs:
+                    path = pending.pop()
+                    running[pool.submit(parse_file, path)] = path
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        failed += 1
+                        print(f"{path}: ОШИБКА: {e}", file=sys.stderr)
+                        continue
+
+                    sink.write(result["columns"])
+                    rows = len(result["columns"]["source_file"])
+                    total_records += result["records"]
+                    total_rows += rows
+                    total_bytes += result["bytes"]
+                    print(f"{result['path']}: {result['records']} записей, {rows} строк, "
+                          f"{result['seconds']:.2f} с, "
+                          f"{_rate(result['records'], result['seconds']):.0f} записей/с, "
+                          f"{_rate(result['bytes'] / 1e6, result['seconds']):.2f} МБ/с")
+    finally:
+        sink.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Итого: {len(files) - failed} файлов ({failed} с ошибками), {total_records} записей, "
+          f"{total_rows} строк за {elapsed:.2f} с: {_rate(total_records, elapsed):.0f} записей/с, "
+          f"{_rate(total_bytes / 1e6, elapsed):.2f} МБ/с -> {sink.path}")
+    return 1 if failed else 0
+
+
+def cmd_archive(args) -> int:
+    from lab_parser.app import create_app
+    from lab_parser.app.services.archive import archive_batches
+    from lab_parser.app.services.batch_cache import get_batch_disk_cache
+
+    app = create_app()
+    config = app.config
+    older_than = config["ARCHIVE_AFTER_DAYS"] if args.older_than is None else args.older_than
+    retain = config["ARCHIVE_RETAIN_ORIGINALS_DAYS"] if args.retain_originals is None else args.retain_originals
+    if retain and retain < older_than:
+        print("Исходные файлы нельзя хранить меньше, чем пакеты ждут архивации "
+              f"(--retain-originals {retain} < --older-than {older_than})", file=sys.stderr)
+        return 2
+
+    disk_cache_mb = config["PARSED_BATCH_DISK_CACHE_MB"]
+    disk_cache = get_batch_disk_cache(app.instance_path, disk_cache_mb * 1024 * 1024) if disk_cache_mb else None
+
+    started = time.perf_counter()
+    stats = archive_batches(app.instance_path, config["INSTANCE_UPLOADS_SUBDIR"], older_than, retain,
+                            disk_cache=disk_cache, dry_run=args.dry_run)
+    prefix = "[dry-run] " if args.dry_run else ""
+    for name in stats["archived"]:
+        print(f"{prefix}в архив: {name}")
+    for name in stats["pruned"]:
+        print(f"{prefix}удалён исходный файл: {name}")
+    for failure in stats["failed"]:
+        print(f"{failure['batch']}: ОШИБКА: {failure['error']}", file=sys.stderr)
+    print(f"{prefix}Итого: в архив {len(stats['archived'])}, удалено исходных файлов {len(stats['pruned'])}, "
+          f"ошибок {len(stats['failed'])}; архив {stats['bytes'] / 1e6:.1f} МБ, "
+          f"{time.perf_counter() - started:.2f} с")
+    return 1 if stats["failed"] else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m lab_parser")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_parse = sub.add_parser("parse", help="распарсить журналы в колоночный файл")
+    p_parse.add_argument("inputs", nargs="+", help="файлы или маски (*.xlsx, archive/**/*.xls)")
+    p_parse.add_argument("--rules", default=os.path.join("instance", "parse_rules.db"),
+                         help="БД правил парсинга (по умолчанию instance/parse_rules.db)")
+    p_parse.add_argument("--out", required=True, help="выходной файл .parquet или .csv")
+    p_parse.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="число процессов")
+    p_parse.set_defaults(func=cmd_parse)
+
+    p_archive = sub.add_parser("archive", help="архивировать старые пакеты приложения по дням")
+    p_archive.add_argument("--older-than", type=int, default=None,
+                           help="архивировать пакеты старше N дней (по умолчанию ARCHIVE_AFTER_DAYS)")
+    p_archive.add_argument("--retain-originals", type=int, default=None,
+                           help="удалять исходные файлы заархивированных пакетов старше N дней, 0 - не удалять "
+                                "(по умолчанию ARCHIVE_RETAIN_ORIGINALS_DAYS)")
+    p_archive.add_argument("--dry-run", action="store_true", help="только показать, что будет сделано")
+    p_archive.set_defaults(func=cmd_archive)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
@@ -0,0 +1,335 @@
+"""
+Демон приёма выгрузок ЛИС из папки наблюдения
+
+    python -m lab_parser.ingest [--watch DIR] [--workers N] [--once]
+
+ЛИС складывает выгрузки в сетевую папку. Демон забирает оттуда каждый файл
+тем же путём, что и форма /upload (services.batches.store_upload: дедупликация
+по хешу, конвертация в .xlsx, регистрация в каталоге), сразу парсит пакет
+(прогревая общий дисковый кэш, services.batch_cache) и добавляет его в поисковый индекс -
+первый просмотр таблицы уже не платит за парсинг.
+
+* Файл берётся в работу, только когда его размер и mtime не меняются
+  INGEST_SETTLE_SECONDS (недописанные файлы пропускаются).
+* Изменения отслеживаются опросом папки; если установлен пакет inotify_simple,
+  inotify будит демон раньше (на сетевых папках события inotify приходят
+  не всегда, поэтому опрос остаётся в любом случае).
+* Обработка идёт в пуле из INGEST_WORKERS процессов; одновременно в работе не больше
+  2 * INGEST_WORKERS файлов, остальные ждут в папке (обратное давление на источник).
+* Успешно принятые файлы переносятся в processed/, файлы с нераспознанным
+  форматом (_detect_header_row) и другими ошибками повторяются с нарастающей
+  паузой, а после INGEST_MAX_ATTEMPTS попыток переносятся в quarantine/
+  вместе с описанием ошибки (<имя>.error.txt). Туда же сразу уходят файлы,
+  оставшиеся пустыми дольше INGEST_SETTLE_SECONDS.
+* Параллельные процессы пула не регистрируют одно содержимое дважды:
+  регистрация в store_upload идёт под блокировкой каталога загрузок.
+"""
+import os
+import sys
+import time
+import shutil
+import signal
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Optional, Tuple
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+from lab_parser.app import create_app
+from lab_parser.app.models.parse_rules import get_parse_rules_db
+from lab_parser.app.models.batch_catalog import get_batch_catalog
+from lab_parser.app.models.search_index import get_search_index_db
+from lab_parser.app.services.batches import store_upload
+from lab_parser.app.services.batch_cache import get_batch_disk_cache
+from lab_parser.app.services.parse_excel import _detect_header_row
+from lab_parser.app.services.parsed_batch import get_parsed_batch
+from lab_parser.app.services.search_index import index_parsed_items
+from lab_parser.app.utils.io_utils import allowed_file, safe_filename_unicode, save_stream_with_hash
+
+
+def ingest_file(instance_path: str, uploads_subdir: str, source_path: str,
+                disk_cache_max_bytes: int = 0) -> Dict[str, Any]:
+    """
+    Принять один файл из папки наблюдения (выполняется в процессе пула)
+
+    Returns:
+        {"status": "ok" | "duplicate" | "bad_header", "name": ..., "rows": ..., "error": ...}
+    """
+    started = time.perf_counter()
+    uploads_dir = os.path.join(instance_path, uploads_subdir)
+    original_name = os.path.basename(source_path)
+    temp_path = os.path.join(uploads_dir, f"temp_{os.getpid()}_{safe_filename_unicode(original_name)}")
+
+    # Копируем во временный файл, считая хеш по ходу записи (источник остаётся на месте до успеха)
+    with open(source_path, "rb") as src:
+        content_hash, size = save_stream_with_hash(src, temp_path)
+
+    try:
+        # Формат проверяем до конвертации - нераспознанный файл пойдёт на повтор/в карантин
+        try:
+            _detect_header_row(temp_path)
+        except ValueError as e:
+            return {"status": "bad_header", "error": str(e)}
+
+        catalog = get_batch_catalog(instance_path)
+        stored = store_upload(catalog, uploads_dir, temp_path, original_name, content_hash)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    if stored["duplicate_of"]:
+        return {"status": "duplicate", "name": stored["name"], "duplicate_of": stored["duplicate_of"]}
+
+    # Парсим сразу: записи попадают в общий дисковый кэш и в поисковый индекс
+    dest_path = os.path.join(uploads_dir, stored["name"])
+    rules_db = get_parse_rules_db(instance_path)
+    disk_cache = get_batch_disk_cache(instance_path, disk_cache_max_bytes) if disk_cache_max_bytes else None
+    batch = get_parsed_batch(dest_path, rules_db, 1, catalog, disk_cache)
+    index_parsed_items(get_search_index_db(instance_path), dest_path, batch.items, batch.rules_generation)
+
+    return {
+        "status": "ok",
+        "name": stored["name"],
+        "rows": len(batch.items),
+        "size": size,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+class IngestDaemon:
+    """Цикл наблюдения за папкой: стабилизация файлов, пул обработки, повторы и карантин"""
+
+    def __init__(self, watch_dir: str, instance_path: str, uploads_subdir: str,
+                 allowed_extensions: set, workers: int = 2, settle_seconds: float = 5.0,
+                 poll_seconds: float = 2.0, max_attempts: int = 3, retry_delay: float = 30.0,
+                 disk_cache_max_bytes: int = 0):
+        self.watch_dir = watch_dir
+        self.processed_dir = os.path.join(watch_dir, "processed")
+        self.quarantine_dir = os.path.join(watch_dir, "quarantine")
+        self.instance_path = instance_path
+        self.uploads_subdir = uploads_subdir
+        self.allowed_extensions = allowed_extensions
+        self.workers = workers
+        self.max_in_flight = 2 * workers
+        self.settle_seconds = settle_seconds
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.disk_cache_max_bytes = disk_cache_max_bytes
+
+        # путь -> (размер, mtime_ns, с какого момента не меняется)
+        self._seen: Dict[str, Tuple[int, int, float]] = {}
+        # путь -> (число неудачных попыток, не раньше какого времени повторять)
+        self._attempts: Dict[str, Tuple[int, float]] = {}
+        self._running: Dict[Any, str] = {}
+        self._stopping = False
+
+        for d in (watch_dir, self.processed_dir, self.quarantine_dir):
+            os.makedirs(d, exist_ok=True)
+
+    def stop(self, *_):
+        self._stopping = True
+
+    def _candidates(self):
+        """Файлы выгрузок в папке наблюдения (служебные подпапки и временные файлы пропускаются)"""
+        for entry in os.scandir(self.watch_dir):
+            name = entry.name
+            if not entry.is_file() or name.startswith((".", "~$")):
+                continue
+            if not allowed_file(name, self.allowed_extensions):
+                continue
+            yield entry
+
+    def _classify(self, entry, now: float) -> str:
+        """
+        Состояние файла: settling - ещё меняется или стабилизируется; empty - пустой и не менялся
+        settle_seconds; retry - ждёт повтора после ошибки; ready - можно брать в работу
+        """
+        st = entry.stat()
+        seen = self._seen.get(entry.path)
+        if seen is None or seen[:2] != (st.st_size, st.st_mtime_ns) or now - seen[2] < self.settle_seconds:
+            return "settling"
+        if st.st_size == 0:
+            return "empty"
+        attempts = self._attempts.get(entry.path)
+        if attempts and now < attempts[1]:
+            return "retry"
+        return "ready"
+
+    def scan(self) -> list:
+        """Файлы, готовые к обработке: не менялись settle_seconds и не ждут повтора"""
+        now = time.monotonic()
+        ready = []
+        present = set()
+        for entry in self._candidates():
+            path = entry.path
+            present.add(path)
+            if path in self._running.values():
+                continue
+            st = entry.stat()
+            state = (st.st_size, st.st_mtime_ns)
+            seen = self._seen.get(path)
+            if seen is None or seen[:2] != state:
+                self._seen[path] = (*state, now)
+                continue
+            status = self._classify(entry, now)
+            if status == "empty":
+                # Так и не дописанный (или пустой) файл: ждать его бесполезно
+                self._quarantine(path, f"файл пуст дольше {self.settle_seconds:g} с")
+            elif status == "ready":
+                ready.append(path)
+
+        # Файлы, которые убрали из папки, забываем
+        for path in list(self._seen):
+            if path not in present:
+                self._seen.pop(path, None)
+                self._attempts.pop(path, None)
+        return ready
+
+    def _move(self, path: str, target_dir: str) -> str:
+        dest = os.path.join(target_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{os.path.basename(path)}")
+        shutil.move(path, dest)
+        return dest
+
+    def _quarantine(self, path: str, reason: str):
+        """Перенести файл в quarantine/ вместе с описанием причины"""
+        self._seen.pop(path, None)
+        self._attempts.pop(path, None)
+        dest = self._move(path, self.quarantine_dir)
+        with open(dest + ".error.txt", "w", encoding="utf-8") as f:
+            f.write(reason + "\n")
+        print(f"[ingest] {os.path.basename(path)}: в карантин ({reason.splitlines()[-1]})", flush=True)
+
+    def _finish(self, path: str, result: Optional[Dict[str, Any]], error: Optional[str]):
+        """Разобрать результат обработки: перенос в processed/, повтор или карантин"""
+        self._seen.pop(path, None)
+        if result and result["status"] in ("ok", "duplicate"):
+            self._attempts.pop(path, None)
+            self._move(path, self.processed_dir)
+            if result["status"] == "ok":
+                print(f"[ingest] {os.path.basename(path)} -> {result['name']}: "
+                      f"{result['rows']} строк за {result['seconds']} с", flush=True)
+            else:
+                print(f"[ingest] {os.path.basename(path)}: дубликат {result['duplicate_of']}", flush=True)
+            return
+
+        if error is None:
+            error = result.get("error", result["status"])
+        count = self._attempts.get(path, (0, 0.0))[0] + 1
+        if count >= self.max_attempts:
+            self._quarantine(path, f"{count} попыток, последняя ошибка:\n{error}")
+        else:
+            self._attempts[path] = (count, time.monotonic() + self.retry_delay * 2 ** (count - 1))
+            print(f"[ingest] {os.path.basename(path)}: ошибка, попытка {count}/{self.max_attempts} ({error})",
+                  flush=True)
+
+    def _collect(self, timeout: float):
+        """Дождаться завершения хотя бы одной задачи (не дольше timeout) и разобрать готовые"""
+        done, _ = wait(list(self._running), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            path = self._running.pop(future)
+            try:
+                self._finish(path, future.result(), None)
+            except Exception as e:
+                self._finish(path, None, str(e))
+
+    def _idle(self, watcher):
+        """Пауза до следующего опроса; inotify (если есть) прерывает её раньше"""
+        if self._running:
+            self._collect(self.poll_seconds)
+        elif watcher is not None:
+            watcher.read(timeout=int(self.poll_seconds * 1000))
+        else:
+            time.sleep(self.poll_seconds)
+
+    def _make_watcher(self):
+        if inotify_simple is None:
+            return None
+        try:
+            watcher = inotify_simple.INotify()
+            flags = inotify_simple.flags
+            watcher.add_watch(self.watch_dir, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+            return watcher
+        except OSError:
+            return None
+
+    def run(self, once: bool = False):
+        """
+        Основной цикл. once=True - обработать то, что уже лежит в папке, и выйти
+        (удобно для запуска из cron).
+        """
+        watcher = self._make_watcher()
+        print(f"[ingest] наблюдение за {self.watch_dir} "
+              f"({'inotify + опрос' if watcher else 'опрос'}, процессов: {self.workers})", flush=True)
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            while not self._stopping:
+                for path in self.scan():
+                    if len(self._running) >= self.max_in_flight:
+                        break
+                    future = pool.submit(ingest_file, self.instance_path, self.uploads_subdir,
+                                         path, self.disk_cache_max_bytes)
+                    self._running[future] = path
+
+                if once and not self._running and not self._pending_in_folder():
+                    break
+                self._idle(watcher)
+
+            # Дожидаемся начатых задач, новых не берём
+            while self._running:
+                self._collect(None)
+
+    def _pending_in_folder(self) -> bool:
+        """
+        Есть ли в папке файлы, которые ещё могут быть приняты: стабилизируются,
+        ждут повтора или готовы (пустые уходят в карантин и сюда не считаются)
+        """
+        now = time.monotonic()
+        running = set(self._running.values())
+        return any(self._classify(entry, now) in ("settling", "retry", "ready")
+                   for entry in self._candidates() if entry.path not in running)
+
+
+def main(argv=None):
+    app = create_app()
+    config = app.config
+
+    parser = argparse.ArgumentParser(prog="python -m lab_parser.ingest",
+                                     description="Приём выгрузок ЛИС из папки наблюдения")
+    parser.add_argument("--watch", default=config["INGEST_WATCH_DIR"],
+                        help="папка с выгрузками (по умолчанию INGEST_WATCH_DIR)")
+    parser.add_argument("--workers", type=int, default=config["INGEST_WORKERS"])
+    parser.add_argument("--settle", type=float, default=config["INGEST_SETTLE_SECONDS"],
+                        help="сколько секунд файл не должен меняться перед обработкой")
+    parser.add_argument("--poll", type=float, default=config["INGEST_POLL_SECONDS"])
+    parser.add_argument("--max-attempts", type=int, default=config["INGEST_MAX_ATTEMPTS"])
+    parser.add_argument("--retry-delay", type=float, default=config["INGEST_RETRY_DELAY_SECONDS"])
+    parser.add_argument("--once", action="store_true", help="обработать текущие файлы и выйти")
+    args = parser.parse_args(argv)
+
+    if not args.watch:
+        parser.error("не задана папка наблюдения (--watch или INGEST_WATCH_DIR)")
+
+    daemon = IngestDaemon(
+        watch_dir=os.path.abspath(args.watch),
+        instance_path=app.instance_path,
+        uploads_subdir=config["INSTANCE_UPLOADS_SUBDIR"],
+        allowed_extensions=config["ALLOWED_EXTENSIONS"],
+        workers=max(args.workers, 1),
+        settle_seconds=args.settle,
+        poll_seconds=args.poll,
+        max_attempts=max(args.max_attempts, 1),
+        retry_delay=args.retry_delay,
+        disk_cache_max_bytes=config["PARSED_BATCH_DISK_CACHE_MB"] * 1024 * 1024,
+    )
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run(once=args.once)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
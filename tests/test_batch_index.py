@@ -0,0 +1,32 @@
+"""Разбор параметра ?tests= фильтров по анализам (services.batch_index.parse_test_filters)"""
+import pytest
+
+from lab_parser.app.services import batch_index
+from lab_parser.app.services.batch_index import parse_test_filters
+
+
+def test_valid_filters():
+    assert parse_test_filters('[{"test_definition_id": "10", "rule_id": 45, "values": ["Обнаружено", 1.5]},'
+                              ' {"rule_id": 44, "min": "1,5", "max": 4}]') == [
+        {"test_definition_id": 10, "rule_id": 45, "values": ["Обнаружено", "1.5"], "min": None, "max": None},
+        {"test_definition_id": None, "rule_id": 44, "values": None, "min": 1.5, "max": 4.0},
+    ]
+
+
+@pytest.mark.parametrize("raw", [
+    "not json",
+    '"x"',
+    '[1]',
+    '[{"values": ["x"]}]',
+    '[{"rule_id": "abc", "values": ["x"]}]',
+    '[{"test_definition_id": [1], "values": ["x"]}]',
+    '[{"rule_id": {}, "min": 1}]',
+    '[{"rule_id": 1, "values": "x"}]',
+    '[{"rule_id": 1, "values": [{"a": 1}]}]',
+    '[{"rule_id": 1, "values": [null]}]',
+    '[{"rule_id": 1, "min": "abc"}]',
+    '[{"rule_id": 1}]',
+])
+def test_invalid_filters(raw):
+    with pytest.raises(batch_index.TestFilterError):
+        parse_test_filters(raw)
@@ -0,0 +1,76 @@
+"""
+Частичный перепарсинг поискового индекса после правки одного анализа (services.reparse)
+
+Журнал с пустыми ячейками результатов (raw_text None у строк) должен обновляться
+инкрементально и давать то же, что полная переиндексация новыми правилами.
+"""
+import os
+
+import pytest
+
+from lab_parser.app.models.parse_rules import get_parse_rules_db
+from lab_parser.app.models.search_index import get_search_index_db
+from lab_parser.app.services.batches import sync_catalog_with_uploads
+from lab_parser.app.services.reparse import run_definition_reparse
+from lab_parser.app.services.search_index import index_batch, sync_search_index
+from benchmarks.generator import generate_definitions, generate_rows, make_rules_db, write_journal
+
+BATCH = "journal__20250101-080000.xlsx"
+
+
+@pytest.fixture
+def instance(tmp_path):
+    definitions = generate_definitions(20, 1)
+    make_rules_db(str(tmp_path / "parse_rules.db"), definitions)
+    rows = generate_rows(200, definitions, 1)
+    for row in rows[::40]:
+        row[-1] = None  # пустая ячейка "Результаты исследования"
+    os.makedirs(tmp_path / "uploads")
+    write_journal(str(tmp_path / "uploads" / BATCH), rows)
+    sync_catalog_with_uploads(str(tmp_path), "uploads")
+    sync_search_index(str(tmp_path), "uploads")
+    return str(tmp_path)
+
+
+def _edit_definition(instance_path: str):
+    """Удалить самый частый анализ: (его id, поколение до правки)"""
+    rules_db = get_parse_rules_db(instance_path)
+    generation = rules_db.get_rules_generation()
+    definition_id = rules_db.get_all_test_definitions()[0]["id"]
+    rules_db.delete_test_definition(definition_id)
+    return definition_id, generation
+
+
+def _rows(search_db):
+    return [(row["summary"], row["tests"]) for row in search_db.get_batch_results(BATCH)]
+
+
+def test_empty_result_cells_reparsed_incrementally(instance):
+    search_db = get_search_index_db(instance)
+    assert any(row["raw_text"] is None for row in search_db.get_batch_results(BATCH))
+
+    definition_id, generation = _edit_definition(instance)
+    result = run_definition_reparse(instance, definition_id, generation, generation + 1)
+
+    assert result["search_index"]["skipped"] == []
+    assert result["search_index"]["batches"] == 1
+    assert result["search_index"]["rows"] > 0
+    assert search_db.get_indexed_batches()[BATCH]["rules_generation"] == generation + 1
+
+    incremental = _rows(search_db)
+    rules_db = get_parse_rules_db(instance)
+    index_batch(search_db, os.path.join(instance, "uploads", BATCH), rules_db.get_all_rules(),
+                rules_db.get_rules_generation())
+    assert incremental == _rows(search_db)
+
+
+def test_legacy_index_skipped(instance):
+    search_db = get_search_index_db(instance)
+    with search_db._get_connection() as conn:
+        conn.execute("UPDATE indexed_batches SET has_raw_text = 0")
+
+    definition_id, generation = _edit_definition(instance)
+    result = run_definition_reparse(instance, definition_id, generation, generation + 1)
+
+    assert result["search_index"]["skipped"] == [BATCH]
+    assert search_db.get_indexed_batches()[BATCH]["rules_generation"] == generation
@@ -0,0 +1,35 @@
+"""Кэш распарсенных пакетов (services.parsed_batch): поколение правил в ключе кэша"""
+import os
+
+from lab_parser.app.models.parse_rules import ParseRulesDB
+from lab_parser.app.services.parsed_batch import get_parsed_batch, clear_parsed_batch_cache
+from benchmarks.generator import generate_definitions, generate_rows, make_rules_db, write_journal
+
+
+class EditingRulesDB(ParseRulesDB):
+    """Правка правил приходит между чтением поколения и чтением самих правил"""
+    edited = False
+
+    def get_all_rules(self):
+        if not self.edited:
+            self.edited = True
+            self.delete_test_definition(self.get_all_test_definitions()[0]["id"])
+        return super().get_all_rules()
+
+
+def test_rules_edit_during_build_uses_new_generation(tmp_path):
+    definitions = generate_definitions(10, 1)
+    make_rules_db(str(tmp_path / "parse_rules.db"), definitions)
+    path = write_journal(str(tmp_path / "journal.xlsx"), generate_rows(50, definitions, 1))
+    rules_db = EditingRulesDB(str(tmp_path / "parse_rules.db"))
+    generation = rules_db.get_rules_generation()
+
+    clear_parsed_batch_cache()
+    batch = get_parsed_batch(path, rules_db)
+
+    assert rules_db.edited
+    assert batch.rules_generation == generation + 1 == rules_db.get_rules_generation()
+    assert batch.rules == rules_db.get_all_rules()
+    # Повторный запрос берёт тот же пакет из кэша - под новым поколением
+    assert get_parsed_batch(path, rules_db) is batch
+    clear_parsed_batch_cache()
@@ -0,0 +1,117 @@
+"""
+Извлечение значений ResultsParser против прежней реализации на синтетическом корпусе
+
+Эталон - копия прежнего извлечения по типам (benchmarks/bench_value_extraction.py).
+Типы 1-3 должны совпадать с ним полностью. Тип 4 (автоопределение) намеренно
+отличается: значение берётся целиком, а прежний путь брал его хвост - проверяется,
+что прежнее значение того же типа остаётся хвостом нового.
+
+    python -m pytest tests
+"""
+import os
+import tempfile
+
+import pytest
+
+from lab_parser.app.services.results_parser import (
+    ResultsParser, VALUE_TYPE_AUTO, VALUE_TYPE_DETECTED, VALUE_TYPE_NUMBER, VALUE_TYPE_TEXT
+)
+from benchmarks.bench_value_extraction import LegacyResultsParser, _corpus, _legacy_extract_value_by_type
+from benchmarks.generator import generate_definitions, generate_rows, make_rules_db
+
+ROWS = 2000
+RULES = 100
+SEED = 1
+
+
+@pytest.fixture(scope="module")
+def definitions():
+    return generate_definitions(RULES, SEED)
+
+
+@pytest.fixture(scope="module")
+def rules(definitions):
+    with tempfile.TemporaryDirectory() as tmp:
+        return make_rules_db(os.path.join(tmp, "rules.db"), definitions).get_all_rules()
+
+
+@pytest.fixture(scope="module")
+def texts(definitions):
+    return [row[-1] for row in generate_rows(ROWS, definitions, SEED) if row[-1]]
+
+
+@pytest.fixture(scope="module")
+def corpus(rules, texts):
+    """Захваченные правилами значения журнала и краевые случаи (EDGE_VALUES): [(значение, тип правила)]"""
+    return _corpus(ResultsParser(rules), texts)
+
+
+def _with_type(rules, value_type):
+    return [dict(rule, value_type=value_type) for rule in rules]
+
+
+@pytest.mark.parametrize("value_type", [VALUE_TYPE_DETECTED, VALUE_TYPE_NUMBER, VALUE_TYPE_TEXT])
+def test_typed_values_match_legacy(rules, corpus, value_type):
+    parser = ResultsParser(rules)
+    mismatches = []
+    for value, _ in corpus:
+        new = parser._extract_value_by_type(value, value_type)
+        old = _legacy_extract_value_by_type(value, value_type)
+        if new != old:
+            mismatches.append((value, new, old))
+    assert mismatches == []
+
+
+def test_parse_results_match_legacy(rules, texts):
+    parser = ResultsParser(rules)
+    legacy = LegacyResultsParser(rules)
+    differ = [text for text in texts if parser.parse_results(text) != legacy.parse_results(text)]
+    assert differ == []
+
+
+def test_auto_value_keeps_legacy_tail(corpus):
+    """Тип 4: прежнее значение определённого типа - хвост нового (или совпадает с ним)"""
+    parser = ResultsParser([])
+    whole = 0
+    for value, _ in corpus:
+        auto, value_type = parser._extract_auto_value(value.strip())
+        legacy = _legacy_extract_value_by_type(value, value_type)
+        if not value.strip():
+            assert auto is None and legacy is None
+            continue
+        assert value_type in (VALUE_TYPE_DETECTED, VALUE_TYPE_NUMBER, VALUE_TYPE_TEXT)
+        assert auto is not None and legacy is not None, value
+        assert auto.endswith(legacy), (value, auto, legacy)
+        whole += auto != legacy
+    # На корпусе есть значения, где целое значение и хвост действительно различаются
+    assert whole > 0
+
+
+@pytest.mark.parametrize("value, auto, value_type, legacy", [
+    ("Не обнаружено", "Не обнаружено", VALUE_TYPE_DETECTED, "Не обнаружено"),
+    ("отриц.", "отриц.", VALUE_TYPE_DETECTED, "отриц."),
+    ("12,345", "12,345", VALUE_TYPE_NUMBER, "12,345"),
+    ("<0,5", "<0,5", VALUE_TYPE_NUMBER, "0,5"),
+    ("1-3", "1-3", VALUE_TYPE_NUMBER, "3"),
+    ("12,3456", "12,3456", VALUE_TYPE_NUMBER, "3456"),
+    ("менее 0.01", "менее 0.01", VALUE_TYPE_TEXT, "0.01"),
+    ("A - B - C", "A - B - C", VALUE_TYPE_TEXT, "C"),
+    ("0,44 Повтор через неделю", "0,44", VALUE_TYPE_NUMBER, "0,44"),
+])
+def test_auto_value_whole_versus_tail(value, auto, value_type, legacy):
+    """Автоопределение берёт значение целиком, прежний путь по типам - его хвост"""
+    assert ResultsParser([])._extract_auto_value(value) == (auto, value_type)
+    assert _legacy_extract_value_by_type(value, value_type) == legacy
+
+
+def test_auto_rules_find_same_tests(rules, texts):
+    """Правила с типом 4 находят те же показатели, что и прежний путь (тип 3), меняется только значение"""
+    auto = ResultsParser(_with_type(rules, VALUE_TYPE_AUTO))
+    legacy = LegacyResultsParser(_with_type(rules, VALUE_TYPE_TEXT))
+    for text in texts:
+        auto_tests = auto.parse_results(text)["tests"]
+        legacy_tests = legacy.parse_results(text)["tests"]
+        assert [t["rule_id"] for t in auto_tests] == [t["rule_id"] for t in legacy_tests], text
+        for new, old in zip(auto_tests, legacy_tests):
+            assert new["raw_value"].endswith(old["raw_value"]), (text, new, old)
+            assert new["value_type"] in (VALUE_TYPE_DETECTED, VALUE_TYPE_NUMBER, VALUE_TYPE_TEXT)
@@ -2,5 +2,11 @@ from lab_parser.app import create_app
 
 app = create_app()
 
+# gunicorn --preload -w 4 wsgi:app с PRELOAD=1: модули чтения Excel, правила и
+# последний пакет загружаются один раз в мастере, воркеры получают их через fork
+if app.config["PRELOAD"]:
+    from lab_parser.app.services.warmup import preload
+    print(f"Предзагрузка: {preload(app)}")
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5001)